@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""@brief Check the diagnostics. The sampling profiler runs over a busy thread and a lock
+          convoy, the rotated .pstats files are loaded with pstats and the cost of a sample
+          is reported as a percentage of one CPU at the default sample rate. SIGUSR1 is sent
+          while the main thread is blocked on the display lock, as the main loop would be in
+          a lock convoy, and the stack dump must show the lock owner and the waiting thread.
+          SIGUSR2 is sent twice around a leak and the leak must be in the top increases."""
+
+import io
+import os
+import sys
+import signal
+import pstats
+import argparse
+import tempfile
+import threading
+
+from time import sleep, monotonic
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from rpi_wifi_setup.diagnostics import OwnedLock, SamplingProfiler, TracemallocToggle, dump_stacks, \
+    PROFILE_FILE_PREFIX, PROFILE_FILE_SUFFIX  # noqa: E402
+
+LEAK = []
+
+
+def busy_loop(stop_event):
+    while not stop_event.is_set():
+        sum(range(1000))
+
+
+def hold_lock(lock, seconds):
+    with lock:
+        sleep(seconds)
+
+
+def leak(count):
+    for _ in range(count):
+        LEAK.append(bytearray(1024))
+
+
+def start_thread(name, target, *args):
+    thread = threading.Thread(target=target, args=args, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+def check_profiler(folder, options):
+    stop_event = threading.Event()
+    lock = OwnedLock("display")
+    threads = [start_thread("busy", busy_loop, stop_event),
+               start_thread("holder", hold_lock, lock, options.seconds)]
+    sleep(0.05)
+    threads.append(start_thread("waiter", hold_lock, lock, 0))
+    profiler = SamplingProfiler(folder, interval=options.seconds / 4, keep=2, rate_hz=options.rate)
+    profiler.start()
+    sleep(options.seconds)
+    profiler.stop()
+    stop_event.set()
+    for thread in threads:
+        thread.join()
+
+    filenames = sorted(name for name in os.listdir(folder) if name.startswith(PROFILE_FILE_PREFIX))
+    assert len(filenames) == 2 and all(name.endswith(PROFILE_FILE_SUFFIX) for name in filenames), filenames
+    assert not [name for name in os.listdir(folder) if name.endswith(".tmp")]
+    stats = pstats.Stats(*(os.path.join(folder, name) for name in filenames), stream=io.StringIO())
+    functions = {func[2]: values for func, values in stats.stats.items()}
+    for name in ("busy_loop", "hold_lock", "<thread busy>", "<thread holder>", "<thread waiter>", "<thread MainThread>"):
+        assert name in functions, name
+    assert not any("SamplingProfiler" in name for name in functions), "the sampling thread was sampled"
+    # The busy thread is in busy_loop() for each sample (cc, nc, tt, ct).
+    busy = functions["busy_loop"]
+    assert busy[0] == functions["<thread busy>"][0] and busy[3] > 0
+    callers = [func[2] for func in busy[4]]
+    assert callers == ["run"], callers
+    stats.sort_stats("cumulative").print_stats(5)
+    stats.print_callers("hold_lock")
+    print(f"profiler: {profiler.get_stats()}, {len(functions)} functions in {filenames}")
+
+
+def check_sample_cost(options):
+    stop_event = threading.Event()
+    threads = [start_thread(f"idle{index}", stop_event.wait) for index in range(options.threads)]
+    profiler = SamplingProfiler("/nonexistent", rate_hz=SamplingProfiler.DEFAULT_RATE_HZ)
+    start = monotonic()
+    for _ in range(options.samples):
+        profiler.sample()
+    cost = (monotonic() - start) / options.samples
+    stop_event.set()
+    for thread in threads:
+        thread.join()
+    cpu = cost * SamplingProfiler.DEFAULT_RATE_HZ * 100
+    print(f"sample cost: {cost * 1e6:.1f} us with {options.threads + 1} threads, "
+          f"{cpu:.3f}% of one CPU at {SamplingProfiler.DEFAULT_RATE_HZ:.0f} Hz")
+    assert cpu < 1.0, cpu
+
+
+def check_stack_dump(folder):
+    lock = OwnedLock("display")
+    filenames = []
+    signal.signal(signal.SIGUSR1, lambda signum, frame: filenames.append(dump_stacks(folder, (lock,))))
+    holder = start_thread("holder", hold_lock, lock, 1.0)
+    sleep(0.05)
+    threading.Timer(0.2, os.kill, (os.getpid(), signal.SIGUSR1)).start()
+    start = monotonic()
+    # The main thread is blocked here when the signal is received.
+    with lock:
+        waited = monotonic() - start
+    holder.join()
+    signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+    assert len(filenames) == 1 and waited > 0.9, (filenames, waited)
+    with open(filenames[0]) as fd:
+        text = fd.read()
+    assert "Lock display: held by holder" in text and "waiting: MainThread" in text, text
+    assert "in hold_lock" in text and "Thread MainThread" in text
+    assert lock.get_owner() is None
+    print(f"stack dump: written while the main thread waited on the lock, {text.splitlines()[2]}")
+
+
+def check_tracemalloc(folder):
+    toggle = TracemallocToggle(folder)
+    signal.signal(signal.SIGUSR2, lambda signum, frame: filenames.append(toggle.toggle()))
+    filenames = []
+    os.kill(os.getpid(), signal.SIGUSR2)
+    assert toggle.is_tracing()
+    leak(2000)
+    os.kill(os.getpid(), signal.SIGUSR2)
+    signal.signal(signal.SIGUSR2, signal.SIG_DFL)
+    assert not toggle.is_tracing() and filenames[0] is None, filenames
+    with open(filenames[1]) as fd:
+        text = fd.read()
+    increases = text.split("increases since tracing started:")[1].splitlines()[1]
+    assert os.path.basename(__file__) in increases, increases
+    print(f"tracemalloc: top increase {increases}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profiler, stack dump and tracemalloc check.")
+    parser.add_argument("--seconds", type=float, help="The time the profiler runs (default = 1.2).", default=1.2)
+    parser.add_argument("--rate", type=float, help="The profiler sample rate in Hz (default = 200).", default=200.0)
+    parser.add_argument("--threads", type=int, help="The number of idle threads when the sample cost is measured (default = 8).", default=8)
+    parser.add_argument("--samples", type=int, help="The number of samples timed (default = 2000).", default=2000)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        check_profiler(folder, options)
+    check_sample_cost(options)
+    with tempfile.TemporaryDirectory() as folder:
+        check_stack_dump(folder)
+        check_tracemalloc(folder)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""@brief Measure the bytes sent to the display and the time per frame with and without
+          frame diffing. An SSD1309 driver on a byte counting serial interface stands in for
+          the I2C display and luma's dummy device is used for the full frame path."""
+
+import os
+import sys
+import argparse
+
+from time import perf_counter
+
+from PIL import ImageFont
+from luma.core.device import dummy
+from luma.oled.device import ssd1309
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from rpi_wifi_setup.display import DiffingDisplay  # noqa: E402
+from rpi_wifi_setup.frame_renderer import FrameRenderer  # noqa: E402
+
+FONT_FILE = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+
+
+class CountingSerial(object):
+    """@brief A serial interface that counts the bytes written instead of sending them."""
+
+    def __init__(self):
+        self.byte_count = 0
+
+    def command(self, *cmd):
+        self.byte_count += len(cmd)
+
+    def data(self, data):
+        self.byte_count += len(data)
+
+    def cleanup(self):
+        pass
+
+
+def load_font():
+    if os.path.isfile(FONT_FILE):
+        return ImageFont.truetype(FONT_FILE, 14)
+    return ImageFont.load_default()
+
+
+def frames(device, font):
+    """@brief A heartbeat like sequence: mostly unchanged frames with occasional signal and IP changes."""
+    renderer = FrameRenderer(device.size, font, cache_size=0)
+    sequence = []
+    for i in range(100):
+        strength = 74 if i % 10 else 49
+        ip = "192.168.1.50" if i < 50 else "192.168.1.51"
+        sequence.append(renderer.render(f"ONLINE\n{ip}\nSignal: {strength}%", strength=strength))
+    return sequence
+
+
+def run(name, display_frame, sequence, counter):
+    start_bytes = counter()
+    start = perf_counter()
+    for image in sequence:
+        display_frame(image)
+    elapsed = perf_counter() - start
+    sent = counter() - start_bytes
+    print(f"{name:<32} {sent / len(sequence):8.1f} bytes/frame {elapsed / len(sequence) * 1E3:8.3f} ms/frame")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Display frame diffing benchmark.")
+    parser.parse_args()
+    font = load_font()
+
+    serial = CountingSerial()
+    device = ssd1309(serial_interface=serial)
+    sequence = frames(device, font)
+    run("ssd1309 full frames", device.display, sequence, lambda: serial.byte_count)
+
+    diffing_display = DiffingDisplay(device)
+    run("ssd1309 diffed frames", diffing_display.display, sequence, lambda: serial.byte_count)
+    print(f"  {diffing_display.get_stats()}")
+
+    dummy_device = dummy(mode='1')
+    dummy_display = DiffingDisplay(dummy_device)
+    run("dummy diffed frames", dummy_display.display, sequence, lambda: dummy_display.get_stats()['bytes_sent'])
+    print(f"  {dummy_display.get_stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""@brief Send messages to the display socket as fast as possible and measure the
+          messages per second accepted and the time from sending a message to the
+          frame containing it being written to a luma dummy display."""
+
+import os
+import sys
+import argparse
+import tempfile
+import threading
+import selectors
+
+from time import perf_counter, sleep
+
+from PIL import ImageFont
+from luma.core.device import dummy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from rpi_wifi_setup.display_socket import DisplaySocketServer  # noqa: E402
+from rpi_wifi_setup.display_client import DisplayClient  # noqa: E402
+from rpi_wifi_setup.display import DiffingDisplay  # noqa: E402
+from rpi_wifi_setup.frame_renderer import FrameRenderer  # noqa: E402
+from rpi_wifi_setup.render_pipeline import DisplayState, DisplayScheduler, DisplayConsumer  # noqa: E402
+
+FONT_FILE = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+
+
+def load_font():
+    if os.path.isfile(FONT_FILE):
+        return ImageFont.truetype(FONT_FILE, 14)
+    return ImageFont.load_default(14)
+
+
+class NullUIO(object):
+
+    def debug(self, msg):
+        pass
+
+    def error(self, msg):
+        print(msg)
+
+
+class Pipeline(object):
+    """@brief The display socket server, main loop and display consumer of the threaded engine."""
+
+    def __init__(self, path, rate, font):
+        self._server = DisplaySocketServer(path, on_change=self._on_change, rate=rate, burst=rate)
+        self._renderer = FrameRenderer((128, 64), font)
+        self._display = DiffingDisplay(dummy(width=128, height=64, mode='1'))
+        self._queue = DisplayScheduler()
+        self._consumer = DisplayConsumer(NullUIO(), self._queue, threading.Lock(), self._show)
+        self._running = True
+        self._thread = threading.Thread(target=self._main_loop, daemon=True)
+        # The time each message number was displayed
+        self.displayed = {}
+
+    def start(self):
+        self._server.open()
+        self._consumer.start()
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._thread.join()
+        self._consumer.stop()
+        self._server.close()
+
+    def get_stats(self):
+        return self._server.get_stats()
+
+    def _main_loop(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self._server, selectors.EVENT_READ, self._server.handle_events)
+        while self._running:
+            for key, _ in selector.select(timeout=0.05):
+                key.data()
+        selector.close()
+
+    def _on_change(self):
+        message = self._server.get_message()
+        if message:
+            self._queue.put(DisplayState(message[0], strength=message[1]))
+
+    def _show(self, state):
+        self._display.display(self._renderer.render(state.msg, strength=state.strength))
+        self.displayed[int(state.msg.split('\n')[1])] = perf_counter()
+
+
+def run(name, options, rate, font):
+    with tempfile.TemporaryDirectory() as folder:
+        pipeline = Pipeline(os.path.join(folder, "display.sock"), rate, font)
+        pipeline.start()
+        sent = {}
+        with DisplayClient(os.path.join(folder, "display.sock")) as client:
+            start = perf_counter()
+            for i in range(options.messages):
+                sent[i] = perf_counter()
+                while True:
+                    try:
+                        client.show(f"Message\n{i}", signal=i % 100)
+                        break
+                    except BlockingIOError:
+                        # The socket receive queue is full
+                        sleep(0.0001)
+                if options.interval:
+                    sleep(options.interval)
+            elapsed = perf_counter() - start
+        sleep(0.2)
+        pipeline.stop()
+
+    stats = pipeline.get_stats()
+    latencies = sorted((pipeline.displayed[i] - sent[i]) * 1000 for i in pipeline.displayed)
+    if latencies:
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[int(len(latencies) * 0.99)]
+        latency = f"latency ms p50 {p50:6.2f} p99 {p99:6.2f} max {latencies[-1]:6.2f}"
+    else:
+        latency = ""
+    print(f"{name:<14} {options.messages / elapsed:8.0f} msgs/s sent {stats['accepted'] / elapsed:8.0f} msgs/s accepted {stats['rate_limited']:7d} rate limited {len(latencies):6d} frames {latency}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Display socket benchmark.")
+    parser.add_argument("-n", "--messages", type=int, help="The number of messages to send (default = 5000).", default=5000)
+    parser.add_argument("-i", "--interval", type=float, help="The delay between messages in seconds (default = 0).", default=0)
+    options = parser.parse_args()
+
+    font = load_font()
+    run("unlimited", options, 1E9, font)
+    run("rate limited", options, DisplaySocketServer.DEFAULT_RATE, font)
+
+
+if __name__ == '__main__':
+    main()
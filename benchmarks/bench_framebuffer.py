@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""@brief Measure the frames per second written to the shared memory framebuffer and sent
+          to the display compared with sending the same frames as PIL images. An SSD1309
+          driver on a byte counting serial interface stands in for the I2C display."""
+
+import os
+import sys
+import argparse
+import tempfile
+
+from time import perf_counter, process_time
+
+from PIL import Image, ImageDraw
+from luma.oled.device import ssd1309
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from bench_display import CountingSerial  # noqa: E402
+from rpi_wifi_setup.display import DiffingDisplay, pack_pages  # noqa: E402
+from rpi_wifi_setup.framebuffer import FramebufferReader, FramebufferWriter  # noqa: E402
+
+DISPLAY_SIZE = (128, 64)
+
+
+def images(count):
+    """@brief Frames that an application rendering its own graphics might produce (a moving bar graph)."""
+    sequence = []
+    for i in range(count):
+        image = Image.new('1', DISPLAY_SIZE)
+        draw = ImageDraw.Draw(image)
+        for bar in range(16):
+            height = 1 + (i * 3 + bar * 7) % DISPLAY_SIZE[1]
+            draw.rectangle((bar * 8, DISPLAY_SIZE[1] - height, bar * 8 + 5, DISPLAY_SIZE[1] - 1), fill=1)
+        sequence.append(image)
+    return sequence
+
+
+def run(name, send_frame, frames, counter):
+    start_bytes = counter()
+    start = perf_counter()
+    start_cpu = process_time()
+    for frame in frames:
+        send_frame(frame)
+    cpu = process_time() - start_cpu
+    elapsed = perf_counter() - start
+    sent = counter() - start_bytes
+    print(f"{name:<28} {len(frames) / elapsed:10.0f} frames/s {cpu / len(frames) * 1E6:10.1f} us CPU/frame {sent / len(frames):8.1f} bytes/frame")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared memory framebuffer benchmark.")
+    parser.add_argument("-n", "--frames", type=int, help="The number of frames to send (default = 1000).", default=1000)
+    options = parser.parse_args()
+
+    sequence = images(options.frames)
+    packed = [b''.join(pack_pages(image, DISPLAY_SIZE[1] // 8)) for image in sequence]
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "fb")
+        reader = FramebufferReader(path, DISPLAY_SIZE[0], DISPLAY_SIZE[1])
+        reader.open()
+        writer = FramebufferWriter(path)
+
+        serial = CountingSerial()
+        device = ssd1309(serial_interface=serial)
+        display = DiffingDisplay(device)
+
+        def framebuffer_frame(data):
+            writer.write(data)
+            if reader.handle_events():
+                reader.blit(display)
+
+        run("ssd1309 PIL images", device.display, sequence, lambda: serial.byte_count)
+        run("ssd1309 diffed PIL images", display.display, sequence, lambda: serial.byte_count)
+        run("ssd1309 framebuffer", framebuffer_frame, packed, lambda: serial.byte_count)
+        print(f"  {reader.get_stats()}")
+
+        writer.close()
+        reader.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""@brief Simulate the heartbeat over several days of a stable WiFi link with occasional
+          disconnects and button presses. The connectivity checks per hour and the time
+          from each disconnect until a heartbeat detects it are reported for the fixed
+          10 second heartbeat and for the HeartbeatPolicy. Disconnects are only found by
+          the heartbeat here. On a Pi the rtnetlink and D-Bus monitors report most of them
+          immediately."""
+
+import os
+import sys
+import random
+import argparse
+
+from statistics import mean
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from rpi_wifi_setup.connectivity import ConnectivitySnapshot  # noqa: E402
+from rpi_wifi_setup.heartbeat import HeartbeatPolicy, RESET_BUTTON  # noqa: E402
+
+HEARTBEAT_SECONDS = 10
+SCREEN_OFF_SECONDS = 120
+
+
+class FixedPolicy(object):
+    """@brief The previous fixed heartbeat."""
+
+    def next_interval(self, shown):
+        return HEARTBEAT_SECONDS
+
+    def record(self, snapshot):
+        return False
+
+    def reset(self, reason):
+        pass
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_events(options):
+    """@return The sorted (time, kind) disconnect, reconnect and button events."""
+    rng = random.Random(options.seed)
+    duration = options.days * 86400
+    events = []
+    t = 0.0
+    while True:
+        t += rng.expovariate(options.disconnects_per_day / 86400)
+        if t >= duration:
+            break
+        events.append((t, 'disconnect'))
+        events.append((t + rng.uniform(5, 300), 'reconnect'))
+    t = 0.0
+    while True:
+        t += rng.expovariate(options.presses_per_day / 86400)
+        if t >= duration:
+            break
+        events.append((t, 'button'))
+    return sorted(events)
+
+
+def simulate(policy, clock, events, options):
+    """@return The number of heartbeats, the time taken to detect each disconnect and the number
+               of disconnects that ended before a heartbeat detected them."""
+    duration = options.days * 86400
+    connected = True
+    undetected_since = None
+    missed = 0
+    last_press = -SCREEN_OFF_SECONDS
+    next_heartbeat = 0.0
+    polls = 0
+    detect_times = []
+    pending = list(events)
+    while clock.now < duration:
+        # Apply the events before the next heartbeat. A button press shortens the wait.
+        while pending and pending[0][0] <= next_heartbeat:
+            t, kind = pending.pop(0)
+            clock.now = t
+            if kind == 'disconnect':
+                connected = False
+                undetected_since = t
+            elif kind == 'reconnect':
+                connected = True
+                if undetected_since is not None:
+                    missed += 1
+                    undetected_since = None
+            else:
+                last_press = t
+                policy.reset(RESET_BUTTON)
+                next_heartbeat = min(next_heartbeat, t + options.min_interval)
+
+        clock.now = next_heartbeat
+        polls += 1
+        if undetected_since is not None:
+            detect_times.append(clock.now - undetected_since)
+            undetected_since = None
+        policy.record(ConnectivitySnapshot(connected, ip="192.168.1.50" if connected else None, timestamp=clock.now))
+        screen_on = clock.now - last_press < SCREEN_OFF_SECONDS
+        next_heartbeat = clock.now + policy.next_interval(screen_on)
+    return polls, detect_times, missed
+
+
+def report(name, polls, detect_times, missed, options):
+    hours = options.days * 24
+    detect = f"mean {mean(detect_times):6.1f} s max {max(detect_times):6.1f} s" if detect_times else "no disconnects"
+    print(f"{name:<16} {polls / hours:7.1f} checks/hour  time to detect disconnect: {detect} "
+          f"({len(detect_times)} detected, {missed} ended before a check)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Heartbeat policy simulation.")
+    parser.add_argument("--days", type=float, help="The simulated time in days (default = 7).", default=7)
+    parser.add_argument("--disconnects_per_day", type=float, help="The average disconnects per day (default = 4).", default=4)
+    parser.add_argument("--presses_per_day", type=float, help="The average button presses per day (default = 3).", default=3)
+    parser.add_argument("--min_interval", type=float, help=f"The heartbeat policy minimum interval (default = {HeartbeatPolicy.DEFAULT_MIN_SECONDS}).", default=HeartbeatPolicy.DEFAULT_MIN_SECONDS)
+    parser.add_argument("--max_interval", type=float, help=f"The heartbeat policy maximum interval (default = {HeartbeatPolicy.DEFAULT_MAX_SECONDS}).", default=HeartbeatPolicy.DEFAULT_MAX_SECONDS)
+    parser.add_argument("--seed", type=int, help="The random seed (default = 1).", default=1)
+    options = parser.parse_args()
+
+    events = make_events(options)
+    report("fixed 10 s", *simulate(FixedPolicy(), Clock(), events, options), options)
+
+    clock = Clock()
+    policy = HeartbeatPolicy(HEARTBEAT_SECONDS,
+                             min_interval=options.min_interval,
+                             max_interval=options.max_interval,
+                             clock=clock)
+    report("HeartbeatPolicy", *simulate(policy, clock, events, options), options)
+    print(f"HeartbeatPolicy stats: {policy.get_stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""@brief Measure the wake ups of the override file watcher while a synthetic workload
+          creates, writes, reads and deletes unrelated files in the watched directory.
+          The inotify watcher used by rpi_wifi_setup is compared with an inotify watch
+          using the event mask of a watchdog Observer and, if installed, a watchdog
+          Observer itself."""
+
+import os
+import sys
+import argparse
+import tempfile
+import threading
+import selectors
+
+from time import sleep, perf_counter, process_time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from rpi_wifi_setup.inotify import InotifyWatcher, IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE, IN_CLOSE_NOWRITE, IN_OPEN, \
+    IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE, IN_DELETE_SELF  # noqa: E402
+
+try:
+    from watchdog.observers import Observer
+    from rpi_wifi_setup.rpi_wifi_setup import OverrideHandler
+except ImportError:
+    Observer = None
+
+OVERRIDE_FILENAME = "oled_override.txt"
+# The events a watchdog Observer asks the kernel for.
+WATCHDOG_MASK = IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | \
+    IN_CLOSE_WRITE | IN_OPEN | IN_CLOSE_NOWRITE
+
+
+class WatcherThread(threading.Thread):
+    """@brief Runs an InotifyWatcher from a selector as the main loop does."""
+
+    def __init__(self, watcher):
+        super().__init__(daemon=True)
+        self._watcher = watcher
+        self._running = True
+        self.changes = 0
+
+    def run(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self._watcher, selectors.EVENT_READ)
+        while self._running:
+            if selector.select(timeout=0.05):
+                if self._watcher.handle_events():
+                    self.changes += 1
+        selector.close()
+
+    def stop(self):
+        self._running = False
+        self.join()
+
+    def get_stats(self):
+        return self._watcher.get_stats()
+
+
+class CountingManager(object):
+
+    def __init__(self):
+        self.triggers = 0
+
+    def handle_interrupt_trigger(self):
+        self.triggers += 1
+
+
+def workload(folder, options):
+    """@brief Unrelated file activity with an occasional override file update."""
+    override_path = os.path.join(folder, OVERRIDE_FILENAME)
+    for i in range(options.files):
+        path = os.path.join(folder, f"build_{i % 50}.tmp")
+        with open(path, 'w') as fd:
+            for _ in range(options.chunks):
+                fd.write("x" * 512)
+                fd.flush()
+        with open(path, 'r') as fd:
+            fd.read()
+        os.chmod(path, 0o600)
+        os.remove(path)
+
+        if i % options.override_every == 0:
+            if (i // options.override_every) % 2:
+                with open(override_path, 'w') as fd:
+                    fd.write(f"Count\n{i}")
+            else:
+                # Atomic replace
+                tmp_path = override_path + ".new"
+                with open(tmp_path, 'w') as fd:
+                    fd.write(f"Count\n{i}")
+                os.rename(tmp_path, override_path)
+
+        if options.delay:
+            sleep(options.delay)
+
+
+def run_inotify(name, mask, options):
+    with tempfile.TemporaryDirectory() as folder:
+        watcher = InotifyWatcher(os.path.join(folder, OVERRIDE_FILENAME), mask=mask)
+        watcher.open()
+        thread = WatcherThread(watcher)
+        thread.start()
+        start = perf_counter()
+        start_cpu = process_time()
+        workload(folder, options)
+        sleep(0.2)
+        thread.stop()
+        cpu = process_time() - start_cpu
+        elapsed = perf_counter() - start
+        watcher.close()
+    stats = thread.get_stats()
+    print(f"{name:<16} {stats['wakeups']:8d} wake ups {stats['events']:8d} events {stats['matched']:6d} override changes {cpu:6.2f} s CPU {elapsed:6.2f} s")
+    return stats['wakeups']
+
+
+def run_watchdog(options):
+    with tempfile.TemporaryDirectory() as folder:
+        manager = CountingManager()
+        observer = Observer()
+        observer.schedule(OverrideHandler(manager, target_file=os.path.join(folder, OVERRIDE_FILENAME)), path=folder, recursive=False)
+        observer.start()
+        start = perf_counter()
+        start_cpu = process_time()
+        workload(folder, options)
+        sleep(0.2)
+        observer.stop()
+        observer.join()
+        cpu = process_time() - start_cpu
+        elapsed = perf_counter() - start
+    print(f"{'watchdog':<16} {'':>8}          {'':>8}        {manager.triggers:6d} override triggers {cpu:6.2f} s CPU {elapsed:6.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Override file watcher wake up benchmark.")
+    parser.add_argument("-f", "--files", type=int, help="The number of unrelated files written (default = 2000).", default=2000)
+    parser.add_argument("-c", "--chunks", type=int, help="The number of writes to each unrelated file (default = 4).", default=4)
+    parser.add_argument("-o", "--override_every", type=int, help="Update the override file after this many unrelated files (default = 100).", default=100)
+    parser.add_argument("--delay", type=float, help="The delay in seconds after each unrelated file (default = 0.0005).", default=0.0005)
+    options = parser.parse_args()
+
+    watchdog_wakeups = run_inotify("watchdog mask", WATCHDOG_MASK, options)
+    wakeups = run_inotify("override mask", InotifyWatcher.WATCH_MASK, options)
+    if watchdog_wakeups:
+        print(f"Wake ups avoided: {watchdog_wakeups - wakeups} ({100 * (watchdog_wakeups - wakeups) / watchdog_wakeups:.1f}%)")
+    if Observer:
+        run_watchdog(options)
+
+
+if __name__ == '__main__':
+    main()
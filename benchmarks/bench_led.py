@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""@brief Count the wake ups per hour of the WiFi LED controller in each state using
+          gpiozero's mock pin factory. The LED thread wake ups and the gpiozero blink
+          thread wake ups (one per pin change) are counted. The previous controller,
+          which woke every 0.5 seconds in every state, is shown for comparison."""
+
+import os
+import sys
+import argparse
+
+from time import sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from gpiozero import Device  # noqa: E402
+from gpiozero.pins.mock import MockFactory  # noqa: E402
+
+from rpi_wifi_setup.rpi_wifi_setup import WifiLEDCtrl  # noqa: E402
+
+POLLING_INTERVAL = 0.5
+STATES = (('connected', WifiLEDCtrl.CONNECTED),
+          ('no internet', WifiLEDCtrl.NO_INTERNET),
+          ('disconnected', WifiLEDCtrl.DISCONNECTED),
+          ('configuring', WifiLEDCtrl.CONFIGURING))
+
+
+def per_hour(count, seconds):
+    return count * 3600 / seconds
+
+
+def measure(name, pin_factory, pin, options):
+    Device.pin_factory = pin_factory
+    led_ctrl = WifiLEDCtrl(pin)
+    led_ctrl.start()
+    mock_pin = led_ctrl.led.pin
+    print(f"{name} (GPIO{pin})")
+    for state_name, state in STATES:
+        led_ctrl.set_state(state)
+        # Allow the state to be applied before counting.
+        sleep(0.1)
+        wakeups = led_ctrl.get_stats()['wakeups']
+        mock_pin.clear_states()
+        sleep(options.seconds)
+        thread_wakeups = led_ctrl.get_stats()['wakeups'] - wakeups
+        # The blink thread sets the pin on each change, the first entry is the state when cleared.
+        pin_changes = len(mock_pin.states) - 1
+        print(f"  {state_name:<14} {per_hour(thread_wakeups, options.seconds):8.0f} LED thread wake ups/hour "
+              f"{per_hour(pin_changes, options.seconds):8.0f} blink wake ups/hour "
+              f"(polling {per_hour(options.seconds / POLLING_INTERVAL, options.seconds):.0f}/hour)")
+    led_ctrl.stop()
+    led_ctrl.led.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WiFi LED controller wake ups per hour.")
+    parser.add_argument("-s", "--seconds", type=float, help="The time each state is measured for (default = 4).", default=4.0)
+    options = parser.parse_args()
+
+    measure("Ordinary pin", MockFactory(), 5, options)
+
+
+if __name__ == '__main__':
+    main()
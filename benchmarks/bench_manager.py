@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""@brief Run the WiFiSetupManager main loop without hardware and write the results as JSON
+          so that releases can be compared. The display is luma's ssd1309 driver on luma's
+          noop serial interface rather than luma's dummy device so that the partial page
+          updates run as on the device. The button and LED use gpiozero's mock pin factory
+          and nmcli, wifi-connect and sudo are fake commands on the PATH (see
+          tests/fixtures/fake_nmcli.py and tests/fixtures/fake_wifi_connect.py).
+          The following are measured:
+          render        The time taken to build and send a frame for each type of screen.
+          override      The time from writing /tmp/oled_override.txt until its frame has been sent.
+          idle          The heartbeats, display frames and thread wake ups (context switches of
+                        all threads) per minute and the CPU time per heartbeat while nothing
+                        changes. The fake nmcli is a Python script so the CPU time of the
+                        commands the manager starts is shown separately.
+          portal        The time from the button being held until wifi-connect is running, from
+                        the button being held again until it has stopped and the CPU time of
+                        each start/stop.
+          --baseline compares the results with a previous JSON file and exits with an error
+          if any time or count is more than --tolerance and --min_difference higher."""
+
+import os
+import sys
+import json
+import shutil
+import signal
+import argparse
+import platform
+import tempfile
+import resource
+import threading
+import statistics
+import traceback
+
+from time import sleep, perf_counter, process_time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from gpiozero import Device  # noqa: E402
+from gpiozero.pins.mock import MockFactory  # noqa: E402
+from p3lib.uio import UIO  # noqa: E402
+
+from rpi_wifi_setup.rpi_wifi_setup import WiFiSetupManager, OverrideHandler, get_arg_parser  # noqa: E402
+from rpi_wifi_setup.portal import PORTAL_RUNNING, PORTAL_FINISHED_STATES  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'fixtures')
+UI_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'rpi_wifi_setup', 'assets', 'ui')
+# Any pin other than the button pin (default GPIO17).
+LED_PIN = 27
+# The screens shown by the manager, the online screen is shown as the signal strength varies.
+SCREENS = (("offline", lambda index: (WiFiSetupManager.OFFLINE_MSG, None)),
+           ("online", lambda index: (f"ONLINE\n192.168.1.50\nSignal: {60 + index % 7}%", 60 + index % 7)),
+           ("portal", lambda index: (f"Connect to\n{WiFiSetupManager.DEFAULT_PORTAL_SSID}\nto setup wifi.", None)),
+           ("override", lambda index: (f"Backup\nrunning\n{index % 100}%", None)))
+
+
+class BenchManagerMixin(object):
+    """@brief Replaces the hardware and records the frames sent and the heartbeats."""
+
+    def _init(self):
+        # The root user and the installed wifi-connect binary are not required.
+        self._assets_folder = os.path.dirname(UI_PATH)
+        self._ui_path = UI_PATH
+        self._wifi_connect_binary = shutil.which(WiFiSetupManager.WIFI_CONNECT_BIN_FILENAME)
+        self.frame_condition = threading.Condition()
+        self.frames = []
+        self.heartbeats = 0
+
+    def _create_display_device(self):
+        from luma.core.interface.serial import noop
+        from luma.oled.device import ssd1309
+        # The I2C time is not included.
+        return ssd1309(noop(), width=self._options.display_width, height=self._options.display_height)
+
+    def _update_display(self, msg, strength=None):
+        super()._update_display(msg, strength=strength)
+        if not self._device:
+            return
+        with self.frame_condition:
+            self.frames.append((perf_counter(), msg))
+            self.frame_condition.notify_all()
+
+    def _heartbeat(self):
+        self.heartbeats += 1
+        super()._heartbeat()
+
+    def wait_frame(self, msg, start, timeout=5.0):
+        """@return The time of the first frame showing msg sent after start or None."""
+        def find():
+            for frame_time, frame_msg in reversed(self.frames):
+                if frame_time < start:
+                    return None
+                if frame_msg == msg:
+                    return frame_time
+            return None
+        with self.frame_condition:
+            if self.frame_condition.wait_for(lambda: find() is not None, timeout):
+                return find()
+        return None
+
+
+def create_manager(options, uio):
+    if options.engine == WiFiSetupManager.ENGINE_ASYNCIO:
+        from rpi_wifi_setup.async_manager import AsyncWiFiSetupManager
+        base = AsyncWiFiSetupManager
+    else:
+        base = WiFiSetupManager
+    manager_class = type(f"Bench{base.__name__}", (BenchManagerMixin, base), {})
+    return manager_class(uio, options)
+
+
+def create_fake_commands(folder):
+    """@brief Create the nmcli, wifi-connect and sudo commands and put them first in the PATH."""
+    bin_folder = os.path.join(folder, 'bin')
+    os.makedirs(bin_folder)
+    commands = {'nmcli': f'exec "{sys.executable}" "{os.path.join(FIXTURES, "fake_nmcli.py")}" "$@"',
+                # wifi-connect runs until it is stopped.
+                'wifi-connect': f'exec "{sys.executable}" "{os.path.join(FIXTURES, "fake_wifi_connect.py")}" connect 3600',
+                'sudo': 'exec "$@"'}
+    for name, command in commands.items():
+        filename = os.path.join(bin_folder, name)
+        with open(filename, 'w') as fd:
+            fd.write(f"#!/bin/sh\n{command}\n")
+        os.chmod(filename, 0o755)
+    os.environ['PATH'] = bin_folder + os.pathsep + os.environ['PATH']
+    state_file = os.path.join(folder, 'nmcli_state.json')
+    with open(state_file, 'w') as fd:
+        json.dump({'connectivity': 'full', 'fix': None, 'calls': []}, fd)
+    os.environ['FAKE_NMCLI_STATE'] = state_file
+
+
+def get_manager_args(bench_options, folder):
+    args = ['--engine', bench_options.engine,
+            '--nm_backend', 'nmcli',
+            '--signal_source', 'nmcli',
+            '--mailbox_dir', os.path.join(folder, 'messages'),
+            '--display_socket', os.path.join(folder, 'display.sock'),
+            '--framebuffer', '',
+            '--diagnostics_dir', folder,
+            '--screen_off_seconds', '0']
+    if bench_options.led:
+        args += ['--led_pin', str(LED_PIN)]
+    return args
+
+
+def summarise(values):
+    """@return A dict of the mean, median, 95th percentile and maximum in ms."""
+    values = sorted(values)
+    return {'mean_ms': round(statistics.mean(values) * 1000, 3),
+            'p50_ms': round(statistics.median(values) * 1000, 3),
+            'p95_ms': round(values[min(len(values) - 1, int(len(values) * 0.95))] * 1000, 3),
+            'max_ms': round(values[-1] * 1000, 3),
+            'count': len(values)}
+
+
+def get_context_switches():
+    """@return A dict of thread name: the voluntary and involuntary context switches of the thread."""
+    names = {thread.native_id: thread.name for thread in threading.enumerate()}
+    switches = {}
+    task_folder = f"/proc/{os.getpid()}/task"
+    for task in os.listdir(task_folder):
+        try:
+            with open(os.path.join(task_folder, task, 'status')) as fd:
+                count = sum(int(line.split()[1]) for line in fd
+                            if line.startswith(('voluntary_ctxt_switches', 'nonvoluntary_ctxt_switches')))
+        except OSError:
+            # The thread has exited.
+            continue
+        name = names.get(int(task), "other")
+        switches[name] = switches.get(name, 0) + count
+    return switches
+
+
+def get_cpu_times():
+    """@return A tuple of the CPU time of this process and of its finished child processes."""
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (process_time(), children.ru_utime + children.ru_stime)
+
+
+def wait_until(condition, timeout=10.0, poll=0.001):
+    end = perf_counter() + timeout
+    while not condition():
+        if perf_counter() > end:
+            raise TimeoutError("Timeout waiting for the manager.")
+        sleep(poll)
+
+
+def measure_idle(manager, options):
+    heartbeats = manager.heartbeats
+    frames = len(manager.frames)
+    switches = get_context_switches()
+    cpu, child_cpu = get_cpu_times()
+    sleep(options.idle_seconds)
+    heartbeats = manager.heartbeats - heartbeats
+    cpu_end, child_cpu_end = get_cpu_times()
+    minutes = options.idle_seconds / 60
+    # This thread is not part of the manager.
+    thread_wakeups = {name: round((count - switches.get(name, 0)) / minutes, 1)
+                      for name, count in get_context_switches().items() if name != threading.current_thread().name}
+    return {'heartbeats_per_minute': round(heartbeats / minutes, 1),
+            'frames_per_minute': round((len(manager.frames) - frames) / minutes, 1),
+            'wakeups_per_minute': round(sum(thread_wakeups.values()), 1),
+            'thread_wakeups_per_minute': thread_wakeups,
+            'heartbeat_cpu_ms': round((cpu_end - cpu) * 1000 / heartbeats, 3) if heartbeats else None,
+            'heartbeat_command_cpu_ms': round((child_cpu_end - child_cpu) * 1000 / heartbeats, 3) if heartbeats else None}
+
+
+def measure_override(manager, options):
+    latencies = []
+    try:
+        for index in range(options.overrides):
+            msg = f"Override\n{index}"
+            start = perf_counter()
+            tmp_filename = OverrideHandler.FORCE_DISPLAY_FILE + ".tmp"
+            with open(tmp_filename, 'w') as fd:
+                fd.write(msg)
+            os.replace(tmp_filename, OverrideHandler.FORCE_DISPLAY_FILE)
+            frame_time = manager.wait_frame(msg, start)
+            if frame_time is None:
+                raise TimeoutError(f"The override message {index} was not shown.")
+            latencies.append(frame_time - start)
+            # Frames are sent no faster than --max_fps.
+            sleep(1.0 / manager._options.max_fps)
+    finally:
+        os.remove(OverrideHandler.FORCE_DISPLAY_FILE)
+    return summarise(latencies)
+
+
+def measure_portal(manager, options):
+    start_times = []
+    stop_times = []
+    cpu_times = []
+    for _ in range(options.portals):
+        cpu = sum(get_cpu_times())
+        start = perf_counter()
+        # gpiozero calls the held callback from its own thread.
+        manager._btn.when_held()
+        wait_until(lambda: manager._portal_session and manager._portal_session.get_state() == PORTAL_RUNNING)
+        running = perf_counter()
+        session = manager._portal_session
+        manager._btn.when_held()
+        wait_until(lambda: session.get_state() in PORTAL_FINISHED_STATES)
+        stopped = perf_counter()
+        # The reconnect ladder runs after the portal, the fake nmcli reports full connectivity.
+        wait_until(lambda: not session.is_active() and manager._reconnect_ladder.get_stats()['runs'] > len(start_times))
+        sleep(0.2)
+        cpu_times.append(sum(get_cpu_times()) - cpu)
+        start_times.append(running - start)
+        stop_times.append(stopped - running)
+    return {'start': summarise(start_times),
+            'stop': summarise(stop_times),
+            'cpu': summarise(cpu_times)}
+
+
+def measure_render(manager, options):
+    results = {}
+    for name, screen in SCREENS:
+        times = []
+        for index in range(options.frames):
+            msg, strength = screen(index)
+            start = perf_counter()
+            manager._update_display(msg, strength=strength)
+            times.append(perf_counter() - start)
+        results[name] = summarise(times)
+    return results
+
+
+def drive(manager, options, results):
+    """@brief Run the measurements on the manager while its main loop runs, then stop it."""
+    try:
+        wait_until(lambda: manager.heartbeats > 0)
+        # Allow the start up frames and the first scan to complete.
+        sleep(options.settle_seconds)
+        results['idle'] = measure_idle(manager, options)
+        if not options.led:
+            results['override'] = measure_override(manager, options)
+        results['portal'] = measure_portal(manager, options)
+    except Exception:
+        results['error'] = traceback.format_exc()
+    finally:
+        # Stop the main loop as CTRL C would.
+        os.kill(os.getpid(), signal.SIGINT)
+
+
+def compare(results, baseline, tolerance, min_difference, path=""):
+    """@return A list of the results that are more than tolerance worse than the baseline.
+               All the results are times, rates or counts where lower is better."""
+    regressions = []
+    for key, value in results.items():
+        name = f"{path}.{key}" if path else key
+        base = baseline.get(key) if isinstance(baseline, dict) else None
+        if isinstance(value, dict):
+            regressions += compare(value, base or {}, tolerance, min_difference, name)
+        elif isinstance(value, (int, float)) and isinstance(base, (int, float)) and base > 0 and key != 'count':
+            ratio = value / base
+            # Small differences are noise (E.G a 1 ms portal stop time).
+            worse = ratio > 1 + tolerance and value - base > min_difference
+            print(f"{name:<45} {base:12.3f} {value:12.3f} {ratio:6.2f}{' REGRESSION' if worse else ''}")
+            if worse:
+                regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WiFiSetupManager benchmark without hardware.")
+    parser.add_argument("--engine", choices=WiFiSetupManager.ENGINES, help=f"The manager engine (default = {WiFiSetupManager.DEFAULT_ENGINE}).", default=WiFiSetupManager.DEFAULT_ENGINE)
+    parser.add_argument("--led", action='store_true', help="Use an LED rather than the display. The render and override results are not measured.")
+    parser.add_argument("--frames", type=int, help="The number of frames rendered for each screen type (default = 500).", default=500)
+    parser.add_argument("--overrides", type=int, help="The number of override file writes (default = 20).", default=20)
+    parser.add_argument("--portals", type=int, help="The number of portal start/stops (default = 5).", default=5)
+    parser.add_argument("--idle_seconds", type=float, help="The idle period measured (default = 30).", default=30.0)
+    parser.add_argument("--settle_seconds", type=float, help="The time allowed after start up before measuring (default = 2).", default=2.0)
+    parser.add_argument("--output", help="Write the JSON results to this file rather than stdout.")
+    parser.add_argument("--baseline", help="Compare the results with a JSON results file from a previous run.")
+    parser.add_argument("--tolerance", type=float, help="The fraction a result may be worse than the baseline (default = 0.25).", default=0.25)
+    parser.add_argument("--min_difference", type=float, help="The amount (ms or per minute) a result may be worse than the baseline whatever --tolerance (default = 1).", default=1.0)
+    options = parser.parse_args()
+
+    Device.pin_factory = MockFactory()
+    results = {'engine': options.engine,
+               'output': "led" if options.led else "display",
+               'python': platform.python_version(),
+               'machine': platform.machine()}
+    with tempfile.TemporaryDirectory() as folder:
+        create_fake_commands(folder)
+        manager_options = get_arg_parser().parse_args(get_manager_args(options, folder))
+        manager = create_manager(manager_options, UIO())
+        driver = threading.Thread(target=drive, args=(manager, options, results), daemon=True)
+        driver.start()
+        try:
+            manager.run()
+        except KeyboardInterrupt:
+            pass
+        driver.join()
+        if not options.led:
+            # The main loop has stopped so only this thread uses the display.
+            results['render'] = measure_render(manager, options)
+
+    text = json.dumps(results, indent=2)
+    if options.output:
+        with open(options.output, 'w') as fd:
+            fd.write(text + "\n")
+    else:
+        print(text)
+    if 'error' in results:
+        sys.exit(results['error'])
+    if options.baseline:
+        with open(options.baseline) as fd:
+            baseline = json.load(fd)
+        for key in ('engine', 'output', 'machine'):
+            if baseline.get(key) != results[key]:
+                print(f"The baseline {key} is {baseline.get(key)}, not {results[key]}.")
+        regressions = compare(results, baseline, options.tolerance, options.min_difference)
+        if regressions:
+            sys.exit(f"{len(regressions)} results are more than {options.tolerance:.0%} worse than {options.baseline}: {', '.join(regressions)}")
+
+
+if __name__ == '__main__':
+    main()
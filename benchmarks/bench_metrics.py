@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""@brief Measure the overhead of the metrics instrumentation. The cost of the timers
+          recorded on each heartbeat plus the textfile write (amortised over the heartbeats
+          between writes) is shown as a percentage of the shortest heartbeat interval and of
+          a heartbeat that starts the three processes the nmcli backend starts ('true' is
+          started in place of nmcli so this understates the heartbeat on a Pi).
+          tests/test_metrics.py checks the exports and that the overhead is below 1%."""
+
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+
+from timeit import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from rpi_wifi_setup.metrics import MetricsRegistry, TextfileExporter, METRIC_COMMAND, METRIC_RENDER, \
+    METRIC_DISPLAY_TRANSFER, METRIC_BUTTON_TO_DISPLAY, METRIC_TIME_TO_CONNECTIVITY  # noqa: E402
+from rpi_wifi_setup.heartbeat import HeartbeatPolicy  # noqa: E402
+
+# The observations on a heartbeat with the nmcli backend that redraws the display after a button press.
+HEARTBEAT_TIMERS = ((METRIC_COMMAND, {'command': "check_internet"}),
+                    (METRIC_COMMAND, {'command': "wifi_ip"}),
+                    (METRIC_COMMAND, {'command': "wifi_strength"}),
+                    (METRIC_RENDER, {}),
+                    (METRIC_DISPLAY_TRANSFER, {}))
+HEARTBEAT_OBSERVATIONS = ((METRIC_BUTTON_TO_DISPLAY, {}),
+                          (METRIC_TIME_TO_CONNECTIVITY, {}))
+
+
+def measure_overhead(folder, options):
+    registry = MetricsRegistry()
+    n = options.iterations
+
+    def timers():
+        for name, labels in HEARTBEAT_TIMERS:
+            with registry.time(name, **labels):
+                pass
+        for name, labels in HEARTBEAT_OBSERVATIONS:
+            registry.observe(name, 0.1, **labels)
+
+    timer_cost = timeit(timers, number=n) / n
+    exporter = TextfileExporter(registry, os.path.join(folder, 'overhead.prom'), min_interval=0)
+
+    def write():
+        registry.observe(METRIC_RENDER, 0.001)
+        exporter.write()
+
+    write_cost = timeit(write, number=options.writes) / options.writes
+    heartbeat_interval = HeartbeatPolicy.DEFAULT_MIN_SECONDS
+    writes_per_heartbeat = min(1.0, heartbeat_interval / TextfileExporter.DEFAULT_MIN_INTERVAL_SECONDS)
+    overhead = timer_cost + write_cost * writes_per_heartbeat
+
+    heartbeat_work = timeit(lambda: [subprocess.run(['true']) for _ in range(3)], number=20) / 20
+    print(f"overhead: timers {timer_cost * 1e6:.1f} us/heartbeat, textfile write {write_cost * 1e6:.1f} us "
+          f"({writes_per_heartbeat:.2f}/heartbeat), total {overhead * 1e6:.1f} us = "
+          f"{overhead / heartbeat_interval * 100:.4f}% of a {heartbeat_interval:.0f} s heartbeat, "
+          f"{overhead / heartbeat_work * 100:.2f}% of a heartbeat's {heartbeat_work * 1e3:.2f} ms of process starts")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Metrics instrumentation overhead benchmark.")
+    parser.add_argument("-n", "--iterations", type=int, help="The number of heartbeats of timers timed (default = 20000).", default=20000)
+    parser.add_argument("--writes", type=int, help="The number of textfile writes timed (default = 500).", default=500)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        measure_overhead(folder, options)
+
+
+if __name__ == '__main__':
+    main()
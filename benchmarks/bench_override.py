@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""@brief Stress the display override file handling by writing to the override file
+          at a fixed rate and measure the number of renders and the CPU time used when
+          every file event is rendered and when events are debounced and unchanged
+          text is skipped."""
+
+import os
+import sys
+import argparse
+import tempfile
+import threading
+
+from time import sleep, perf_counter, process_time
+
+from PIL import ImageFont
+from luma.core.device import dummy
+from watchdog.observers import Observer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from rpi_wifi_setup.rpi_wifi_setup import OverrideHandler, WiFiSetupManager  # noqa: E402
+from rpi_wifi_setup.override import OverrideFile, Debouncer  # noqa: E402
+from rpi_wifi_setup.display import DiffingDisplay  # noqa: E402
+from rpi_wifi_setup.frame_renderer import FrameRenderer  # noqa: E402
+
+FONT_FILE = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+
+
+def load_font():
+    if os.path.isfile(FONT_FILE):
+        return ImageFont.truetype(FONT_FILE, 14)
+    return ImageFont.load_default(14)
+
+
+def start_timer(delay, function):
+    timer = threading.Timer(delay, function)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+class PerEventHarness(object):
+    """@brief Reads the file and renders a frame for every file event."""
+
+    def __init__(self, path, font):
+        self._path = path
+        self._lock = threading.Lock()
+        self._renderer = FrameRenderer((128, 64), font)
+        self._display = DiffingDisplay(dummy(width=128, height=64, mode='1'))
+        self.events = 0
+        self.renders = 0
+
+    def handle_interrupt_trigger(self):
+        self.events += 1
+        try:
+            with open(self._path, 'r') as fd:
+                msg = fd.read().strip()
+        except OSError:
+            msg = ""
+        self._render(msg)
+
+    def _render(self, msg):
+        with self._lock:
+            self.renders += 1
+            self._display.display(self._renderer.render(msg if msg else WiFiSetupManager.OFFLINE_MSG))
+
+    def stop(self):
+        pass
+
+
+class DebouncedHarness(PerEventHarness):
+    """@brief Merges file events and renders only when the text changes."""
+
+    def __init__(self, path, font, window):
+        super().__init__(path, font)
+        self._override_file = OverrideFile(path)
+        # The watchdog observer thread has no loop to poll the debouncer so a timer thread is used.
+        self._debouncer = Debouncer(window, self._on_change, schedule=start_timer)
+
+    def handle_interrupt_trigger(self):
+        self.events += 1
+        self._debouncer.trigger()
+
+    def _on_change(self):
+        if self._override_file.update():
+            self._render(self._override_file.get_message())
+
+    def stop(self):
+        self._debouncer.cancel()
+
+
+def write_file(path, text):
+    with open(path, 'w') as fd:
+        fd.write(text)
+
+
+def run(name, harness_factory, options, changing):
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, os.path.basename(OverrideHandler.FORCE_DISPLAY_FILE))
+        harness = harness_factory(path)
+        observer = Observer()
+        observer.schedule(OverrideHandler(harness, target_file=path), path=folder, recursive=False)
+        observer.start()
+
+        writes = int(options.rate * options.seconds)
+        interval = 1.0 / options.rate
+        start = perf_counter()
+        start_cpu = process_time()
+        for i in range(writes):
+            write_file(path, f"Count\n{i}" if changing else "Fixed\nmessage")
+            next_write = start + (i + 1) * interval
+            delay = next_write - perf_counter()
+            if delay > 0:
+                sleep(delay)
+        # Let the last events be handled
+        sleep(options.window * 2 + 0.2)
+        observer.stop()
+        observer.join()
+        harness.stop()
+        cpu = process_time() - start_cpu
+        elapsed = perf_counter() - start
+
+    text = "changing" if changing else "unchanged"
+    print(f"{name:<10} {text:<10} {writes:6d} writes {writes / elapsed:7.0f} writes/s {harness.events:6d} events {harness.renders:6d} renders {cpu:6.2f} s CPU")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Override file stress benchmark.")
+    parser.add_argument("-r", "--rate", type=float, help="The number of writes to the override file per second (default = 1000).", default=1000)
+    parser.add_argument("-s", "--seconds", type=float, help="The number of seconds to write for (default = 3).", default=3)
+    parser.add_argument("-w", "--window", type=float, help=f"The debounce window in seconds (default = {WiFiSetupManager.DEFAULT_OVERRIDE_DEBOUNCE_SECONDS}).", default=WiFiSetupManager.DEFAULT_OVERRIDE_DEBOUNCE_SECONDS)
+    options = parser.parse_args()
+
+    font = load_font()
+    for changing in (True, False):
+        run("per event", lambda path: PerEventHarness(path, font), options, changing)
+        run("debounced", lambda path: DebouncedHarness(path, font, options.window), options, changing)
+
+
+if __name__ == '__main__':
+    main()
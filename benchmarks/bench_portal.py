@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""@brief Measure the time taken to stop the WiFi portal session after a cancel or timeout
+          with a fake wifi-connect script. Each case is run on a session thread and on an
+          asyncio event loop. tests/test_portal.py checks the session states."""
+
+import os
+import sys
+import asyncio
+import argparse
+import tempfile
+import threading
+
+from time import sleep, perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from rpi_wifi_setup.portal import PortalSession, PORTAL_STOPPING  # noqa: E402
+
+FAKE_WIFI_CONNECT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'fixtures', 'fake_wifi_connect.py')
+KILL_TIMEOUT = 0.3
+
+
+class Case(object):
+
+    def __init__(self, name, args, timeout=0, cancel_after=None, cancel_in_prepare=False):
+        self.name = name
+        self.args = args
+        self.timeout = timeout
+        self.cancel_after = cancel_after
+        self.cancel_in_prepare = cancel_in_prepare
+
+
+CASES = (
+    Case("connect", ['connect', '0.2']),
+    Case("fail", ['fail', '0.1']),
+    Case("timeout", ['connect', '30'], timeout=0.3),
+    Case("cancel", ['connect', '30'], cancel_after=0.3),
+    Case("cancel stubborn", ['stubborn', '30'], cancel_after=0.3),
+    Case("cancel child", ['child', '30'], cancel_after=0.5),
+    Case("cancel in prepare", ['connect', '30'], cancel_in_prepare=True),
+)
+
+
+class Recorder(object):
+
+    def __init__(self):
+        self.states = []
+        self.times = {}
+        self.done = threading.Event()
+
+    def __call__(self, session, state):
+        self.states.append(state)
+        self.times[state] = perf_counter()
+        if not session.is_active():
+            self.done.set()
+
+
+def make_session(case, folder, recorder):
+    pid_file = os.path.join(folder, 'child.pid')
+    return PortalSession([sys.executable, FAKE_WIFI_CONNECT] + case.args + [pid_file],
+                         timeout=case.timeout,
+                         kill_timeout=KILL_TIMEOUT,
+                         on_state_change=recorder), pid_file
+
+
+def report(case, engine, session, recorder, pid_file, cancel_time):
+    if os.path.isfile(pid_file):
+        os.remove(pid_file)
+    stop_start = cancel_time or recorder.times.get(PORTAL_STOPPING)
+    stop = f"stopped in {(recorder.times[recorder.states[-1]] - stop_start) * 1000:6.1f} ms" if stop_start else ""
+    print(f"{engine:<8} {case.name:<18} {recorder.states[-1]:<10} returncode={session.get_returncode()} {stop}")
+
+
+def run_thread(case, folder):
+    recorder = Recorder()
+    session, pid_file = make_session(case, folder, recorder)
+    prepare = session.cancel if case.cancel_in_prepare else None
+    cancel_time = None
+    session.start(prepare=prepare)
+    if case.cancel_after:
+        sleep(case.cancel_after)
+        cancel_time = perf_counter()
+        session.cancel()
+    recorder.done.wait(10)
+    session.join()
+    report(case, "thread", session, recorder, pid_file, cancel_time)
+
+
+async def run_async(case, folder):
+    recorder = Recorder()
+    session, pid_file = make_session(case, folder, recorder)
+
+    async def prepare():
+        session.cancel()
+
+    task = asyncio.get_running_loop().create_task(session.run_async(prepare=prepare if case.cancel_in_prepare else None))
+    cancel_time = None
+    if case.cancel_after:
+        await asyncio.sleep(case.cancel_after)
+        cancel_time = perf_counter()
+        # Cancel from another thread as the gpiozero button does.
+        threading.Thread(target=session.cancel).start()
+    await asyncio.wait_for(task, 10)
+    report(case, "asyncio", session, recorder, pid_file, cancel_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WiFi portal session stop time with a fake wifi-connect.")
+    parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        for case in CASES:
+            run_thread(case, folder)
+        for case in CASES:
+            asyncio.run(run_async(case, folder))
+
+
+if __name__ == '__main__':
+    main()
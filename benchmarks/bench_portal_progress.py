@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""@brief Measure the time from each wifi-connect line being written until its WiFi portal
+          progress event is reported, with recorded wifi-connect transcripts, on a session
+          thread and on an asyncio event loop. The fake wifi-connect writes each transcript
+          line in two parts, alternately to stdout and stderr. The line splitter time per
+          line is also shown. tests/test_portal_progress.py checks the events."""
+
+import os
+import sys
+import asyncio
+import argparse
+import threading
+
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from rpi_wifi_setup.portal import PortalSession, LineSplitter  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'fixtures')
+FAKE_WIFI_CONNECT = os.path.join(FIXTURES, 'fake_wifi_connect.py')
+
+# transcript, exit code
+CASES = (
+    ('wifi_connect_success.txt', 0),
+    ('wifi_connect_failed.txt', 1),
+)
+
+
+class Recorder(object):
+
+    def __init__(self):
+        self.lines = []
+        self.events = []
+        self.line_times = []
+        self.done = threading.Event()
+
+    def on_output(self, session, line, event):
+        self.lines.append(line)
+        self.line_times.append(session.get_elapsed())
+        if event:
+            self.events.append(event)
+
+    def on_state_change(self, session, state):
+        if not session.is_active():
+            self.done.set()
+
+
+def make_session(transcript, returncode, seconds, recorder):
+    cmd = [sys.executable, FAKE_WIFI_CONNECT, 'replay', str(seconds), os.path.join(FIXTURES, transcript), str(returncode)]
+    return PortalSession(cmd,
+                         timeout=0,
+                         on_state_change=recorder.on_state_change,
+                         on_output=recorder.on_output)
+
+
+def report(engine, case, recorder, seconds):
+    transcript, returncode = case
+    # Each line is complete <seconds> after the previous one, the first at seconds / 2 after start up.
+    start = recorder.line_times[0] - seconds / 2
+    latency = [t - start - (index + 0.5) * seconds for index, t in enumerate(recorder.line_times)]
+    print(f"{engine:<8} {transcript:<26} exit={returncode} {len(recorder.events):2d} events "
+          f"line to event latency max {max(latency) * 1000:6.1f} ms")
+
+
+def run_thread(case, seconds):
+    recorder = Recorder()
+    session = make_session(case[0], case[1], seconds, recorder)
+    session.start()
+    recorder.done.wait(30)
+    session.join()
+    report("thread", case, recorder, seconds)
+
+
+async def run_async(case, seconds):
+    recorder = Recorder()
+    session = make_session(case[0], case[1], seconds, recorder)
+    await asyncio.wait_for(session.run_async(), 30)
+    report("asyncio", case, recorder, seconds)
+
+
+def measure_splitter():
+    splitter = LineSplitter()
+    start = perf_counter()
+    data = b"Starting HTTP server on 192.168.42.1:80\n" * 1000
+    for _ in range(100):
+        splitter.feed(data)
+    print(f"LineSplitter {(perf_counter() - start) * 1e9 / 100000:.0f} ns/line")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WiFi portal progress event latency with wifi-connect transcripts.")
+    parser.add_argument("-s", "--seconds", type=float, help="The time between transcript lines (default = 0.05).", default=0.05)
+    options = parser.parse_args()
+
+    measure_splitter()
+    for case in CASES:
+        run_thread(case, options.seconds)
+    for case in CASES:
+        asyncio.run(run_async(case, options.seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""@brief Measure the time the reconnect ladder takes to restore connectivity with a fake
+          nmcli. In each case connectivity returns after one step (or none), a command
+          hangs or fails or the ladder is cancelled. Each case is run blocking and on an
+          asyncio event loop and the time to connectivity and the number of nmcli commands
+          run are reported. tests/test_reconnect.py checks the steps run."""
+
+import os
+import sys
+import json
+import asyncio
+import argparse
+import tempfile
+import threading
+
+from time import time, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from rpi_wifi_setup.reconnect import ReconnectLadder, STEP_CONNECTION_UP, STEP_DEVICE_REAPPLY, STEP_RADIO_TOGGLE, \
+    STEP_NETWORKING_CYCLE  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'fixtures')
+FAKE_NMCLI = [sys.executable, os.path.join(FIXTURES, 'fake_nmcli.py')]
+
+
+class Case(object):
+
+    def __init__(self, name, fix, hang=None, fail=(), cancel_after=None):
+        self.name = name
+        self.fix = fix
+        self.hang = hang
+        self.fail = list(fail)
+        self.cancel_after = cancel_after
+
+
+CASES = (
+    Case("connection up", STEP_CONNECTION_UP),
+    Case("device reapply", STEP_DEVICE_REAPPLY),
+    Case("radio toggle", STEP_RADIO_TOGGLE),
+    Case("networking cycle", STEP_NETWORKING_CYCLE),
+    Case("no connectivity", None),
+    Case("reapply hangs", STEP_RADIO_TOGGLE, hang=STEP_DEVICE_REAPPLY),
+    Case("up/reapply fail", STEP_RADIO_TOGGLE, fail=(STEP_CONNECTION_UP, STEP_DEVICE_REAPPLY)),
+    Case("cancelled", None, cancel_after=0.3),
+)
+
+
+def write_state(state_file, case, options):
+    with open(state_file, 'w') as fd:
+        json.dump({'fix': case.fix, 'delay': options.delay, 'hang': case.hang, 'fail': case.fail,
+                   'connected_at': None, 'calls': []}, fd)
+
+
+def read_state(state_file):
+    with open(state_file) as fd:
+        return json.load(fd)
+
+
+def make_ladder(options):
+    return ReconnectLadder('wlan0',
+                           nmcli=FAKE_NMCLI,
+                           timeout=options.timeout,
+                           settle=options.settle,
+                           poll_interval=0.05,
+                           pause=0.1)
+
+
+def report(engine, case, ladder, step, state_file):
+    state = read_state(state_file)
+    called = [call for call in state['calls'] if '--fields' not in call and '-f' not in call]
+    stats = ladder.get_stats()
+    seconds = stats['steps'][step]['last_seconds'] if step else None
+    result = f"restored by {step} in {seconds:5.2f} s" if step else "not restored"
+    print(f"{engine:<8} {case.name:<18} {result:<42} {len(called)} nmcli commands cancelled={stats['cancelled']}")
+
+
+def run_blocking(case, options, state_file):
+    write_state(state_file, case, options)
+    ladder = make_ladder(options)
+    if case.cancel_after:
+        threading.Timer(case.cancel_after, ladder.cancel).start()
+    step = ladder.run(lambda: is_connected(state_file))
+    report("blocking", case, ladder, step, state_file)
+
+
+async def run_async(case, options, state_file):
+    write_state(state_file, case, options)
+    ladder = make_ladder(options)
+    if case.cancel_after:
+        # Cancel from another thread as the gpiozero button does.
+        threading.Timer(case.cancel_after, ladder.cancel).start()
+
+    async def is_connected_async():
+        return is_connected(state_file)
+
+    step = await ladder.run_async(is_connected_async)
+    report("asyncio", case, ladder, step, state_file)
+
+
+def is_connected(state_file):
+    connected_at = read_state(state_file)['connected_at']
+    return connected_at is not None and time() >= connected_at
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconnect ladder time to connectivity with a fake nmcli.")
+    parser.add_argument("--timeout", type=float, help="The step command timeout in seconds (default = 1).", default=1.0)
+    parser.add_argument("--settle", type=float, help="The time to wait for connectivity after each step (default = 0.5).", default=0.5)
+    parser.add_argument("--delay", type=float, help="The time connectivity takes to return after the step that restores it (default = 0.2).", default=0.2)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        state_file = os.path.join(folder, 'state.json')
+        os.environ['FAKE_NMCLI_STATE'] = state_file
+        for case in CASES:
+            run_blocking(case, options, state_file)
+        # Allow the cancel timers to complete.
+        sleep(0.1)
+        for case in CASES:
+            asyncio.run(run_async(case, options, state_file))
+
+
+if __name__ == '__main__':
+    main()
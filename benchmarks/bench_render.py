@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""@brief Measure the frames per second and CPU time per frame of the status frame
+          renderer with and without the bitmap cache."""
+
+import os
+import sys
+import argparse
+
+from time import perf_counter, process_time
+
+from PIL import ImageFont
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from rpi_wifi_setup.frame_renderer import FrameRenderer, BitmapCache  # noqa: E402
+
+FONT_FILE = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+DISPLAY_SIZE = (128, 64)
+
+
+def load_font():
+    if os.path.isfile(FONT_FILE):
+        return ImageFont.truetype(FONT_FILE, 14)
+    return ImageFont.load_default(14)
+
+
+def screens(count):
+    """@brief The screens shown over a period: the online screen as the signal varies and the fixed screens."""
+    sequence = []
+    for i in range(count):
+        if i % 20 == 0:
+            sequence.append(("OFFLINE\nHold button to\nsetup WiFi", None))
+        else:
+            strength = 60 + (i % 7)
+            sequence.append((f"ONLINE\n192.168.1.50\nSignal: {strength}%", strength))
+    return sequence
+
+
+def run(name, renderer, sequence):
+    start = perf_counter()
+    start_cpu = process_time()
+    for msg, strength in sequence:
+        renderer.render(msg, strength=strength)
+    cpu = process_time() - start_cpu
+    elapsed = perf_counter() - start
+    print(f"{name:<16} {len(sequence) / elapsed:10.0f} frames/s {cpu / len(sequence) * 1E6:10.1f} us CPU/frame  {renderer.get_stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Frame renderer bitmap cache benchmark.")
+    parser.add_argument("-n", "--frames", type=int, help="The number of frames to render (default = 2000).", default=2000)
+    options = parser.parse_args()
+
+    font = load_font()
+    sequence = screens(options.frames)
+    run("no cache", FrameRenderer(DISPLAY_SIZE, font, cache_size=0), sequence)
+    run("cache", FrameRenderer(DISPLAY_SIZE, font, cache_size=BitmapCache.DEFAULT_SIZE), sequence)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""@brief Measure the systemd notify messages against a local fake NOTIFY_SOCKET. A main loop
+          like the one in rpi_wifi_setup sends READY=1, STATUS= lines and WATCHDOG=1 pings.
+          The loop then stalls (E.G a hung nmcli command) and the time from the last ping
+          until systemd would restart the service is reported. The cost of each notify
+          message is also measured. The notify messages are checked by tests/test_sd_notify.py."""
+
+import os
+import sys
+import socket
+import argparse
+import tempfile
+
+from time import sleep, perf_counter, monotonic
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from rpi_wifi_setup.sd_notify import SystemdNotifier  # noqa: E402
+
+
+class FakeSystemd(object):
+    """@brief Receives the notify messages as systemd does."""
+
+    def __init__(self, address):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(address)
+        self._sock.settimeout(0)
+        self.messages = []
+
+    def receive(self):
+        """@return The messages received since the last call as (time, {field: value}) tuples."""
+        received = []
+        while True:
+            try:
+                data = self._sock.recv(4096)
+            except BlockingIOError:
+                break
+            fields = dict(line.split('=', 1) for line in data.decode('utf-8').splitlines())
+            received.append((monotonic(), fields))
+        self.messages += received
+        return received
+
+    def close(self):
+        self._sock.close()
+
+
+def run_loop(notifier, fake_systemd, duration, stall_after, tick):
+    """@brief A main loop that stops iterating (stalls) after stall_after seconds."""
+    start = monotonic()
+    iterations = 0
+    while monotonic() - start < duration:
+        if monotonic() - start < stall_after:
+            notifier.status(f"ONLINE 192.168.1.50 Signal: {50 + iterations % 3}%, render 4.2 ms")
+            notifier.watchdog()
+            iterations += 1
+        sleep(tick)
+        fake_systemd.receive()
+    return iterations
+
+
+def measure_watchdog(address, environ_address, options):
+    fake_systemd = FakeSystemd(address)
+    watchdog_usec = int(options.watchdog * 1_000_000)
+    notifier = SystemdNotifier(environ={'NOTIFY_SOCKET': environ_address,
+                                        'WATCHDOG_USEC': str(watchdog_usec),
+                                        'WATCHDOG_PID': str(os.getpid())})
+
+    notifier.ready("Checking connectivity")
+    run_loop(notifier, fake_systemd, options.watchdog * 4, options.watchdog * 2, options.watchdog / 20)
+    notifier.stopping()
+    fake_systemd.receive()
+    fake_systemd.close()
+    notifier.close()
+
+    messages = fake_systemd.messages
+    pings = [t for t, fields in messages if 'WATCHDOG' in fields]
+    statuses = [fields['STATUS'] for _, fields in messages[1:] if 'STATUS' in fields]
+    ready_time = messages[0][0]
+    gaps = [b - a for a, b in zip([ready_time] + pings, pings)]
+    # systemd restarts the service when no ping is received for WatchdogSec.
+    silence = messages[-1][0] - pings[-1]
+    print(f"{environ_address[:1]:<2} READY + {len(pings)} pings, max gap {max(gaps):.2f} s (WatchdogSec {options.watchdog} s), "
+          f"{len(statuses)} status lines, no ping for {silence:.2f} s after the loop stalled")
+
+
+def measure_send(address, options):
+    fake_systemd = FakeSystemd(address)
+    notifier = SystemdNotifier(environ={'NOTIFY_SOCKET': address, 'WATCHDOG_USEC': '2'})
+    notifier.ready()
+    start = perf_counter()
+    for i in range(options.messages):
+        notifier.status(f"ONLINE 192.168.1.50 Signal: {i}%")
+        if i % 5 == 4:
+            fake_systemd.receive()
+    elapsed = perf_counter() - start
+    fake_systemd.receive()
+    fake_systemd.close()
+    notifier.close()
+    print(f"STATUS message: {elapsed * 1_000_000 / options.messages:.2f} us each")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="systemd notify benchmark against a fake NOTIFY_SOCKET.")
+    parser.add_argument("-w", "--watchdog", type=float, help="The WatchdogSec value in seconds (default = 0.4).", default=0.4)
+    parser.add_argument("-m", "--messages", type=int, help="The number of messages timed (default = 20000).", default=20000)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        address = os.path.join(folder, "notify")
+        measure_watchdog(address, address, options)
+        os.remove(address)
+        abstract_name = f"rpi_wifi_setup_bench_{os.getpid()}"
+        measure_watchdog('\0' + abstract_name, '@' + abstract_name, options)
+        measure_send(address, options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""@brief Compare the cost of reading the WiFi signal strength from each signal source.
+          Fixture files stand in for /proc/net/wireless and the nmcli output so this runs
+          on any Linux machine. The nmcli source is timed both parsing the fixture and
+          starting a process (cat) to produce it as nmcli would."""
+
+import os
+import sys
+import argparse
+
+from timeit import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from rpi_wifi_setup.signal_source import ProcNetWirelessSource, NmcliSignalSource  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'fixtures')
+PROC_NET_WIRELESS_FIXTURE = os.path.join(FIXTURES, 'proc_net_wireless.txt')
+NMCLI_FIXTURE = os.path.join(FIXTURES, 'nmcli_device_wifi.txt')
+
+
+def report(name, iterations, seconds, strength):
+    print(f"{name:<28} {seconds / iterations * 1E6:10.1f} us/read  (strength={strength}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Signal strength source micro benchmark.")
+    parser.add_argument("-n", "--iterations", type=int, help="The number of reads per source (default = 1000).", default=1000)
+    options = parser.parse_args()
+    n = options.iterations
+
+    proc_source = ProcNetWirelessSource('wlan0', path=PROC_NET_WIRELESS_FIXTURE)
+    report("proc read", n, timeit(proc_source.read, number=n), proc_source.read())
+
+    with open(NMCLI_FIXTURE) as fd:
+        nmcli_output = fd.read()
+    nmcli_source = NmcliSignalSource('wlan0', cmd=['cat', NMCLI_FIXTURE])
+    report("nmcli parse only", n, timeit(lambda: nmcli_source.parse(nmcli_output), number=n), nmcli_source.parse(nmcli_output))
+
+    # Process start up dominates, fewer iterations are needed.
+    fork_n = max(1, n // 10)
+    report("nmcli process (cat fixture)", fork_n, timeit(nmcli_source.read, number=fork_n), nmcli_source.read())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""@brief Measure the background SSID scanner with recorded nmcli device wifi list output.
+          A shell command that sleeps and then prints the fixture stands in for nmcli. The
+          scans run while offline with the screen on, offline with the screen off, online
+          and while the portal is running (paused) are counted and the time to get a
+          network list when the portal starts is compared for a cold scan and the cache.
+          tests/test_ssid_scan.py checks the scanner."""
+
+import os
+import sys
+import asyncio
+import argparse
+
+from time import sleep, perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from rpi_wifi_setup.ssid_scan import SsidScanner, parse_wifi_list  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'fixtures')
+NMCLI_FIXTURE = os.path.join(FIXTURES, 'nmcli_device_wifi_list.txt')
+
+
+def scan_cmd(seconds):
+    return ["sh", "-c", f"sleep {seconds}; cat '{NMCLI_FIXTURE}'"]
+
+
+def measure_parse():
+    with open(NMCLI_FIXTURE) as fd:
+        output = fd.read()
+    start = perf_counter()
+    for _ in range(1000):
+        networks = parse_wifi_list(output)
+    print(f"parse: {len(networks)} networks from {NMCLI_FIXTURE} in {(perf_counter() - start) * 1000:.1f} us")
+
+
+def count_scans(scanner, seconds, **state):
+    scans = scanner.get_stats()['scans']
+    for name, value in state.items():
+        getattr(scanner, f"set_{name}")(value)
+    sleep(seconds)
+    return scanner.get_stats()['scans'] - scans
+
+
+def measure_duty_cycle(options):
+    interval = options.interval
+    scanner = SsidScanner(interval=interval, idle_interval=interval * 5, cmd=scan_cmd(options.scan_seconds))
+    scanner.start()
+    period = interval * 10
+    cases = (("online", {'offline': False}, 0),
+             ("offline screen on", {'offline': True}, period / interval),
+             ("offline screen off", {'screen_on': False}, period / (interval * 5)),
+             ("portal running", {'paused': True}, 0))
+    for name, state, expected in cases:
+        scans = count_scans(scanner, period, **state)
+        print(f"{name:<20} {scans:3d} scans in {period:.1f} s (expected {expected:.0f}), "
+              f"{scans * 3600 / period * interval / 30:7.1f} scans/hour at the default 30 s interval")
+    scanner.stop()
+
+
+def measure_portal_start(options):
+    scanner = SsidScanner(interval=30, cmd=scan_cmd(options.cold_scan_seconds))
+    start = perf_counter()
+    scanner.get_result(max_age=30) or scanner.scan()
+    cold = perf_counter() - start
+    start = perf_counter()
+    scanner.get_result(max_age=30) or scanner.scan()
+    cached = perf_counter() - start
+    print(f"portal network list: cold scan {cold * 1000:8.1f} ms, cached {cached * 1000:8.3f} ms")
+
+
+async def measure_async(options):
+    scanner = SsidScanner(cmd=scan_cmd(options.scan_seconds))
+    await scanner.scan_async()
+    print(f"asyncio scan: {scanner.get_stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Background SSID scanner scans and network list time.")
+    parser.add_argument("--interval", type=float, help="The scan interval used (default = 0.2).", default=0.2)
+    parser.add_argument("--scan_seconds", type=float, help="The time each fake scan takes (default = 0.02).", default=0.02)
+    parser.add_argument("--cold_scan_seconds", type=float, help="The time a cold scan takes (default = 3).", default=3.0)
+    options = parser.parse_args()
+
+    measure_parse()
+    measure_duty_cycle(options)
+    measure_portal_start(options)
+    asyncio.run(measure_async(options))
+
+
+if __name__ == '__main__':
+    main()
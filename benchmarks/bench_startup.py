@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""@brief Measure the startup import time of each mode with python -X importtime and
+          check it against the recorded budget. Each mode is run in a new interpreter
+          that loads the modules the mode loads and reports any module the mode should
+          not load (E.G LED mode must not load PIL, luma or watchdog).
+
+          The budgets were recorded on an x86_64 development machine. Use --scale to
+          check against them on a slower machine (E.G --scale 8 on a Raspberry Pi Zero 2 W)."""
+
+import os
+import sys
+import argparse
+import subprocess
+
+from statistics import median
+from time import perf_counter
+
+SRC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# The code run in each mode and the top level modules that the mode must not load.
+MODES = {
+    # Interpreter startup only, the other modes include this.
+    'interpreter': ("pass",
+                    ()),
+    # The BootManager options (--enable_auto_start, --check_auto_start etc) parse the command line and exit.
+    'boot_manager': ("import sys\n"
+                     "sys.argv = ['rpi_wifi_setup', '--help']\n"
+                     "sys.stdout = open(os.devnull, 'w')\n"
+                     "from rpi_wifi_setup.rpi_wifi_setup import main\n"
+                     "main()\n",
+                     ('PIL', 'luma', 'watchdog', 'gpiozero', 'jeepney', 'asyncio')),
+    # --led_pin with the threaded engine.
+    'led': ("from rpi_wifi_setup.rpi_wifi_setup import WifiLEDCtrl\n"
+            "WifiLEDCtrl(5)\n",
+            ('PIL', 'luma', 'watchdog', 'asyncio')),
+    # The OLED display with the threaded engine. watchdog is only loaded if inotify is not available.
+    'display': ("import rpi_wifi_setup.rpi_wifi_setup\n"
+                "from gpiozero import Button\n"
+                "from PIL import ImageFont\n"
+                "from luma.core.interface.serial import i2c\n"
+                "from luma.oled.device import ssd1309\n"
+                "from rpi_wifi_setup.display import DiffingDisplay\n"
+                "from rpi_wifi_setup.frame_renderer import FrameRenderer\n",
+                ('watchdog', 'asyncio')),
+    # --engine asyncio
+    'asyncio': ("import rpi_wifi_setup.async_manager\n",
+                ('watchdog',)),
+}
+
+# The maximum median import time of each mode in ms.
+STARTUP_BUDGET_MS = {
+    'interpreter': 15,
+    'boot_manager': 110,
+    'led': 170,
+    'display': 210,
+    'asyncio': 190,
+}
+
+CHECK_CODE = "\nprint(' '.join(name for name in {forbidden!r} if name in sys.modules))\n"
+
+
+def parse_importtime(stderr):
+    """@brief Parse the python -X importtime output.
+       @return A tuple containing the total import time in ms and a list of (self ms, module) tuples."""
+    total_ms = 0
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split('|')
+        modules.append((int(self_us) / 1000, name.strip()))
+        # Nested imports are indented
+        if not name[1:].startswith(' '):
+            total_ms += int(cumulative_us) / 1000
+    return total_ms, modules
+
+
+def run_mode(code, forbidden):
+    """@brief Run the code of a mode in a new interpreter.
+       @return A tuple containing the import time in ms, the wall time in ms, the module import times and the forbidden modules loaded."""
+    env = dict(os.environ, PYTHONPATH=SRC_FOLDER, GPIOZERO_PIN_FACTORY='mock')
+    code = "import os, sys\n" + code + CHECK_CODE.format(forbidden=tuple(forbidden))
+    start = perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env, capture_output=True, text=True)
+    wall_ms = (perf_counter() - start) * 1000
+    if proc.returncode != 0:
+        raise Exception(proc.stderr)
+    import_ms, modules = parse_importtime(proc.stderr)
+    loaded = proc.stdout.strip().splitlines()[-1].split() if proc.stdout.strip() else []
+    return import_ms, wall_ms, modules, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup import time benchmark.")
+    parser.add_argument("-n", "--runs", type=int, help="The number of runs of each mode (default = 5).", default=5)
+    parser.add_argument("-t", "--top", type=int, help="The number of slowest modules (excluding the modules they import) to show for each mode (default = 5).", default=5)
+    parser.add_argument("--scale", type=float, help="Multiply the budgets by this factor (default = 1).", default=1.0)
+    parser.add_argument("--check", action='store_true', help="Exit with a non zero status if a mode is over budget or loads a module it should not.")
+    options = parser.parse_args()
+
+    failed = False
+    for mode, (code, forbidden) in MODES.items():
+        results = [run_mode(code, forbidden) for _ in range(options.runs)]
+        import_ms = median(result[0] for result in results)
+        wall_ms = median(result[1] for result in results)
+        budget_ms = STARTUP_BUDGET_MS[mode] * options.scale
+        loaded = results[-1][3]
+        ok = import_ms <= budget_ms and not loaded
+        failed = failed or not ok
+        print(f"{mode:<14} import {import_ms:7.1f} ms wall {wall_ms:7.1f} ms budget {budget_ms:7.1f} ms {'OK' if ok else 'OVER'}")
+        if loaded:
+            print(f"  loads {' '.join(loaded)}")
+        for ms, name in sorted(results[-1][2], reverse=True)[:options.top]:
+            print(f"  {ms:7.1f} ms {name}")
+
+    if options.check and failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
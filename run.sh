@@ -1,2 +1,2 @@
 #!/bin/bash
-poetry run src/rpi_wifi_setup/rpi_wifi_setup.py -d
\ No newline at end of file
+poetry run python3 -m rpi_wifi_setup.rpi_wifi_setup -d
\ No newline at end of file
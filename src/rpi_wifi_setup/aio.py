@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+import asyncio
+import subprocess
+
+
+async def check_output_async(cmd, timeout=None):
+    """@brief Run a command without blocking the event loop and return its output.
+              A subprocess.CalledProcessError is raised if the command fails.
+       @param cmd The command as a list of arguments.
+       @param timeout If not None the maximum number of seconds the command may take. If it
+                      takes longer it is killed and asyncio.TimeoutError is raised.
+       @return The stdout text."""
+    proc = await asyncio.create_subprocess_exec(*cmd,
+                                                stdout=asyncio.subprocess.PIPE,
+                                                stderr=asyncio.subprocess.DEVNULL)
+    try:
+        stdout, _ = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=stdout)
+    return stdout.decode("utf-8")
+
+
+async def run_async(cmd):
+    """@brief Run a command without blocking the event loop.
+              A subprocess.CalledProcessError is raised if the command fails.
+       @param cmd The command as a list of arguments."""
+    proc = await asyncio.create_subprocess_exec(*cmd)
+    returncode = await proc.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+
+import asyncio
+
+from time import perf_counter, monotonic
+
+from p3lib.helper import logTraceBack
+
+from gpiozero import Button, LED
+
+from rpi_wifi_setup.rpi_wifi_setup import WiFiSetupManager, WifiLEDCtrl
+from rpi_wifi_setup.connectivity import ConnectivitySnapshot, AsyncConnectivityCache
+from rpi_wifi_setup.override import Debouncer
+from rpi_wifi_setup.led import PatternLED
+from rpi_wifi_setup.heartbeat import RESET_PORTAL
+from rpi_wifi_setup.portal import PORTAL_STOPPING, PORTAL_SUCCEEDED
+from rpi_wifi_setup.metrics import METRIC_COMMAND, METRIC_PORTAL
+from rpi_wifi_setup.aio import check_output_async, run_async
+
+
+class AsyncWiFiSetupManager(WiFiSetupManager):
+    """@brief Runs the WiFi setup manager on a single asyncio event loop. Button edges,
+              override file changes, connectivity updates, the screen off timeout, LED
+              blinking and the wifi-connect portal are all handled as callbacks or tasks
+              on the loop and nmcli is run with asyncio subprocesses. As only the loop
+              touches the display no display lock is required."""
+
+    def __init__(self, uio, options):
+        super().__init__(uio, options)
+        self._connectivity_cache = AsyncConnectivityCache(self._read_connectivity_snapshot_async,
+                                                          ttl=options.connectivity_ttl)
+        self._loop = None
+        self._update_task = None
+        self._update_pending = False
+        self._screen_off_handle = None
+        self._portal_task = None
+        self._reconnect_task = None
+        self._led = None
+        self._watchdog_task = None
+        self._heartbeat_wakeup = None
+        self._scan_task = None
+        self._scan_wakeup = None
+        self._scan = None
+        self._mailbox_expiry = None
+        self._mailbox_expiry_handle = None
+
+    def run(self):
+        asyncio.run(self._run())
+
+    async def _run(self):
+        self._loop = asyncio.get_running_loop()
+        self._heartbeat_wakeup = asyncio.Event()
+        self._scan_wakeup = asyncio.Event()
+        self._override_debouncer = Debouncer(self._options.override_debounce,
+                                             self._on_override_change,
+                                             schedule=self._loop.call_later)
+
+        # Hardware Setup
+        self._btn = Button(self._options.button_pin,
+                           hold_time=WiFiSetupManager.BUTTON_HOLD_SECONDS)
+
+        if self._options.led_pin is not None:
+            self._led = PatternLED(LED(self._options.led_pin))
+
+        else:
+            self._setup_display()
+            self._start_override_observer()
+            self._start_mailbox()
+            self._schedule_mailbox_expiry()
+            self._start_display_socket()
+            self._start_framebuffer()
+
+        await run_async(WiFiSetupManager.NMCLI_WIFI_ON_CMD)
+
+        self._start_nm_monitor()
+        self._start_netlink_monitor()
+
+        if self._ssid_scanner.is_enabled():
+            self._scan_task = self._loop.create_task(self._run_ssid_scanner())
+        self._start_metrics()
+        self._start_diagnostics()
+
+        # gpiozero calls these from its own thread so pass them to the loop.
+        self._btn.when_held = lambda: self._loop.call_soon_threadsafe(self._start_wifi_portal)
+        self._btn.when_pressed = lambda: self._loop.call_soon_threadsafe(self._on_button_pressed)
+        self._schedule_screen_off()
+
+        try:
+            self._notify_ready(await self._connectivity_cache.get())
+            self._watchdog_task = self._loop.create_task(self._run_watchdog())
+            while True:
+                self._heartbeat()
+                await self._wait_heartbeat(self._get_heartbeat_interval())
+
+        finally:
+            self._notifier.stopping()
+            for task in (self._update_task, self._portal_task, self._watchdog_task, self._scan_task):
+                if task:
+                    task.cancel()
+            await self._stop_reconnect()
+            if self._mailbox_expiry_handle:
+                self._mailbox_expiry_handle.cancel()
+            self._connectivity_cache.close()
+            self._stop_metrics()
+            self._stop_diagnostics()
+            self._stop_monitors()
+            if self._led:
+                self._led.off()
+            self._notifier.close()
+
+    async def _wait_heartbeat(self, interval):
+        """@brief Wait until the next heartbeat. The wait is shortened if the heartbeat policy is
+                  reset (E.G by a button press) while waiting.
+           @param interval The number of seconds until the next heartbeat."""
+        deadline = self._loop.time() + interval
+        while True:
+            delay = deadline - self._loop.time()
+            if delay <= 0:
+                return
+            self._heartbeat_wakeup.clear()
+            try:
+                await asyncio.wait_for(self._heartbeat_wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                return
+            deadline = min(deadline, self._loop.time() + self._heartbeat_policy.get_interval(self._screen_on))
+
+    def _wake_main_loop(self):
+        if self._heartbeat_wakeup:
+            self._loop.call_soon_threadsafe(self._heartbeat_wakeup.set)
+
+    def _create_display_socket(self, schedule=None):
+        return super()._create_display_socket(schedule=self._loop.call_later)
+
+    def _create_ssid_scanner(self, on_change=None):
+        return super()._create_ssid_scanner(on_change=self._wake_ssid_scanner)
+
+    def _wake_ssid_scanner(self):
+        if self._scan_wakeup:
+            self._loop.call_soon_threadsafe(self._scan_wakeup.set)
+
+    async def _run_ssid_scanner(self):
+        """@brief Scan for WiFi networks while offline, see SsidScanner."""
+        while True:
+            self._scan_wakeup.clear()
+            delay = self._ssid_scanner.get_delay()
+            if delay == 0:
+                # The scan is a separate task so that the portal can wait for it.
+                self._scan = self._loop.create_task(self._ssid_scanner.scan_async())
+                await self._scan
+                continue
+            try:
+                await asyncio.wait_for(self._scan_wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run_watchdog(self):
+        """@brief Ping the systemd watchdog. The task only runs if the event loop is not blocked."""
+        while True:
+            delay = self._notifier.get_watchdog_delay()
+            if delay is None:
+                return
+            await asyncio.sleep(delay)
+            self._notify_watchdog()
+
+    def _heartbeat(self):
+        """@brief Periodic connectivity update. The screen timeout is a loop timer."""
+        if not self._led:
+            self._update_mailbox()
+        if self._led or self._screen_on:
+            self._update_status_output()
+        self._record_connectivity()
+        self._notify_status()
+        self._export_metrics()
+        self._log_stats()
+
+    def _on_mailbox_change(self, names):
+        super()._on_mailbox_change(names)
+        self._schedule_mailbox_expiry()
+
+    def _update_mailbox(self):
+        super()._update_mailbox()
+        self._schedule_mailbox_expiry()
+
+    def _schedule_mailbox_expiry(self):
+        """@brief Set a loop timer for the next mailbox message expiry. The timer is only
+                  replaced when the time of the next expiry changes."""
+        expires = self._mailbox.get_next_expiry() if self._mailbox else None
+        if expires == self._mailbox_expiry:
+            return
+        if self._mailbox_expiry_handle:
+            self._mailbox_expiry_handle.cancel()
+            self._mailbox_expiry_handle = None
+        self._mailbox_expiry = expires
+        if expires is not None:
+            self._mailbox_expiry_handle = self._loop.call_later(self._get_mailbox_expiry_delay(),
+                                                                self._on_mailbox_expiry)
+
+    def _on_mailbox_expiry(self):
+        self._mailbox_expiry_handle = None
+        self._mailbox_expiry = None
+        self._expire_mailbox()
+        self._schedule_mailbox_expiry()
+
+    def _watch_fd(self, fileobj, callback):
+        self._loop.add_reader(fileobj, callback)
+
+    def _unwatch_fd(self, fileobj):
+        self._loop.remove_reader(fileobj)
+
+    def handle_interrupt_trigger(self):
+        """Called by the loop (inotify) or the watchdog thread when the file changes"""
+        self._loop.call_soon_threadsafe(self._override_debouncer.trigger)
+
+    def _on_connectivity_change(self):
+        """@brief Called by the NetworkManager D-Bus monitor thread when the connectivity state changes."""
+        self._loop.call_soon_threadsafe(super()._on_connectivity_change)
+
+    def _reset_timer(self):
+        super()._reset_timer()
+        self._schedule_screen_off()
+
+    def _schedule_screen_off(self):
+        if self._screen_off_handle:
+            self._screen_off_handle.cancel()
+            self._screen_off_handle = None
+        if self._options.screen_off_seconds:
+            self._screen_off_handle = self._loop.call_later(self._options.screen_off_seconds,
+                                                            self._set_screen_power,
+                                                            False)
+
+    def _update_status_output(self):
+        """@brief Show the connectivity state on the LED or display. If an update is already
+                  running one more update is run when it completes, intermediate requests
+                  are merged."""
+        if self._update_task and not self._update_task.done():
+            self._update_pending = True
+            return
+        self._update_task = self._loop.create_task(self._update_status_output_async())
+
+    async def _update_status_output_async(self):
+        while True:
+            self._update_pending = False
+            # Requests received while waiting for the frame governor are merged.
+            delay = self._frame_governor.get_delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                await self._show_status()
+            except Exception:
+                logTraceBack(self._uio)
+            self._record_connectivity()
+            if not self._update_pending:
+                break
+
+    async def _show_status(self):
+        if self._portal_task and not self._portal_task.done():
+            # The portal owns the display/LED until it completes.
+            return
+
+        if self._led:
+            self._show_led_state(await self._connectivity_cache.get())
+            return
+
+        if not self._screen_on:
+            return
+
+        state = self._get_external_display_state()
+        if state:
+            self._show_display_state(state)
+        else:
+            self._show_connectivity(await self._connectivity_cache.get())
+
+    def _show_display_state(self, state):
+        frame_start = monotonic()
+        start = perf_counter()
+        super()._show_display_state(state)
+        self._frame_governor.record(frame_start, perf_counter() - start)
+
+    def _show_led_state(self, snapshot):
+        self._set_led_state(self._get_led_state(snapshot))
+
+    def _set_led_state(self, state):
+        # Flashing is generated by gpiozero's blink() thread, the loop is not woken.
+        self._led.show(state)
+
+    def _start_wifi_portal(self):
+        """@brief Called on the loop when the button is held. Start the WiFi portal or, if it is running, cancel it."""
+        if self._portal_task and not self._portal_task.done():
+            if self._portal_session:
+                self._uio.debug("Cancelling the WiFi portal.")
+                self._portal_session.cancel()
+            return
+        self._portal_session = self._create_portal_session()
+        # wifi-connect owns the WiFi interface until the portal completes.
+        self._ssid_scanner.set_paused(True)
+        # A reconnect after the last portal stops once the step it is running has completed.
+        self._reconnect_ladder.cancel()
+        # The reconnect after this portal is stopped by the next portal even if it has not started.
+        generation = self._reconnect_ladder.begin()
+        self._portal_task = self._loop.create_task(self._run_portal(self._portal_session, generation))
+
+    def _on_portal_state_change(self, session, state):
+        """@brief Called on the loop when the portal state changes."""
+        self._uio.debug(f"WiFi portal: {state} ({session.get_elapsed():.1f} s)")
+        if state == PORTAL_STOPPING:
+            self._show_portal_message("Stopping\nWiFi setup")
+
+    def _show_portal_message(self, msg):
+        # The portal owns the display until it completes, see _show_status().
+        self._update_display(msg)
+
+    def _show_portal_led_state(self, state):
+        if self._led:
+            self._set_led_state(state)
+
+    async def _run_portal(self, session, reconnect_generation):
+        if self._led:
+            self._set_led_state(WifiLEDCtrl.CONFIGURING)
+
+        self._update_display(f"Connect to\n{self._options.ssid}\nto setup wifi.")
+
+        reconnect = True
+        try:
+            # The loop continues to run while the user connects.
+            await session.run_async(prepare=self._prepare_portal_async)
+            state = session.get_state()
+            self._metrics.observe(METRIC_PORTAL, session.get_elapsed(), state=state)
+            if state == PORTAL_SUCCEEDED:
+                self._update_display("Checking\nconnectivity")
+
+                # The connectivity has changed so don't use the cached state
+                self._connectivity_cache.invalidate()
+                snapshot = await self._connectivity_cache.get()
+                if snapshot.connected:
+                    self._update_connected_state(snapshot)
+                    reconnect = False
+                    return
+
+                self._update_display("OFFLINE\nNo Internet")
+
+            else:
+                if session.get_error():
+                    self._uio.debug(f"WiFi portal error: {session.get_error()}")
+                self._update_display(WiFiSetupManager.PORTAL_END_MESSAGES[state])
+
+        except Exception:
+            logTraceBack(self._uio)
+            self._update_display("OFFLINE\nConnect\nerror")
+
+        finally:
+            self._portal_task = None
+            self._ssid_scanner.set_paused(False)
+            if self._led:
+                self._update_status_output()
+            # Poll often while the new connection settles.
+            self._reset_heartbeat(RESET_PORTAL)
+
+        if reconnect:
+            # The connectivity state is shown while reconnecting. The reconnect is a separate
+            # task so that it is cancelled on shutdown or when the portal is started again.
+            self._reconnect_task = self._loop.create_task(self._reconnect_async(reconnect_generation))
+
+    async def _prepare_portal_async(self):
+        """@brief Awaited before wifi-connect is started."""
+        if self._scan and not self._scan.done():
+            # A background scan that started before the portal completes (or times out) before wifi-connect takes the interface.
+            await asyncio.wait([self._scan])
+        with self._metrics.time(METRIC_COMMAND, command="wifi_on"):
+            await run_async(WiFiSetupManager.NMCLI_WIFI_ON_CMD)
+        if self._is_scan_stale():
+            await self._ssid_scanner.scan_async()
+
+    async def _reconnect_async(self, generation):
+        """@brief Restore connectivity with the cheapest reconnect step that works, see ReconnectLadder.
+           @param generation The reconnect ladder generation taken when the portal was started."""
+        try:
+            step = await self._reconnect_ladder.run_async(self._is_connected_now_async, on_step=self._on_reconnect_step,
+                                                          generation=generation)
+            self._on_reconnect_done(step)
+
+        except Exception:
+            logTraceBack(self._uio)
+
+        finally:
+            # A cancelled task may complete after the next reconnect task has been created.
+            if self._reconnect_task is asyncio.current_task():
+                self._reconnect_task = None
+
+    async def _stop_reconnect(self):
+        """@brief Stop the reconnect ladder. The task is not cancelled but waited for, so that
+                  the step it is running completes and the WiFi radio or networking is not left off."""
+        self._reconnect_ladder.cancel()
+        if self._reconnect_task:
+            await asyncio.wait([self._reconnect_task])
+
+    async def _is_connected_now_async(self):
+        self._connectivity_cache.invalidate()
+        return (await self._connectivity_cache.get()).connected
+
+    async def _check_internet_async(self):
+        if self._use_nm_monitor():
+            return self._nm_monitor.is_internet_connected()
+
+        try:
+            with self._metrics.time(METRIC_COMMAND, command="check_internet"):
+                output = await check_output_async(WiFiSetupManager.NMCLI_CONNECTIVITY_CMD)
+            return self._parse_connectivity(output)
+        except Exception:
+            return False
+
+    async def _get_wifi_ip_and_ssid_async(self):
+        if self._use_nm_monitor():
+            return (self._nm_monitor.get_ip(), self._nm_monitor.get_ssid())
+
+        try:
+            with self._metrics.time(METRIC_COMMAND, command="wifi_ip"):
+                output = await check_output_async(WiFiSetupManager.NMCLI_DEVICE_SHOW_CMD)
+            return self._parse_device_show(output)
+        except Exception:
+            return (None, None)
+
+    async def _get_wifi_strength_async(self):
+        if self._use_nm_monitor():
+            return self._nm_monitor.get_strength()
+
+        with self._metrics.time(METRIC_COMMAND, command="wifi_strength"):
+            return await self._signal_reader.read_async()
+
+    async def _read_connectivity_snapshot_async(self):
+        """@brief The asyncio version of _read_connectivity_snapshot()."""
+        if not await self._check_internet_async():
+            return ConnectivitySnapshot(False)
+
+        ip, ssid = await self._get_wifi_ip_and_ssid_async()
+        if self._netlink_monitor and self._netlink_monitor.get_ip():
+            ip = self._netlink_monitor.get_ip()
+        strength = await self._get_wifi_strength_async()
+        return ConnectivitySnapshot(True, ip=ip, strength=strength, ssid=ssid)
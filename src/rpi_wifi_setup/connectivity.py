@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+import threading
+
+from time import monotonic
+
+
+class ConnectivitySnapshot(object):
+    """@brief The WiFi connectivity state at a point in time."""
+
+    def __init__(self, connected, ip=None, strength=0, ssid=None, timestamp=None):
+        """@brief Constructor.
+           @param connected True if NetworkManager reports full internet connectivity.
+           @param ip The IPv4 address of the WiFi interface or None.
+           @param strength The WiFi signal strength (0-100).
+           @param ssid The SSID of the WiFi network or None.
+           @param timestamp The monotonic time the state was read. If None the current time is used."""
+        self.connected = connected
+        self.ip = ip
+        self.strength = strength
+        self.ssid = ssid
+        self.timestamp = monotonic() if timestamp is None else timestamp
+
+    def __eq__(self, other):
+        """@brief Snapshots are equal if the connectivity state (not the timestamp) is equal."""
+        if not isinstance(other, ConnectivitySnapshot):
+            return NotImplemented
+        return (self.connected, self.ip, self.strength, self.ssid) == \
+               (other.connected, other.ip, other.strength, other.ssid)
+
+    def __repr__(self):
+        return f"ConnectivitySnapshot(connected={self.connected}, ip={self.ip}, strength={self.strength}, ssid={self.ssid})"
+
+
+class ConnectivityCache(object):
+    """@brief Holds the most recent ConnectivitySnapshot for up to ttl seconds.
+              Only one refresh runs at a time. Callers that arrive while a refresh
+              is in flight wait for it and share its result rather than each
+              running the (slow) nmcli commands themselves."""
+
+    DEFAULT_TTL_SECONDS = 2.0
+
+    def __init__(self, read_snapshot, ttl=DEFAULT_TTL_SECONDS, clock=monotonic):
+        """@brief Constructor.
+           @param read_snapshot A function that reads and returns a ConnectivitySnapshot.
+           @param ttl The number of seconds a snapshot is valid for.
+           @param clock A function returning the current time in seconds."""
+        self._read_snapshot = read_snapshot
+        self._ttl = ttl
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._snapshot = None
+        self._read_time = None
+        self._refreshing = False
+        # Incremented by set() and invalidate() so that a refresh that was reading while the
+        # state changed does not overwrite the change, and by each stored snapshot.
+        self._generation = 0
+        self._stored = 0
+        self._hits = 0
+        self._misses = 0
+        self._shared = 0
+
+    def get(self):
+        """@brief Get the connectivity state, refreshing it if the cached snapshot has expired.
+           @return A ConnectivitySnapshot instance."""
+        with self._cond:
+            stored = self._stored
+            while True:
+                if self._snapshot is not None and self._clock() - self._read_time < self._ttl:
+                    self._hits += 1
+                    return self._snapshot
+
+                if not self._refreshing:
+                    break
+
+                self._cond.wait()
+                if self._stored != stored and self._snapshot is not None:
+                    # The refresh we waited on completed, use its result.
+                    self._shared += 1
+                    return self._snapshot
+
+            self._refreshing = True
+            self._misses += 1
+            generation = self._generation
+
+        snapshot = None
+        try:
+            while True:
+                snapshot = self._read_snapshot()
+                with self._cond:
+                    if self._generation == generation:
+                        self._store(snapshot)
+                        break
+                    if self._snapshot is not None:
+                        # set() was called during the read, its snapshot is newer.
+                        snapshot = self._snapshot
+                        break
+                    # invalidate() was called during the read so the state may have changed before it completed.
+                    generation = self._generation
+        finally:
+            with self._cond:
+                self._refreshing = False
+                self._cond.notify_all()
+
+        return snapshot
+
+    def _store(self, snapshot):
+        self._snapshot = snapshot
+        self._read_time = self._clock()
+        self._stored += 1
+        self._cond.notify_all()
+
+    def peek(self):
+        """@return The cached snapshot (which may have expired) or None. This never triggers a refresh."""
+        with self._cond:
+            return self._snapshot
+
+    def set(self, snapshot):
+        """@brief Store a snapshot obtained from another source (e.g. a kernel notification).
+           @param snapshot The ConnectivitySnapshot to cache."""
+        with self._cond:
+            self._generation += 1
+            self._store(snapshot)
+
+    def invalidate(self):
+        """@brief Discard the cached snapshot so that the next get() reads the state again. A
+                  refresh in flight reads the state again rather than storing its result."""
+        with self._cond:
+            self._snapshot = None
+            self._generation += 1
+
+    def get_stats(self):
+        """@return A dict containing the hits, misses and shared (waited on an in flight refresh) counts."""
+        with self._cond:
+            return {'hits': self._hits,
+                    'misses': self._misses,
+                    'shared': self._shared}
+
+
+class AsyncConnectivityCache(object):
+    """@brief The asyncio equivalent of ConnectivityCache. Callers that arrive while a
+              refresh is in flight await the same refresh task. asyncio is imported by the
+              methods that use it so that the threaded engine does not load it."""
+
+    def __init__(self, read_snapshot, ttl=ConnectivityCache.DEFAULT_TTL_SECONDS, clock=None):
+        """@brief Constructor.
+           @param read_snapshot A coroutine function that reads and returns a ConnectivitySnapshot.
+           @param ttl The number of seconds a snapshot is valid for.
+           @param clock A function returning the current time in seconds. If None the event loop time is used."""
+        self._read_snapshot = read_snapshot
+        self._ttl = ttl
+        self._clock = clock
+        self._snapshot = None
+        self._read_time = None
+        self._refresh_task = None
+        # Incremented by set() and invalidate(), see ConnectivityCache.
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._shared = 0
+
+    def _now(self):
+        if self._clock:
+            return self._clock()
+        import asyncio
+        return asyncio.get_running_loop().time()
+
+    async def get(self):
+        """@brief Get the connectivity state, refreshing it if the cached snapshot has expired.
+           @return A ConnectivitySnapshot instance."""
+        import asyncio
+        if self._snapshot is not None and self._now() - self._read_time < self._ttl:
+            self._hits += 1
+            return self._snapshot
+
+        if self._refresh_task is not None:
+            self._shared += 1
+        else:
+            self._misses += 1
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh())
+        # shield() so that a cancelled caller does not cancel the refresh other callers are waiting on.
+        return await asyncio.shield(self._refresh_task)
+
+    async def _refresh(self):
+        try:
+            while True:
+                generation = self._generation
+                snapshot = await self._read_snapshot()
+                if self._generation == generation:
+                    self._snapshot = snapshot
+                    self._read_time = self._now()
+                    return snapshot
+                if self._snapshot is not None:
+                    # set() was called during the read, its snapshot is newer.
+                    return self._snapshot
+                # invalidate() was called during the read, read the state again.
+        finally:
+            self._refresh_task = None
+
+    def peek(self):
+        """@return The cached snapshot (which may have expired) or None. This never triggers a refresh."""
+        return self._snapshot
+
+    def set(self, snapshot):
+        """@brief Store a snapshot obtained from another source (e.g. a kernel notification).
+           @param snapshot The ConnectivitySnapshot to cache."""
+        self._snapshot = snapshot
+        self._read_time = self._now()
+        self._generation += 1
+
+    def invalidate(self):
+        """@brief Discard the cached snapshot so that the next get() reads the state again. A
+                  refresh in flight reads the state again rather than storing its result."""
+        self._snapshot = None
+        self._generation += 1
+
+    def close(self):
+        """@brief Cancel the refresh in flight (E.G on shutdown). The callers waiting on it
+                  receive asyncio.CancelledError."""
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+
+    def get_stats(self):
+        """@return A dict containing the hits, misses and shared (waited on an in flight refresh) counts."""
+        return {'hits': self._hits,
+                'misses': self._misses,
+                'shared': self._shared}
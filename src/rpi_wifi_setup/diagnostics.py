@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import glob
+import marshal
+import threading
+import traceback
+
+from time import time, monotonic, strftime, localtime
+
+DEFAULT_DIAGNOSTICS_DIR = "/run/rpi_wifi_setup"
+STACKS_FILE_PREFIX = "stacks-"
+TRACEMALLOC_FILE_PREFIX = "tracemalloc-"
+PROFILE_FILE_PREFIX = "profile-"
+PROFILE_FILE_SUFFIX = ".pstats"
+
+
+def get_timestamped_filename(folder, prefix, suffix, now=None):
+    """@return <folder>/<prefix><local time><suffix>. The time includes milliseconds so that
+               two files written in the same second do not overwrite each other."""
+    now = time() if now is None else now
+    return os.path.join(folder, f"{prefix}{strftime('%Y%m%d-%H%M%S', localtime(now))}.{int(now * 1000) % 1000:03d}{suffix}")
+
+
+def _write_file(filename, text):
+    """@brief Write a text file. It is written to a temporary file that is then renamed so a
+              reader never sees part of it."""
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, 'w') as fd:
+        fd.write(text)
+    os.replace(tmp_filename, filename)
+    return filename
+
+
+class OwnedLock(object):
+    """@brief A threading.Lock that records the thread that holds it, when it was acquired
+              and the threads waiting for it so that a stack dump can show a lock convoy."""
+
+    def __init__(self, name):
+        """@brief Constructor.
+           @param name The name shown in the stack dump."""
+        self._name = name
+        self._lock = threading.Lock()
+        self._owner = None
+        self._acquired = None
+        # set.add() and set.discard() are atomic so no extra lock is needed.
+        self._waiters = set()
+
+    def get_name(self):
+        return self._name
+
+    def acquire(self, blocking=True, timeout=-1):
+        thread = threading.current_thread()
+        self._waiters.add(thread.name)
+        try:
+            acquired = self._lock.acquire(blocking, timeout)
+        finally:
+            self._waiters.discard(thread.name)
+        if acquired:
+            self._owner = (thread.name, thread.ident)
+            self._acquired = monotonic()
+        return acquired
+
+    def release(self):
+        self._owner = None
+        self._acquired = None
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+    def get_owner(self):
+        """@return None if the lock is free or a tuple of the owner thread name, the owner
+                   thread ident, the number of seconds it has been held and a sorted list of
+                   the names of the waiting threads."""
+        owner = self._owner
+        acquired = self._acquired
+        if owner is None or acquired is None:
+            return None
+        return (owner[0], owner[1], monotonic() - acquired, sorted(self._waiters))
+
+
+def format_stacks(locks=(), now=None):
+    """@brief Format the stack of each thread and the owner of each lock.
+       @param locks OwnedLock instances.
+       @param now The wall clock time shown in the header.
+       @return The text."""
+    now = time() if now is None else now
+    lines = [f"Thread stacks at {strftime('%Y-%m-%d %H:%M:%S', localtime(now))} (pid {os.getpid()})", ""]
+    for lock in locks:
+        owner = lock.get_owner()
+        if owner is None:
+            lines.append(f"Lock {lock.get_name()}: free")
+        else:
+            name, ident, held, waiters = owner
+            waiting = ", ".join(waiters) if waiters else "none"
+            lines.append(f"Lock {lock.get_name()}: held by {name} ({ident}) for {held:.3f} s, waiting: {waiting}")
+    frames = sys._current_frames()
+    threads = {thread.ident: thread for thread in threading.enumerate()}
+    for ident, frame in frames.items():
+        thread = threads.get(ident)
+        name = thread.name if thread else "<unknown>"
+        daemon = f", daemon={thread.daemon}" if thread else ""
+        lines.append("")
+        lines.append(f"Thread {name} ({ident}{daemon}):")
+        lines.append("".join(traceback.format_stack(frame)).rstrip())
+    return "\n".join(lines) + "\n"
+
+
+def dump_stacks(folder=DEFAULT_DIAGNOSTICS_DIR, locks=()):
+    """@brief Write the stack of each thread and the owner of each lock to a stacks-<time>.txt file.
+       @param folder The folder to write to.
+       @param locks OwnedLock instances.
+       @return The filename."""
+    now = time()
+    return _write_file(get_timestamped_filename(folder, STACKS_FILE_PREFIX, ".txt", now), format_stacks(locks, now))
+
+
+class TracemallocToggle(object):
+    """@brief Each call to toggle() starts or stops tracemalloc. When it is stopped the top
+              allocators and the growth since it was started are written to a
+              tracemalloc-<time>.txt file. Tracing slows allocations so it is only on
+              between two toggles."""
+
+    DEFAULT_FRAMES = 10
+    DEFAULT_TOP = 25
+
+    def __init__(self, folder=DEFAULT_DIAGNOSTICS_DIR, frames=DEFAULT_FRAMES, top=DEFAULT_TOP):
+        """@brief Constructor.
+           @param folder The folder to write to.
+           @param frames The number of frames stored for each allocation.
+           @param top The number of allocators written."""
+        self._folder = folder
+        self._frames = frames
+        self._top = top
+        self._baseline = None
+        self._started = None
+
+    def is_tracing(self):
+        return self._baseline is not None
+
+    def toggle(self):
+        """@return None if tracing was started or the file written when it was stopped."""
+        import tracemalloc
+        if self._baseline is None:
+            tracemalloc.start(self._frames)
+            self._started = monotonic()
+            self._baseline = self._take_snapshot(tracemalloc)
+            return None
+        snapshot = self._take_snapshot(tracemalloc)
+        traced, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        baseline = self._baseline
+        self._baseline = None
+        now = time()
+        lines = [f"tracemalloc at {strftime('%Y-%m-%d %H:%M:%S', localtime(now))} (pid {os.getpid()}) "
+                 f"after {monotonic() - self._started:.1f} s: traced {traced / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB",
+                 "",
+                 f"Top {self._top} allocators:"]
+        lines += [str(stat) for stat in snapshot.statistics('lineno')[:self._top]]
+        lines += ["", f"Top {self._top} increases since tracing started:"]
+        lines += [str(stat) for stat in snapshot.compare_to(baseline, 'lineno')[:self._top]]
+        lines += ["", "Traceback of the largest allocator:"]
+        stats = snapshot.statistics('traceback')
+        if stats:
+            lines += stats[0].traceback.format()
+        filename = get_timestamped_filename(self._folder, TRACEMALLOC_FILE_PREFIX, ".txt", now)
+        return _write_file(filename, "\n".join(lines) + "\n")
+
+    def _take_snapshot(self, tracemalloc):
+        # Exclude the memory used by tracemalloc itself.
+        return tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                                          tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                                                          tracemalloc.Filter(False, "<unknown>")))
+
+
+class SamplingProfiler(object):
+    """@brief Samples the stack of every thread (the main loop, the display consumer, the
+              portal session, gpiozero's callback threads etc) rate_hz times a second and
+              writes the samples to a profile-<time>.pstats file every interval seconds,
+              keeping the newest files. The files are read with pstats.Stats() (E.G
+              python3 -m pstats profile-....pstats). The times are wall clock times so a
+              thread waiting in select() or on a lock shows where it waits. Each thread is
+              shown as a {thread <name>} function that calls the thread's outer function.
+              cProfile is not used as it only profiles the thread that enables it and
+              slows every Python call."""
+
+    DEFAULT_RATE_HZ = 20.0
+    DEFAULT_INTERVAL_SECONDS = 300.0
+    DEFAULT_KEEP = 5
+
+    def __init__(self,
+                 folder=DEFAULT_DIAGNOSTICS_DIR,
+                 interval=DEFAULT_INTERVAL_SECONDS,
+                 keep=DEFAULT_KEEP,
+                 rate_hz=DEFAULT_RATE_HZ):
+        """@brief Constructor.
+           @param folder The folder to write to.
+           @param interval The number of seconds of samples in each file.
+           @param keep The number of files kept.
+           @param rate_hz The number of samples per second."""
+        self._folder = folder
+        self._interval = interval
+        self._keep = keep
+        self._period = 1.0 / rate_hz
+        self._stats = {}
+        self._samples = 0
+        self._total_samples = 0
+        self._files = 0
+        self._sample_seconds = 0.0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="SamplingProfiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """@brief Stop sampling and write the samples taken since the last file."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        return self.write()
+
+    def _run(self):
+        next_write = monotonic() + self._interval
+        while not self._stop_event.wait(self._period):
+            self.sample()
+            if monotonic() >= next_write:
+                next_write += self._interval
+                try:
+                    self.write()
+                except OSError:
+                    pass
+
+    def sample(self, frames=None):
+        """@brief Record the stack of each thread except the sampling thread.
+           @param frames A dict of thread ident: frame. Defaults to sys._current_frames()."""
+        start = monotonic()
+        frames = sys._current_frames() if frames is None else frames
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own_ident = threading.get_ident()
+        dt = self._period
+        with self._lock:
+            stats = self._stats
+            for ident, frame in frames.items():
+                if ident == own_ident:
+                    continue
+                callee = None
+                seen = set()
+                while frame is not None:
+                    code = frame.f_code
+                    func = (code.co_filename, code.co_firstlineno, code.co_name)
+                    self._add(stats, func, callee, seen, dt)
+                    callee = func
+                    frame = frame.f_back
+                if callee is not None:
+                    self._add(stats, ("~", 0, f"<thread {names.get(ident, ident)}>"), callee, seen, dt)
+            self._samples += 1
+            self._total_samples += 1
+        self._sample_seconds += monotonic() - start
+
+    def _add(self, stats, func, callee, seen, dt):
+        """@brief Add one frame of a sampled stack, innermost first.
+           @param stats The dict of func: [cc, nc, tt, ct, callers].
+           @param func The function of the frame.
+           @param callee The function called by the frame or None if it is the innermost frame.
+           @param seen The functions already counted in this stack, recursion is counted once.
+           @param dt The time each sample represents."""
+        entry = stats.get(func)
+        if entry is None:
+            entry = stats[func] = [0, 0, 0.0, 0.0, {}]
+        if callee is None:
+            # The time is spent in the innermost function.
+            entry[2] += dt
+        if func not in seen:
+            seen.add(func)
+            entry[0] += 1
+            entry[1] += 1
+            entry[3] += dt
+        if callee is not None:
+            # pstats stores the functions each function was called by.
+            counts = stats[callee][4].get(func)
+            if counts is None:
+                counts = stats[callee][4][func] = [0, 0, 0.0, 0.0]
+            counts[0] += 1
+            counts[1] += 1
+            counts[3] += dt
+
+    @staticmethod
+    def _to_pstats(stats):
+        return {func: (cc, nc, tt, ct, {caller: tuple(counts) for caller, counts in callers.items()})
+                for func, (cc, nc, tt, ct, callers) in stats.items()}
+
+    def get_pstats(self):
+        """@return The samples since the last file in the pstats dict format, func: (cc, nc, tt, ct, callers)."""
+        with self._lock:
+            return self._to_pstats(self._stats)
+
+    def write(self):
+        """@brief Write the samples taken since the last file to a new file, remove the oldest
+                  files and start a new set of samples.
+           @return The filename or None if there were no samples."""
+        with self._lock:
+            stats = self._stats
+            samples = self._samples
+            self._stats = {}
+            self._samples = 0
+        if not samples:
+            return None
+        stats = self._to_pstats(stats)
+        os.makedirs(self._folder, exist_ok=True)
+        filename = get_timestamped_filename(self._folder, PROFILE_FILE_PREFIX, PROFILE_FILE_SUFFIX)
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, 'wb') as fd:
+            marshal.dump(stats, fd)
+        os.replace(tmp_filename, filename)
+        self._files += 1
+        self._rotate()
+        return filename
+
+    def _rotate(self):
+        filenames = sorted(glob.glob(os.path.join(self._folder, f"{PROFILE_FILE_PREFIX}*{PROFILE_FILE_SUFFIX}")))
+        for filename in filenames[:-self._keep] if self._keep else []:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+    def get_stats(self):
+        """@return A dict containing the samples taken, the files written and the mean time taken by a sample (ms)."""
+        return {'samples': self._total_samples,
+                'files': self._files,
+                'sample_avg_ms': round(self._sample_seconds * 1000 / self._total_samples, 3) if self._total_samples else 0.0}
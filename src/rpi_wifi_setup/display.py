@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+from PIL import Image
+
+from luma.oled.device import ssd1306
+
+# SSD1306/SSD1309 addressing commands
+COLUMNADDR = 0x21
+PAGEADDR = 0x22
+PAGE_HEIGHT_PIXELS = 8
+# The number of command bytes sent to set the column and page address window.
+ADDRESS_CMD_BYTES = 6
+
+
+def pack_pages(image, pages):
+    """@brief Convert a 1 bit image into the SSD1306 display RAM layout. Each page is
+              8 rows high and is stored as one byte per column with bit 0 as the top row.
+       @param image A mode '1' PIL image.
+       @param pages The number of 8 pixel pages in the image.
+       @return A list of bytes objects, one per page."""
+    # Rotating 90 degrees clockwise turns each column into a row of packed bytes
+    # with the bottom page first and the top row of each page in bit 0.
+    rotated = image.transpose(Image.Transpose.ROTATE_270).tobytes()
+    return [rotated[pages - 1 - page::pages] for page in range(pages)]
+
+
+def unpack_pages(data, width, height):
+    """@brief Convert SSD1306 display RAM data into a 1 bit image. This is the reverse of pack_pages().
+       @param data The pages, one byte per column per page.
+       @param width The width of the image in pixels.
+       @param height The height of the image in pixels.
+       @return A mode '1' PIL image."""
+    pages = height // PAGE_HEIGHT_PIXELS
+    rotated = bytearray(len(data))
+    for page in range(pages):
+        rotated[pages - 1 - page::pages] = data[page * width:(page + 1) * width]
+    return Image.frombytes('1', (height, width), bytes(rotated)).transpose(Image.Transpose.ROTATE_90)
+
+
+class DiffingDisplay(object):
+    """@brief Sends frames to a luma display device only when they change. On SSD1306
+              family devices only the columns of each 8 pixel page that differ from the
+              last frame sent are written, reducing the I2C bus traffic."""
+
+    def __init__(self, device, uio=None):
+        """@brief Constructor.
+           @param device A luma device.
+           @param uio A UIO instance. If set the bytes sent per frame are reported in debug mode."""
+        self._device = device
+        self._uio = uio
+        self._partial = isinstance(device, ssd1306)
+        self._colstart = getattr(device, '_colstart', 0)
+        self._last_pages = None
+        self._frames = 0
+        self._frames_skipped = 0
+        self._bytes_sent = 0
+
+    def invalidate(self):
+        """@brief Forget the last frame so that the next frame is sent in full."""
+        self._last_pages = None
+
+    def display(self, image):
+        """@brief Send an image to the display if it differs from the last one sent.
+           @param image A PIL image the size of the display.
+           @return The number of bytes sent to the display."""
+        frame = self._device.preprocess(image)
+        if frame.mode != '1':
+            frame = frame.convert('1')
+
+        pages = pack_pages(frame, frame.height // PAGE_HEIGHT_PIXELS)
+        self._frames += 1
+        if pages == self._last_pages:
+            self._frames_skipped += 1
+            bytes_sent = 0
+
+        elif self._partial and self._last_pages is not None:
+            bytes_sent = self._send_changed(pages)
+
+        else:
+            bytes_sent = self._send_all(image, frame.width, pages)
+
+        self._last_pages = pages
+        self._bytes_sent += bytes_sent
+        if self._uio and self._uio.isDebugEnabled():
+            self._uio.debug(f"Display frame: {bytes_sent} bytes sent.")
+        return bytes_sent
+
+    def display_buffer(self, buffer):
+        """@brief Send a frame that is already in the SSD1306 display RAM layout (see pack_pages()).
+                  On SSD1306 family devices the buffer is written to the device without being copied.
+           @param buffer A bytes like object containing the pages of the whole display.
+           @return The number of bytes sent to the display."""
+        width = self._device.width
+        pages = self._device.height // PAGE_HEIGHT_PIXELS
+        self._frames += 1
+        # The display RAM no longer holds the last frame.
+        self._last_pages = None
+        if self._partial:
+            bytes_sent = self._send_window(0, width - 1, 0, pages - 1, buffer)
+        else:
+            self._device.display(unpack_pages(buffer, width, self._device.height))
+            bytes_sent = len(buffer)
+        self._bytes_sent += bytes_sent
+        return bytes_sent
+
+    def get_stats(self):
+        """@return A dict containing the frames, frames_skipped and bytes_sent counts."""
+        return {'frames': self._frames,
+                'frames_skipped': self._frames_skipped,
+                'bytes_sent': self._bytes_sent}
+
+    def _send_all(self, image, width, pages):
+        if self._partial:
+            return self._send_window(0, width - 1, 0, len(pages) - 1, b''.join(pages))
+
+        self._device.display(image)
+        return sum(len(page) for page in pages)
+
+    def _send_changed(self, pages):
+        bytes_sent = 0
+        for page, (new, old) in enumerate(zip(pages, self._last_pages)):
+            if new == old:
+                continue
+            first = 0
+            while new[first] == old[first]:
+                first += 1
+            last = len(new) - 1
+            while new[last] == old[last]:
+                last -= 1
+            bytes_sent += self._send_window(first, last, page, page, new[first:last + 1])
+        return bytes_sent
+
+    def _send_window(self, first_col, last_col, first_page, last_page, data):
+        self._device.command(COLUMNADDR, self._colstart + first_col, self._colstart + last_col,
+                             PAGEADDR, first_page, last_page)
+        # The data is sent in blocks sliced from the bytes like object, it is not copied into a list first.
+        self._device.data(data)
+        return ADDRESS_CMD_BYTES + len(data)
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import socket
+
+from rpi_wifi_setup.display_socket import DEFAULT_SOCKET_PATH, encode_display_message
+
+
+class DisplayClient(object):
+    """@brief Sends messages to the rpi_wifi_setup display socket.
+
+              E.G
+              client = DisplayClient()
+              client.show("CPU: 55C\\nLoad: 0.4")
+              client.show("Streaming", signal=80)
+              client.clear()
+
+              Messages sent faster than the rate limit of the server are merged, the
+              latest message is displayed when the rate limit next allows."""
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH):
+        """@brief Constructor.
+           @param path The display socket path."""
+        self._path = path
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC)
+
+    def show(self, text, signal=None):
+        """@brief Display text.
+           @param text The text to display. Lines are separated with \\n.
+           @param signal If not None the WiFi signal icon is shown with this strength (0-100).
+           @throws OSError if the server is not running."""
+        self._sock.sendto(encode_display_message(text, signal=signal), self._path)
+
+    def clear(self):
+        """@brief Remove the message sent by this process."""
+        self._sock.sendto(encode_display_message(None), self._path)
+
+    def close(self):
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import socket
+import struct
+import threading
+
+from time import monotonic
+
+DEFAULT_SOCKET_PATH = "/run/rpi_wifi_setup/display.sock"
+MAX_MESSAGE_BYTES = 4096
+UCRED = struct.Struct("=iII")
+
+
+def encode_display_message(text=None, signal=None):
+    """@brief Build a display socket message. The text is always sent in a JSON object so
+              that text starting with '{' is not read as a JSON object.
+       @param text The text to display or None to remove the message.
+       @param signal If not None the WiFi signal icon is shown with this strength (0-100).
+       @return The message bytes."""
+    if not text:
+        return b''
+    layout = {'text': text}
+    if signal is not None:
+        layout['signal'] = signal
+    return json.dumps(layout).encode('utf-8')
+
+
+def parse_display_message(data):
+    """@brief Parse a display socket message. A message is either UTF-8 text or a JSON
+              object containing 'text' (or a list of 'lines') and an optional 'signal'
+              strength. A message starting with '{' is a JSON object so text starting
+              with '{' must be sent in a JSON object. An empty message removes the
+              client's message.
+       @param data The message bytes.
+       @return None or a tuple containing the text and signal strength (None if the WiFi icon is not shown).
+       @throws ValueError if the message is invalid."""
+    text = data.decode('utf-8').strip()
+    if not text:
+        return None
+
+    signal = None
+    if text.startswith('{'):
+        layout = json.loads(text)
+        if not isinstance(layout, dict):
+            raise ValueError("The layout message must be a JSON object.")
+        if 'lines' in layout:
+            text = '\n'.join(str(line) for line in layout['lines'])
+        else:
+            text = str(layout.get('text', ''))
+        signal = layout.get('signal')
+        if signal is not None:
+            signal = min(max(int(signal), 0), 100)
+        if not text.strip():
+            return None
+    return (text.strip('\n'), signal)
+
+
+class RateLimiter(object):
+    """@brief A token bucket that limits the messages accepted from one client."""
+
+    def __init__(self, rate, burst, clock=monotonic):
+        """@brief Constructor.
+           @param rate The number of messages per second allowed.
+           @param burst The number of messages that may be received back to back.
+           @param clock A function returning the time in seconds."""
+        self._rate = rate
+        self._burst = burst
+        self._clock = clock
+        self._tokens = burst
+        self._last = clock()
+
+    def allow(self):
+        """@return True if a message may be accepted now."""
+        now = self._clock()
+        self._tokens = min(self._burst, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def get_delay(self):
+        """@return The number of seconds until a message may be accepted (0 if one may be accepted now)."""
+        tokens = min(self._burst, self._tokens + (self._clock() - self._last) * self._rate)
+        return max(0.0, (1 - tokens) / self._rate)
+
+
+class DisplayClientState(object):
+    """@brief The latest message and the rate limiter of a display socket client."""
+
+    def __init__(self, pid, limiter):
+        self.pid = pid
+        self.limiter = limiter
+        self.message = None
+        self.updated = 0
+        # True if the latest message has not been displayed because of the rate limit.
+        self.dirty = False
+
+
+class DisplaySocketServer(object):
+    """@brief A unix domain datagram socket that local applications send display messages
+              to. Clients are identified by their process ID (SO_PASSCRED). The message
+              most recently received from any client is displayed. All pending messages are
+              read on each handle_events() call so a burst of messages causes a single
+              display update.
+
+              The display updates caused by each client are rate limited. A message is
+              never dropped: the latest message of each client is always kept and a
+              message received over the rate limit is displayed on the next frame, which
+              is at the latest when the client's rate limit next allows an update.
+
+              The socket is non blocking. The owner waits for it to become readable
+              (e.g. with a selector) and then calls handle_events()."""
+
+    DEFAULT_RATE = 20
+    DEFAULT_BURST = 5
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH, on_change=None, rate=DEFAULT_RATE, burst=DEFAULT_BURST, schedule=None,
+                 clock=monotonic):
+        """@brief Constructor.
+           @param path The socket path.
+           @param on_change A function called when the message to display changed. This is called once per
+                            handle_events() call or, for a message received over the rate limit, later from
+                            the schedule function.
+           @param rate The maximum number of display updates per second caused by each client.
+           @param burst The number of display updates a client may cause back to back.
+           @param schedule A function called with a delay and a function that calls the function
+                           after the delay and returns an object with a cancel() method
+                           (E.G asyncio loop.call_later). If None a threading.Timer is used.
+           @param clock A function returning the time in seconds."""
+        self._path = path
+        self._on_change = on_change
+        self._rate = rate
+        self._burst = burst
+        self._schedule = schedule if schedule else self._start_timer
+        self._clock = clock
+        self._sock = None
+        self._lock = threading.Lock()
+        self._clients = {}
+        # The message last passed to on_change() and the timer that displays messages received over the rate limit.
+        self._displayed = None
+        self._timer = None
+        self._update_count = 0
+        self._received = 0
+        self._accepted = 0
+        self._rate_limited = 0
+        self._invalid = 0
+
+    def open(self):
+        """@brief Create and bind the socket. Any local user may send messages."""
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_NONBLOCK | socket.SOCK_CLOEXEC)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_PASSCRED, 1)
+        self._sock.bind(self._path)
+        os.chmod(self._path, 0o666)
+
+    def close(self):
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+            try:
+                os.unlink(self._path)
+            except OSError:
+                pass
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def get_path(self):
+        return self._path
+
+    def get_message(self):
+        """@return A tuple containing the text and signal strength of the message to display or None."""
+        with self._lock:
+            return self._get_message()
+
+    def _get_message(self):
+        latest = None
+        for client in self._clients.values():
+            if client.message and (latest is None or client.updated > latest.updated):
+                latest = client
+        return latest.message if latest else None
+
+    def handle_events(self):
+        """@brief Read all pending messages.
+           @return True if the message to display changed."""
+        update = False
+        cmsg_size = socket.CMSG_SPACE(UCRED.size)
+        while True:
+            try:
+                data, ancdata, _flags, _addr = self._sock.recvmsg(MAX_MESSAGE_BYTES, cmsg_size)
+            except BlockingIOError:
+                break
+            self._received += 1
+
+            pid = 0
+            for level, cmsg_type, cmsg_data in ancdata:
+                if level == socket.SOL_SOCKET and cmsg_type == socket.SCM_CREDENTIALS:
+                    pid = UCRED.unpack_from(cmsg_data)[0]
+
+            client = self._clients.get(pid)
+            if client is None:
+                client = DisplayClientState(pid, RateLimiter(self._rate, self._burst, clock=self._clock))
+                with self._lock:
+                    self._clients[pid] = client
+
+            try:
+                message = parse_display_message(data)
+            except (ValueError, TypeError):
+                self._invalid += 1
+                continue
+
+            self._accepted += 1
+            self._update_count += 1
+            with self._lock:
+                client.message = message
+                client.updated = self._update_count
+                # Removing a message is never rate limited so a message is not left on the display.
+                if message is None or client.limiter.allow():
+                    client.dirty = False
+                    update = True
+                else:
+                    client.dirty = True
+                    self._rate_limited += 1
+
+        with self._lock:
+            self._schedule_dirty()
+        return self._update_display() if update else False
+
+    def _schedule_dirty(self):
+        """@brief Start the timer that displays the messages received over the rate limit. Called with the lock held."""
+        if self._timer:
+            return
+        delays = [client.limiter.get_delay() for client in self._clients.values() if client.dirty]
+        if delays:
+            self._timer = self._schedule(min(delays), self._on_timer)
+
+    def _on_timer(self):
+        update = False
+        with self._lock:
+            self._timer = None
+            for client in self._clients.values():
+                if client.dirty and client.limiter.allow():
+                    client.dirty = False
+                    update = True
+            self._schedule_dirty()
+        if update:
+            self._update_display()
+
+    def _update_display(self):
+        """@brief Call on_change() if the message to display is not the message last displayed.
+           @return True if the message to display changed."""
+        with self._lock:
+            message = self._get_message()
+            changed = message != self._displayed
+            self._displayed = message
+        if changed and self._on_change:
+            self._on_change()
+        return changed
+
+    def _start_timer(self, delay, function):
+        timer = threading.Timer(delay, function)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def prune(self):
+        """@brief Remove the messages of clients that have exited.
+           @return True if the message to display changed."""
+        with self._lock:
+            for pid in list(self._clients.keys()):
+                if pid and not os.path.exists(f"/proc/{pid}"):
+                    del self._clients[pid]
+            message = self._get_message()
+            changed = message != self._displayed
+            self._displayed = message
+        return changed
+
+    def get_stats(self):
+        """@return A dict containing the clients, received, accepted, rate_limited (display update deferred)
+                   and invalid message counts."""
+        return {'clients': len(self._clients),
+                'received': self._received,
+                'accepted': self._accepted,
+                'rate_limited': self._rate_limited,
+                'invalid': self._invalid}
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+from collections import OrderedDict
+
+from PIL import Image, ImageDraw
+
+# The gap in pixels between lines of text (the PIL multiline text default).
+LINE_SPACING_PIXELS = 4
+TEXT_POS = (5, 5)
+WIFI_ICON_POS = (109, 18)
+WIFI_ICON_BARS = 4
+
+
+def get_signal_bars(strength):
+    """@brief Get the number of WiFi icon bars to show for a signal strength.
+       @param strength The signal strength (0-100).
+       @return The number of bars (0-4)."""
+    return sum(1 for i in range(WIFI_ICON_BARS) if strength > (i * 25))
+
+
+class BitmapCache(object):
+    """@brief A bounded least recently used cache of pre rendered bitmaps."""
+
+    DEFAULT_SIZE = 64
+
+    def __init__(self, size=DEFAULT_SIZE):
+        """@brief Constructor.
+           @param size The maximum number of bitmaps held. 0 disables the cache."""
+        self._size = size
+        self._bitmaps = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key, create):
+        """@brief Get a bitmap from the cache, creating it if not present.
+           @param key The key identifying the bitmap.
+           @param create A function that creates the bitmap if not cached.
+           @return The bitmap. This must not be modified by the caller."""
+        bitmap = self._bitmaps.get(key)
+        if bitmap is not None:
+            self._bitmaps.move_to_end(key)
+            self._hits += 1
+            return bitmap
+
+        self._misses += 1
+        bitmap = create()
+        if self._size > 0:
+            self._bitmaps[key] = bitmap
+            if len(self._bitmaps) > self._size:
+                self._bitmaps.popitem(last=False)
+        return bitmap
+
+    def get_stats(self):
+        """@return A dict containing the hits, misses and size counts."""
+        return {'hits': self._hits,
+                'misses': self._misses,
+                'size': len(self._bitmaps)}
+
+
+class FrameRenderer(object):
+    """@brief Renders the 1 bit status frames shown on the display. Text lines, the
+              WiFi signal icon and whole frames are cached as bitmaps so that a frame
+              is normally built by pasting bitmaps rather than rasterising glyphs."""
+
+    def __init__(self, size, font, cache_size=BitmapCache.DEFAULT_SIZE):
+        """@brief Constructor.
+           @param size The (width, height) of the display in pixels.
+           @param font The PIL font used for text.
+           @param cache_size The maximum number of cached bitmaps. 0 disables caching."""
+        self._size = size
+        self._font = font
+        self._cache = BitmapCache(cache_size)
+        draw = ImageDraw.Draw(Image.new('1', (1, 1)))
+        self._line_height = draw.textbbox((0, 0), "A", font=font)[3] + LINE_SPACING_PIXELS
+
+    def render(self, msg, strength=None):
+        """@brief Render a frame.
+           @param msg The text to display. This may contain several lines.
+           @param strength The WiFi signal strength (0-100) or None if the WiFi icon is not shown.
+           @return A mode '1' PIL image. This must not be modified by the caller."""
+        bars = None if strength is None else get_signal_bars(strength)
+        return self._cache.get(('frame', msg, bars), lambda: self._create_frame(msg, bars))
+
+    def get_stats(self):
+        """@return The bitmap cache statistics."""
+        return self._cache.get_stats()
+
+    def _create_frame(self, msg, bars):
+        image = self._cache.get(('background',), self._create_background).copy()
+        x, y = TEXT_POS
+        for line in msg.split('\n'):
+            if line:
+                bitmap, (offset_x, offset_y) = self._cache.get(('line', line), lambda: self._create_line(line))
+                image.paste(1, (x + offset_x, y + offset_y), mask=bitmap)
+            y += self._line_height
+
+        if bars is not None:
+            icon, mask, (offset_x, offset_y) = self._cache.get(('wifi', bars), lambda: self._create_wifi_icon(bars))
+            image.paste(icon, (WIFI_ICON_POS[0] + offset_x, WIFI_ICON_POS[1] + offset_y), mask=mask)
+        return image
+
+    def _create_background(self):
+        image = Image.new('1', self._size)
+        draw = ImageDraw.Draw(image)
+        draw.rectangle((0, 0, self._size[0] - 1, self._size[1] - 1), outline="white", fill="black")
+        return image
+
+    def _create_line(self, line):
+        """@return A tuple containing the line bitmap and its offset from the text position."""
+        left, top, right, bottom = self._font.getbbox(line, mode='1')
+        bitmap = Image.new('1', (max(1, right - left), max(1, bottom - top)))
+        ImageDraw.Draw(bitmap).text((-left, -top), line, fill="white", font=self._font)
+        return (bitmap, (left, top))
+
+    def _create_wifi_icon(self, bars):
+        """@return A tuple containing the icon bitmap, the mask of the pixels it covers
+                   and its offset from the icon position."""
+        # 4 bars of increasing height, the tallest is 12 pixels high.
+        width = (WIFI_ICON_BARS - 1) * 4 + 3
+        height = WIFI_ICON_BARS * 3 + 1
+        icon = Image.new('1', (width, height))
+        mask = Image.new('1', (width, height))
+        icon_draw = ImageDraw.Draw(icon)
+        mask_draw = ImageDraw.Draw(mask)
+        bottom = height - 1
+        for i in range(WIFI_ICON_BARS):
+            bar_height = (i + 1) * 3
+            fill = "white" if i < bars else "black"
+            rect = [i * 4, bottom - bar_height, (i * 4) + 2, bottom]
+            icon_draw.rectangle(rect, outline="white", fill=fill)
+            mask_draw.rectangle(rect, outline="white", fill="white")
+        return (icon, mask, (0, -bottom))
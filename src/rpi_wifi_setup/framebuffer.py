@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+import os
+import mmap
+import errno
+import struct
+
+DEFAULT_FRAMEBUFFER_FILE = "/dev/shm/rpi_wifi_setup_fb"
+FRAMEBUFFER_MAGIC = b'RWFB'
+# magic, width, height, flags, sequence
+HEADER = struct.Struct("=4sHHII")
+HEADER_SIZE = 16
+SEQUENCE_OFFSET = 12
+FLAG_ACTIVE = 0x1
+PAGE_HEIGHT_PIXELS = 8
+
+
+def get_frame_size(width, height):
+    """@return The number of bytes in a packed 1 bit frame."""
+    return width * height // PAGE_HEIGHT_PIXELS
+
+
+def get_doorbell_path(path):
+    """@return The path of the FIFO that a writer writes a byte to after each frame."""
+    return path + ".notify"
+
+
+class FramebufferReader(object):
+    """@brief A shared memory 1 bit framebuffer that applications write frames to
+              (see FramebufferWriter). The file contains a 16 byte header (magic,
+              width, height, flags and a sequence number) followed by the frame in
+              the SSD1306 display RAM layout: one byte per column for each 8 row
+              page with the top row in bit 0. The sequence number is odd while a
+              frame is being written.
+
+              After each frame the writer writes a byte to a FIFO. The FIFO is non
+              blocking, the owner waits for it to become readable (e.g. with a
+              selector) and then calls handle_events()."""
+
+    def __init__(self, path, width, height, on_change=None):
+        """@brief Constructor.
+           @param path The framebuffer file.
+           @param width The display width in pixels.
+           @param height The display height in pixels.
+           @param on_change A function called once per handle_events() call that found a new frame."""
+        self._path = path
+        self._width = width
+        self._height = height
+        self._on_change = on_change
+        self._frame_size = get_frame_size(width, height)
+        self._mmap = None
+        self._frame = None
+        self._fifo_fd = None
+        self._last_sequence = None
+        self._frames = 0
+        self._torn = 0
+
+    def open(self):
+        """@brief Create the framebuffer file and FIFO. Any local user may write frames."""
+        size = HEADER_SIZE + self._frame_size
+        # A new file is created as a writer may still have the old one mapped.
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT | os.O_EXCL | os.O_CLOEXEC, 0o666)
+        try:
+            os.fchmod(fd, 0o666)
+            os.ftruncate(fd, size)
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        HEADER.pack_into(self._mmap, 0, FRAMEBUFFER_MAGIC, self._width, self._height, 0, 0)
+        self._frame = memoryview(self._mmap)[HEADER_SIZE:]
+        self._last_sequence = 0
+
+        doorbell_path = get_doorbell_path(self._path)
+        if os.path.exists(doorbell_path):
+            os.unlink(doorbell_path)
+        os.mkfifo(doorbell_path)
+        os.chmod(doorbell_path, 0o666)
+        # Opened for writing as well so the FIFO does not report end of file when no writer has it open.
+        self._fifo_fd = os.open(doorbell_path, os.O_RDWR | os.O_NONBLOCK | os.O_CLOEXEC)
+
+    def close(self):
+        if self._fifo_fd is not None:
+            os.close(self._fifo_fd)
+            self._fifo_fd = None
+        if self._mmap:
+            self._frame.release()
+            self._frame = None
+            self._mmap.close()
+            self._mmap = None
+        for path in (self._path, get_doorbell_path(self._path)):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def fileno(self):
+        return self._fifo_fd
+
+    def is_active(self):
+        """@return True if a writer has written a frame and not cleared it."""
+        return self._mmap is not None and HEADER.unpack_from(self._mmap, 0)[3] & FLAG_ACTIVE != 0
+
+    def handle_events(self):
+        """@brief Read the FIFO and check for a new frame.
+           @return True if the frame or active state changed."""
+        while True:
+            try:
+                if not os.read(self._fifo_fd, 4096):
+                    break
+            except BlockingIOError:
+                break
+
+        sequence = self._get_sequence()
+        if sequence == self._last_sequence or sequence & 1:
+            # Unchanged or a frame is being written, the writer will notify us when it completes.
+            return False
+        self._last_sequence = sequence
+        if self._on_change:
+            self._on_change()
+        return True
+
+    def blit(self, display):
+        """@brief Send the frame directly from shared memory to the display.
+           @param display A DiffingDisplay instance.
+           @return True if the frame was complete. If False the writer changed the frame
+                   while it was being sent and it will be sent again when the writer completes."""
+        sequence = self._get_sequence()
+        if sequence & 1:
+            self._torn += 1
+            return False
+        display.display_buffer(self._frame)
+        self._frames += 1
+        if self._get_sequence() != sequence:
+            self._torn += 1
+            return False
+        return True
+
+    def get_stats(self):
+        """@return A dict containing the frames sent and the torn (written during the send) counts."""
+        return {'frames': self._frames,
+                'torn': self._torn}
+
+    def _get_sequence(self):
+        return struct.unpack_from("=I", self._mmap, SEQUENCE_OFFSET)[0]
+
+
+class FramebufferWriter(object):
+    """@brief Writes frames to the rpi_wifi_setup shared memory framebuffer.
+
+              E.G
+              with FramebufferWriter() as writer:
+                  writer.write_image(image)   # A PIL image the size of the display
+                  writer.write(pages)         # Bytes in the SSD1306 display RAM layout
+                  writer.clear()              # Return to the WiFi status display"""
+
+    def __init__(self, path=DEFAULT_FRAMEBUFFER_FILE):
+        """@brief Constructor.
+           @param path The framebuffer file created by rpi_wifi_setup."""
+        self._path = path
+        fd = os.open(path, os.O_RDWR | os.O_CLOEXEC)
+        try:
+            self._mmap = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+        magic, self.width, self.height, _flags, _sequence = HEADER.unpack_from(self._mmap, 0)
+        if magic != FRAMEBUFFER_MAGIC:
+            self._mmap.close()
+            raise Exception(f"{path} is not an rpi_wifi_setup framebuffer.")
+        self.frame_size = get_frame_size(self.width, self.height)
+        self._doorbell_fd = None
+
+    def write(self, data):
+        """@brief Display a frame.
+           @param data A bytes like object of frame_size bytes in the SSD1306 display RAM layout."""
+        if len(data) != self.frame_size:
+            raise Exception(f"The frame must be {self.frame_size} bytes ({len(data)} bytes).")
+        sequence = self._begin_update()
+        self._mmap[HEADER_SIZE:HEADER_SIZE + self.frame_size] = data
+        self._set_flags(FLAG_ACTIVE)
+        self._end_update(sequence)
+
+    def write_image(self, image):
+        """@brief Display a PIL image the size of the display."""
+        # Imported here so that applications that write packed frames do not load luma.
+        from rpi_wifi_setup.display import pack_pages
+        if image.mode != '1':
+            image = image.convert('1')
+        self.write(b''.join(pack_pages(image, self.height // PAGE_HEIGHT_PIXELS)))
+
+    def clear(self):
+        """@brief Stop displaying frames from the framebuffer."""
+        sequence = self._begin_update()
+        self._set_flags(0)
+        self._end_update(sequence)
+
+    def close(self):
+        if self._doorbell_fd is not None:
+            os.close(self._doorbell_fd)
+            self._doorbell_fd = None
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _begin_update(self):
+        """@brief Make the sequence number odd while the framebuffer is updated.
+           @return The odd sequence number."""
+        sequence = struct.unpack_from("=I", self._mmap, SEQUENCE_OFFSET)[0] | 1
+        struct.pack_into("=I", self._mmap, SEQUENCE_OFFSET, sequence)
+        return sequence
+
+    def _end_update(self, sequence):
+        struct.pack_into("=I", self._mmap, SEQUENCE_OFFSET, (sequence + 1) & 0xFFFFFFFF)
+        self._notify()
+
+    def _set_flags(self, flags):
+        struct.pack_into("=I", self._mmap, 8, flags)
+
+    def _notify(self):
+        try:
+            if self._doorbell_fd is None:
+                self._doorbell_fd = os.open(get_doorbell_path(self._path), os.O_WRONLY | os.O_NONBLOCK | os.O_CLOEXEC)
+            os.write(self._doorbell_fd, b'\0')
+        except OSError as ex:
+            # EAGAIN: the FIFO is full so a notification is already pending.
+            # ENXIO/ENOENT: rpi_wifi_setup is not running.
+            if ex.errno not in (errno.EAGAIN, errno.ENXIO, errno.ENOENT):
+                raise
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+import os
+import threading
+
+from time import monotonic
+
+# The reasons that the heartbeat interval is reset to the minimum.
+RESET_BUTTON = "button"
+RESET_PORTAL = "portal"
+RESET_DISCONNECT = "disconnect"
+RESET_CHANGE = "change"
+
+
+class HeartbeatPolicy(object):
+    """@brief Chooses the time until the next heartbeat. After start up or an event (a button
+              press, a portal session or a connectivity change) the interval is the minimum.
+              Each heartbeat that finds the connectivity unchanged multiplies it by the
+              back off factor up to the base interval while the state is shown (the screen
+              is on) and up to the maximum interval while it is not (the screen is off)."""
+
+    DEFAULT_MIN_SECONDS = 2.0
+    DEFAULT_MAX_SECONDS = 120.0
+    DEFAULT_BACKOFF = 2.0
+
+    def __init__(self,
+                 base_interval,
+                 min_interval=DEFAULT_MIN_SECONDS,
+                 max_interval=DEFAULT_MAX_SECONDS,
+                 backoff=DEFAULT_BACKOFF,
+                 clock=monotonic):
+        """@brief Constructor.
+           @param base_interval The maximum interval in seconds while the state is shown.
+           @param min_interval The interval in seconds after an event.
+           @param max_interval The maximum interval in seconds while the state is not shown.
+           @param backoff The factor the interval is multiplied by on each heartbeat with no change.
+           @param clock A function returning the time in seconds."""
+        self._base_interval = base_interval
+        self._min_interval = min(min_interval, base_interval)
+        self._max_interval = max(max_interval, base_interval)
+        self._backoff = max(backoff, 1.0)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._interval = self._min_interval
+        self._state = None
+        self._connected_time = None
+        self._start_time = clock()
+        self._polls = 0
+        self._resets = {}
+        self._detect_last = None
+        self._detect_max = None
+
+    def reset(self, reason):
+        """@brief Poll at the minimum interval (E.G after a button press).
+           @param reason One of the RESET_* reasons."""
+        with self._lock:
+            self._interval = self._min_interval
+            self._resets[reason] = self._resets.get(reason, 0) + 1
+
+    def record(self, snapshot):
+        """@brief Record the connectivity state. A change resets the interval.
+           @param snapshot The latest ConnectivitySnapshot or None if it is not known.
+           @return True if the connectivity state has changed."""
+        if snapshot is None:
+            return False
+
+        with self._lock:
+            # The signal strength varies, only the connectivity and address are compared.
+            state = (snapshot.connected, snapshot.ip)
+            changed = self._state is not None and state != self._state
+            if changed and not snapshot.connected and self._state[0]:
+                # The link was last seen connected at _connected_time so the disconnect was detected within this time.
+                detect = max(0.0, snapshot.timestamp - self._connected_time)
+                self._detect_last = detect
+                self._detect_max = detect if self._detect_max is None else max(self._detect_max, detect)
+            if snapshot.connected:
+                self._connected_time = snapshot.timestamp
+            self._state = state
+
+        if changed:
+            self.reset(RESET_DISCONNECT if not snapshot.connected else RESET_CHANGE)
+        return changed
+
+    def get_interval(self, shown):
+        """@param shown True if the connectivity state is shown (E.G the screen is on).
+           @return The current interval in seconds."""
+        with self._lock:
+            return min(self._interval, self._base_interval if shown else self._max_interval)
+
+    def next_interval(self, shown):
+        """@brief Called on each heartbeat.
+           @param shown True if the connectivity state is shown (E.G the screen is on).
+           @return The number of seconds until the next heartbeat."""
+        with self._lock:
+            self._polls += 1
+            interval = self._interval
+            limit = self._base_interval if shown else self._max_interval
+            self._interval = min(max(interval * self._backoff, self._min_interval), limit)
+            return min(interval, limit)
+
+    def get_stats(self):
+        """@return A dict containing the current interval, the heartbeats (polls) per hour, the
+                   resets by reason and the last and maximum disconnect detection times in seconds."""
+        with self._lock:
+            elapsed = self._clock() - self._start_time
+            return {'interval': self._interval,
+                    'polls': self._polls,
+                    'polls_per_hour': round(self._polls * 3600 / elapsed, 1) if elapsed > 0 else 0.0,
+                    'resets': dict(self._resets),
+                    'detect_disconnect_last': self._detect_last,
+                    'detect_disconnect_max': self._detect_max}
+
+
+class LoopWaker(object):
+    """@brief A pipe registered with the main loop selector so that another thread can
+              wake the main loop (E.G to apply a shorter heartbeat interval)."""
+
+    def __init__(self):
+        self._read_fd = None
+        self._write_fd = None
+
+    def open(self):
+        self._read_fd, self._write_fd = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+
+    def fileno(self):
+        return self._read_fd
+
+    def wake(self):
+        """@brief Wake the main loop. Safe to call from any thread."""
+        try:
+            os.write(self._write_fd, b'\0')
+        except BlockingIOError:
+            # The pipe is full so the loop will wake anyway.
+            pass
+
+    def handle_events(self):
+        """@brief Called by the main loop when woken."""
+        try:
+            while os.read(self._read_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        for fd in (self._read_fd, self._write_fd):
+            if fd is not None:
+                os.close(fd)
+        self._read_fd = None
+        self._write_fd = None
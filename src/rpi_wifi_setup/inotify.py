@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+import os
+import ctypes
+import ctypes.util
+import struct
+
+# From sys/inotify.h
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_CLOSE_NOWRITE = 0x00000010
+IN_OPEN = 0x00000020
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+INOTIFY_EVENT = struct.Struct("=iIII")
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or "libc.so.6", use_errno=True)
+    return _libc
+
+
+def parse_inotify_events(data):
+    """@brief Parse the inotify_event structures read from an inotify file descriptor.
+       @param data The bytes read.
+       @return A list of (wd, mask, cookie, name) tuples."""
+    events = []
+    offset = 0
+    while offset + INOTIFY_EVENT.size <= len(data):
+        wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+        offset += INOTIFY_EVENT.size
+        name = data[offset:offset + length].rstrip(b'\0').decode(errors='replace')
+        offset += length
+        events.append((wd, mask, cookie, name))
+    return events
+
+
+class InotifyWatcher(object):
+    """@brief Watches a single file using inotify. The parent directory is watched
+              (so the file may be created, deleted or atomically replaced by a rename)
+              for only the events that complete a change to a file so the kernel does
+              not wake us for the opens, reads and partial writes of files. A completed
+              write, rename or delete of any other file in the directory still wakes
+              the owner, handle_events() then returns False and on_change is not called.
+              The file descriptor is non blocking. The owner waits for it to become
+              readable (e.g. with a selector) and then calls handle_events()."""
+
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_ONLYDIR
+    READ_BUFFER_SIZE = 65536
+
+    @staticmethod
+    def is_available():
+        """@return True if inotify is supported on this system."""
+        try:
+            return hasattr(_get_libc(), 'inotify_init1')
+        except OSError:
+            return False
+
+    def __init__(self, path, on_change=None, mask=WATCH_MASK):
+        """@brief Constructor.
+           @param path The file to watch.
+           @param on_change A function called once per handle_events() call that read an event for the file.
+           @param mask The inotify events to watch the parent directory for."""
+        self._path = path
+        self._folder, self._name = os.path.split(os.path.abspath(path))
+        self._on_change = on_change
+        self._mask = mask
+        self._fd = None
+        self._wakeups = 0
+        self._events = 0
+        self._matched = 0
+
+    def open(self):
+        """@brief Create the inotify instance and add the watch."""
+        libc = _get_libc()
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1: {os.strerror(errno)}")
+
+        if libc.inotify_add_watch(fd, self._folder.encode(), self._mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, f"inotify_add_watch {self._folder}: {os.strerror(errno)}")
+        self._fd = fd
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def fileno(self):
+        return self._fd
+
+    def handle_events(self):
+        """@brief Read all pending inotify events.
+           @return True if any event was for the watched file."""
+        self._wakeups += 1
+        names = set()
+        overflow = False
+        while True:
+            try:
+                data = os.read(self._fd, InotifyWatcher.READ_BUFFER_SIZE)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            for _wd, mask, _cookie, name in parse_inotify_events(data):
+                self._events += 1
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                elif name:
+                    names.add(name)
+        return self._dispatch(names, overflow)
+
+    def _dispatch(self, names, overflow):
+        # If the queue overflowed events may have been lost.
+        matched = overflow or self._name in names
+        if matched:
+            self._matched += 1
+            if self._on_change:
+                self._on_change()
+        return matched
+
+    def get_stats(self):
+        """@return A dict containing the wakeups, events read and matched (wake ups with an event for the file) counts."""
+        return {'wakeups': self._wakeups,
+                'events': self._events,
+                'matched': self._matched}
+
+
+class InotifyDirectoryWatcher(InotifyWatcher):
+    """@brief Watches the files in a directory for the same events as InotifyWatcher."""
+
+    def __init__(self, folder, on_change=None, mask=InotifyWatcher.WATCH_MASK):
+        """@brief Constructor.
+           @param folder The directory to watch.
+           @param on_change A function called once per handle_events() call that read events. This
+                            is passed the set of file names that changed or None if events were lost.
+           @param mask The inotify events to watch the directory for."""
+        super().__init__(folder, on_change=on_change, mask=mask)
+        self._folder = os.path.abspath(folder)
+        self._name = None
+
+    def _dispatch(self, names, overflow):
+        if not names and not overflow:
+            return False
+        self._matched += 1
+        if self._on_change:
+            self._on_change(None if overflow else names)
+        return True
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+# The WiFi LED states.
+LED_CONNECTED = 1
+LED_CONFIGURING = 2
+LED_DISCONNECTED = 3
+# An IP address has been assigned but there is no internet connectivity.
+LED_NO_INTERNET = 4
+# The WiFi portal has received credentials and wifi-connect is joining the network.
+LED_CONNECTING = 5
+
+# The (on seconds, off seconds) pattern of each flashing state. CONNECTED is steady on
+# and DISCONNECTED is off.
+LED_BLINK_PATTERNS = {
+    LED_CONFIGURING: (0.5, 0.5),
+    LED_NO_INTERNET: (0.1, 1.9),
+    LED_CONNECTING: (0.1, 0.1),
+}
+
+
+class PatternLED(object):
+    """@brief Shows a WiFi LED state on a gpiozero LED. A steady state is written once.
+              A flashing state is generated by gpiozero's background blink() so it does
+              not require the caller to wake up. The pin PWM is not used as the
+              Raspberry Pi pin factories reject or clamp the low frequencies (down to
+              0.5 Hz) that the flash patterns need."""
+
+    def __init__(self, led, blink_patterns=LED_BLINK_PATTERNS):
+        """@brief Constructor.
+           @param led A gpiozero LED instance.
+           @param blink_patterns A dict of state: (on seconds, off seconds)."""
+        self._led = led
+        self._blink_patterns = blink_patterns
+        self._state = None
+        self._writes = 0
+
+    def show(self, state):
+        """@brief Show a state. Nothing is written if the state has not changed.
+           @param state One of the LED_* states."""
+        if state == self._state:
+            return
+        self._state = state
+        self._writes += 1
+
+        pattern = self._blink_patterns.get(state)
+        if pattern:
+            self._led.blink(on_time=pattern[0], off_time=pattern[1])
+        elif state == LED_CONNECTED:
+            self._led.on()
+        else:
+            self._led.off()
+
+    def off(self):
+        self._led.off()
+        self._state = None
+
+    def get_stats(self):
+        """@return A dict containing the number of state changes written."""
+        return {'writes': self._writes}
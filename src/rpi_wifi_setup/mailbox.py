@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+import os
+import heapq
+import threading
+
+from time import time, time_ns
+
+from rpi_wifi_setup.override import RACY_MTIME_NS
+
+HEADER_PRIORITY = "priority"
+HEADER_TTL = "ttl"
+HEADER_EXPIRES = "expires"
+
+
+def parse_message(text, mtime):
+    """@brief Parse a mailbox message file. The file may start with #priority=<int>,
+              #ttl=<seconds after the file was written> and #expires=<unix time> lines.
+              The remaining lines are the text to display.
+       @param text The file contents.
+       @param mtime The file modification time (seconds since the epoch).
+       @return A tuple containing the priority, expiry time (None if the message does not expire) and text."""
+    priority = 0
+    expires = None
+    lines = text.strip().split('\n')
+    while lines and lines[0].startswith('#'):
+        key, sep, value = lines[0][1:].partition('=')
+        key = key.strip().lower()
+        if not sep or key not in (HEADER_PRIORITY, HEADER_TTL, HEADER_EXPIRES):
+            break
+        try:
+            if key == HEADER_PRIORITY:
+                priority = int(value)
+            elif key == HEADER_TTL:
+                expires = mtime + float(value)
+            else:
+                expires = float(value)
+        except ValueError:
+            pass
+        lines.pop(0)
+    return (priority, expires, '\n'.join(lines).strip())
+
+
+class MailboxMessage(object):
+    """@brief A message read from a file in the mailbox directory."""
+
+    def __init__(self, name, stat_key, priority, expires, text):
+        self.name = name
+        self.stat_key = stat_key
+        self.priority = priority
+        self.expires = expires
+        self.text = text
+        # If True the file may change without the stat_key changing.
+        self.racy = time_ns() - stat_key[2] < RACY_MTIME_NS
+
+
+class Mailbox(object):
+    """@brief The messages that applications have written to the mailbox directory, one
+              file per application. Each file is indexed by its inode, size and modification
+              time so it is only re-read when it changes. The highest priority active
+              message is displayed, messages with equal priority are shown in turn.
+
+              File names starting with '.' are ignored so an application may write a
+              hidden file and rename it to replace its message atomically."""
+
+    def __init__(self, folder, clock=time):
+        """@brief Constructor.
+           @param folder The mailbox directory.
+           @param clock A function returning the current time (seconds since the epoch)."""
+        self._folder = folder
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._messages = {}
+        # The priorities of the active messages (negated as heapq is a min heap)
+        # and the messages with each priority in the order they are shown.
+        self._priority_heap = []
+        self._heap_priorities = set()
+        self._groups = {}
+        # (expires, name) of each message that expires. An entry is stale if the message
+        # has been removed or its expiry time has changed, stale entries are dropped when
+        # they reach the top.
+        self._expiry_heap = []
+        self._rotation = 0
+        self._reads = 0
+
+    def get_folder(self):
+        return self._folder
+
+    def create(self):
+        """@brief Create the mailbox directory. Any user may add messages but only remove their own."""
+        os.makedirs(self._folder, exist_ok=True)
+        os.chmod(self._folder, 0o1777)
+
+    def scan(self):
+        """@brief Check every file in the mailbox directory.
+           @return True if the active messages changed."""
+        try:
+            names = set(os.listdir(self._folder))
+        except OSError:
+            names = set()
+        with self._lock:
+            return self._update(names | set(self._messages.keys()))
+
+    def update(self, names):
+        """@brief Check the files that have changed.
+           @param names The names of the files that may have changed or None to check all files.
+           @return True if the active messages changed."""
+        if names is None:
+            return self.scan()
+        with self._lock:
+            return self._update(names)
+
+    def expire(self):
+        """@brief Remove expired messages.
+           @return True if a message was removed."""
+        with self._lock:
+            return self._expire()
+
+    def get_next_expiry(self):
+        """@return The time (seconds since the epoch) the next message expires or None if no messages expire."""
+        with self._lock:
+            while self._expiry_heap and not self._is_current(*self._expiry_heap[0]):
+                heapq.heappop(self._expiry_heap)
+            return self._expiry_heap[0][0] if self._expiry_heap else None
+
+    def rotate(self):
+        """@brief Show the next of the highest priority messages."""
+        with self._lock:
+            self._rotation += 1
+
+    def get_message(self):
+        """@return The text of the message to display or None if there are no active messages."""
+        with self._lock:
+            self._expire()
+            while self._priority_heap:
+                group = self._groups.get(-self._priority_heap[0])
+                if group:
+                    return self._messages[group[self._rotation % len(group)]].text
+                self._heap_priorities.discard(-heapq.heappop(self._priority_heap))
+            return None
+
+    def get_stats(self):
+        """@return A dict containing the number of messages and file reads."""
+        return {'messages': len(self._messages),
+                'reads': self._reads}
+
+    def _update(self, names):
+        changed = False
+        for name in names:
+            if name.startswith('.'):
+                continue
+            path = os.path.join(self._folder, name)
+            try:
+                st = os.stat(path)
+                stat_key = (st.st_ino, st.st_size, st.st_mtime_ns)
+            except OSError:
+                stat_key = None
+
+            old = self._messages.get(name)
+            if old and old.stat_key == stat_key and not old.racy:
+                continue
+
+            new = None
+            if stat_key is not None:
+                try:
+                    self._reads += 1
+                    with open(path, 'r') as fd:
+                        priority, expires, text = parse_message(fd.read(), st.st_mtime)
+                    if text and (expires is None or expires > self._clock()):
+                        new = MailboxMessage(name, stat_key, priority, expires, text)
+                except (OSError, ValueError):
+                    pass
+
+            if old and new and (old.priority, old.expires, old.text) == (new.priority, new.expires, new.text):
+                # Only the file timestamps have changed so the expiry heap entry is still current.
+                old.stat_key = new.stat_key
+                old.racy = new.racy
+                continue
+
+            if old:
+                self._remove(old)
+                changed = True
+            if new:
+                self._add(new)
+                changed = True
+        return changed
+
+    def _add(self, message):
+        self._messages[message.name] = message
+        group = self._groups.get(message.priority)
+        if group is None:
+            group = self._groups[message.priority] = []
+            if message.priority not in self._heap_priorities:
+                heapq.heappush(self._priority_heap, -message.priority)
+                self._heap_priorities.add(message.priority)
+        group.append(message.name)
+        if message.expires is not None:
+            if len(self._expiry_heap) > 2 * len(self._messages):
+                # Drop the stale entries of messages that are replaced before they expire.
+                self._expiry_heap = [entry for entry in self._expiry_heap if self._is_current(*entry)]
+                heapq.heapify(self._expiry_heap)
+            heapq.heappush(self._expiry_heap, (message.expires, message.name))
+
+    def _remove(self, message):
+        del self._messages[message.name]
+        group = self._groups[message.priority]
+        group.remove(message.name)
+        if not group:
+            # The priority heap entry is removed when it reaches the top.
+            del self._groups[message.priority]
+
+    def _is_current(self, expires, name):
+        """@return True if the expiry heap entry is for the current message."""
+        message = self._messages.get(name)
+        return message is not None and message.expires == expires
+
+    def _expire(self):
+        now = self._clock()
+        removed = False
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            expires, name = heapq.heappop(self._expiry_heap)
+            if self._is_current(expires, name):
+                self._remove(self._messages[name])
+                removed = True
+        return removed
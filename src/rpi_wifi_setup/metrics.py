@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+import os
+import bisect
+import threading
+
+from time import perf_counter, monotonic
+
+METRIC_PREFIX = "rpi_wifi_setup_"
+# The histogram bucket upper bounds in seconds, from 1 ms (a cached frame) to 30 s (a slow nmcli or reconnect).
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# The bucket upper bounds in seconds for the times that are measured in minutes (E.G a portal session).
+LONG_BUCKETS = (1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 900.0, 1800.0)
+
+# The metrics recorded by the WiFi setup manager.
+METRIC_COMMAND = "command_seconds"
+METRIC_RENDER = "render_seconds"
+METRIC_DISPLAY_TRANSFER = "display_transfer_seconds"
+METRIC_BUTTON_TO_DISPLAY = "button_to_display_seconds"
+METRIC_PORTAL = "portal_seconds"
+METRIC_TIME_TO_CONNECTIVITY = "time_to_connectivity_seconds"
+
+METRIC_HELP = {
+    METRIC_COMMAND: "The time taken to read the connectivity state or run an nmcli command.",
+    METRIC_RENDER: "The time taken to build a display frame.",
+    METRIC_DISPLAY_TRANSFER: "The time taken to send a frame to the display (I2C).",
+    METRIC_BUTTON_TO_DISPLAY: "The time from a button press until the next frame has been sent to the display.",
+    METRIC_PORTAL: "The duration of each WiFi portal session by its final state.",
+    METRIC_TIME_TO_CONNECTIVITY: "The time from connectivity being lost until it was next seen.",
+}
+METRIC_BUCKETS = {
+    METRIC_PORTAL: LONG_BUCKETS,
+    METRIC_TIME_TO_CONNECTIVITY: LONG_BUCKETS,
+}
+
+
+class Histogram(object):
+    """@brief Counts observations in fixed buckets so the memory used does not grow."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._buckets = tuple(buckets)
+        # The last count is for the observations above the highest bucket (+Inf).
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value):
+        """@brief Record a value. The caller holds the registry lock."""
+        self._counts[bisect.bisect_left(self._buckets, value)] += 1
+        self._sum += value
+        self._count += 1
+
+    def get_count(self):
+        return self._count
+
+    def get_sum(self):
+        return self._sum
+
+    def get_cumulative_counts(self):
+        """@return A list of (upper bound, cumulative count) tuples, the last upper bound is +Inf."""
+        counts = []
+        total = 0
+        for bound, count in zip(self._buckets + (float('inf'),), self._counts):
+            total += count
+            counts.append((bound, total))
+        return counts
+
+
+class _Timer(object):
+    """@brief A context manager that records the time taken by the block it wraps."""
+
+    __slots__ = ('_registry', '_name', '_labels', '_start')
+
+    def __init__(self, registry, name, labels):
+        self._registry = registry
+        self._name = name
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._registry.observe(self._name, perf_counter() - self._start, **self._labels)
+        return False
+
+
+class MetricsRegistry(object):
+    """@brief Holds the histograms. A histogram is created on its first observation.
+              Each histogram is identified by its name and label values."""
+
+    def __init__(self, prefix=METRIC_PREFIX, help_text=METRIC_HELP, buckets=METRIC_BUCKETS):
+        """@brief Constructor.
+           @param prefix The prefix added to each metric name when exported.
+           @param help_text A dict of metric name: help text.
+           @param buckets A dict of metric name: bucket upper bounds. Other metrics use DEFAULT_BUCKETS."""
+        self._prefix = prefix
+        self._help = help_text
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._version = 0
+
+    def observe(self, name, value, **labels):
+        """@brief Record a value in seconds. Safe to call from any thread.
+           @param name The metric name.
+           @param value The value.
+           @param labels The label values (E.G command="check_internet")."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self._buckets.get(name, DEFAULT_BUCKETS))
+            histogram.observe(value)
+            self._version += 1
+
+    def time(self, name, **labels):
+        """@return A context manager that records the time taken by the block it wraps."""
+        return _Timer(self, name, labels)
+
+    def get_version(self):
+        """@return A number that changes on each observation."""
+        return self._version
+
+    def render(self):
+        """@return The metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            keys = sorted(self._histograms)
+            last_name = None
+            for name, labels in keys:
+                histogram = self._histograms[(name, labels)]
+                full_name = self._prefix + name
+                if name != last_name:
+                    if name in self._help:
+                        lines.append(f"# HELP {full_name} {self._help[name]}")
+                    lines.append(f"# TYPE {full_name} histogram")
+                    last_name = name
+                label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+                separator = "," if label_text else ""
+                for bound, count in histogram.get_cumulative_counts():
+                    le = "+Inf" if bound == float('inf') else repr(bound)
+                    lines.append(f'{full_name}_bucket{{{label_text}{separator}le="{le}"}} {count}')
+                suffix = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{full_name}_sum{suffix} {histogram.get_sum()!r}")
+                lines.append(f"{full_name}_count{suffix} {histogram.get_count()}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+class TextfileExporter(object):
+    """@brief Writes the metrics to a file read by the Prometheus node exporter textfile
+              collector. The file is only written if the metrics have changed and it is
+              replaced so that the collector never reads part of it. Writes are at least
+              min_interval seconds apart to limit SD card writes."""
+
+    DEFAULT_MIN_INTERVAL_SECONDS = 15.0
+
+    def __init__(self, registry, filename, min_interval=DEFAULT_MIN_INTERVAL_SECONDS, clock=monotonic):
+        """@brief Constructor.
+           @param registry The MetricsRegistry.
+           @param filename The file to write. The node exporter only reads files ending in .prom.
+           @param min_interval The minimum number of seconds between writes.
+           @param clock A function returning the time in seconds."""
+        self._registry = registry
+        self._filename = filename
+        self._min_interval = min_interval
+        self._clock = clock
+        self._written_version = None
+        self._written_time = None
+        self._writes = 0
+
+    def write(self, force=False):
+        """@param force If True the file is written if it has changed even if it was written less than min_interval seconds ago.
+           @return True if the file was written."""
+        version = self._registry.get_version()
+        if version == self._written_version:
+            return False
+        now = self._clock()
+        if not force and self._written_time is not None and now - self._written_time < self._min_interval:
+            return False
+        tmp_filename = self._filename + ".tmp"
+        with open(tmp_filename, 'w') as fd:
+            fd.write(self._registry.render())
+        os.replace(tmp_filename, self._filename)
+        self._written_version = version
+        self._written_time = now
+        self._writes += 1
+        return True
+
+    def get_stats(self):
+        return {'writes': self._writes}
+
+
+class MetricsHTTPServer(object):
+    """@brief Serves the metrics at http://<address>:<port>/metrics on a background thread."""
+
+    def __init__(self, registry, port, address="127.0.0.1"):
+        self._registry = registry
+        self._port = port
+        self._address = address
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        # Imported here as the HTTP server is optional.
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        registry = self._registry
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self._address, self._port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def get_port(self):
+        return self._server.server_address[1]
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
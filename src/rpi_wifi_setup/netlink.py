@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+import os
+import errno
+import socket
+import struct
+
+# Netlink message types and multicast groups from linux/rtnetlink.h
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+IFLA_IFNAME = 3
+IFF_UP = 0x1
+IFF_LOWER_UP = 0x10000
+
+NLMSGHDR = struct.Struct("=IHHII")
+IFADDRMSG = struct.Struct("=BBBBI")
+IFINFOMSG = struct.Struct("=BxHiII")
+RTATTR = struct.Struct("=HH")
+RTGENMSG = struct.Struct("=Bxxx")
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def _parse_attrs(data, offset, end):
+    """@brief Parse the rtattr entries in data[offset:end].
+       @return A dict of attribute type to value bytes."""
+    attrs = {}
+    while offset + RTATTR.size <= end:
+        length, attr_type = RTATTR.unpack_from(data, offset)
+        if length < RTATTR.size:
+            break
+        attrs[attr_type] = data[offset + RTATTR.size:offset + length]
+        offset += _align(length)
+    return attrs
+
+
+class NetlinkEvent(object):
+    """@brief An address or link change reported by the kernel."""
+
+    def __init__(self, msg_type, ifindex, ifname=None, address=None, link_up=None):
+        """@brief Constructor.
+           @param msg_type One of RTM_NEWADDR, RTM_DELADDR, RTM_NEWLINK or RTM_DELLINK.
+           @param ifindex The interface index.
+           @param ifname The interface name if reported.
+           @param address The IPv4 address (address messages only).
+           @param link_up True if the link is up (link messages only)."""
+        self.msg_type = msg_type
+        self.ifindex = ifindex
+        self.ifname = ifname
+        self.address = address
+        self.link_up = link_up
+
+    def __repr__(self):
+        return f"NetlinkEvent(msg_type={self.msg_type}, ifindex={self.ifindex}, ifname={self.ifname}, address={self.address}, link_up={self.link_up})"
+
+
+def parse_netlink_messages(data):
+    """@brief Parse the rtnetlink messages in a buffer read from a NETLINK_ROUTE socket.
+              Messages other than IPv4 address and link messages are ignored.
+       @param data The bytes read from the socket.
+       @return A list of NetlinkEvent instances."""
+    events = []
+    offset = 0
+    while offset + NLMSGHDR.size <= len(data):
+        msg_len, msg_type, _flags, _seq, _pid = NLMSGHDR.unpack_from(data, offset)
+        if msg_len < NLMSGHDR.size or offset + msg_len > len(data):
+            break
+        body = offset + NLMSGHDR.size
+        end = offset + msg_len
+
+        if msg_type in (RTM_NEWADDR, RTM_DELADDR):
+            family, _prefixlen, _flags, _scope, ifindex = IFADDRMSG.unpack_from(data, body)
+            if family == socket.AF_INET:
+                attrs = _parse_attrs(data, body + IFADDRMSG.size, end)
+                # IFA_LOCAL is the interface address, IFA_ADDRESS is the peer address on point to point links.
+                raw_address = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+                address = socket.inet_ntop(socket.AF_INET, raw_address) if raw_address else None
+                label = attrs.get(IFA_LABEL)
+                ifname = label.rstrip(b'\0').decode() if label else None
+                events.append(NetlinkEvent(msg_type, ifindex, ifname=ifname, address=address))
+
+        elif msg_type in (RTM_NEWLINK, RTM_DELLINK):
+            _family, _type, ifindex, flags, _change = IFINFOMSG.unpack_from(data, body)
+            attrs = _parse_attrs(data, body + IFINFOMSG.size, end)
+            name = attrs.get(IFLA_IFNAME)
+            ifname = name.rstrip(b'\0').decode() if name else None
+            link_up = msg_type == RTM_NEWLINK and (flags & IFF_UP) != 0 and (flags & IFF_LOWER_UP) != 0
+            events.append(NetlinkEvent(msg_type, ifindex, ifname=ifname, link_up=link_up))
+
+        offset += _align(msg_len)
+    return events
+
+
+class RtnetlinkMonitor(object):
+    """@brief Tracks the IPv4 address and link state of a network interface from the
+              rtnetlink address and link notifications that the kernel multicasts.
+              The socket is non blocking. The owner waits for it to become readable
+              (e.g. with a selector) and then calls handle_events()."""
+
+    RECV_BUFFER_SIZE = 65536
+    SYS_CLASS_NET = "/sys/class/net"
+
+    def __init__(self, iface, on_change=None, on_overrun=None):
+        """@brief Constructor.
+           @param iface The network interface name (e.g. wlan0).
+           @param on_change A function called once per handle_events() call that changed the state.
+           @param on_overrun A function called when notifications have been lost (the socket
+                             receive buffer overflowed) and the state has been read again."""
+        self._iface = iface
+        self._on_change = on_change
+        self._on_overrun = on_overrun
+        self._sock = None
+        self._ifindex = None
+        self._addresses = []
+        self._link_up = None
+        self._overruns = 0
+
+    def open(self):
+        """@brief Open the netlink socket, subscribe to the link and IPv4 address groups
+                  and request the current addresses."""
+        self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW | socket.SOCK_NONBLOCK, socket.NETLINK_ROUTE)
+        self._sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR))
+        try:
+            self._ifindex = socket.if_nametoindex(self._iface)
+        except OSError:
+            self._ifindex = None
+        self._read_state()
+
+    def _read_state(self):
+        """@brief Read the link state and request the current addresses. The link state is read
+                  from sysfs as a netlink socket only runs one dump at a time."""
+        self._addresses = []
+        self._link_up = self._read_operstate()
+        # The dump replies are read by handle_events() in the same way as notifications.
+        request = RTGENMSG.pack(socket.AF_INET)
+        self._sock.send(NLMSGHDR.pack(NLMSGHDR.size + len(request), RTM_GETADDR, NLM_F_REQUEST | NLM_F_DUMP, 1, 0) + request)
+
+    def close(self):
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def get_ip(self):
+        """@return The first IPv4 address of the interface or None."""
+        return self._addresses[0] if self._addresses else None
+
+    def is_link_up(self):
+        """@return True if the link is up, False if down or None if not known."""
+        return self._link_up
+
+    def handle_events(self):
+        """@brief Read all pending netlink messages and update the state.
+           @return True if the IP address or link state changed."""
+        events = []
+        overrun = False
+        while True:
+            try:
+                data = self._sock.recv(RtnetlinkMonitor.RECV_BUFFER_SIZE)
+            except BlockingIOError:
+                break
+            except OSError as ex:
+                if ex.errno != errno.ENOBUFS:
+                    raise
+                # The kernel dropped notifications because the receive buffer was full.
+                # The events read so far are out of date so read the state again.
+                self._overruns += 1
+                overrun = True
+                events = []
+                self._read_state()
+                continue
+            if not data:
+                break
+            events += parse_netlink_messages(data)
+
+        changed = self.apply(events)
+        if overrun and self._on_overrun:
+            self._on_overrun()
+        elif changed and self._on_change:
+            self._on_change()
+        return changed or overrun
+
+    def get_overruns(self):
+        """@return The number of times notifications were lost and the state was read again."""
+        return self._overruns
+
+    def apply(self, events):
+        """@brief Update the state from a list of NetlinkEvent instances.
+           @return True if the IP address or link state changed."""
+        before = (self.get_ip(), self._link_up)
+        for event in events:
+            if event.ifname == self._iface and event.ifindex != self._ifindex:
+                # The interface has been (re)created with a new index.
+                self._ifindex = event.ifindex
+                self._addresses = []
+            if event.ifindex != self._ifindex:
+                continue
+
+            if event.msg_type == RTM_NEWADDR:
+                if event.address and event.address not in self._addresses:
+                    self._addresses.append(event.address)
+
+            elif event.msg_type == RTM_DELADDR:
+                if event.address in self._addresses:
+                    self._addresses.remove(event.address)
+
+            elif event.msg_type in (RTM_NEWLINK, RTM_DELLINK):
+                self._link_up = event.link_up
+                if event.msg_type == RTM_DELLINK:
+                    self._addresses = []
+
+        return (self.get_ip(), self._link_up) != before
+
+    def _read_operstate(self):
+        try:
+            with open(os.path.join(RtnetlinkMonitor.SYS_CLASS_NET, self._iface, "operstate")) as fd:
+                return fd.read().strip() == "up"
+        except OSError:
+            return None
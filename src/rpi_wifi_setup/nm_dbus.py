@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+import threading
+
+from collections import deque
+from time import sleep
+
+from p3lib.helper import logTraceBack
+
+try:
+    from jeepney import DBusAddress, HeaderFields, MatchRule, Properties, message_bus, new_method_call
+    from jeepney.io.blocking import open_dbus_connection, Proxy
+except ImportError:
+    open_dbus_connection = None
+
+
+class NMDBusMonitor(threading.Thread):
+    """@brief Keeps a single persistent D-Bus connection to NetworkManager and tracks
+              the WiFi connectivity, IP address, signal strength and SSID from the
+              signals that NetworkManager emits. This removes the need to fork nmcli
+              to read the connectivity state."""
+
+    NM_BUS_NAME = "org.freedesktop.NetworkManager"
+    NM_PATH = "/org/freedesktop/NetworkManager"
+    NM_INTERFACE = "org.freedesktop.NetworkManager"
+    DEVICE_INTERFACE = "org.freedesktop.NetworkManager.Device"
+    WIRELESS_INTERFACE = "org.freedesktop.NetworkManager.Device.Wireless"
+    IP4_CONFIG_INTERFACE = "org.freedesktop.NetworkManager.IP4Config"
+    AP_INTERFACE = "org.freedesktop.NetworkManager.AccessPoint"
+    PROPERTIES_INTERFACE = "org.freedesktop.DBus.Properties"
+    NO_OBJECT_PATH = "/"
+    CONNECTIVITY_FULL = 4
+    RECV_TIMEOUT_SECONDS = 1.0
+    RECONNECT_SECONDS = 5
+
+    @staticmethod
+    def is_available():
+        """@return True if the jeepney D-Bus module is installed."""
+        return open_dbus_connection is not None
+
+    def __init__(self, uio, iface="wlan0", on_change=None, bus="SYSTEM"):
+        """@brief Constructor.
+           @param uio A UIO instance.
+           @param iface The WiFi interface to monitor.
+           @param on_change A function called (from this thread) when the connectivity state changes.
+           @param bus 'SYSTEM', 'SESSION' or a D-Bus address. A session or private bus address
+                      can be used to run against a stand in NetworkManager service."""
+        super().__init__(daemon=True)
+        self._uio = uio
+        self._iface = iface
+        self._on_change = on_change
+        self._bus = bus
+        self._conn = None
+        self._queue = deque()
+        self._filter = None
+        self._lock = threading.Lock()
+        self._running = False
+        self._device_path = None
+        self._ip4_config_path = None
+        self._ap_path = None
+        self._connectivity = None
+        self._ip = None
+        self._strength = 0
+        self._ssid = None
+
+    def connect(self):
+        """@brief Connect to the bus, subscribe to the NetworkManager signals and read the
+                  initial state. An exception is raised if NetworkManager cannot be reached."""
+        self._conn = open_dbus_connection(bus=self._bus)
+        try:
+            # The bus daemon resolves the well known name so only NetworkManager signals are routed to us.
+            rule = MatchRule(type='signal',
+                             sender=NMDBusMonitor.NM_BUS_NAME,
+                             path_namespace=NMDBusMonitor.NM_PATH)
+            Proxy(message_bus, self._conn).AddMatch(rule)
+            # Received signals carry the unique sender name so the local filter matches on path only.
+            self._filter = self._conn.filter(MatchRule(type='signal',
+                                                       path_namespace=NMDBusMonitor.NM_PATH),
+                                             queue=self._queue)
+            self._read_initial_state()
+
+        except Exception:
+            self._close()
+            raise
+
+    def is_connected(self):
+        """@return True if the D-Bus connection to NetworkManager is up."""
+        return self._conn is not None
+
+    def is_internet_connected(self):
+        """@return True if NetworkManager reports full connectivity."""
+        with self._lock:
+            return self._connectivity == NMDBusMonitor.CONNECTIVITY_FULL
+
+    def get_ip(self):
+        """@return The IPv4 address of the monitored interface or None."""
+        with self._lock:
+            return self._ip
+
+    def get_strength(self):
+        """@return The signal strength (0-100) of the active access point."""
+        with self._lock:
+            return self._strength
+
+    def get_ssid(self):
+        """@return The SSID of the active access point or None."""
+        with self._lock:
+            return self._ssid
+
+    def run(self):
+        self._running = True
+        while self._running:
+            try:
+                if not self._conn:
+                    self.connect()
+                    self._notify_change()
+
+                try:
+                    msg = self._conn.recv_until_filtered(self._queue, timeout=NMDBusMonitor.RECV_TIMEOUT_SECONDS)
+                except TimeoutError:
+                    continue
+
+                if self._handle_signal(msg):
+                    self._notify_change()
+
+            except Exception:
+                if not self._running:
+                    break
+                logTraceBack(self._uio)
+                self._uio.debug("Lost NetworkManager D-Bus connection. Falling back to nmcli.")
+                self._close()
+                sleep(NMDBusMonitor.RECONNECT_SECONDS)
+
+    def stop(self):
+        self._running = False
+        if self.is_alive():
+            self.join()
+        self._close()
+
+    def _close(self):
+        if self._filter:
+            self._filter.close()
+            self._filter = None
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    def _notify_change(self):
+        if self._on_change:
+            self._on_change()
+
+    def _call(self, path, interface, method, signature=None, body=()):
+        addr = DBusAddress(path, bus_name=NMDBusMonitor.NM_BUS_NAME, interface=interface)
+        reply = self._conn.send_and_get_reply(new_method_call(addr, method, signature, body))
+        return reply.body[0]
+
+    def _get_property(self, path, interface, name):
+        addr = DBusAddress(path, bus_name=NMDBusMonitor.NM_BUS_NAME, interface=interface)
+        reply = self._conn.send_and_get_reply(Properties(addr).get(name))
+        # The property value is a variant of the form (signature, value)
+        return reply.body[0][1]
+
+    def _read_initial_state(self):
+        connectivity = self._get_property(NMDBusMonitor.NM_PATH, NMDBusMonitor.NM_INTERFACE, 'Connectivity')
+        device_path = self._call(NMDBusMonitor.NM_PATH, NMDBusMonitor.NM_INTERFACE, 'GetDeviceByIpIface', 's', (self._iface,))
+        with self._lock:
+            self._connectivity = connectivity
+            self._device_path = device_path
+        self._set_ip4_config(self._get_property(device_path, NMDBusMonitor.DEVICE_INTERFACE, 'Ip4Config'))
+        self._set_access_point(self._get_property(device_path, NMDBusMonitor.WIRELESS_INTERFACE, 'ActiveAccessPoint'))
+
+    def _set_ip4_config(self, path):
+        ip = None
+        if path and path != NMDBusMonitor.NO_OBJECT_PATH:
+            ip = self._parse_address_data(self._get_property(path, NMDBusMonitor.IP4_CONFIG_INTERFACE, 'AddressData'))
+        else:
+            path = None
+        with self._lock:
+            self._ip4_config_path = path
+            self._ip = ip
+
+    def _set_access_point(self, path):
+        strength = 0
+        ssid = None
+        if path and path != NMDBusMonitor.NO_OBJECT_PATH:
+            strength = self._get_property(path, NMDBusMonitor.AP_INTERFACE, 'Strength')
+            ssid = self._decode_ssid(self._get_property(path, NMDBusMonitor.AP_INTERFACE, 'Ssid'))
+        else:
+            path = None
+        with self._lock:
+            self._ap_path = path
+            self._strength = strength
+            self._ssid = ssid
+
+    def _parse_address_data(self, address_data):
+        """@brief Get the first address from an IP4Config AddressData (aa{sv}) value."""
+        for address in address_data:
+            if 'address' in address:
+                return address['address'][1]
+        return None
+
+    def _decode_ssid(self, ssid):
+        if not ssid:
+            return None
+        return bytes(ssid).decode('utf-8', errors='replace')
+
+    def _get_state(self):
+        with self._lock:
+            return (self._connectivity, self._ip, self._strength, self._ssid)
+
+    def _handle_signal(self, msg):
+        """@brief Update the state from a NetworkManager signal.
+           @return True if the connectivity state changed."""
+        before = self._get_state()
+        fields = msg.header.fields
+        path = fields.get(HeaderFields.path)
+        interface = fields.get(HeaderFields.interface)
+        member = fields.get(HeaderFields.member)
+
+        if interface == NMDBusMonitor.NM_INTERFACE and member == 'StateChanged':
+            connectivity = self._get_property(NMDBusMonitor.NM_PATH, NMDBusMonitor.NM_INTERFACE, 'Connectivity')
+            with self._lock:
+                self._connectivity = connectivity
+
+        elif interface == NMDBusMonitor.PROPERTIES_INTERFACE and member == 'PropertiesChanged':
+            changed = msg.body[1]
+            if path == NMDBusMonitor.NM_PATH:
+                if 'Connectivity' in changed:
+                    with self._lock:
+                        self._connectivity = changed['Connectivity'][1]
+
+            elif path == self._device_path:
+                if 'Ip4Config' in changed:
+                    self._set_ip4_config(changed['Ip4Config'][1])
+                if 'ActiveAccessPoint' in changed:
+                    self._set_access_point(changed['ActiveAccessPoint'][1])
+
+            elif path == self._ip4_config_path:
+                if 'AddressData' in changed:
+                    ip = self._parse_address_data(changed['AddressData'][1])
+                    with self._lock:
+                        self._ip = ip
+
+            elif path == self._ap_path:
+                with self._lock:
+                    if 'Strength' in changed:
+                        self._strength = changed['Strength'][1]
+                    if 'Ssid' in changed:
+                        self._ssid = self._decode_ssid(changed['Ssid'][1])
+
+        return self._get_state() != before
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+import os
+import threading
+
+from time import time_ns, monotonic
+
+# A file modified this recently may be modified again without its mtime
+# changing (the kernel timestamp granularity) so its contents are re-read
+# on the next update.
+RACY_MTIME_NS = 100_000_000
+
+
+class OverrideFile(object):
+    """@brief Reads the display override message file. The file is only re-read when
+              its inode, size or modification time has changed."""
+
+    def __init__(self, path):
+        """@brief Constructor.
+           @param path The override message file."""
+        self._path = path
+        self._lock = threading.Lock()
+        self._stat_key = None
+        self._msg = None
+        self._reads = 0
+        self._changes = 0
+
+    def update(self):
+        """@brief Check the file for a new message.
+           @return True if the message has changed."""
+        with self._lock:
+            try:
+                st = os.stat(self._path)
+                stat_key = (st.st_ino, st.st_size, st.st_mtime_ns)
+            except OSError:
+                stat_key = None
+
+            if stat_key is not None and stat_key == self._stat_key:
+                return False
+
+            msg = None
+            if stat_key is not None:
+                msg = self._read()
+                if time_ns() - st.st_mtime_ns < RACY_MTIME_NS:
+                    stat_key = None
+            self._stat_key = stat_key
+
+            if msg == self._msg:
+                return False
+            self._msg = msg
+            self._changes += 1
+            return True
+
+    def get_message(self):
+        """@return The override message or None if there is no override message."""
+        self.update()
+        return self._msg
+
+    def get_stats(self):
+        """@return A dict containing the reads and changes counts."""
+        return {'reads': self._reads,
+                'changes': self._changes}
+
+    def _read(self):
+        self._reads += 1
+        try:
+            with open(self._path, 'r') as fd:
+                msg = fd.read().strip()
+                return msg if msg else None
+        except Exception:
+            return None
+
+
+class Debouncer(object):
+    """@brief Calls a function once at the end of a window that starts with the first
+              of a burst of triggers. Triggers within the window are merged.
+              By default no timer is used, the owner's loop waits for at most
+              get_delay() seconds and then calls poll()."""
+
+    def __init__(self, window, callback, schedule=None, clock=monotonic):
+        """@brief Constructor.
+           @param window The window in seconds. If 0 the function is called on every trigger.
+           @param callback The function to call.
+           @param schedule A function called with a delay and a function that calls the function
+                           after the delay and returns an object with a cancel() method
+                           (E.G asyncio loop.call_later). If None the owner calls poll().
+           @param clock The function that returns the time in seconds used when schedule is None."""
+        self._window = window
+        self._callback = callback
+        self._schedule = schedule
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._timer = None
+        self._deadline = None
+        self._triggers = 0
+        self._calls = 0
+
+    def trigger(self):
+        with self._lock:
+            self._triggers += 1
+            if self._timer or self._deadline is not None:
+                return
+
+            if self._window > 0:
+                if self._schedule:
+                    self._timer = self._schedule(self._window, self._fire)
+                else:
+                    self._deadline = self._clock() + self._window
+                return
+
+        self._fire()
+
+    def get_delay(self):
+        """@return The seconds until poll() should be called or None if no call is pending."""
+        with self._lock:
+            if self._deadline is None:
+                return None
+            return max(0.0, self._deadline - self._clock())
+
+    def poll(self):
+        """@brief Call the function if the end of the window has been reached.
+           @return True if the function was called."""
+        with self._lock:
+            if self._deadline is None or self._clock() < self._deadline:
+                return False
+            self._deadline = None
+        self._fire()
+        return True
+
+    def cancel(self):
+        with self._lock:
+            self._deadline = None
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+
+    def get_stats(self):
+        """@return A dict containing the triggers and calls counts."""
+        return {'triggers': self._triggers,
+                'calls': self._calls}
+
+    def _fire(self):
+        with self._lock:
+            self._timer = None
+            self._calls += 1
+        self._callback()
@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import signal
+import threading
+import selectors
+import subprocess
+
+from time import monotonic
+
+from rpi_wifi_setup.heartbeat import LoopWaker
+
+# The portal session states.
+PORTAL_IDLE = "idle"
+PORTAL_STARTING = "starting"
+PORTAL_RUNNING = "running"
+PORTAL_STOPPING = "stopping"
+PORTAL_SUCCEEDED = "succeeded"
+PORTAL_FAILED = "failed"
+PORTAL_TIMED_OUT = "timed_out"
+PORTAL_CANCELLED = "cancelled"
+PORTAL_FINISHED_STATES = (PORTAL_SUCCEEDED, PORTAL_FAILED, PORTAL_TIMED_OUT, PORTAL_CANCELLED)
+
+# The progress events found in the wifi-connect output.
+PORTAL_EVENT_STARTED = "portal_started"
+PORTAL_EVENT_CLIENT_CONNECTED = "client_connected"
+PORTAL_EVENT_CREDENTIALS = "credentials_received"
+PORTAL_EVENT_CONNECTING = "connecting"
+PORTAL_EVENT_CONNECTED = "connected"
+PORTAL_EVENT_CONNECT_FAILED = "connect_failed"
+
+# The wifi-connect log messages that mark each progress event.
+PORTAL_EVENT_PATTERNS = (
+    (re.compile(r"Access point '.*' created|Starting HTTP server"), PORTAL_EVENT_STARTED),
+    (re.compile(r"User connected to the captive portal"), PORTAL_EVENT_CLIENT_CONNECTED),
+    (re.compile(r"Incoming `connect` to access point"), PORTAL_EVENT_CREDENTIALS),
+    (re.compile(r"Connecting to access point"), PORTAL_EVENT_CONNECTING),
+    (re.compile(r"Internet connectivity established|Connected to access point"), PORTAL_EVENT_CONNECTED),
+    (re.compile(r"Connection to access point not activated|Cannot connect to access point|Connection failed"), PORTAL_EVENT_CONNECT_FAILED),
+)
+
+# Longer lines are truncated so a child that never writes a newline cannot use unbounded memory.
+MAX_LINE_BYTES = 1024
+
+
+def parse_portal_line(line):
+    """@brief Find the progress event in a line of wifi-connect output.
+       @param line The line of text.
+       @return One of the PORTAL_EVENT_* events or None."""
+    for pattern, event in PORTAL_EVENT_PATTERNS:
+        if pattern.search(line):
+            return event
+    return None
+
+
+class LineSplitter(object):
+    """@brief Splits the output of a child process into lines as it is read."""
+
+    def __init__(self, max_line_bytes=MAX_LINE_BYTES):
+        self._max_line_bytes = max_line_bytes
+        self._partial = bytearray()
+
+    def feed(self, data):
+        """@brief Add output.
+           @param data The bytes read.
+           @return A list of the complete lines."""
+        lines = []
+        start = 0
+        while True:
+            end = data.find(b'\n', start)
+            if end < 0:
+                self._add(data[start:])
+                return lines
+            self._add(data[start:end])
+            lines.append(self._take())
+            start = end + 1
+
+    def flush(self):
+        """@return A list containing the last line if it had no newline."""
+        return [self._take()] if self._partial else []
+
+    def _add(self, data):
+        self._partial += data[:max(self._max_line_bytes - len(self._partial), 0)]
+
+    def _take(self):
+        line = self._partial.decode('utf-8', errors='replace').rstrip('\r')
+        self._partial = bytearray()
+        return line
+
+
+class PortalSession(object):
+    """@brief Runs the wifi-connect captive portal as a child process in its own process
+              group. The session ends when the child exits, when the overall timeout
+              expires or when it is cancelled. A timed out or cancelled child is sent
+              SIGTERM and then SIGKILL if it has not exited after kill_timeout seconds.
+              The state is passed to on_state_change as it changes.
+
+              start() runs the session on its own thread. run_async() runs it as an
+              asyncio task."""
+
+    DEFAULT_TIMEOUT_SECONDS = 900
+    DEFAULT_KILL_SECONDS = 5
+
+    def __init__(self, cmd, timeout=DEFAULT_TIMEOUT_SECONDS, kill_timeout=DEFAULT_KILL_SECONDS,
+                 on_state_change=None, on_output=None, clock=monotonic):
+        """@brief Constructor.
+           @param cmd The wifi-connect command as a list of arguments.
+           @param timeout The maximum number of seconds the portal may run for. 0 sets no limit.
+           @param kill_timeout The number of seconds between SIGTERM and SIGKILL.
+           @param on_state_change If not None a function called with the session and the new state.
+                                  It is called from the thread that changed the state.
+           @param on_output If not None a function called with the session, each line of the child
+                            stdout/stderr as it is read and the progress event (PORTAL_EVENT_*) in
+                            the line or None. It is called from the session thread (or the loop).
+           @param clock A function returning the time in seconds."""
+        self._cmd = cmd
+        self._timeout = timeout
+        self._kill_timeout = kill_timeout
+        self._on_state_change = on_state_change
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = PORTAL_IDLE
+        self._stop_state = None
+        self._pid = None
+        self._returncode = None
+        self._error = None
+        self._start_time = None
+        self._end_time = None
+        self._thread = None
+        self._wake = None
+        self._on_output = on_output
+        self._splitter = LineSplitter()
+        self._last_event = None
+        self._events = []
+
+    def get_state(self):
+        with self._lock:
+            return self._state
+
+    def is_active(self):
+        """@return True if the session has been started and has not finished."""
+        state = self.get_state()
+        return state != PORTAL_IDLE and state not in PORTAL_FINISHED_STATES
+
+    def get_returncode(self):
+        """@return The child exit code (negative if killed by a signal) or None if it has not exited."""
+        return self._returncode
+
+    def get_error(self):
+        """@return The exception that caused the session to fail or None."""
+        return self._error
+
+    def get_elapsed(self):
+        """@return The number of seconds the session has run for or None if it has not started."""
+        if self._start_time is None:
+            return None
+        end_time = self._end_time if self._end_time is not None else self._clock()
+        return end_time - self._start_time
+
+    def get_events(self):
+        """@return A list of (event, seconds since the session started) tuples for the progress events so far."""
+        with self._lock:
+            return list(self._events)
+
+    def _handle_output(self, data):
+        """@brief Pass each complete line in the output read from the child to on_output.
+           @param data The bytes read or None at the end of the output."""
+        lines = self._splitter.feed(data) if data is not None else self._splitter.flush()
+        for line in lines:
+            event = parse_portal_line(line)
+            if event:
+                if event == self._last_event:
+                    # E.G the portal page is reloaded, reported once.
+                    event = None
+                else:
+                    self._last_event = event
+                    with self._lock:
+                        self._events.append((event, self._clock() - self._start_time))
+            if self._on_output:
+                self._on_output(self, line, event)
+
+    def _read_output(self, fd):
+        """@brief Read the output that is available from the non blocking child stdout.
+           @return False at the end of the output."""
+        while True:
+            try:
+                data = os.read(fd, 4096)
+            except BlockingIOError:
+                return True
+            if not data:
+                self._handle_output(None)
+                return False
+            self._handle_output(data)
+
+    def _set_state(self, state):
+        with self._lock:
+            if state == self._state:
+                return
+            self._state = state
+            if state in PORTAL_FINISHED_STATES:
+                self._end_time = self._clock()
+        if self._on_state_change:
+            self._on_state_change(self, state)
+
+    def _finish(self, returncode):
+        self._returncode = returncode
+        if self._stop_state:
+            self._set_state(self._stop_state)
+        else:
+            self._set_state(PORTAL_SUCCEEDED if returncode == 0 else PORTAL_FAILED)
+
+    def _fail(self, ex):
+        self._error = ex
+        self._set_state(PORTAL_FAILED)
+
+    def _signal(self, sig):
+        """@brief Send a signal to the child process group (sudo and wifi-connect)."""
+        try:
+            os.killpg(self._pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _get_remaining(self):
+        """@return The number of seconds until the overall timeout or None if there is no timeout."""
+        if not self._timeout:
+            return None
+        return max(0.0, self._start_time + self._timeout - self._clock())
+
+    def cancel(self):
+        """@brief Stop the portal. Safe to call from any thread.
+           @return True if the session was active."""
+        with self._lock:
+            if self._state == PORTAL_IDLE or self._state in PORTAL_FINISHED_STATES or self._stop_state:
+                return False
+            self._stop_state = PORTAL_CANCELLED
+            wake = self._wake
+        if wake:
+            wake()
+        return True
+
+    def start(self, prepare=None):
+        """@brief Start the session on a new thread.
+           @param prepare If not None a function called on the session thread before the child is started."""
+        self._start_time = self._clock()
+        self._set_state(PORTAL_STARTING)
+        self._thread = threading.Thread(target=self._run, args=(prepare,), daemon=True)
+        self._thread.start()
+
+    def join(self, timeout=None):
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self, prepare):
+        waker = LoopWaker()
+        try:
+            waker.open()
+            self._wake = waker.wake
+            if prepare:
+                prepare()
+            if self._stop_state:
+                self._set_state(self._stop_state)
+                return
+
+            proc = subprocess.Popen(self._cmd,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT,
+                                    start_new_session=True)
+            self._pid = proc.pid
+            self._set_state(PORTAL_RUNNING)
+            try:
+                self._finish(self._wait(proc, waker))
+            finally:
+                proc.stdout.close()
+
+        except Exception as ex:
+            self._fail(ex)
+
+        finally:
+            self._wake = None
+            waker.close()
+
+    def _wait(self, proc, waker):
+        """@brief Wait for the child to exit, the timeout to expire or the session to be cancelled.
+           @return The child exit code."""
+        try:
+            pidfd = os.pidfd_open(proc.pid)
+        except (AttributeError, OSError):
+            pidfd = None
+
+        stdout_fd = proc.stdout.fileno()
+        os.set_blocking(stdout_fd, False)
+        output_open = True
+        selector = selectors.DefaultSelector()
+        try:
+            if pidfd is not None:
+                selector.register(pidfd, selectors.EVENT_READ)
+            selector.register(waker, selectors.EVENT_READ)
+            selector.register(stdout_fd, selectors.EVENT_READ)
+            while True:
+                if output_open and not self._read_output(stdout_fd):
+                    output_open = False
+                    selector.unregister(stdout_fd)
+
+                returncode = proc.poll()
+                if returncode is not None:
+                    if output_open:
+                        # A grandchild may hold the pipe open, only the output written so far is read.
+                        self._handle_output(None)
+                    return returncode
+
+                if self._stop_state:
+                    return self._stop(proc)
+
+                remaining = self._get_remaining()
+                if remaining == 0:
+                    with self._lock:
+                        self._stop_state = self._stop_state or PORTAL_TIMED_OUT
+                    continue
+
+                if pidfd is None:
+                    # No pidfd (kernels before 5.3), check the child once a second.
+                    remaining = 1.0 if remaining is None else min(remaining, 1.0)
+                selector.select(timeout=remaining)
+                waker.handle_events()
+        finally:
+            selector.close()
+            if pidfd is not None:
+                os.close(pidfd)
+
+    def _stop(self, proc):
+        """@brief Send SIGTERM and then SIGKILL to the child.
+           @return The child exit code."""
+        self._set_state(PORTAL_STOPPING)
+        self._signal(signal.SIGTERM)
+        try:
+            returncode = proc.wait(timeout=self._kill_timeout)
+        except subprocess.TimeoutExpired:
+            returncode = None
+        # Also kills any process left in the group after the child has exited.
+        self._signal(signal.SIGKILL)
+        return proc.wait() if returncode is None else returncode
+
+    async def run_async(self, prepare=None):
+        """@brief Run the session on the running asyncio event loop. The session may be cancelled
+                  with cancel() from the loop or another thread.
+           @param prepare If not None an async function awaited before the child is started."""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        stop_event = asyncio.Event()
+        self._wake = lambda: loop.call_soon_threadsafe(stop_event.set)
+        self._start_time = self._clock()
+        self._set_state(PORTAL_STARTING)
+        transport = None
+        try:
+            if prepare:
+                await prepare()
+            if self._stop_state:
+                self._set_state(self._stop_state)
+                return
+
+            # The protocol reports the exit as soon as the child exits. Process.wait() would
+            # also wait for the output pipe to be closed, which a grandchild may hold open.
+            protocol = _PortalProtocol(self, loop.create_future())
+            transport, _ = await loop.subprocess_exec(lambda: protocol, *self._cmd,
+                                                      stdin=subprocess.DEVNULL,
+                                                      stdout=subprocess.PIPE,
+                                                      stderr=subprocess.STDOUT,
+                                                      start_new_session=True)
+            self._pid = transport.get_pid()
+            self._set_state(PORTAL_RUNNING)
+
+            exit_task = asyncio.ensure_future(protocol.exited)
+            stop_task = loop.create_task(stop_event.wait())
+            try:
+                await asyncio.wait((exit_task, stop_task),
+                                   timeout=self._get_remaining(),
+                                   return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                stop_task.cancel()
+
+            if not exit_task.done():
+                with self._lock:
+                    self._stop_state = self._stop_state or PORTAL_TIMED_OUT
+                self._set_state(PORTAL_STOPPING)
+                self._signal(signal.SIGTERM)
+                try:
+                    await asyncio.wait_for(asyncio.shield(exit_task), self._kill_timeout)
+                except asyncio.TimeoutError:
+                    pass
+                # Also kills any process left in the group after the child has exited.
+                self._signal(signal.SIGKILL)
+            await exit_task
+
+            # A grandchild may hold the pipe open, only the output written so far is read.
+            await asyncio.wait((protocol.output_closed,), timeout=0.1)
+            transport.close()
+            protocol.close_output()
+            self._finish(transport.get_returncode())
+
+        except asyncio.CancelledError:
+            # The manager is shutting down.
+            if self._pid is not None and self._returncode is None:
+                self._signal(signal.SIGKILL)
+            if transport:
+                transport.close()
+            raise
+
+        except Exception as ex:
+            self._fail(ex)
+
+        finally:
+            self._wake = None
+
+    def get_stats(self):
+        """@return A dict containing the state, the child exit code, the elapsed time and the time of
+                   each progress event in seconds."""
+        elapsed = self.get_elapsed()
+        return {'state': self.get_state(),
+                'returncode': self._returncode,
+                'elapsed': round(elapsed, 3) if elapsed is not None else None,
+                'events': [(event, round(t, 3)) for event, t in self.get_events()]}
+
+
+class _PortalProtocol(object):
+    """@brief The asyncio subprocess protocol of the wifi-connect child. The output is passed
+              to the session as it is received."""
+
+    def __init__(self, session, exited):
+        self._session = session
+        self.exited = exited
+        self.output_closed = exited.get_loop().create_future()
+
+    def connection_made(self, transport):
+        pass
+
+    def pipe_data_received(self, fd, data):
+        self._session._handle_output(data)
+
+    def pipe_connection_lost(self, fd, exc):
+        self.close_output()
+
+    def close_output(self):
+        if not self.output_closed.done():
+            self.output_closed.set_result(None)
+            self._session._handle_output(None)
+
+    def process_exited(self):
+        if not self.exited.done():
+            self.exited.set_result(None)
+
+    def connection_lost(self, exc):
+        pass
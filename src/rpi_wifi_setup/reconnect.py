@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+import threading
+import subprocess
+
+from time import monotonic, sleep
+
+from rpi_wifi_setup.ssid_scan import split_terse_fields
+
+# The reconnect steps, cheapest first.
+STEP_CONNECTION_UP = "connection_up"
+STEP_DEVICE_REAPPLY = "device_reapply"
+STEP_RADIO_TOGGLE = "radio_toggle"
+STEP_NETWORKING_CYCLE = "networking_cycle"
+STEPS = (STEP_CONNECTION_UP, STEP_DEVICE_REAPPLY, STEP_RADIO_TOGGLE, STEP_NETWORKING_CYCLE)
+
+WIRELESS_CONNECTION_TYPE = "802-11-wireless"
+
+
+def parse_last_wifi_profile(output):
+    """@brief Find the most recently used WiFi connection profile.
+       @param output The output of nmcli -t -f NAME,TYPE,TIMESTAMP connection show.
+       @return The profile name or None if there is no WiFi profile."""
+    last = None
+    for line in output.splitlines():
+        fields = split_terse_fields(line)
+        if len(fields) < 3 or fields[1] != WIRELESS_CONNECTION_TYPE:
+            continue
+        try:
+            timestamp = int(fields[2])
+        except ValueError:
+            timestamp = 0
+        if last is None or timestamp > last[1]:
+            last = (fields[0], timestamp)
+    return last[0] if last else None
+
+
+class ReconnectStep(object):
+    """@brief One step of the reconnect ladder."""
+
+    def __init__(self, name, cmds, timeout, pause=0.0):
+        """@brief Constructor.
+           @param name One of the STEP_* names.
+           @param cmds The commands run in turn.
+           @param timeout The maximum number of seconds each command may take.
+           @param pause The number of seconds between the commands (E.G radio off and on)."""
+        self.name = name
+        self.cmds = cmds
+        self.timeout = timeout
+        self.pause = pause
+
+
+class ReconnectLadder(object):
+    """@brief Restores connectivity with the cheapest step that works. Each step is only
+              tried if the previous step did not restore connectivity:
+              1 nmcli connection up on the last used WiFi profile.
+              2 nmcli device reapply on the WiFi interface.
+              3 WiFi radio off/on, other interfaces (E.G Ethernet) are not touched.
+              4 NetworkManager networking off/on (all interfaces).
+              The time from the start of each step until connectivity is recorded.
+              cancel() stops the ladder (E.G when the WiFi portal is started again) between
+              steps or while waiting for connectivity. Once a step has started all its
+              commands are run so the WiFi radio or networking is never left off. A run is
+              given the generation returned by begin() when it is scheduled so that a
+              cancel() between scheduling and starting the run is not lost."""
+
+    DEFAULT_STEP_TIMEOUT_SECONDS = 20.0
+    DEFAULT_SETTLE_SECONDS = 15.0
+    DEFAULT_POLL_SECONDS = 1.0
+    DEFAULT_PAUSE_SECONDS = 1.0
+
+    def __init__(self,
+                 iface,
+                 nmcli=("nmcli",),
+                 steps=STEPS,
+                 timeout=DEFAULT_STEP_TIMEOUT_SECONDS,
+                 settle=DEFAULT_SETTLE_SECONDS,
+                 poll_interval=DEFAULT_POLL_SECONDS,
+                 pause=DEFAULT_PAUSE_SECONDS,
+                 clock=monotonic):
+        """@brief Constructor.
+           @param iface The WiFi interface name.
+           @param nmcli The nmcli command.
+           @param steps The names of the steps to try in order.
+           @param timeout The maximum number of seconds each step command may take.
+           @param settle The maximum number of seconds to wait for connectivity after each step.
+           @param poll_interval The number of seconds between connectivity checks while waiting.
+           @param pause The number of seconds between the off and on commands.
+           @param clock A function returning the time in seconds."""
+        self._iface = iface
+        self._nmcli = list(nmcli)
+        self._steps = steps
+        self._timeout = timeout
+        self._settle = settle
+        self._poll_interval = poll_interval
+        self._pause = pause
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._generation = 0
+        self._runs = 0
+        self._failures = 0
+        self._cancelled = 0
+        self._step_stats = {name: {'attempts': 0, 'successes': 0, 'last_seconds': None, 'total_seconds': 0.0}
+                            for name in steps}
+
+    def get_profile_cmd(self):
+        return self._nmcli + ["-t", "-f", "NAME,TYPE,TIMESTAMP", "connection", "show"]
+
+    def get_steps(self, profile):
+        """@param profile The last used WiFi profile or None.
+           @return A list of the ReconnectStep instances to try."""
+        nmcli = self._nmcli
+        timeout = self._timeout
+        # nmcli waits for the activation, the command timeout allows for nmcli to start.
+        wait = ["--wait", str(int(timeout))]
+        all_steps = {
+            STEP_CONNECTION_UP: ReconnectStep(STEP_CONNECTION_UP,
+                                              [nmcli + wait + ["connection", "up", "id", profile]] if profile else [],
+                                              timeout + 5),
+            STEP_DEVICE_REAPPLY: ReconnectStep(STEP_DEVICE_REAPPLY,
+                                               [nmcli + ["device", "reapply", self._iface]],
+                                               timeout),
+            STEP_RADIO_TOGGLE: ReconnectStep(STEP_RADIO_TOGGLE,
+                                             [nmcli + ["radio", "wifi", "off"], nmcli + ["radio", "wifi", "on"]],
+                                             timeout, pause=self._pause),
+            STEP_NETWORKING_CYCLE: ReconnectStep(STEP_NETWORKING_CYCLE,
+                                                 [nmcli + ["networking", "off"], nmcli + ["networking", "on"]],
+                                                 timeout, pause=self._pause),
+        }
+        return [all_steps[name] for name in self._steps if all_steps[name].cmds]
+
+    def begin(self):
+        """@brief Called when a run is scheduled. Safe to call from any thread.
+           @return The generation to pass to run() or run_async(). A cancel() after this call stops the run."""
+        with self._cond:
+            return self._generation
+
+    def cancel(self):
+        """@brief Stop the runs scheduled before this call before their next step or connectivity check.
+                  Safe to call from any thread."""
+        with self._cond:
+            self._generation += 1
+            self._cond.notify_all()
+
+    def _is_current(self, generation):
+        return self._generation == generation
+
+    def _wait(self, generation, seconds):
+        """@brief Wait until the run is cancelled.
+           @return True if the run was cancelled."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._is_current(generation), seconds)
+
+    def _is_cancelled(self, generation):
+        if not self._is_current(generation):
+            self._cancelled += 1
+            return True
+        return False
+
+    def run(self, is_connected, on_step=None, generation=None):
+        """@brief Try each step until connectivity is restored. Blocks until complete.
+           @param is_connected A function returning True if there is connectivity. It must not return a cached state.
+           @param on_step If not None a function called with the name of each step before it is run.
+           @param generation The value returned by begin() when the run was scheduled. If None the run starts a new generation.
+           @return The name of the step that restored connectivity or None."""
+        if generation is None:
+            generation = self.begin()
+        self._runs += 1
+        for step in self.get_steps(self._get_profile()):
+            if self._is_cancelled(generation):
+                return None
+            if on_step:
+                on_step(step.name)
+            start = self._clock()
+            self._run_cmds(step)
+            settle_start = self._clock()
+            while self._is_current(generation):
+                if is_connected():
+                    self._record(step.name, start, True)
+                    return step.name
+                if self._clock() - settle_start >= self._settle:
+                    break
+                self._wait(generation, self._poll_interval)
+            if self._is_cancelled(generation):
+                return None
+            self._record(step.name, start, False)
+        self._failures += 1
+        return None
+
+    async def run_async(self, is_connected, on_step=None, generation=None):
+        """@brief Try each step until connectivity is restored without blocking the event loop.
+           @param is_connected An async function returning True if there is connectivity. It must not return a cached state.
+           @param on_step If not None a function called with the name of each step before it is run.
+           @param generation The value returned by begin() when the run was scheduled. If None the run starts a new generation.
+           @return The name of the step that restored connectivity or None."""
+        import asyncio
+        if generation is None:
+            generation = self.begin()
+        self._runs += 1
+        for step in self.get_steps(await self._get_profile_async()):
+            if self._is_cancelled(generation):
+                return None
+            if on_step:
+                on_step(step.name)
+            start = self._clock()
+            cmds = asyncio.ensure_future(self._run_cmds_async(step))
+            try:
+                await asyncio.shield(cmds)
+            except asyncio.CancelledError:
+                # The task was cancelled, the step commands are still completed.
+                await cmds
+                raise
+            settle_start = self._clock()
+            while self._is_current(generation):
+                if await is_connected():
+                    self._record(step.name, start, True)
+                    return step.name
+                if self._clock() - settle_start >= self._settle:
+                    break
+                await asyncio.sleep(self._poll_interval)
+            if self._is_cancelled(generation):
+                return None
+            self._record(step.name, start, False)
+        self._failures += 1
+        return None
+
+    def _get_profile(self):
+        try:
+            output = subprocess.check_output(self.get_profile_cmd(), encoding="utf-8",
+                                             stderr=subprocess.DEVNULL, timeout=self._timeout)
+            return parse_last_wifi_profile(output)
+        except Exception:
+            return None
+
+    async def _get_profile_async(self):
+        import asyncio
+        from rpi_wifi_setup.aio import check_output_async
+        try:
+            output = await asyncio.wait_for(check_output_async(self.get_profile_cmd()), self._timeout)
+            return parse_last_wifi_profile(output)
+        except Exception:
+            return None
+
+    def _run_cmds(self, step):
+        """@brief Run all the commands of a step (E.G radio off and on) whether or not the run is cancelled."""
+        for index, cmd in enumerate(step.cmds):
+            if index:
+                sleep(step.pause)
+            self._run_cmd(cmd, step.timeout)
+
+    async def _run_cmds_async(self, step):
+        import asyncio
+        for index, cmd in enumerate(step.cmds):
+            if index:
+                await asyncio.sleep(step.pause)
+            await self._run_cmd_async(cmd, step.timeout)
+
+    def _run_cmd(self, cmd, timeout):
+        """@brief Run a step command. A failure or timeout does not stop the step as the
+                  connectivity may have been restored anyway."""
+        try:
+            subprocess.run(cmd, timeout=timeout, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except subprocess.TimeoutExpired:
+            # subprocess.run() has killed the command.
+            pass
+
+    async def _run_cmd_async(self, cmd, timeout):
+        import asyncio
+        proc = await asyncio.create_subprocess_exec(*cmd,
+                                                    stdout=asyncio.subprocess.DEVNULL,
+                                                    stderr=asyncio.subprocess.DEVNULL)
+        try:
+            await asyncio.wait_for(proc.wait(), timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+
+    def _record(self, name, start, success):
+        stats = self._step_stats[name]
+        stats['attempts'] += 1
+        if success:
+            seconds = self._clock() - start
+            stats['successes'] += 1
+            stats['last_seconds'] = round(seconds, 3)
+            stats['total_seconds'] += seconds
+
+    def get_stats(self):
+        """@return A dict containing the number of runs, the runs that did not restore connectivity,
+                   the runs cancelled and for each step the attempts, successes and the last and mean time to connectivity in seconds."""
+        steps = {}
+        for name, stats in self._step_stats.items():
+            steps[name] = {'attempts': stats['attempts'],
+                           'successes': stats['successes'],
+                           'last_seconds': stats['last_seconds'],
+                           'mean_seconds': round(stats['total_seconds'] / stats['successes'], 3) if stats['successes'] else None}
+        return {'runs': self._runs, 'failures': self._failures, 'cancelled': self._cancelled, 'steps': steps}
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+import threading
+
+from time import monotonic
+
+from p3lib.helper import logTraceBack
+
+# Display frame priority classes, a higher value has a higher priority.
+PRIORITY_STATUS = 0
+PRIORITY_OVERRIDE = 1
+PRIORITY_PORTAL = 2
+PRIORITIES = (PRIORITY_STATUS, PRIORITY_OVERRIDE, PRIORITY_PORTAL)
+
+
+class DisplayState(object):
+    """@brief What the display should show."""
+
+    def __init__(self, msg, strength=None, frame=None):
+        """@brief Constructor.
+           @param msg The text to display.
+           @param strength The WiFi signal strength (0-100) or None if the WiFi icon is not shown.
+           @param frame If not None a FramebufferReader whose frame is displayed instead of the text."""
+        self.msg = msg
+        self.strength = strength
+        self.frame = frame
+
+
+class FrameGovernor(object):
+    """@brief Limits the rate that frames are sent to the display. The interval between
+              frames is the larger of 1/max_fps and the measured time to send a frame
+              divided by the maximum fraction of the time the bus may be busy."""
+
+    MAX_BUS_DUTY = 0.5
+    # The weight of each new measurement in the send time moving average.
+    SEND_TIME_WEIGHT = 0.2
+
+    def __init__(self, max_fps, clock=monotonic):
+        """@brief Constructor.
+           @param max_fps The maximum frames per second. 0 sets no limit other than the bus time.
+           @param clock A function returning the time in seconds."""
+        self._min_interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self._clock = clock
+        self._send_time = 0.0
+        self._last_frame_time = None
+
+    def get_interval(self):
+        """@return The minimum time in seconds between the start of each frame."""
+        return max(self._min_interval, self._send_time / FrameGovernor.MAX_BUS_DUTY)
+
+    def get_next_frame_time(self):
+        """@return The clock time at which the next frame may be sent."""
+        if self._last_frame_time is None:
+            return 0.0
+        return self._last_frame_time + self.get_interval()
+
+    def get_delay(self):
+        """@return The number of seconds until the next frame may be sent."""
+        return max(0.0, self.get_next_frame_time() - self._clock())
+
+    def record(self, start, send_time):
+        """@brief Record a frame sent to the display.
+           @param start The clock time the frame was started.
+           @param send_time The time in seconds taken to send the frame."""
+        self._last_frame_time = start
+        self._send_time += (send_time - self._send_time) * FrameGovernor.SEND_TIME_WEIGHT
+
+    def get_stats(self):
+        """@return A dict containing the frame interval and the average send time in ms."""
+        return {'interval_ms': round(self.get_interval() * 1000, 3),
+                'send_time_ms': round(self._send_time * 1000, 3)}
+
+
+class DisplayScheduler(object):
+    """@brief Holds the frames waiting to be sent to the display, at most one per priority
+              class. A new frame replaces the waiting frame of the same priority and any
+              waiting frames of a lower priority so intermediate frames are dropped. The
+              highest priority waiting frame is sent first. While a floor priority is set
+              frames below it are dropped (E.G status frames while the portal owns the display)."""
+
+    def __init__(self, clock=monotonic):
+        """@brief Constructor.
+           @param clock A function returning the time in seconds (the same clock as the FrameGovernor)."""
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._slots = {}
+        self._floor = PRIORITY_STATUS
+        self._closed = False
+        self._puts = 0
+        self._dropped = 0
+
+    def put(self, item, priority=PRIORITY_STATUS):
+        """@brief Add a frame.
+           @param item The frame (E.G a DisplayState).
+           @param priority The priority class of the frame."""
+        with self._cond:
+            self._puts += 1
+            if priority < self._floor:
+                self._dropped += 1
+                return
+            for slot_priority in list(self._slots.keys()):
+                if slot_priority <= priority:
+                    del self._slots[slot_priority]
+                    self._dropped += 1
+            self._slots[priority] = item
+            self._cond.notify()
+
+    def set_floor(self, priority):
+        """@brief Drop frames with a priority lower than this until the floor is changed."""
+        with self._cond:
+            self._floor = priority
+            for slot_priority in list(self._slots.keys()):
+                if slot_priority < priority:
+                    del self._slots[slot_priority]
+                    self._dropped += 1
+
+    def get(self, not_before=None):
+        """@brief Wait for a frame.
+           @param not_before A function returning the clock time at which a frame may be
+                             returned. Frames added before then replace the waiting frames.
+           @return The highest priority frame or None if the scheduler has been closed."""
+        with self._cond:
+            while not self._closed:
+                if not self._slots:
+                    self._cond.wait()
+                    continue
+
+                delay = not_before() - self._clock() if not_before else 0
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+
+                return self._slots.pop(max(self._slots.keys()))
+            return None
+
+    def close(self):
+        """@brief Wake the consumer and cause get() to return None."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def depth(self):
+        """@return The number of frames waiting."""
+        with self._cond:
+            return len(self._slots)
+
+    def get_stats(self):
+        """@return A dict containing the depth, puts and frames_dropped counts."""
+        with self._cond:
+            return {'depth': len(self._slots),
+                    'puts': self._puts,
+                    'frames_dropped': self._dropped}
+
+
+class DisplayConsumer(threading.Thread):
+    """@brief The only thread that writes to the display. It takes the highest priority
+              DisplayState from a DisplayScheduler no faster than a FrameGovernor allows
+              and holds the display lock only while the frame is sent."""
+
+    def __init__(self, uio, scheduler, lock, show, governor=None, clock=monotonic):
+        """@brief Constructor.
+           @param uio A UIO instance.
+           @param scheduler The DisplayScheduler holding the DisplayState instances to show.
+           @param lock The lock that must be held while writing to the display.
+           @param show A function called with a DisplayState to write it to the display.
+           @param governor If not None the FrameGovernor that limits the frame rate.
+           @param clock A function returning the time in seconds (the same clock as the FrameGovernor)."""
+        super().__init__(daemon=True)
+        self._uio = uio
+        self._scheduler = scheduler
+        self._lock = lock
+        self._show = show
+        self._governor = governor
+        self._clock = clock
+        self._frames = 0
+        self._lock_hold_last = 0.0
+        self._lock_hold_max = 0.0
+        self._lock_hold_total = 0.0
+        self._lock_wait_max = 0.0
+        self._frame_start = None
+
+    def run(self):
+        not_before = self._governor.get_next_frame_time if self._governor else None
+        while True:
+            state = self._scheduler.get(not_before=not_before)
+            if state is None:
+                break
+
+            wait_start = self._clock()
+            with self._lock:
+                hold_start = self._clock()
+                self._frame_start = hold_start
+                try:
+                    self._show(state)
+                except Exception:
+                    logTraceBack(self._uio)
+                self._frame_start = None
+                hold = self._clock() - hold_start
+
+            if self._governor:
+                self._governor.record(hold_start, hold)
+            self._frames += 1
+            self._lock_wait_max = max(self._lock_wait_max, hold_start - wait_start)
+            self._lock_hold_last = hold
+            self._lock_hold_max = max(self._lock_hold_max, hold)
+            self._lock_hold_total += hold
+
+    def get_busy_seconds(self):
+        """@return The number of seconds the frame being sent has taken so far or 0 if no frame is being sent."""
+        frame_start = self._frame_start
+        return self._clock() - frame_start if frame_start is not None else 0.0
+
+    def stop(self):
+        self._scheduler.close()
+        self.join()
+
+    def get_stats(self):
+        """@return A dict containing the frames sent, the display lock hold times (ms), the scheduler
+                   statistics and the frame governor statistics."""
+        stats = {'frames_sent': self._frames,
+                 'lock_hold_last_ms': round(self._lock_hold_last * 1000, 3),
+                 'lock_hold_max_ms': round(self._lock_hold_max * 1000, 3),
+                 'lock_hold_avg_ms': round(self._lock_hold_total * 1000 / self._frames, 3) if self._frames else 0.0,
+                 'lock_wait_max_ms': round(self._lock_wait_max * 1000, 3)}
+        stats.update(self._scheduler.get_stats())
+        if self._governor:
+            stats.update(self._governor.get_stats())
+        return stats
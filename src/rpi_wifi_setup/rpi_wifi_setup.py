@@ -1,35 +1,61 @@
 #!/usr/bin/env python3
 
 import os
+import shutil
+import signal
 import argparse
 import threading
 import subprocess
-import platform
+import selectors
 
-from time import sleep, time
+from time import time, monotonic, perf_counter
 
 from p3lib.uio import UIO
 from p3lib.helper import logTraceBack, get_assets_dir
 from p3lib.boot_manager import BootManager
 
-from gpiozero import Button, LED
-from luma.core.interface.serial import i2c
-from luma.oled.device import ssd1309
-from luma.core.render import canvas
-from PIL import ImageFont
-
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
-
-
-class OverrideHandler(FileSystemEventHandler):
-    """Interrupt handler for filesystem events"""
+# gpiozero, luma, PIL, watchdog and jeepney are imported where they are used so that each
+# mode only loads the modules it needs and the BootManager options load none of them.
+
+from rpi_wifi_setup.connectivity import ConnectivitySnapshot, ConnectivityCache
+from rpi_wifi_setup.netlink import RtnetlinkMonitor
+from rpi_wifi_setup.inotify import InotifyWatcher, InotifyDirectoryWatcher
+from rpi_wifi_setup.mailbox import Mailbox
+from rpi_wifi_setup.framebuffer import FramebufferReader, DEFAULT_FRAMEBUFFER_FILE
+from rpi_wifi_setup.display_socket import DisplaySocketServer, DEFAULT_SOCKET_PATH
+from rpi_wifi_setup.override import OverrideFile, Debouncer
+from rpi_wifi_setup.render_pipeline import DisplayState, DisplayScheduler, DisplayConsumer, FrameGovernor, \
+    PRIORITY_STATUS, PRIORITY_OVERRIDE, PRIORITY_PORTAL
+from rpi_wifi_setup.signal_source import SignalStrengthReader, SIGNAL_SOURCE_AUTO, SIGNAL_SOURCE_NAMES
+from rpi_wifi_setup.led import PatternLED, LED_BLINK_PATTERNS, LED_CONNECTED, LED_CONFIGURING, LED_DISCONNECTED, \
+    LED_NO_INTERNET, LED_CONNECTING
+from rpi_wifi_setup.heartbeat import HeartbeatPolicy, LoopWaker, RESET_BUTTON, RESET_PORTAL
+from rpi_wifi_setup.portal import PortalSession, PORTAL_STOPPING, PORTAL_SUCCEEDED, PORTAL_FAILED, PORTAL_TIMED_OUT, \
+    PORTAL_CANCELLED, PORTAL_FINISHED_STATES, PORTAL_EVENT_CLIENT_CONNECTED, PORTAL_EVENT_CREDENTIALS, \
+    PORTAL_EVENT_CONNECTING, PORTAL_EVENT_CONNECTED, PORTAL_EVENT_CONNECT_FAILED
+from rpi_wifi_setup.ssid_scan import SsidScanner
+from rpi_wifi_setup.reconnect import ReconnectLadder
+from rpi_wifi_setup.metrics import MetricsRegistry, TextfileExporter, MetricsHTTPServer, METRIC_COMMAND, METRIC_RENDER, \
+    METRIC_DISPLAY_TRANSFER, METRIC_BUTTON_TO_DISPLAY, METRIC_PORTAL, METRIC_TIME_TO_CONNECTIVITY
+from rpi_wifi_setup.diagnostics import OwnedLock, SamplingProfiler, TracemallocToggle, dump_stacks, \
+    DEFAULT_DIAGNOSTICS_DIR
+from rpi_wifi_setup.sd_notify import SystemdNotifier, DEFAULT_WATCHDOG_SECONDS, get_service_name, \
+    write_service_dropin, remove_service_dropin
+
+
+class OverrideHandler(object):
+    """Interrupt handler for filesystem events. watchdog calls dispatch() for each event."""
 
     FORCE_DISPLAY_FILE = "/tmp/oled_override.txt"
 
-    def __init__(self, manager):
+    def __init__(self, manager, target_file=FORCE_DISPLAY_FILE):
         self.manager = manager
-        self.target_file = OverrideHandler.FORCE_DISPLAY_FILE
+        self.target_file = target_file
+
+    def dispatch(self, event):
+        handler = getattr(self, f"on_{event.event_type}", None)
+        if handler:
+            handler(event)
 
     def on_modified(self, event):
         if event.src_path == self.target_file:
@@ -45,48 +71,84 @@ class OverrideHandler(FileSystemEventHandler):
 
 
 class WifiLEDCtrl(threading.Thread):
+    """@brief Owns the WiFi LED. The thread waits on a condition variable and only wakes
+              when the state changes. Steady states are written once and flashing states
+              are generated by gpiozero's background blink() so a steady
+              or flashing LED costs this thread no wake ups."""
 
-    CONNECTED = 1
-    CONFIGURING = 2
-    DISCONNECTED = 3
+    CONNECTED = LED_CONNECTED
+    CONFIGURING = LED_CONFIGURING
+    DISCONNECTED = LED_DISCONNECTED
+    NO_INTERNET = LED_NO_INTERNET
+    CONNECTING = LED_CONNECTING
 
     def __init__(self, gpio_pin, interval=0.5):
-        super().__init__()
+        """@brief Constructor.
+           @param gpio_pin The GPIO pin the LED is connected to.
+           @param interval The on and off time in seconds when configuring."""
+        super().__init__(daemon=True)
+        from gpiozero import LED
         self.led = LED(gpio_pin)
-        self.interval = interval
-        self._running = False
+        blink_patterns = dict(LED_BLINK_PATTERNS)
+        blink_patterns[WifiLEDCtrl.CONFIGURING] = (interval, interval)
+        self._output = PatternLED(self.led, blink_patterns=blink_patterns)
+        self._cond = threading.Condition()
+        self._running = True
         self._state = WifiLEDCtrl.DISCONNECTED
+        self._wakeups = 0
+
+    def set_state(self, state):
+        """@brief Set the LED state.
+           @param state One of the CONNECTED, CONFIGURING, DISCONNECTED, NO_INTERNET or CONNECTING states."""
+        with self._cond:
+            if state != self._state:
+                self._state = state
+                self._cond.notify()
 
     def connected(self):
         """@called when WiFi is connected to set LED on."""
-        self._state = WifiLEDCtrl.CONNECTED
+        self.set_state(WifiLEDCtrl.CONNECTED)
 
     def configuring(self):
         """@called when WiFi is connected to set LED flashing."""
-        self._state = WifiLEDCtrl.CONFIGURING
+        self.set_state(WifiLEDCtrl.CONFIGURING)
 
     def disconnected(self):
         """@called when WiFi is connected to set LED off."""
-        self._state = WifiLEDCtrl.DISCONNECTED
+        self.set_state(WifiLEDCtrl.DISCONNECTED)
 
-    def run(self):
-        self._running = True
-        while self._running:
-            if self._state == WifiLEDCtrl.CONNECTED:
-                self.led.on()
+    def no_internet(self):
+        """@called when WiFi has an IP address but no internet to set the LED flashing briefly."""
+        self.set_state(WifiLEDCtrl.NO_INTERNET)
 
-            elif self._state == WifiLEDCtrl.CONFIGURING:
-                self.led.toggle()
+    def connecting(self):
+        """@called when the WiFi portal is joining the selected network to set the LED flashing quickly."""
+        self.set_state(WifiLEDCtrl.CONNECTING)
 
-            elif self._state == WifiLEDCtrl.DISCONNECTED:
-                self.led.off()
-
-            sleep(self.interval)
+    def run(self):
+        shown = None
+        while True:
+            with self._cond:
+                while self._running and self._state == shown:
+                    self._cond.wait()
+                if not self._running:
+                    break
+                shown = self._state
+            self._wakeups += 1
+            self._output.show(shown)
 
     def stop(self):
-        self._running = False
+        with self._cond:
+            self._running = False
+            self._cond.notify()
         self.join()
-        self.led.off()
+        self._output.off()
+
+    def get_stats(self):
+        """@return A dict containing the thread wake ups and the LED output statistics."""
+        stats = {'wakeups': self._wakeups}
+        stats.update(self._output.get_stats())
+        return stats
 
 
 class WiFiSetupManager(object):
@@ -100,23 +162,118 @@ class WiFiSetupManager(object):
     DEFAULT_SCREEN_OFF_SECONDS = 120
     WIFI_CONNECT_BIN_FILENAME = "wifi-connect"
     BUTTON_HOLD_SECONDS = 5
+    WIFI_IFACE = "wlan0"
+    NM_BACKEND_AUTO = "auto"
+    NM_BACKEND_DBUS = "dbus"
+    NM_BACKEND_NMCLI = "nmcli"
+    NM_BACKENDS = (NM_BACKEND_AUTO, NM_BACKEND_DBUS, NM_BACKEND_NMCLI)
+    DEFAULT_NM_BACKEND = NM_BACKEND_AUTO
+    DEFAULT_NM_BUS = "SYSTEM"
+    DEFAULT_CONNECTIVITY_TTL_SECONDS = ConnectivityCache.DEFAULT_TTL_SECONDS
+    # The heartbeat interval while the screen is on, see HeartbeatPolicy.
+    HEARTBEAT_SECONDS = 10
+    DEFAULT_HEARTBEAT_MIN_SECONDS = HeartbeatPolicy.DEFAULT_MIN_SECONDS
+    DEFAULT_HEARTBEAT_MAX_SECONDS = HeartbeatPolicy.DEFAULT_MAX_SECONDS
+    DEFAULT_HEARTBEAT_BACKOFF = HeartbeatPolicy.DEFAULT_BACKOFF
+    OFFLINE_MSG = "OFFLINE\nHold button to\nsetup WiFi"
+    PORTAL_END_MESSAGES = {PORTAL_FAILED: "OFFLINE\nConnect\nerror",
+                           PORTAL_TIMED_OUT: "OFFLINE\nWiFi setup\ntimed out",
+                           PORTAL_CANCELLED: "OFFLINE\nWiFi setup\ncancelled"}
+    # The messages and LED states shown for the progress events in the wifi-connect output.
+    PORTAL_EVENT_MESSAGES = {PORTAL_EVENT_CLIENT_CONNECTED: "Phone connected\nSelect WiFi\nnetwork",
+                             PORTAL_EVENT_CREDENTIALS: "Credentials\nreceived",
+                             PORTAL_EVENT_CONNECTING: "Connecting\nto WiFi",
+                             PORTAL_EVENT_CONNECTED: "WiFi\nconnected",
+                             PORTAL_EVENT_CONNECT_FAILED: "WiFi connect\nfailed\nTry again"}
+    PORTAL_EVENT_LED_STATES = {PORTAL_EVENT_CREDENTIALS: LED_CONNECTING,
+                               PORTAL_EVENT_CONNECTING: LED_CONNECTING,
+                               PORTAL_EVENT_CONNECTED: LED_CONNECTED,
+                               PORTAL_EVENT_CONNECT_FAILED: LED_CONFIGURING}
+    DEFAULT_PORTAL_TIMEOUT_SECONDS = PortalSession.DEFAULT_TIMEOUT_SECONDS
+    DEFAULT_SCAN_INTERVAL_SECONDS = SsidScanner.DEFAULT_INTERVAL_SECONDS
+    DEFAULT_SCAN_IDLE_INTERVAL_SECONDS = SsidScanner.DEFAULT_IDLE_INTERVAL_SECONDS
+    DEFAULT_RECONNECT_TIMEOUT_SECONDS = ReconnectLadder.DEFAULT_STEP_TIMEOUT_SECONDS
+    DEFAULT_RECONNECT_SETTLE_SECONDS = ReconnectLadder.DEFAULT_SETTLE_SECONDS
+    DEFAULT_METRICS_FILE = ""
+    DEFAULT_METRICS_PORT = 0
+    DEFAULT_DIAGNOSTICS_DIR = DEFAULT_DIAGNOSTICS_DIR
+    DEFAULT_PROFILE_INTERVAL_SECONDS = SamplingProfiler.DEFAULT_INTERVAL_SECONDS
+    DEFAULT_PROFILE_KEEP = SamplingProfiler.DEFAULT_KEEP
+    NMCLI_CONNECTIVITY_CMD = ["nmcli", "-t", "-f", "CONNECTIVITY", "networking", "connectivity"]
+    # One nmcli call reads both fields. -t (terse) gives FIELD:value lines.
+    NMCLI_DEVICE_SHOW_CMD = ["nmcli", "-t", "-f", "GENERAL.CONNECTION,IP4.ADDRESS", "device", "show", WIFI_IFACE]
+    NMCLI_WIFI_ON_CMD = ["nmcli", "radio", "wifi", "on"]
+    DEFAULT_SIGNAL_SOURCE = SIGNAL_SOURCE_AUTO
+    # BitmapCache.DEFAULT_SIZE, not referenced so that PIL is not loaded in LED mode.
+    DEFAULT_RENDER_CACHE_SIZE = 64
+    DEFAULT_OVERRIDE_DEBOUNCE_SECONDS = 0.02
+    DEFAULT_MAILBOX_DIR = "/run/rpi_wifi_setup/messages"
+    DEFAULT_DISPLAY_SOCKET = DEFAULT_SOCKET_PATH
+    DEFAULT_SOCKET_RATE = DisplaySocketServer.DEFAULT_RATE
+    DEFAULT_FRAMEBUFFER_FILE = DEFAULT_FRAMEBUFFER_FILE
+    DEFAULT_MAX_FPS = 10
+    DEFAULT_WATCHDOG_SECONDS = DEFAULT_WATCHDOG_SECONDS
+    ENGINE_THREADS = "threads"
+    ENGINE_ASYNCIO = "asyncio"
+    ENGINES = (ENGINE_THREADS, ENGINE_ASYNCIO)
+    DEFAULT_ENGINE = ENGINE_THREADS
 
     def __init__(self, uio, options):
         self._uio = uio
         self._options = options
-        self._display_lock = threading.Lock()
+        # The lock owners are shown in the SIGUSR1 stack dump.
+        self._display_lock = OwnedLock("display")
         self._btn = None
         self._device = None
-        self._last_button_press_time = time()
+        self._display = None
+        self._renderer = None
+        self._display_consumer = None
+        self._display_scheduler = None
+        self._frame_governor = FrameGovernor(options.max_fps)
+        self._portal_lock = OwnedLock("portal")
+        self._portal_session = None
+        self._last_button_press_time = monotonic()
         self._screen_on = True
         self._wifi_led = None
+        self._observer = None
+        self._override_watcher = None
+        self._nm_monitor = None
+        self._netlink_monitor = None
+        self._selector = selectors.DefaultSelector()
+        self._override_file = OverrideFile(OverrideHandler.FORCE_DISPLAY_FILE)
+        self._override_debouncer = Debouncer(options.override_debounce, self._on_override_change)
+        self._override_redraws_skipped = 0
+        self._mailbox = Mailbox(options.mailbox_dir)
+        self._mailbox_watcher = None
+        self._display_socket = None
+        self._display_socket_active = False
+        self._framebuffer = None
+        self._framebuffer_active = False
+        self._signal_reader = SignalStrengthReader(WiFiSetupManager.WIFI_IFACE,
+                                                   source_name=options.signal_source)
+        self._connectivity_cache = ConnectivityCache(self._read_connectivity_snapshot,
+                                                     ttl=options.connectivity_ttl)
+        self._notifier = SystemdNotifier()
+        self._heartbeat_policy = HeartbeatPolicy(WiFiSetupManager.HEARTBEAT_SECONDS,
+                                                 min_interval=options.heartbeat_min,
+                                                 max_interval=options.heartbeat_max,
+                                                 backoff=options.heartbeat_backoff)
+        self._loop_waker = None
+        self._next_heartbeat = 0
+        self._ssid_scanner = self._create_ssid_scanner()
+        self._reconnect_ladder = ReconnectLadder(WiFiSetupManager.WIFI_IFACE,
+                                                 timeout=options.reconnect_timeout,
+                                                 settle=options.reconnect_settle)
+        self._metrics = MetricsRegistry()
+        self._metrics_exporter = None
+        self._metrics_server = None
+        self._button_press_perf = None
+        self._offline_since = None
+        self._profiler = None
+        self._tracemalloc_toggle = TracemallocToggle(options.diagnostics_dir)
         self._init()
 
     def _init(self):
-        self._font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 14)
-        if not self._font:
-            self._font = ImageFont.load_default()
-
         self._assets_folder = get_assets_dir(module_name='rpi_wifi_setup')
 
         self._ui_path = os.path.join(self._assets_folder, 'ui')
@@ -132,51 +289,215 @@ class WiFiSetupManager(object):
             raise Exception("This program must be executed as root user.")
 
     def handle_interrupt_trigger(self):
-        """Called by the watchdog thread when the file changes"""
+        """Called by the main loop (inotify) or the watchdog thread when the file changes"""
+        # A single write to the file produces several events so they are merged.
+        self._override_debouncer.trigger()
+        if self._observer:
+            # The watchdog thread wakes the main loop so that it waits for the end of the debounce window.
+            self._wake_main_loop()
+
+    def _on_override_change(self):
+        """@brief Called once for each burst of override file events."""
+        changed = self._override_file.update()
+        woken = not self._screen_on
         self._reset_timer()  # Wake the screen
-        self._render_current_state()  # Force redraw
+        if changed or woken:
+            self._update_status_output()
+        else:
+            self._override_redraws_skipped += 1
 
     def _check_external_message(self):
-        """Checks for an override message in /tmp."""
-        override_path = "/tmp/oled_override.txt"
-        if os.path.exists(override_path):
+        """Checks for an override message in /tmp and then for a message in the mailbox."""
+        msg = self._override_file.get_message()
+        if msg is None and self._mailbox:
+            msg = self._mailbox.get_message()
+        return msg
+
+    def _get_external_display_state(self):
+        """@return A DisplayState for the /tmp override message, the shared memory framebuffer,
+                    the latest display socket message or the mailbox message in that order of
+                    preference or None if there are no external messages."""
+        msg = self._override_file.get_message()
+        if msg:
+            return DisplayState(msg)
+
+        if self._framebuffer and self._framebuffer.is_active():
+            return DisplayState(None, frame=self._framebuffer)
+
+        socket_message = self._display_socket.get_message() if self._display_socket else None
+        if socket_message:
+            return DisplayState(socket_message[0], strength=socket_message[1])
+
+        msg = self._check_external_message()
+        return DisplayState(msg) if msg else None
+
+    def _start_display_socket(self):
+        """@brief Start receiving messages from the display socket."""
+        if not self._options.display_socket:
+            return
+
+        display_socket = self._create_display_socket()
+        try:
+            display_socket.open()
+        except OSError:
+            logTraceBack(self._uio)
+            display_socket.close()
+            self._uio.debug(f"Unable to open {self._options.display_socket}. Display socket messages will not be displayed.")
+            return
+
+        self._display_socket = display_socket
+        self._watch_fd(self._display_socket, self._display_socket.handle_events)
+
+    def _create_display_socket(self, schedule=None):
+        return DisplaySocketServer(self._options.display_socket,
+                                   on_change=self._on_display_socket_change,
+                                   rate=self._options.socket_rate,
+                                   schedule=schedule)
+
+    def _start_framebuffer(self):
+        """@brief Create the shared memory framebuffer that applications may write frames to."""
+        if not self._options.framebuffer:
+            return
+
+        framebuffer = FramebufferReader(self._options.framebuffer,
+                                        self._options.display_width,
+                                        self._options.display_height,
+                                        on_change=self._on_framebuffer_change)
+        try:
+            framebuffer.open()
+        except OSError:
+            logTraceBack(self._uio)
+            framebuffer.close()
+            self._uio.debug(f"Unable to create {self._options.framebuffer}. Framebuffer frames will not be displayed.")
+            return
+
+        self._framebuffer = framebuffer
+        self._watch_fd(self._framebuffer, self._framebuffer.handle_events)
+
+    def _on_framebuffer_change(self):
+        """@brief Called from the main loop when an application has written a frame to the framebuffer."""
+        active = self._framebuffer.is_active()
+        if active and not self._framebuffer_active:
+            self._reset_timer()
+        self._framebuffer_active = active
+        self._update_status_output()
+
+    def _on_display_socket_change(self):
+        """@brief Called from the main loop (or the display socket timer for a message received
+                  over the rate limit) when the display socket message changes."""
+        # Clients may update the display many times a second so the screen is
+        # only woken when a client starts displaying a message.
+        active = self._display_socket.get_message() is not None
+        if active and not self._display_socket_active:
+            self._reset_timer()
+        self._display_socket_active = active
+        self._update_status_output()
+
+    def _start_mailbox(self):
+        """@brief Create the mailbox directory, read the messages in it and watch it for changes."""
+        try:
+            self._mailbox.create()
+        except OSError:
+            logTraceBack(self._uio)
+            self._uio.debug(f"Unable to create {self._mailbox.get_folder()}. Mailbox messages will not be displayed.")
+            self._mailbox = None
+            return
+
+        self._mailbox.scan()
+        if InotifyWatcher.is_available():
+            mailbox_watcher = InotifyDirectoryWatcher(self._mailbox.get_folder(),
+                                                      on_change=self._on_mailbox_change)
             try:
-                with open(override_path, 'r') as f:
-                    # Read first 3 lines to fit the OLED
-                    msg = f.read().strip()
-                    return msg if msg else None
-            except Exception:
-                return None
-        return None
+                mailbox_watcher.open()
+                self._mailbox_watcher = mailbox_watcher
+                self._watch_fd(self._mailbox_watcher, self._mailbox_watcher.handle_events)
+
+            except OSError:
+                logTraceBack(self._uio)
+                mailbox_watcher.close()
+                self._uio.debug("Unable to use inotify. The mailbox will be checked on each heartbeat.")
+
+    def _on_mailbox_change(self, names):
+        """@brief Called from the main loop when files in the mailbox directory change.
+           @param names The names of the changed files or None if all files must be checked."""
+        if self._mailbox.update(names):
+            self._reset_timer()  # Wake the screen
+            self._update_status_output()
+
+    def _get_mailbox_expiry_delay(self):
+        """@return The seconds until the next mailbox message expires or None if no messages expire."""
+        expires = self._mailbox.get_next_expiry() if self._mailbox else None
+        if expires is None:
+            return None
+        return max(0.0, expires - time())
+
+    def _expire_mailbox(self):
+        """@brief Called from the main loop when a mailbox message expires so that it is removed
+                  from the display without waiting for the next heartbeat."""
+        if self._mailbox and self._mailbox.expire():
+            self._update_status_output()
+
+    def _update_mailbox(self):
+        """@brief Called on each heartbeat to remove expired messages and show the next
+                  of the highest priority messages."""
+        if self._mailbox:
+            if not self._mailbox_watcher:
+                self._mailbox.scan()
+            self._mailbox.expire()
+            self._mailbox.rotate()
+        if self._display_socket:
+            self._display_socket.prune()
 
     def _render_current_state(self):
         """Consolidated rendering logic called by both loop and interrupt"""
         if not self._wifi_led:
-            with self._display_lock:
-                if not self._screen_on:
-                    return
-
-                msg = self._check_external_message()
-                if msg:
-                    self._update_display(msg)
-                elif self._check_internet():
-                    self._update_connected_state()
-                else:
-                    self._update_display("OFFLINE\nHold button to\nsetup WiFi")
+            # The state is gathered without holding the display lock. Only the
+            # display consumer thread takes the lock to write the frame.
+            if not self._screen_on:
+                return
+
+            state = self._get_external_display_state()
+            if state:
+                self._display_scheduler.put(state, PRIORITY_OVERRIDE)
+                return
+
+            self._display_scheduler.put(self._get_connectivity_display_state(self._connectivity_cache.get()), PRIORITY_STATUS)
+
+    def _get_connectivity_display_state(self, snapshot):
+        """@return The DisplayState showing the connectivity state."""
+        if snapshot.connected:
+            return DisplayState(f"ONLINE\n{snapshot.ip}\nSignal: {snapshot.strength}%", strength=snapshot.strength)
+        return DisplayState(WiFiSetupManager.OFFLINE_MSG)
+
+    def _show_connectivity(self, snapshot):
+        """@brief Display the connectivity state.
+           @param snapshot A ConnectivitySnapshot instance."""
+        self._show_display_state(self._get_connectivity_display_state(snapshot))
+
+    def _show_display_state(self, state):
+        if state.frame:
+            if self._display:
+                # The frame is sent from shared memory, it is not drawn.
+                state.frame.blit(self._display)
+        else:
+            self._update_display(state.msg, strength=state.strength)
+
+    def _start_display_consumer(self):
+        """@brief Start the thread that writes the rendered states to the display."""
+        self._display_scheduler = DisplayScheduler()
+        self._display_consumer = DisplayConsumer(self._uio,
+                                                 self._display_scheduler,
+                                                 self._display_lock,
+                                                 self._show_display_state,
+                                                 governor=self._frame_governor)
+        self._display_consumer.start()
 
     def _check_nmcli_present(self):
-        present = False
-        try:
-            cmd = ['nmcli', '--version']
-            subprocess.run(cmd, check=True)
-            present = True
-
-        except Exception:
-            pass
-        return present
+        # A PATH lookup rather than running nmcli --version.
+        return shutil.which('nmcli') is not None
 
     def _get_wifi_connect_bin(self):
-        arch = platform.machine()
+        arch = os.uname().machine
         if arch not in ['aarch64', 'armv7l', 'x86_64', 'i686']:
             raise Exception(f"{arch} is an unsupported architecture.")
         wifi_connect_folder = os.path.join(self._assets_folder, arch)
@@ -188,145 +509,699 @@ class WiFiSetupManager(object):
     def _update_display(self, msg, strength=None):
         # update display if not using just a single led to indicate wifi connectivity
         if self._device:
-            with canvas(self._device) as draw:
-                draw.rectangle(self._device.bounding_box, outline="white", fill="black")
-                draw.text((5, 5), msg, fill="white", font=self._font)
-
-                if strength is not None:
-                    self._draw_wifi_icon(draw,
-                                         109,
-                                         18,
-                                         strength)
-
-    def _draw_wifi_icon(self, draw, x, y, strength):
-        # Draw 4 bars of increasing height
-        for i in range(4):
-            height = (i + 1) * 3
-            fill = "white" if strength > (i * 25) else "black"
-            draw.rectangle([x + (i * 4), y - height, x + (i * 4) + 2, y],
-                           outline="white", fill=fill)
-
-    def _cycle_networking(self):
-        """@brief Turn networking off/on"""
+            # The frame is built from cached text line and WiFi icon bitmaps.
+            with self._metrics.time(METRIC_RENDER):
+                image = self._renderer.render(msg, strength=strength)
+
+            # Only the parts of the frame that have changed are sent to the display.
+            with self._metrics.time(METRIC_DISPLAY_TRANSFER):
+                self._display.display(image)
+
+            button_press_perf = self._button_press_perf
+            if button_press_perf is not None:
+                self._button_press_perf = None
+                self._metrics.observe(METRIC_BUTTON_TO_DISPLAY, perf_counter() - button_press_perf)
+
+    def _reconnect(self, generation):
+        """@brief Restore connectivity with the cheapest reconnect step that works, see ReconnectLadder.
+           @param generation The reconnect ladder generation taken when the portal was started."""
         try:
+            step = self._reconnect_ladder.run(self._is_connected_now, on_step=self._on_reconnect_step, generation=generation)
+            self._on_reconnect_done(step)
+
+        except Exception:
+            logTraceBack(self._uio)
+
+    def _is_connected_now(self):
+        self._connectivity_cache.invalidate()
+        return self._connectivity_cache.get().connected
+
+    def _on_reconnect_step(self, step):
+        self._uio.debug(f"Reconnect: {step}")
+
+    def _on_reconnect_done(self, step):
+        if step:
+            seconds = self._reconnect_ladder.get_stats()['steps'][step]['last_seconds']
+            self._uio.debug(f"Reconnect: connectivity restored by {step} in {seconds:.1f} s")
+        else:
+            self._uio.debug("Reconnect: connectivity not restored.")
+
+    def _start_wifi_portal(self):
+        """@brief Called when the button is held. Start the WiFi portal or, if it is running, cancel it."""
+        with self._portal_lock:
+            # Only one portal may run at a time.
+            if self._portal_session and self._portal_session.is_active():
+                self._uio.debug("Cancelling the WiFi portal.")
+                self._portal_session.cancel()
+                return
+
+            # Stop a reconnect after the last portal. The reconnect after this portal is
+            # scheduled now so that it is stopped by the next portal even if it has not started.
+            self._reconnect_ladder.cancel()
+            generation = self._reconnect_ladder.begin()
+            self._portal_session = self._create_portal_session(
+                on_state_change=lambda session, state: self._on_portal_state_change(session, state, generation))
+
+        # wifi-connect owns the WiFi interface until the portal completes.
+        self._ssid_scanner.set_paused(True)
+
+        # The portal frames are shown in preference to the status and override frames until the portal completes.
+        self._set_display_floor(PRIORITY_PORTAL)
+        if self._wifi_led:
+            self._wifi_led.configuring()
+
+        self._show_portal_message(f"Connect to\n{self._options.ssid}\nto setup wifi.")
+
+        # wifi-connect runs as a child of the session thread so this (gpiozero) thread returns.
+        self._portal_session.start(prepare=self._prepare_portal)
+
+    def _prepare_portal(self):
+        """@brief Called on the portal session thread before wifi-connect is started."""
+        # A background scan that started before the portal completes (or times out) before wifi-connect takes the interface.
+        self._ssid_scanner.wait_idle()
+        self._ensure_wifi_on()
+        if self._is_scan_stale():
+            self._ssid_scanner.scan()
+
+    def _is_scan_stale(self):
+        """@return True if NetworkManager's scan list should be refreshed before wifi-connect reads it
+                   (E.G the device was online so the list is out of date)."""
+        return self._ssid_scanner.is_enabled() and self._ssid_scanner.get_result(max_age=self._options.scan_interval) is None
+
+    def _create_portal_session(self, on_state_change=None):
+        return PortalSession(self._get_portal_cmd(),
+                             timeout=self._options.portal_timeout,
+                             on_state_change=on_state_change or self._on_portal_state_change,
+                             on_output=self._on_portal_output)
+
+    def _on_portal_output(self, session, line, event):
+        """@brief Called with each line of wifi-connect output as it is read.
+           @param session The PortalSession.
+           @param line The line of output.
+           @param event The progress event (PORTAL_EVENT_*) in the line or None."""
+        self._uio.debug(f"wifi-connect: {line}")
+        if not event:
+            return
+
+        events = session.get_events()
+        elapsed = events[-1][1]
+        phase = elapsed - events[-2][1] if len(events) > 1 else elapsed
+        self._uio.debug(f"WiFi portal: {event} after {phase:.1f} s ({elapsed:.1f} s)")
+
+        msg = WiFiSetupManager.PORTAL_EVENT_MESSAGES.get(event)
+        if msg:
+            self._show_portal_message(msg)
+        led_state = WiFiSetupManager.PORTAL_EVENT_LED_STATES.get(event)
+        if led_state:
+            self._show_portal_led_state(led_state)
+
+    def _show_portal_led_state(self, state):
+        if self._wifi_led:
+            self._wifi_led.set_state(state)
+
+    def _on_portal_state_change(self, session, state, reconnect_generation):
+        """@brief Called from the portal session thread when the portal state changes.
+           @param reconnect_generation The reconnect ladder generation taken when the portal was started."""
+        self._uio.debug(f"WiFi portal: {state} ({session.get_elapsed():.1f} s)")
+        if state == PORTAL_STOPPING:
+            self._show_portal_message("Stopping\nWiFi setup")
+
+        elif state in PORTAL_FINISHED_STATES:
+            self._metrics.observe(METRIC_PORTAL, session.get_elapsed(), state=state)
+            reconnect = False
             try:
-                cmd = ["sudo", "nmcli", "networking", "off"]
-                subprocess.run(cmd, check=True)
+                reconnect = self._on_portal_finished(session, state)
             finally:
-                sleep(1)
-                cmd = ["sudo", "nmcli", "networking", "on"]
-                subprocess.run(cmd, check=True)
+                self._set_display_floor(PRIORITY_STATUS)
+                self._ssid_scanner.set_paused(False)
+                # Poll often while the new connection settles.
+                self._reset_heartbeat(RESET_PORTAL)
+                if self._wifi_led:
+                    self._update_led_state()
+            if reconnect:
+                # The connectivity state is shown while reconnecting.
+                self._reconnect(reconnect_generation)
+
+    def _on_portal_finished(self, session, state):
+        """@brief Show the result of the portal session.
+           @return True if there is no connectivity."""
+        try:
+            if state == PORTAL_SUCCEEDED:
+                self._show_portal_message("Checking\nconnectivity")
+
+                # The connectivity has changed so don't use the cached state
+                self._connectivity_cache.invalidate()
+                snapshot = self._connectivity_cache.get()
+                if snapshot.connected:
+                    self._show_portal_state(self._get_connectivity_display_state(snapshot))
+                    return False
+
+                self._show_portal_message("OFFLINE\nNo Internet")
 
+            else:
+                if session.get_error():
+                    self._uio.debug(f"WiFi portal error: {session.get_error()}")
+                self._show_portal_message(WiFiSetupManager.PORTAL_END_MESSAGES[state])
+
+        except Exception:
+            logTraceBack(self._uio)
+        return True
+
+    def _set_display_floor(self, priority):
+        if self._display_scheduler:
+            self._display_scheduler.set_floor(priority)
+
+    def _show_portal_message(self, msg):
+        self._show_portal_state(DisplayState(msg))
+
+    def _show_portal_state(self, state):
+        if self._display_scheduler:
+            self._display_scheduler.put(state, PRIORITY_PORTAL)
+
+    def _get_portal_cmd(self):
+        """@return The wifi-connect command line."""
+        # -u points to the UI files
+        # --portal-ssid is the name your phone will see
+        cmd = [
+            "sudo", self._wifi_connect_binary,
+            "--portal-ssid", self._options.ssid,
+            "--ui-directory", self._ui_path
+        ]
+
+        if self._options.password:
+            cmd += ['-portal-passphrase', self._options.password]
+        return cmd
+
+    def _start_nm_monitor(self):
+        """@brief Start the NetworkManager D-Bus monitor if selected. If the D-Bus
+                  backend is not available the nmcli command is used instead."""
+        backend = self._options.nm_backend
+        if backend == WiFiSetupManager.NM_BACKEND_NMCLI:
+            return
+
+        from rpi_wifi_setup.nm_dbus import NMDBusMonitor
+        if not NMDBusMonitor.is_available():
+            if backend == WiFiSetupManager.NM_BACKEND_DBUS:
+                raise Exception("The jeepney python module is required for the dbus NetworkManager backend.")
+            self._uio.debug("jeepney not installed. Using nmcli to read the connectivity state.")
+            return
+
+        nm_monitor = NMDBusMonitor(self._uio,
+                                   iface=WiFiSetupManager.WIFI_IFACE,
+                                   on_change=self._on_connectivity_change,
+                                   bus=self._options.nm_bus)
+        try:
+            nm_monitor.connect()
         except Exception:
+            if backend == WiFiSetupManager.NM_BACKEND_DBUS:
+                raise
             logTraceBack(self._uio)
+            self._uio.debug("Unable to connect to NetworkManager over D-Bus. Using nmcli to read the connectivity state.")
+            return
 
-    def _start_wifi_portal(self):
-        with self._display_lock:
-            if self._wifi_led:
-                self._wifi_led.configuring()
+        self._nm_monitor = nm_monitor
+        self._nm_monitor.start()
+        self._uio.debug("Using the NetworkManager D-Bus backend.")
 
-            self._update_display(f"Connect to\n{self._options.ssid}\nto setup wifi.")
+    def _use_nm_monitor(self):
+        return self._nm_monitor is not None and self._nm_monitor.is_connected()
 
-            self._ensure_wifi_on()
+    def _on_connectivity_change(self):
+        """@brief Called by the NetworkManager D-Bus monitor thread when the connectivity state changes."""
+        self._connectivity_cache.invalidate()
+        self._update_status_output()
 
-            # -u points to the UI files
-            # --portal-ssid is the name your phone will see
-            cmd = [
-                "sudo", self._wifi_connect_binary,
-                "--portal-ssid", self._options.ssid,
-                "--ui-directory", self._ui_path
-            ]
+    def _update_status_output(self):
+        """@brief Show the connectivity state on the LED or display."""
+        if self._wifi_led:
+            self._update_led_state()
+        else:
+            self._render_current_state()
+        self._record_connectivity()
+
+    def _start_netlink_monitor(self):
+        """@brief Start listening for kernel address and link notifications for the WiFi interface
+                  so IP address changes are displayed immediately rather than on the next heartbeat."""
+        netlink_monitor = RtnetlinkMonitor(WiFiSetupManager.WIFI_IFACE,
+                                           on_change=self._on_netlink_change,
+                                           on_overrun=self._on_netlink_overrun)
+        try:
+            netlink_monitor.open()
+        except OSError:
+            logTraceBack(self._uio)
+            self._uio.debug("Unable to open rtnetlink socket. IP address changes will be detected on the heartbeat.")
+            netlink_monitor.close()
+            return
 
-            if self._options.password:
-                cmd += ['-portal-passphrase', self._options.password]
+        self._netlink_monitor = netlink_monitor
+        self._watch_fd(self._netlink_monitor, self._netlink_monitor.handle_events)
 
-            try:
-                # This will block until the user connects or you kill it
-                subprocess.run(cmd, check=True)
-                self._update_display("Checking\nconnectivity")
+    def _watch_fd(self, fileobj, callback):
+        """@brief Call a function from the main loop when a file descriptor becomes readable.
+           @param fileobj An object with a fileno() method.
+           @param callback The function to call."""
+        self._selector.register(fileobj, selectors.EVENT_READ, callback)
 
-                # Example usage with your display logic:
-                if self._check_internet():
-                    self._update_connected_state()
+    def _unwatch_fd(self, fileobj):
+        self._selector.unregister(fileobj)
+
+    def _handle_fd_event(self, callback):
+        """@brief Call a _watch_fd() callback. An error is logged rather than stopping the main
+                  loop, as the asyncio event loop does for its reader callbacks."""
+        try:
+            callback()
+        except Exception:
+            logTraceBack(self._uio)
 
-                else:
-                    self._update_display("OFFLINE\nNo Internet")
-                    # Cycle the networking in an effort to bring it to life
-                    self._cycle_networking()
+    def _on_netlink_change(self):
+        """@brief Called from the main loop when the WiFi interface IP address or link state changes."""
+        ip = self._netlink_monitor.get_ip()
+        snapshot = self._connectivity_cache.peek()
+        if ip is not None and self._netlink_monitor.is_link_up() is not False and snapshot is not None and snapshot.connected:
+            # Only the WiFi address has changed.
+            self._connectivity_cache.set(ConnectivitySnapshot(True, ip=ip, strength=snapshot.strength, ssid=snapshot.ssid))
 
-            except Exception:
-                logTraceBack(self._uio)
-                self._update_display("OFFLINE\nConnect\nerror")
-                self._cycle_networking()
+        else:
+            # The WiFi address or link has been lost or an address has been assigned. Another
+            # interface (E.G Ethernet) may reach the internet so the connectivity must be checked.
+            self._connectivity_cache.invalidate()
+
+        self._update_status_output()
+
+    def _on_netlink_overrun(self):
+        """@brief Called from the main loop when netlink notifications were lost. The WiFi
+                  address and link state have been read again but the connectivity may have
+                  changed in the meantime so it is checked again."""
+        self._uio.debug(f"rtnetlink notifications lost ({self._netlink_monitor.get_overruns()} times), checking the connectivity.")
+        self._connectivity_cache.invalidate()
+        self._update_status_output()
+
+    def _update_led_state(self):
+        self._show_led_state(self._connectivity_cache.get())
+
+    def _show_led_state(self, snapshot):
+        self._wifi_led.set_state(self._get_led_state(snapshot))
+
+    def _get_led_state(self, snapshot):
+        """@return The WifiLEDCtrl state showing the connectivity state."""
+        if snapshot.connected:
+            return WifiLEDCtrl.CONNECTED
+        if self._get_known_ip():
+            return WifiLEDCtrl.NO_INTERNET
+        return WifiLEDCtrl.DISCONNECTED
+
+    def _get_known_ip(self):
+        """@return The WiFi interface IP address known from the rtnetlink or D-Bus monitor without
+                    running nmcli or None if it has no address or neither monitor is running."""
+        if self._netlink_monitor and self._netlink_monitor.get_ip():
+            return self._netlink_monitor.get_ip()
+        if self._use_nm_monitor():
+            return self._nm_monitor.get_ip()
+        return None
 
     def _check_internet(self):
         """Returns True if connectivity is 'full', otherwise False."""
+        if self._use_nm_monitor():
+            return self._nm_monitor.is_internet_connected()
+
         try:
             # Run nmcli command: -t (terse) for easy parsing
-            result = subprocess.check_output(
-                ["nmcli", "-t", "-f", "CONNECTIVITY", "networking", "connectivity"],
-                encoding="utf-8"
-            ).strip()
-
-            return result == "full"
+            with self._metrics.time(METRIC_COMMAND, command="check_internet"):
+                output = subprocess.check_output(WiFiSetupManager.NMCLI_CONNECTIVITY_CMD, encoding="utf-8")
+            return self._parse_connectivity(output)
         except Exception:
             return False
 
+    def _parse_connectivity(self, output):
+        """@return True if the nmcli connectivity output is 'full'."""
+        return output.strip() == "full"
+
     def _get_wifi_ip(self):
         """Returns the IPv4 address of wlan0, or None if not connected."""
-        try:
-            # -g (get) pulls just the specific field. -t (terse) avoids extra text.
-            cmd = ["nmcli", "-g", "IP4.ADDRESS", "device", "show", "wlan0"]
-            result = subprocess.check_output(cmd, encoding="utf-8").strip()
+        return self._get_wifi_ip_and_ssid()[0]
 
-            # result is usually "192.168.1.50/24", we strip the subnet (/24)
-            if result:
-                return result.split('/')[0]
-            return None
-        except Exception:
-            return None
+    def _get_wifi_ip_and_ssid(self):
+        """@return A tuple containing the IPv4 address and the SSID (connection name) of wlan0.
+                    Either may be None if not connected."""
+        if self._use_nm_monitor():
+            return (self._nm_monitor.get_ip(), self._nm_monitor.get_ssid())
 
-    def _get_wifi_strength(self):
-        sig_strength = 0
         try:
-            cmd = ["nmcli", "-f", "IN-USE,SIGNAL", "device", "wifi"]
-            output = subprocess.check_output(cmd, encoding="utf-8")
-            for line in output.splitlines():
-                if line.startswith('*'):  # The connected network
-                    sig_strength = int(line.split()[1])
-                    break
-
+            with self._metrics.time(METRIC_COMMAND, command="wifi_ip"):
+                output = subprocess.check_output(WiFiSetupManager.NMCLI_DEVICE_SHOW_CMD, encoding="utf-8")
+            return self._parse_device_show(output)
         except Exception:
-            pass
-        return sig_strength
+            return (None, None)
+
+    def _parse_device_show(self, output):
+        """@return A tuple containing the IPv4 address and the connection name from the nmcli device show output."""
+        ip = None
+        ssid = None
+        for line in output.splitlines():
+            field, _, value = line.partition(':')
+            # terse mode escapes : and \ in values
+            value = value.replace('\\:', ':').replace('\\\\', '\\').strip()
+            if field == 'GENERAL.CONNECTION' and value:
+                ssid = value
+
+            # value is usually "192.168.1.50/24", we strip the subnet (/24)
+            elif field.startswith('IP4.ADDRESS') and value and ip is None:
+                ip = value.split('/')[0]
+        return (ip, ssid)
 
-    def _update_connected_state(self):
-        ip = self._get_wifi_ip()
+    def _get_wifi_strength(self):
+        if self._use_nm_monitor():
+            return self._nm_monitor.get_strength()
+
+        with self._metrics.time(METRIC_COMMAND, command="wifi_strength"):
+            return self._signal_reader.read()
+
+    def _read_connectivity_snapshot(self):
+        """@brief Read the current connectivity state. This is called by the
+                  connectivity cache, use self._connectivity_cache.get() to get the state.
+           @return A ConnectivitySnapshot instance."""
+        if not self._check_internet():
+            return ConnectivitySnapshot(False)
+
+        ip, ssid = self._get_wifi_ip_and_ssid()
+        if self._netlink_monitor and self._netlink_monitor.get_ip():
+            ip = self._netlink_monitor.get_ip()
         strength = self._get_wifi_strength()
-        self._update_display(f"ONLINE\n{ip}\nSignal: {strength}%", strength=strength)
+        return ConnectivitySnapshot(True, ip=ip, strength=strength, ssid=ssid)
+
+    def _update_connected_state(self, snapshot):
+        self._show_connectivity(snapshot)
 
     def _set_screen_power(self, on):
         if self._device:
             if on and not self._screen_on:
                 self._device.show()
                 self._screen_on = True
+                self._ssid_scanner.set_screen_on(True)
+                # The heartbeat interval is shorter while the screen is on.
+                self._wake_main_loop()
 
             elif not on and self._screen_on:
                 self._device.hide()
                 self._screen_on = False
+                self._ssid_scanner.set_screen_on(False)
 
     def _reset_timer(self):
-        self._last_button_press_time = time()
+        self._last_button_press_time = monotonic()
         self._set_screen_power(True)
 
+    def _on_button_pressed(self):
+        # The time until the next frame is sent is recorded.
+        self._button_press_perf = perf_counter()
+        self._reset_timer()
+        self._reset_heartbeat(RESET_BUTTON)
+
+    def _reset_heartbeat(self, reason):
+        """@brief Check the connectivity at the minimum heartbeat interval. Called from any thread.
+           @param reason One of the heartbeat RESET_* reasons."""
+        self._heartbeat_policy.reset(reason)
+        self._wake_main_loop()
+
+    def _record_connectivity(self):
+        """@brief Pass the latest connectivity state to the heartbeat policy. A change
+                  (E.G a disconnect) shortens the heartbeat interval."""
+        snapshot = self._connectivity_cache.peek()
+        if self._heartbeat_policy.record(snapshot):
+            self._wake_main_loop()
+        if snapshot is not None:
+            # The network list is kept up to date while offline so the portal can show it at once.
+            self._ssid_scanner.set_offline(not snapshot.connected)
+            self._record_time_to_connectivity(snapshot)
+
+    def _record_time_to_connectivity(self, snapshot):
+        """@brief Record the time from connectivity being lost until it is next seen."""
+        if not snapshot.connected:
+            if self._offline_since is None:
+                self._offline_since = snapshot.timestamp
+        elif self._offline_since is not None:
+            self._metrics.observe(METRIC_TIME_TO_CONNECTIVITY, max(0.0, snapshot.timestamp - self._offline_since))
+            self._offline_since = None
+
+    def _wake_main_loop(self):
+        """@brief Wake the main loop so that it applies a shorter heartbeat interval."""
+        if self._loop_waker:
+            self._loop_waker.wake()
+
+    def _on_loop_wake(self):
+        """@brief Called from the main loop when woken by another thread."""
+        self._loop_waker.handle_events()
+        self._next_heartbeat = min(self._next_heartbeat, monotonic() + self._heartbeat_policy.get_interval(self._screen_on))
+
+    def _get_heartbeat_interval(self):
+        """@return The number of seconds until the next heartbeat. The interval backs off while
+                    the connectivity is stable and backs off further while the screen is off."""
+        return self._heartbeat_policy.next_interval(self._screen_on)
+
     def _ensure_wifi_on(self):
         # Ensure WiFi is turned on
-        cmd = ["nmcli", "radio", "wifi", "on"]
-        subprocess.run(cmd, check=True)
+        with self._metrics.time(METRIC_COMMAND, command="wifi_on"):
+            subprocess.run(WiFiSetupManager.NMCLI_WIFI_ON_CMD, check=True)
+
+    def _heartbeat(self):
+        """@brief Periodic screen timeout check and connectivity update."""
+        # Handle timeout check
+        if self._options.screen_off_seconds and \
+           monotonic() - self._last_button_press_time > self._options.screen_off_seconds:
+            with self._display_lock:
+                self._set_screen_power(False)
+
+        if self._wifi_led:
+            self._update_led_state()
+
+        else:
+            self._update_mailbox()
+            # Periodic background update (Signal strength/Internet status)
+            if self._screen_on:
+                self._render_current_state()
+
+        self._record_connectivity()
+        self._notify_status()
+        self._export_metrics()
+        self._log_stats()
+
+    def _get_service_status(self, snapshot=None):
+        """@param snapshot The ConnectivitySnapshot to report or None to report the cached state.
+           @return The systemd STATUS= text showing the connectivity and the time taken to send a frame."""
+        if snapshot is None:
+            snapshot = self._connectivity_cache.peek()
+
+        if snapshot is None:
+            status = "Checking connectivity"
+        elif snapshot.connected:
+            status = f"ONLINE {snapshot.ip} Signal: {snapshot.strength}%"
+        else:
+            status = "OFFLINE"
+
+        if self._display:
+            status += f", render {self._frame_governor.get_stats()['send_time_ms']:.1f} ms"
+        return status
+
+    def _notify_ready(self, snapshot):
+        """@brief Tell systemd the service is ready. Called once the hardware has been setup
+                  and the first connectivity snapshot has been read."""
+        self._notifier.ready(self._get_service_status(snapshot))
+
+    def _notify_status(self):
+        self._notifier.status(self._get_service_status())
+
+    def _is_making_progress(self):
+        """@return False if the display consumer has been sending one frame for longer than the watchdog interval."""
+        if self._display_consumer:
+            return self._display_consumer.get_busy_seconds() < self._notifier.get_watchdog_interval()
+        return True
+
+    def _notify_watchdog(self):
+        """@brief Called from the main loop on each iteration. The systemd watchdog is only pinged
+                  while the loop is running, so a hung loop (E.G a hung nmcli command) or display
+                  causes systemd to restart the service."""
+        if self._notifier.get_watchdog_interval() is not None:
+            self._notifier.watchdog(alive=self._is_making_progress())
+
+    def _start_metrics(self):
+        """@brief Start the Prometheus textfile and HTTP metrics exports if selected."""
+        if self._options.metrics_file:
+            self._metrics_exporter = TextfileExporter(self._metrics, self._options.metrics_file)
+        if self._options.metrics_port:
+            try:
+                self._metrics_server = MetricsHTTPServer(self._metrics, self._options.metrics_port)
+                self._metrics_server.start()
+                self._uio.info(f"Metrics are available at http://127.0.0.1:{self._options.metrics_port}/metrics")
+            except OSError as ex:
+                self._metrics_server = None
+                self._uio.warn(f"Unable to start the metrics HTTP server: {ex}")
+
+    def _export_metrics(self, force=False):
+        """@brief Write the metrics textfile if the metrics have changed."""
+        if self._metrics_exporter:
+            try:
+                self._metrics_exporter.write(force=force)
+            except OSError as ex:
+                self._uio.debug(f"Unable to write {self._options.metrics_file}: {ex}")
+
+    def _stop_metrics(self):
+        self._export_metrics(force=True)
+        if self._metrics_server:
+            self._metrics_server.stop()
+
+    def _start_diagnostics(self):
+        """@brief Install the SIGUSR1 (stack dump) and SIGUSR2 (tracemalloc) handlers and start
+                  the sampling profiler if --profile is set. signal.signal() is used by both
+                  engines so that the handlers run even if the main loop or event loop is blocked."""
+        signal.signal(signal.SIGUSR1, self._on_stack_dump_signal)
+        signal.signal(signal.SIGUSR2, self._on_tracemalloc_signal)
+        if self._options.profile:
+            self._profiler = SamplingProfiler(self._options.diagnostics_dir,
+                                              interval=self._options.profile_interval,
+                                              keep=self._options.profile_keep)
+            self._profiler.start()
+            self._uio.info(f"Writing a profile to {self._options.diagnostics_dir} every {self._options.profile_interval} seconds.")
+
+    def _on_stack_dump_signal(self, signum, frame):
+        try:
+            filename = dump_stacks(self._options.diagnostics_dir, (self._display_lock, self._portal_lock))
+            self._uio.info(f"Wrote the thread stacks to {filename}")
+        except OSError as ex:
+            self._uio.warn(f"Unable to write the thread stacks: {ex}")
+
+    def _on_tracemalloc_signal(self, signum, frame):
+        try:
+            filename = self._tracemalloc_toggle.toggle()
+            if filename:
+                self._uio.info(f"Stopped tracemalloc, wrote the top allocators to {filename}")
+            else:
+                self._uio.info("Started tracemalloc, send SIGUSR2 again to write the top allocators.")
+        except OSError as ex:
+            self._uio.warn(f"Unable to write the top allocators: {ex}")
+
+    def _stop_diagnostics(self):
+        signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+        signal.signal(signal.SIGUSR2, signal.SIG_DFL)
+        if self._profiler:
+            try:
+                self._profiler.stop()
+            except OSError as ex:
+                self._uio.debug(f"Unable to write the profile: {ex}")
+
+    def _log_stats(self):
+        if self._uio.isDebugEnabled():
+            self._uio.debug(f"Connectivity cache: {self._connectivity_cache.get_stats()}")
+            self._uio.debug(f"Heartbeat: {self._heartbeat_policy.get_stats()}")
+            if self._wifi_led:
+                self._uio.debug(f"LED: {self._wifi_led.get_stats()}")
+            if self._renderer:
+                self._uio.debug(f"Render cache: {self._renderer.get_stats()}")
+            if self._display_consumer:
+                self._uio.debug(f"Display pipeline: {self._display_consumer.get_stats()}")
+            elif self._display:
+                self._uio.debug(f"Frame governor: {self._frame_governor.get_stats()}")
+            if self._override_watcher:
+                self._uio.debug(f"Override inotify: {self._override_watcher.get_stats()}")
+            if self._mailbox and not self._wifi_led:
+                self._uio.debug(f"Mailbox: {self._mailbox.get_stats()}")
+            if self._display_socket:
+                self._uio.debug(f"Display socket: {self._display_socket.get_stats()}")
+            if self._framebuffer:
+                self._uio.debug(f"Framebuffer: {self._framebuffer.get_stats()}")
+            if self._override_watcher or self._observer:
+                self._uio.debug(f"Override file: events={self._override_debouncer.get_stats()} file={self._override_file.get_stats()} redraws_skipped={self._override_redraws_skipped}")
+            if self._portal_session:
+                self._uio.debug(f"WiFi portal: {self._portal_session.get_stats()}")
+            if self._ssid_scanner.is_enabled():
+                self._uio.debug(f"SSID scan: {self._ssid_scanner.get_stats()}")
+            self._uio.debug(f"Reconnect: {self._reconnect_ladder.get_stats()}")
+            if self._profiler:
+                self._uio.debug(f"Profiler: {self._profiler.get_stats()}")
+            if self._notifier.is_enabled():
+                self._uio.debug(f"systemd notify: {self._notifier.get_stats()}")
+
+    def _setup_display(self):
+        """@brief Setup the oled display."""
+        from PIL import ImageFont
+        from rpi_wifi_setup.display import DiffingDisplay
+        from rpi_wifi_setup.frame_renderer import FrameRenderer
+
+        self._font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 14)
+        if not self._font:
+            self._font = ImageFont.load_default()
+
+        self._device = self._create_display_device()
+        self._display = DiffingDisplay(self._device, uio=self._uio)
+        self._renderer = FrameRenderer(self._device.size,
+                                       self._font,
+                                       cache_size=self._options.render_cache_size)
+
+    def _create_display_device(self):
+        """@return The luma device for the SSD1309 display on I2C bus 1."""
+        from luma.core.interface.serial import i2c
+        from luma.oled.device import ssd1309
+        return ssd1309(i2c(port=1,
+                       address=self._options.i2c_address),
+                       width=self._options.display_width,
+                       height=self._options.display_height)
+
+    def _start_override_observer(self):
+        """@brief Start watching for changes to the display override file."""
+        if InotifyWatcher.is_available():
+            override_watcher = InotifyWatcher(OverrideHandler.FORCE_DISPLAY_FILE,
+                                              on_change=self.handle_interrupt_trigger)
+            try:
+                override_watcher.open()
+                # The main loop reads the inotify events, no thread is required.
+                self._override_watcher = override_watcher
+                self._watch_fd(self._override_watcher, self._override_watcher.handle_events)
+                return
+
+            except OSError:
+                logTraceBack(self._uio)
+                override_watcher.close()
+                self._uio.debug("Unable to use inotify. Using watchdog to watch the override file.")
+
+        # Setup the Interrupt Observer for filesystem changes
+        from watchdog.observers import Observer
+        self._event_handler = OverrideHandler(self)
+        self._observer = Observer()
+        # Monitor /tmp for changes
+        self._observer.schedule(self._event_handler, path="/tmp", recursive=False)
+        self._observer.start()
+
+    def _create_ssid_scanner(self, on_change=None):
+        return SsidScanner(interval=self._options.scan_interval,
+                           idle_interval=self._options.scan_idle_interval,
+                           on_change=on_change)
+
+    def _stop_monitors(self):
+        """@brief Stop the connectivity monitors and the override file observer."""
+        if self._netlink_monitor:
+            self._unwatch_fd(self._netlink_monitor)
+            self._netlink_monitor.close()
+        if self._nm_monitor:
+            self._nm_monitor.stop()
+        if self._override_watcher:
+            self._unwatch_fd(self._override_watcher)
+            self._override_watcher.close()
+        if self._mailbox_watcher:
+            self._unwatch_fd(self._mailbox_watcher)
+            self._mailbox_watcher.close()
+        if self._display_socket:
+            self._unwatch_fd(self._display_socket)
+            self._display_socket.close()
+        if self._framebuffer:
+            self._unwatch_fd(self._framebuffer)
+            self._framebuffer.close()
+        if self._observer:
+            self._observer.stop()
+            self._observer.join()
+        self._override_debouncer.cancel()
 
     def run(self):
 
         # Hardware Setup
+        from gpiozero import Button
         self._btn = Button(self._options.button_pin,
                            hold_time=WiFiSetupManager.BUTTON_HOLD_SECONDS)
 
@@ -335,50 +1210,278 @@ class WiFiSetupManager(object):
             self._wifi_led.start()
 
         else:
-            self._device = ssd1309(i2c(port=1,
-                                   address=self._options.i2c_address),
-                                   width=self._options.display_width,
-                                   height=self._options.display_height)
+            self._setup_display()
+            self._start_display_consumer()
 
             # We only look at the file system for display text updates if the display is connected.
-            # Setup the Interrupt Observer for filesystem changes
-            self._event_handler = OverrideHandler(self)
-            self._observer = Observer()
-            # Monitor /tmp for changes
-            self._observer.schedule(self._event_handler, path="/tmp", recursive=False)
-            self._observer.start()
+            self._start_override_observer()
+            self._start_mailbox()
+            self._start_display_socket()
+            self._start_framebuffer()
 
         self._ensure_wifi_on()
 
-        self._btn.when_held = self._start_wifi_portal
-        self._btn.when_pressed = self._reset_timer
+        self._start_nm_monitor()
+        self._start_netlink_monitor()
 
-        try:
-            while True:
-                # Handle timeout check
-                if self._options.screen_off_seconds and \
-                   time() - self._last_button_press_time > self._options.screen_off_seconds:
-                    with self._display_lock:
-                        self._set_screen_power(False)
+        if self._ssid_scanner.is_enabled():
+            self._ssid_scanner.start()
+        self._start_metrics()
+        self._start_diagnostics()
 
-                if self._wifi_led:
-                    with self._display_lock:
-                        if self._check_internet():
-                            self._wifi_led.connected()
+        # Other threads (E.G the button) wake the main loop to shorten the heartbeat interval.
+        self._loop_waker = LoopWaker()
+        self._loop_waker.open()
+        self._watch_fd(self._loop_waker, self._on_loop_wake)
 
-                        else:
-                            self._wifi_led.disconnected()
-
-                else:
-                    # Periodic background update (Signal strength/Internet status)
-                    if self._screen_on:
-                        self._render_current_state()
+        self._btn.when_held = self._start_wifi_portal
+        self._btn.when_pressed = self._on_button_pressed
 
-                sleep(10)  # We can sleep longer now because interrupts handle the UI!
+        try:
+            self._notify_ready(self._connectivity_cache.get())
+            self._next_heartbeat = 0
+            while True:
+                now = monotonic()
+                if now >= self._next_heartbeat:
+                    self._heartbeat()
+                    self._next_heartbeat = now + self._get_heartbeat_interval()
+
+                self._notify_watchdog()
+                self._expire_mailbox()
+                self._override_debouncer.poll()
+
+                # Sleep until the next heartbeat unless a registered file descriptor (E.G netlink) becomes readable.
+                timeout = max(0, self._next_heartbeat - monotonic())
+                watchdog_delay = self._notifier.get_watchdog_delay()
+                if watchdog_delay is not None:
+                    timeout = min(timeout, watchdog_delay)
+                expiry_delay = self._get_mailbox_expiry_delay()
+                if expiry_delay is not None:
+                    timeout = min(timeout, expiry_delay)
+                debounce_delay = self._override_debouncer.get_delay()
+                if debounce_delay is not None:
+                    timeout = min(timeout, debounce_delay)
+                for key, _ in self._selector.select(timeout=timeout):
+                    self._handle_fd_event(key.data)
         finally:
-            if self._observer:
-                self._observer.stop()
-                self._observer.join()
+            self._notifier.stopping()
+            self._reconnect_ladder.cancel()
+            if self._portal_session:
+                # The reconnect runs on the session thread, it stops once the step it is
+                # running has completed so the WiFi radio or networking is not left off.
+                self._portal_session.cancel()
+                self._portal_session.join()
+            # The display consumer may be sending a frame from the framebuffer.
+            if self._display_consumer:
+                self._display_consumer.stop()
+            if self._wifi_led:
+                self._wifi_led.stop()
+            self._ssid_scanner.stop()
+            self._stop_metrics()
+            self._stop_diagnostics()
+            self._stop_monitors()
+            self._unwatch_fd(self._loop_waker)
+            self._loop_waker.close()
+            self._notifier.close()
+
+
+def get_arg_parser():
+    """@return The command line argument parser."""
+    parser = argparse.ArgumentParser(description="Linux WiFi provisioning tool.",
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument("-b",
+                        "--button_pin",
+                        type=int,
+                        help=f"The GPIO pin that the WiFi button is connected to (default = {WiFiSetupManager.DEFAULT_BUTTON_PIN}).",
+                        default=WiFiSetupManager.DEFAULT_BUTTON_PIN)
+
+    parser.add_argument("-a",
+                        "--i2c_address",
+                        type=lambda x: hex(int(x, 16)),
+                        help=f"The I2C bus address of the SSD1306 display (default={WiFiSetupManager.DEFAULT_I2C_ADDR:x}).",
+                        default=WiFiSetupManager.DEFAULT_I2C_ADDR)
+
+    parser.add_argument("-l",
+                        "--led_pin",
+                        type=int,
+                        help="If using an LED rather than an oled display to indicate WiFi connectivity then this argument must be the GPIO pin used to drive the LED.")
+
+    parser.add_argument("-w",
+                        "--display_width",
+                        type=int,
+                        help=f"The display width in pixels (default = {WiFiSetupManager.DEFAULT_DISPLAY_WIDTH_PIXELS}).",
+                        default=WiFiSetupManager.DEFAULT_DISPLAY_WIDTH_PIXELS)
+
+    parser.add_argument("-v",
+                        "--display_height",
+                        type=int,
+                        help=f"The display height in pixels (default = {WiFiSetupManager.DEFAULT_DISPLAY_HEIGHT_PIXELS}).",
+                        default=WiFiSetupManager.DEFAULT_DISPLAY_HEIGHT_PIXELS)
+
+    parser.add_argument("-s",
+                        "--ssid",
+                        help=f"The portal SSID to connect your mobile/tablet (default = {WiFiSetupManager.DEFAULT_PORTAL_SSID}).",
+                        default=WiFiSetupManager.DEFAULT_PORTAL_SSID)
+
+    parser.add_argument("-p",
+                        "--password",
+                        help=f"The portal password when connecting your mobile/tablet (default = {WiFiSetupManager.DEFAULT_PORTAL_PASSWORD}).",
+                        default=WiFiSetupManager.DEFAULT_PORTAL_PASSWORD)
+
+    parser.add_argument("-o",
+                        "--screen_off_seconds",
+                        type=int,
+                        help=f"The the screen off timer (default = {WiFiSetupManager.DEFAULT_SCREEN_OFF_SECONDS}). Set to 0 to disable.",
+                        default=WiFiSetupManager.DEFAULT_SCREEN_OFF_SECONDS)
+
+    parser.add_argument("--nm_backend",
+                        choices=WiFiSetupManager.NM_BACKENDS,
+                        help=f"How the NetworkManager connectivity state is read. dbus keeps a persistent D-Bus connection to NetworkManager (requires the jeepney python module), nmcli runs the nmcli command and auto uses dbus if available (default = {WiFiSetupManager.DEFAULT_NM_BACKEND}).",
+                        default=WiFiSetupManager.DEFAULT_NM_BACKEND)
+
+    parser.add_argument("--nm_bus",
+                        help="The D-Bus bus NetworkManager is reached on with the dbus backend. SYSTEM, SESSION or a D-Bus address "
+                             f"(E.G unix:path=/tmp/nm_test_bus) of a stand in NetworkManager service (default = {WiFiSetupManager.DEFAULT_NM_BUS}).",
+                        default=WiFiSetupManager.DEFAULT_NM_BUS)
+
+    parser.add_argument("--connectivity_ttl",
+                        type=float,
+                        help=f"The number of seconds the connectivity state is cached for. Display updates within this time share one connectivity check (default = {WiFiSetupManager.DEFAULT_CONNECTIVITY_TTL_SECONDS}).",
+                        default=WiFiSetupManager.DEFAULT_CONNECTIVITY_TTL_SECONDS)
+
+    parser.add_argument("--signal_source",
+                        choices=SIGNAL_SOURCE_NAMES,
+                        help=f"Where the WiFi signal strength is read from when the NetworkManager D-Bus backend is not in use. proc reads /proc/net/wireless, nmcli reads the nmcli scan table and auto uses proc falling back to nmcli (default = {WiFiSetupManager.DEFAULT_SIGNAL_SOURCE}).",
+                        default=WiFiSetupManager.DEFAULT_SIGNAL_SOURCE)
+
+    parser.add_argument("--render_cache_size",
+                        type=int,
+                        help=f"The maximum number of pre rendered text line, WiFi icon and screen bitmaps cached. Set to 0 to disable (default = {WiFiSetupManager.DEFAULT_RENDER_CACHE_SIZE}).",
+                        default=WiFiSetupManager.DEFAULT_RENDER_CACHE_SIZE)
+
+    parser.add_argument("--override_debounce",
+                        type=float,
+                        help=f"Override file changes within this number of seconds are merged into a single display update (default = {WiFiSetupManager.DEFAULT_OVERRIDE_DEBOUNCE_SECONDS}).",
+                        default=WiFiSetupManager.DEFAULT_OVERRIDE_DEBOUNCE_SECONDS)
+
+    parser.add_argument("--mailbox_dir",
+                        help=f"Applications may display a message by writing a file to this directory (default = {WiFiSetupManager.DEFAULT_MAILBOX_DIR}).",
+                        default=WiFiSetupManager.DEFAULT_MAILBOX_DIR)
+
+    parser.add_argument("--display_socket",
+                        help=f"Applications may display messages by sending them to this unix domain datagram socket (see rpi_wifi_setup.display_client). Set to an empty string to disable (default = {WiFiSetupManager.DEFAULT_DISPLAY_SOCKET}).",
+                        default=WiFiSetupManager.DEFAULT_DISPLAY_SOCKET)
+
+    parser.add_argument("--socket_rate",
+                        type=float,
+                        help=f"The maximum number of display socket messages per second accepted from each application (default = {WiFiSetupManager.DEFAULT_SOCKET_RATE}).",
+                        default=WiFiSetupManager.DEFAULT_SOCKET_RATE)
+
+    parser.add_argument("--framebuffer",
+                        help=f"Applications may display their own graphics by writing packed 1 bit frames to this shared memory file (see rpi_wifi_setup.framebuffer). Set to an empty string to disable (default = {WiFiSetupManager.DEFAULT_FRAMEBUFFER_FILE}).",
+                        default=WiFiSetupManager.DEFAULT_FRAMEBUFFER_FILE)
+
+    parser.add_argument("--max_fps",
+                        type=float,
+                        help=f"The maximum number of frames per second sent to the display. Frames are also limited so that the display bus is busy for no more than half the time. Set to 0 to only apply the bus limit (default = {WiFiSetupManager.DEFAULT_MAX_FPS}).",
+                        default=WiFiSetupManager.DEFAULT_MAX_FPS)
+
+    parser.add_argument("--engine",
+                        choices=WiFiSetupManager.ENGINES,
+                        help=f"threads handles events on separate threads. asyncio handles all events (buttons, override file, connectivity, screen timeout, LED and portal) on a single asyncio event loop (default = {WiFiSetupManager.DEFAULT_ENGINE}).",
+                        default=WiFiSetupManager.DEFAULT_ENGINE)
+
+    parser.add_argument("--portal_timeout",
+                        type=float,
+                        help=f"The maximum number of seconds the WiFi portal runs for. Holding the button while the portal is running stops it. Set to 0 for no limit (default = {WiFiSetupManager.DEFAULT_PORTAL_TIMEOUT_SECONDS}).",
+                        default=WiFiSetupManager.DEFAULT_PORTAL_TIMEOUT_SECONDS)
+
+    parser.add_argument("--scan_interval",
+                        type=float,
+                        help=f"While offline the WiFi networks in range are scanned every this number of seconds so the WiFi portal has a network list as soon as it starts. "
+                             f"Set to 0 to disable (default = {WiFiSetupManager.DEFAULT_SCAN_INTERVAL_SECONDS}).",
+                        default=WiFiSetupManager.DEFAULT_SCAN_INTERVAL_SECONDS)
+
+    parser.add_argument("--scan_idle_interval",
+                        type=float,
+                        help=f"The WiFi network scan interval in seconds while offline with the screen off (default = {WiFiSetupManager.DEFAULT_SCAN_IDLE_INTERVAL_SECONDS}).",
+                        default=WiFiSetupManager.DEFAULT_SCAN_IDLE_INTERVAL_SECONDS)
+
+    parser.add_argument("--reconnect_timeout",
+                        type=float,
+                        help="After a WiFi portal session without connectivity the cheapest reconnect step is tried first "
+                             "(connection up, device reapply, WiFi radio off/on and then networking off/on). "
+                             f"This is the maximum number of seconds each step command may take (default = {WiFiSetupManager.DEFAULT_RECONNECT_TIMEOUT_SECONDS}).",
+                        default=WiFiSetupManager.DEFAULT_RECONNECT_TIMEOUT_SECONDS)
+
+    parser.add_argument("--reconnect_settle",
+                        type=float,
+                        help=f"The number of seconds to wait for connectivity after each reconnect step before the next step is tried (default = {WiFiSetupManager.DEFAULT_RECONNECT_SETTLE_SECONDS}).",
+                        default=WiFiSetupManager.DEFAULT_RECONNECT_SETTLE_SECONDS)
+
+    parser.add_argument("--metrics_file",
+                        help="Write the nmcli, render, display transfer, button to display, WiFi portal and time to connectivity timing histograms "
+                             "to this file in the Prometheus text format when they change "
+                             "(E.G /var/lib/prometheus/node-exporter/rpi_wifi_setup.prom for the node exporter textfile collector). "
+                             "Set to an empty string to disable (default = disabled).",
+                        default=WiFiSetupManager.DEFAULT_METRICS_FILE)
+
+    parser.add_argument("--metrics_port",
+                        type=int,
+                        help="If set the timing histograms are also served at http://127.0.0.1:<port>/metrics (default = disabled).",
+                        default=WiFiSetupManager.DEFAULT_METRICS_PORT)
+
+    parser.add_argument("--profile",
+                        action='store_true',
+                        help="Sample the stacks of the main loop and all other threads and write them to a profile-<time>.pstats file "
+                             "in --diagnostics_dir every --profile_interval seconds. Read the files with python3 -m pstats. "
+                             "Send SIGUSR1 to write the thread stacks and the display lock owner and SIGUSR2 to start/stop tracemalloc "
+                             "and write the top allocators to --diagnostics_dir at any time.")
+
+    parser.add_argument("--profile_interval",
+                        type=float,
+                        help=f"The number of seconds of samples in each --profile file (default = {WiFiSetupManager.DEFAULT_PROFILE_INTERVAL_SECONDS}).",
+                        default=WiFiSetupManager.DEFAULT_PROFILE_INTERVAL_SECONDS)
+
+    parser.add_argument("--profile_keep",
+                        type=int,
+                        help=f"The number of --profile files kept, the oldest are removed (default = {WiFiSetupManager.DEFAULT_PROFILE_KEEP}).",
+                        default=WiFiSetupManager.DEFAULT_PROFILE_KEEP)
+
+    parser.add_argument("--diagnostics_dir",
+                        help=f"The folder the profile, thread stack (SIGUSR1) and tracemalloc (SIGUSR2) files are written to (default = {WiFiSetupManager.DEFAULT_DIAGNOSTICS_DIR}).",
+                        default=WiFiSetupManager.DEFAULT_DIAGNOSTICS_DIR)
+
+    parser.add_argument("--heartbeat_min",
+                        type=float,
+                        help=f"The connectivity check interval in seconds after start up, a button press, a WiFi portal session or a connectivity change. "
+                             f"The interval then doubles (--heartbeat_backoff) while the connectivity is unchanged up to {WiFiSetupManager.HEARTBEAT_SECONDS} seconds "
+                             f"while the screen is on (default = {WiFiSetupManager.DEFAULT_HEARTBEAT_MIN_SECONDS}).",
+                        default=WiFiSetupManager.DEFAULT_HEARTBEAT_MIN_SECONDS)
+
+    parser.add_argument("--heartbeat_max",
+                        type=float,
+                        help=f"The maximum connectivity check interval in seconds while the screen is off (default = {WiFiSetupManager.DEFAULT_HEARTBEAT_MAX_SECONDS}).",
+                        default=WiFiSetupManager.DEFAULT_HEARTBEAT_MAX_SECONDS)
+
+    parser.add_argument("--heartbeat_backoff",
+                        type=float,
+                        help=f"The factor the connectivity check interval is multiplied by each time the connectivity is unchanged. Set to 1 to check at --heartbeat_min (default = {WiFiSetupManager.DEFAULT_HEARTBEAT_BACKOFF}).",
+                        default=WiFiSetupManager.DEFAULT_HEARTBEAT_BACKOFF)
+
+    parser.add_argument("--watchdog_seconds",
+                        type=int,
+                        help=f"The systemd watchdog timeout set when --enable_auto_start is used. The service is restarted if the main loop stops for this number of seconds. Set to 0 to disable (default = {WiFiSetupManager.DEFAULT_WATCHDOG_SECONDS}).",
+                        default=WiFiSetupManager.DEFAULT_WATCHDOG_SECONDS)
+
+    parser.add_argument("-d", "--debug",
+                        action='store_true',
+                        help="Enable debugging.")
+
+    # Add args to auto boot cmd
+    BootManager.AddCmdArgs(parser)
+    return parser
 
 
 def main():
@@ -386,67 +1489,26 @@ def main():
     uio = UIO(use_emojis=True)
 
     try:
-        parser = argparse.ArgumentParser(description="Linux WiFi provisioning tool.",
-                                         formatter_class=argparse.RawDescriptionHelpFormatter)
-
-        parser.add_argument("-b",
-                            "--button_pin",
-                            type=int,
-                            help=f"The GPIO pin that the WiFi button is connected to (default = {WiFiSetupManager.DEFAULT_BUTTON_PIN}).",
-                            default=WiFiSetupManager.DEFAULT_BUTTON_PIN)
-
-        parser.add_argument("-a",
-                            "--i2c_address",
-                            type=lambda x: hex(int(x, 16)),
-                            help=f"The I2C bus address of the SSD1306 display (default={WiFiSetupManager.DEFAULT_I2C_ADDR:x}).",
-                            default=WiFiSetupManager.DEFAULT_I2C_ADDR)
-
-        parser.add_argument("-l",
-                            "--led_pin",
-                            type=int,
-                            help="If using an LED rather than an oled display to indicate WiFi connectivity then this argument must be the GPIO pin used to drive the LED.")
-
-        parser.add_argument("-w",
-                            "--display_width",
-                            type=int,
-                            help=f"The display width in pixels (default = {WiFiSetupManager.DEFAULT_DISPLAY_WIDTH_PIXELS}).",
-                            default=WiFiSetupManager.DEFAULT_DISPLAY_WIDTH_PIXELS)
-
-        parser.add_argument("-v",
-                            "--display_height",
-                            type=int,
-                            help=f"The display height in pixels (default = {WiFiSetupManager.DEFAULT_DISPLAY_HEIGHT_PIXELS}).",
-                            default=WiFiSetupManager.DEFAULT_DISPLAY_HEIGHT_PIXELS)
-
-        parser.add_argument("-s",
-                            "--ssid",
-                            help=f"The portal SSID to connect your mobile/tablet (default = {WiFiSetupManager.DEFAULT_PORTAL_SSID}).",
-                            default=WiFiSetupManager.DEFAULT_PORTAL_SSID)
-
-        parser.add_argument("-p",
-                            "--password",
-                            help=f"The portal password when connecting your mobile/tablet (default = {WiFiSetupManager.DEFAULT_PORTAL_PASSWORD}).",
-                            default=WiFiSetupManager.DEFAULT_PORTAL_PASSWORD)
-
-        parser.add_argument("-o",
-                            "--screen_off_seconds",
-                            type=int,
-                            help=f"The the screen off timer (default = {WiFiSetupManager.DEFAULT_SCREEN_OFF_SECONDS}). Set to 0 to disable.",
-                            default=WiFiSetupManager.DEFAULT_SCREEN_OFF_SECONDS)
-
-        parser.add_argument("-d", "--debug",
-                            action='store_true',
-                            help="Enable debugging.")
-
-        # Add args to auto boot cmd
-        BootManager.AddCmdArgs(parser)
-
+        parser = get_arg_parser()
         options = parser.parse_args()
 
         uio.enableDebug(options.debug)
+        if options.enable_auto_start:
+            # Written before the service is created so that systemd loads it when the service is started.
+            dropin_file = write_service_dropin(get_service_name(), options.watchdog_seconds)
+            uio.info(f"Created {dropin_file}")
         handled = BootManager.HandleOptions(uio, options, False)
+        if options.disable_auto_start:
+            dropin_file = remove_service_dropin(get_service_name())
+            if dropin_file:
+                uio.info(f"Removed {dropin_file}")
         if not handled:
-            wiFiSetupManager = WiFiSetupManager(uio, options)
+            if options.engine == WiFiSetupManager.ENGINE_ASYNCIO:
+                # Imported here as the async manager extends WiFiSetupManager.
+                from rpi_wifi_setup.async_manager import AsyncWiFiSetupManager
+                wiFiSetupManager = AsyncWiFiSetupManager(uio, options)
+            else:
+                wiFiSetupManager = WiFiSetupManager(uio, options)
             wiFiSetupManager.run()
 
     # If the program throws a system exit exception
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import socket
+
+from time import monotonic
+
+SYSTEMD_SERVICE_FOLDER = "/etc/systemd/system"
+DROPIN_FILENAME = "notify.conf"
+DEFAULT_WATCHDOG_SECONDS = 30
+
+
+def get_service_name():
+    """@brief The service name used by p3lib.BootManager (the name of the executed file without .py)."""
+    return os.path.basename(sys.argv[0]).replace(".py", "")
+
+
+def get_dropin_file(service_name, folder=SYSTEMD_SERVICE_FOLDER):
+    """@return The systemd drop-in file that adds notify support to the service."""
+    return os.path.join(folder, f"{service_name}.service.d", DROPIN_FILENAME)
+
+
+def write_service_dropin(service_name, watchdog_seconds, folder=SYSTEMD_SERVICE_FOLDER):
+    """@brief BootManager creates a Type=simple service. Add a drop-in that changes it to
+              Type=notify so systemd waits for READY=1 and restarts the service if the
+              WATCHDOG=1 pings stop.
+       @param service_name The name of the service.
+       @param watchdog_seconds The systemd WatchdogSec value. 0 disables the watchdog.
+       @param folder The systemd unit folder.
+       @return The drop-in file."""
+    dropin_file = get_dropin_file(service_name, folder=folder)
+    lines = ["[Service]",
+             "Type=notify",
+             "NotifyAccess=main"]
+    if watchdog_seconds:
+        lines.append(f"WatchdogSec={watchdog_seconds}")
+    os.makedirs(os.path.dirname(dropin_file), exist_ok=True)
+    with open(dropin_file, 'w') as fd:
+        fd.write("\n".join(lines) + "\n")
+    return dropin_file
+
+
+def remove_service_dropin(service_name, folder=SYSTEMD_SERVICE_FOLDER):
+    """@brief Remove the drop-in written by write_service_dropin().
+       @return The drop-in file or None if it was not present."""
+    dropin_file = get_dropin_file(service_name, folder=folder)
+    if not os.path.isfile(dropin_file):
+        return None
+    os.remove(dropin_file)
+    try:
+        os.rmdir(os.path.dirname(dropin_file))
+    except OSError:
+        pass
+    return dropin_file
+
+
+class SystemdNotifier(object):
+    """@brief Sends sd_notify() messages (READY=1, WATCHDOG=1, STATUS=...) to the
+              NOTIFY_SOCKET that systemd passes to a Type=notify service. If the
+              process was not started by systemd every method does nothing."""
+
+    def __init__(self, environ=os.environ, clock=monotonic):
+        """@brief Constructor.
+           @param environ The environment containing NOTIFY_SOCKET, WATCHDOG_USEC and WATCHDOG_PID.
+           @param clock A function returning the time in seconds."""
+        self._clock = clock
+        self._address = self._get_address(environ.get('NOTIFY_SOCKET'))
+        self._watchdog_interval = self._get_watchdog_interval(environ)
+        self._sock = None
+        self._status = None
+        self._last_ping = None
+        self._ready = False
+        self._pings = 0
+        self._skipped = 0
+        self._send_errors = 0
+
+    def _get_address(self, notify_socket):
+        """@return The socket address or None if NOTIFY_SOCKET is not set."""
+        if not notify_socket or notify_socket[0] not in ('/', '@'):
+            return None
+        if notify_socket[0] == '@':
+            # Abstract namespace socket
+            return '\0' + notify_socket[1:]
+        return notify_socket
+
+    def _get_watchdog_interval(self, environ):
+        """@return The interval between watchdog pings in seconds (half of the systemd
+                   WatchdogSec) or None if the watchdog is not enabled for this process."""
+        try:
+            usec = int(environ.get('WATCHDOG_USEC', '0'))
+        except ValueError:
+            return None
+        if usec <= 0:
+            return None
+        pid = environ.get('WATCHDOG_PID')
+        if pid and pid != str(os.getpid()):
+            return None
+        return usec / 2_000_000
+
+    def is_enabled(self):
+        """@return True if the process was started by systemd with a NOTIFY_SOCKET."""
+        return self._address is not None
+
+    def get_watchdog_interval(self):
+        """@return The number of seconds between watchdog pings or None if the watchdog is not enabled."""
+        return self._watchdog_interval if self.is_enabled() else None
+
+    def _send(self, msg):
+        """@return True if the message was sent."""
+        if not self.is_enabled():
+            return False
+        try:
+            if self._sock is None:
+                # Non blocking so the main loop is never held up by systemd.
+                self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC | socket.SOCK_NONBLOCK)
+            self._sock.sendto(msg.encode('utf-8'), self._address)
+            return True
+        except OSError:
+            self._send_errors += 1
+            return False
+
+    def ready(self, status=None):
+        """@brief Tell systemd that the service has started.
+           @param status If not None the STATUS= text sent with READY=1."""
+        msg = "READY=1"
+        if status is not None:
+            msg += f"\nSTATUS={status}"
+            self._status = status
+        self._ready = self._send(msg)
+        if self._ready:
+            self._last_ping = self._clock()
+
+    def status(self, status):
+        """@brief Send a STATUS= line. It is not sent if it has not changed."""
+        if status != self._status and self._send(f"STATUS={status}"):
+            self._status = status
+
+    def watchdog(self, alive=True):
+        """@brief Send WATCHDOG=1 if the watchdog is enabled and a ping is due. Call this
+                  only when the main loop has completed an iteration so a hung loop stops
+                  the pings and systemd restarts the service.
+           @param alive If False the ping that is due is skipped (E.G another thread is hung)."""
+        if self.get_watchdog_interval() is None or not self._ready:
+            return
+        now = self._clock()
+        if now - self._last_ping < self._watchdog_interval:
+            return
+        # The next ping is due one interval after this one even if it is skipped or fails.
+        self._last_ping = now
+        if not alive:
+            self._skipped += 1
+        elif self._send("WATCHDOG=1"):
+            self._pings += 1
+
+    def get_watchdog_delay(self):
+        """@return The number of seconds until the next watchdog ping is due or None if the watchdog is not enabled."""
+        if self.get_watchdog_interval() is None or not self._ready:
+            return None
+        return max(0.0, self._last_ping + self._watchdog_interval - self._clock())
+
+    def stopping(self):
+        """@brief Tell systemd that the service is stopping."""
+        self._send("STOPPING=1")
+
+    def close(self):
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+    def get_stats(self):
+        """@return A dict containing the ready state, the watchdog interval, the pings sent and skipped and the send errors."""
+        return {'ready': self._ready,
+                'watchdog_interval': self._watchdog_interval,
+                'pings': self._pings,
+                'pings_skipped': self._skipped,
+                'send_errors': self._send_errors}
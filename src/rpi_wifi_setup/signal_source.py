@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+import os
+import subprocess
+
+from abc import ABC, abstractmethod
+
+# NetworkManager clamps the signal level to this range and maps it linearly to 0-100%
+# (nm_wifi_utils_level_to_quality()) so the same mapping is used here to match nmcli.
+NM_LEVEL_MIN_DBM = -100
+NM_LEVEL_MAX_DBM = -40
+
+
+def dbm_to_percent(dbm):
+    """@brief Convert a signal level in dBm to a percentage using the same mapping as NetworkManager.
+       @param dbm The signal level in dBm.
+       @return The signal strength (0-100)."""
+    dbm = min(max(dbm, NM_LEVEL_MIN_DBM), NM_LEVEL_MAX_DBM)
+    # As NetworkManager, the percentage below the maximum is truncated.
+    return 100 - int(100 * (NM_LEVEL_MAX_DBM - dbm) / (NM_LEVEL_MAX_DBM - NM_LEVEL_MIN_DBM))
+
+
+class SignalSource(ABC):
+    """@brief Base class for the objects that read the WiFi signal strength."""
+
+    NAME = None
+
+    def __init__(self, iface):
+        """@brief Constructor.
+           @param iface The WiFi interface name."""
+        self._iface = iface
+
+    def is_available(self):
+        """@return True if this source can be used on this system."""
+        return True
+
+    @abstractmethod
+    def read(self):
+        """@return The signal strength (0-100) of the connected network, 0 if not connected
+                   or None if the strength could not be read."""
+
+    async def read_async(self):
+        """@brief The asyncio version of read(). Sources that do not block return read()."""
+        return self.read()
+
+
+class ProcNetWirelessSource(SignalSource):
+    """@brief Reads the signal level of the associated access point from /proc/net/wireless.
+              This is a read of a small kernel file, no process is started and the radio is not used."""
+
+    NAME = "proc"
+    PROC_NET_WIRELESS = "/proc/net/wireless"
+
+    def __init__(self, iface, path=PROC_NET_WIRELESS):
+        """@brief Constructor.
+           @param iface The WiFi interface name.
+           @param path The file to read."""
+        super().__init__(iface)
+        self._path = path
+        self._prefix = f"{iface}:"
+
+    def is_available(self):
+        return os.path.isfile(self._path)
+
+    def read(self):
+        try:
+            with open(self._path, 'r') as fd:
+                return self.parse(fd.read())
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def parse(self, text):
+        """@brief Get the signal strength from the contents of /proc/net/wireless.
+           @param text The file contents.
+           @return The signal strength (0-100) or None if the interface is not listed."""
+        for line in text.splitlines():
+            line = line.strip()
+            if line.startswith(self._prefix):
+                # wlan0: 0000   70.  -40.  -256 ...
+                # iface: status link level noise ...
+                fields = line[len(self._prefix):].split()
+                level = float(fields[2].rstrip('.'))
+                if level > 0:
+                    # Some drivers report the level as an unsigned 8 bit value.
+                    level -= 256
+                if level == 0:
+                    # A level of 0 is reported when not associated.
+                    return 0
+                return dbm_to_percent(level)
+        return None
+
+
+class NmcliSignalSource(SignalSource):
+    """@brief Reads the signal strength of the connected network from the nmcli scan table.
+              This is the slowest source as nmcli is started and it may trigger a rescan."""
+
+    NAME = "nmcli"
+    NMCLI_CMD = ["nmcli", "-f", "IN-USE,SIGNAL", "device", "wifi"]
+
+    def __init__(self, iface, cmd=NMCLI_CMD):
+        """@brief Constructor.
+           @param iface The WiFi interface name.
+           @param cmd The command to run."""
+        super().__init__(iface)
+        self._cmd = cmd
+
+    def read(self):
+        try:
+            output = subprocess.check_output(self._cmd, encoding="utf-8")
+            return self.parse(output)
+        except Exception:
+            return None
+
+    async def read_async(self):
+        # Imported here so that the threaded engine does not load asyncio.
+        from rpi_wifi_setup.aio import check_output_async
+        try:
+            output = await check_output_async(self._cmd)
+            return self.parse(output)
+        except Exception:
+            return None
+
+    def parse(self, output):
+        """@brief Get the signal strength from the nmcli output.
+           @param output The nmcli command output.
+           @return The signal strength (0-100) or 0 if not connected."""
+        for line in output.splitlines():
+            if line.startswith('*'):  # The connected network
+                return int(line.split()[1])
+        return 0
+
+
+SIGNAL_SOURCES = (ProcNetWirelessSource, NmcliSignalSource)
+SIGNAL_SOURCE_AUTO = "auto"
+SIGNAL_SOURCE_NAMES = (SIGNAL_SOURCE_AUTO,) + tuple(source.NAME for source in SIGNAL_SOURCES)
+
+
+class SignalStrengthReader(object):
+    """@brief Reads the signal strength from the first source that returns a value."""
+
+    def __init__(self, iface, source_name=SIGNAL_SOURCE_AUTO):
+        """@brief Constructor.
+           @param iface The WiFi interface name.
+           @param source_name 'auto' to use the fastest available source falling back
+                              to the slower sources or the name of a single source."""
+        self._sources = []
+        for source_class in SIGNAL_SOURCES:
+            if source_name in (SIGNAL_SOURCE_AUTO, source_class.NAME):
+                source = source_class(iface)
+                if source.is_available():
+                    self._sources.append(source)
+
+    def read(self):
+        """@return The signal strength (0-100)."""
+        for source in self._sources:
+            strength = source.read()
+            if strength is not None:
+                return strength
+        return 0
+
+    async def read_async(self):
+        """@return The signal strength (0-100)."""
+        for source in self._sources:
+            strength = await source.read_async()
+            if strength is not None:
+                return strength
+        return 0
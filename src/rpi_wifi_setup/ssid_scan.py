@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+import threading
+import subprocess
+
+from time import monotonic
+
+
+def split_terse_fields(line):
+    """@brief Split a line of nmcli -t (terse) output. ':' and '\\' in a field are escaped with '\\'.
+       @param line The line of text.
+       @return A list of the field values."""
+    fields = []
+    field = []
+    chars = iter(line)
+    for char in chars:
+        if char == '\\':
+            field.append(next(chars, ''))
+        elif char == ':':
+            fields.append(''.join(field))
+            field = []
+        else:
+            field.append(char)
+    fields.append(''.join(field))
+    return fields
+
+
+def parse_wifi_list(output):
+    """@brief Parse the output of nmcli -t -f SSID,SIGNAL,SECURITY device wifi list.
+              Hidden networks are dropped and a network seen on several access points or
+              bands is listed once with its strongest signal.
+       @param output The nmcli command output.
+       @return A list of Network instances, strongest first."""
+    networks = {}
+    for line in output.splitlines():
+        fields = split_terse_fields(line)
+        if len(fields) < 3 or not fields[0]:
+            continue
+        try:
+            signal = int(fields[1])
+        except ValueError:
+            continue
+        network = networks.get(fields[0])
+        if network is None or signal > network.signal:
+            networks[fields[0]] = Network(fields[0], signal, fields[2])
+    return sorted(networks.values(), key=lambda network: (-network.signal, network.ssid))
+
+
+class Network(object):
+    """@brief A WiFi network found by a scan."""
+
+    def __init__(self, ssid, signal, security):
+        self.ssid = ssid
+        self.signal = signal
+        self.security = security
+
+
+class ScanResult(object):
+    """@brief The networks found by a scan and when the scan completed."""
+
+    def __init__(self, networks, timestamp, scan_time):
+        """@brief Constructor.
+           @param networks A list of Network instances.
+           @param timestamp The (scanner clock) time the scan completed.
+           @param scan_time The number of seconds the scan took."""
+        self.networks = networks
+        self.timestamp = timestamp
+        self.scan_time = scan_time
+
+
+class SsidScanner(object):
+    """@brief Keeps NetworkManager's list of the WiFi networks in range fresh while the device
+              is offline. wifi-connect reads this list when it starts so the WiFi portal has a
+              network list without scanning from cold. Scans run every interval seconds while the screen is on and
+              every idle_interval seconds while it is off. No scans run while the device is
+              online or while the portal is running (the WiFi interface is an access point)."""
+
+    DEFAULT_INTERVAL_SECONDS = 30.0
+    DEFAULT_IDLE_INTERVAL_SECONDS = 300.0
+    DEFAULT_TIMEOUT_SECONDS = 20.0
+    NMCLI_CMD = ["nmcli", "-t", "-f", "SSID,SIGNAL,SECURITY", "device", "wifi", "list", "--rescan", "yes"]
+
+    def __init__(self,
+                 interval=DEFAULT_INTERVAL_SECONDS,
+                 idle_interval=DEFAULT_IDLE_INTERVAL_SECONDS,
+                 cmd=NMCLI_CMD,
+                 timeout=DEFAULT_TIMEOUT_SECONDS,
+                 on_change=None,
+                 clock=monotonic):
+        """@brief Constructor.
+           @param interval The seconds between scans while offline with the screen on. 0 disables scanning.
+           @param idle_interval The seconds between scans while offline with the screen off.
+           @param cmd The scan command.
+           @param timeout The maximum number of seconds a scan may take. A scan that takes longer is killed and counted as an error.
+           @param on_change If not None a function called (from any thread) when the time of the next scan changes.
+           @param clock A function returning the time in seconds."""
+        self._interval = interval
+        self._idle_interval = max(idle_interval, interval)
+        self._cmd = cmd
+        self._timeout = timeout
+        self._on_change = on_change
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._offline = False
+        self._screen_on = True
+        self._paused = False
+        self._scanning = False
+        self._running = False
+        self._thread = None
+        self._result = None
+        self._last_scan = None
+        self._scans = 0
+        self._errors = 0
+        self._start_time = clock()
+
+    def is_enabled(self):
+        return self._interval > 0
+
+    def set_offline(self, offline):
+        """@brief Scans only run while the device is offline. Going offline starts a scan if the
+                  network list is older than the interval."""
+        self._set('_offline', offline)
+
+    def set_screen_on(self, on):
+        self._set('_screen_on', on)
+
+    def set_paused(self, paused):
+        """@brief Stop scanning (E.G while the portal is running). A scan that is already running
+                  is not stopped, use wait_idle() to wait for it."""
+        self._set('_paused', paused)
+
+    def wait_idle(self, timeout=None):
+        """@brief Wait for a scan that is running (E.G on the background thread) to complete.
+           @param timeout The maximum number of seconds to wait or None to wait until it completes.
+           @return True if no scan is running."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._scanning, timeout)
+
+    def _set(self, name, value):
+        with self._cond:
+            if getattr(self, name) == value:
+                return
+            setattr(self, name, value)
+            self._cond.notify()
+        if self._on_change:
+            self._on_change()
+
+    def get_interval(self):
+        """@return The seconds between scans or None if scans are not running."""
+        with self._cond:
+            if not self.is_enabled() or not self._offline or self._paused:
+                return None
+            return self._interval if self._screen_on else self._idle_interval
+
+    def get_delay(self):
+        """@return The seconds until the next scan is due (0 if it is due now) or None if scans are not running."""
+        interval = self.get_interval()
+        if interval is None:
+            return None
+        with self._cond:
+            if self._last_scan is None:
+                return 0.0
+            return max(0.0, self._last_scan + interval - self._clock())
+
+    def get_result(self, max_age=None):
+        """@param max_age If not None a result older than this number of seconds is not returned.
+           @return The latest ScanResult or None."""
+        with self._cond:
+            result = self._result
+        if result is None or (max_age is not None and self._clock() - result.timestamp > max_age):
+            return None
+        return result
+
+    def scan(self):
+        """@brief Scan for networks. Blocks until the scan completes.
+           @return The ScanResult or None if the scan failed."""
+        start = self._begin()
+        try:
+            # subprocess kills the command if it times out.
+            output = subprocess.check_output(self._cmd, encoding="utf-8", stderr=subprocess.DEVNULL, timeout=self._timeout)
+        except Exception:
+            return self._store(None, start)
+        else:
+            return self._store(output, start)
+        finally:
+            self._end()
+
+    async def scan_async(self):
+        """@brief Scan for networks without blocking the event loop.
+           @return The ScanResult or None if the scan failed."""
+        # Imported here so that the threaded engine does not load asyncio.
+        from rpi_wifi_setup.aio import check_output_async
+        start = self._begin()
+        try:
+            output = await check_output_async(self._cmd, timeout=self._timeout)
+        except Exception:
+            return self._store(None, start)
+        else:
+            return self._store(output, start)
+        finally:
+            self._end()
+
+    def _begin(self):
+        with self._cond:
+            self._scanning = True
+        return self._clock()
+
+    def _end(self):
+        with self._cond:
+            self._scanning = False
+            self._cond.notify_all()
+
+    def _store(self, output, start):
+        now = self._clock()
+        with self._cond:
+            # A failed scan is not retried until the next interval.
+            self._last_scan = now
+            if output is None:
+                self._errors += 1
+                return None
+            self._scans += 1
+            self._result = ScanResult(parse_wifi_list(output), now, now - start)
+            return self._result
+
+    def start(self):
+        """@brief Scan on a background thread."""
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    delay = self.get_delay()
+                    if delay == 0:
+                        # Set before the lock is released so that wait_idle() after set_paused() waits for this scan.
+                        self._scanning = True
+                        break
+                    self._cond.wait(delay)
+                if not self._running:
+                    return
+            self.scan()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def get_stats(self):
+        """@return A dict containing the scans, scans per hour, failed scans, the age of the
+                   network list and the number of networks and the time taken by the last scan."""
+        with self._cond:
+            result = self._result
+            elapsed = self._clock() - self._start_time
+            stats = {'scans': self._scans,
+                     'scans_per_hour': round(self._scans * 3600 / elapsed, 1) if elapsed > 0 else 0.0,
+                     'errors': self._errors}
+        if result:
+            stats.update({'age': round(self._clock() - result.timestamp, 1),
+                          'networks': len(result.networks),
+                          'scan_time': round(result.scan_time, 3)})
+        return stats
@@ -0,0 +1,55 @@
+import asyncio
+import selectors
+
+import pytest
+
+
+class VirtualClockSelector(selectors.DefaultSelector):
+    """@brief Returns the ready file descriptors without waiting. When none are ready the
+              loop's virtual clock is advanced by the timeout, so timers run immediately."""
+
+    def __init__(self):
+        super().__init__()
+        self.loop = None
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if events or timeout is None:
+            return events or super().select(timeout)
+        self.loop.now += timeout
+        return []
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """@brief An event loop whose time() only advances when the loop would otherwise wait."""
+
+    def __init__(self):
+        selector = VirtualClockSelector()
+        super().__init__(selector)
+        selector.loop = self
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def virtual_loop():
+    loop = VirtualClockLoop()
+    yield loop
+    loop.close()
+
+
+class Clock(object):
+    """@brief A clock that is set by the test."""
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""@brief Stands in for nmcli when checking the reconnect ladder and running the manager
+          without hardware. The state is a JSON file named by the FAKE_NMCLI_STATE
+          environment variable:
+          fix          The reconnect step that restores connectivity (E.G radio_toggle) or null.
+          delay        The number of seconds connectivity takes to return after that step.
+          hang         A reconnect step whose command never completes or null.
+          fail         A list of the reconnect steps whose command exits with an error.
+          connected_at Set to the time connectivity returns.
+          calls        Each command line is appended.
+          connectivity The networking connectivity state printed (default full).
+          connection show prints nmcli_connection_show.txt, device wifi list prints
+          nmcli_device_wifi_list.txt and device wifi prints nmcli_device_wifi.txt."""
+
+import os
+import sys
+import json
+import fcntl
+
+from time import sleep, time
+
+FIXTURES = os.path.dirname(os.path.abspath(__file__))
+FIXTURE = os.path.join(FIXTURES, 'nmcli_connection_show.txt')
+WIFI_LIST_FIXTURE = os.path.join(FIXTURES, 'nmcli_device_wifi_list.txt')
+WIFI_FIXTURE = os.path.join(FIXTURES, 'nmcli_device_wifi.txt')
+DEVICE_SHOW = "GENERAL.CONNECTION:HomeNetwork\nIP4.ADDRESS[1]:192.168.1.50/24\n"
+STEPS = {('connection', 'up'): "connection_up",
+         ('device', 'reapply'): "device_reapply",
+         ('radio', 'wifi'): "radio_toggle",
+         ('networking', 'on'): "networking_cycle"}
+
+args = sys.argv[1:]
+while args and args[0].startswith('-'):
+    # Global options, --wait takes a value.
+    args = args[2:] if args[0] in ('--wait', '-w', '-f', '--fields') else args[1:]
+
+state_file = os.environ['FAKE_NMCLI_STATE']
+with open(state_file, 'r+') as fd:
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    state = json.load(fd)
+    state['calls'].append(sys.argv[1:])
+    step = STEPS.get(tuple(args[:2]))
+    if step == "radio_toggle" and args[2:] != ['on']:
+        step = None
+    if step and step == state.get('fix') and state.get('connected_at') is None:
+        state['connected_at'] = time() + state.get('delay', 0)
+    fd.seek(0)
+    fd.truncate()
+    json.dump(state, fd)
+
+if args[:2] == ['connection', 'show']:
+    with open(FIXTURE) as fd:
+        sys.stdout.write(fd.read())
+
+elif args[:2] == ['networking', 'connectivity']:
+    print(state.get('connectivity', 'full'))
+
+elif args[:2] == ['device', 'show']:
+    sys.stdout.write(DEVICE_SHOW)
+
+elif args[:2] == ['device', 'wifi']:
+    with open(WIFI_LIST_FIXTURE if args[2:3] == ['list'] else WIFI_FIXTURE) as fd:
+        sys.stdout.write(fd.read())
+
+elif step and step == state.get('hang'):
+    sleep(3600)
+
+elif step and step in state.get('fail', []):
+    sys.exit(4)
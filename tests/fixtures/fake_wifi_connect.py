@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""@brief Stands in for the wifi-connect binary.
+          fake_wifi_connect.py <mode> <seconds>
+          connect     Exit 0 after <seconds>.
+          fail        Exit 1 after <seconds>.
+          stubborn    Ignore SIGTERM and run for <seconds>.
+          child       Start a child process that ignores SIGTERM (as sudo starts wifi-connect)
+                      and wait for it. Its pid is written to the file named by the third argument.
+          replay      Write the lines of the transcript file named by the third argument <seconds>
+                      apart, alternately to stdout and stderr and each in two parts as wifi-connect's
+                      logger may, then exit with the code given by the fourth argument."""
+
+import os
+import sys
+import signal
+import subprocess
+
+from time import sleep
+
+mode = sys.argv[1]
+seconds = float(sys.argv[2])
+
+if mode == 'connect':
+    sleep(seconds)
+    sys.exit(0)
+
+elif mode == 'fail':
+    sleep(seconds)
+    sys.exit(1)
+
+elif mode == 'stubborn':
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    sleep(seconds)
+
+elif mode == 'child':
+    child = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'stubborn', str(seconds)])
+    with open(sys.argv[3], 'w') as fd:
+        fd.write(str(child.pid))
+    child.wait()
+
+elif mode == 'replay':
+    with open(sys.argv[3], 'rb') as fd:
+        lines = fd.read().splitlines(keepends=True)
+    for index, line in enumerate(lines):
+        out = sys.stdout.buffer if index % 2 == 0 else sys.stderr.buffer
+        split = len(line) // 2
+        out.write(line[:split])
+        out.flush()
+        sleep(seconds / 2)
+        out.write(line[split:])
+        out.flush()
+        sleep(seconds / 2)
+    sys.exit(int(sys.argv[4]))
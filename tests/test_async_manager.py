@@ -0,0 +1,362 @@
+import os
+import asyncio
+
+import pytest
+
+from gpiozero import Device
+from gpiozero.pins.mock import MockFactory
+from p3lib.uio import UIO
+
+from rpi_wifi_setup import async_manager
+from rpi_wifi_setup.async_manager import AsyncWiFiSetupManager
+from rpi_wifi_setup.rpi_wifi_setup import WiFiSetupManager, get_arg_parser
+from rpi_wifi_setup.connectivity import ConnectivitySnapshot
+from rpi_wifi_setup.override import OverrideFile
+from rpi_wifi_setup.reconnect import ReconnectLadder, STEP_NETWORKING_CYCLE
+from rpi_wifi_setup.led import LED_CONNECTED, LED_CONFIGURING, LED_DISCONNECTED
+from rpi_wifi_setup.heartbeat import RESET_BUTTON
+from rpi_wifi_setup.portal import PORTAL_SUCCEEDED, PORTAL_FAILED
+from rpi_wifi_setup.ssid_scan import SsidScanner
+
+LED_PIN = 27
+SCREEN_OFF_SECONDS = 30
+DEBOUNCE_SECONDS = 0.02
+IP = "192.168.1.50"
+# The time each fake reconnect command takes and the pause between the off and on commands.
+CMD_SECONDS = 0.1
+PAUSE_SECONDS = 1.0
+SCAN_SECONDS = 5.0
+SCAN_INTERVAL_SECONDS = 30.0
+
+
+class FakeDevice(object):
+    """@brief Records when the display is shown and hidden."""
+
+    def __init__(self, clock):
+        self._clock = clock
+        self.events = []
+
+    def show(self):
+        self.events.append(('show', self._clock()))
+
+    def hide(self):
+        self.events.append(('hide', self._clock()))
+
+
+class FakePortalSession(object):
+    """@brief Stands in for a PortalSession that finishes in the given state after the given time."""
+
+    def __init__(self, seconds, state):
+        self._seconds = seconds
+        self._state = state
+        self.cancelled = False
+        self.started = None
+
+    async def run_async(self, prepare=None):
+        if prepare:
+            await prepare()
+        self.started = asyncio.get_running_loop().time()
+        try:
+            await asyncio.sleep(self._seconds)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+    def cancel(self):
+        self.cancelled = True
+
+    def get_state(self):
+        return self._state
+
+    def get_elapsed(self):
+        return self._seconds
+
+    def get_error(self):
+        return None
+
+
+class RecordingLadder(ReconnectLadder):
+    """@brief Records the reconnect commands rather than running nmcli."""
+
+    def __init__(self, clock):
+        super().__init__(WiFiSetupManager.WIFI_IFACE, steps=(STEP_NETWORKING_CYCLE,), pause=PAUSE_SECONDS, clock=clock)
+        self.cmds = []
+
+    async def _get_profile_async(self):
+        return None
+
+    async def _run_cmd_async(self, cmd, timeout):
+        await asyncio.sleep(CMD_SECONDS)
+        self.cmds.append(cmd[-2:])
+
+
+class SlowScanner(SsidScanner):
+    """@brief A scan that takes SCAN_SECONDS and finds no networks."""
+
+    def __init__(self, on_change, clock):
+        super().__init__(interval=SCAN_INTERVAL_SECONDS, on_change=on_change, clock=clock)
+        self.completed = []
+
+    async def scan_async(self):
+        start = self._begin()
+        try:
+            await asyncio.sleep(SCAN_SECONDS)
+            self.completed.append(self._clock())
+            return self._store("", start)
+        finally:
+            self._end()
+
+
+class FakeAsyncManager(AsyncWiFiSetupManager):
+    """@brief Replaces the display, nmcli, the override file observer and the rtnetlink
+              socket. The display messages and the heartbeat times are recorded."""
+
+    def _init(self):
+        self._assets_folder = None
+        self._ui_path = None
+        self._wifi_connect_binary = "wifi-connect"
+        self.connected = True
+        self.messages = []
+        self.heartbeats = []
+        self.portal_session = None
+
+    def _setup_display(self):
+        self._device = FakeDevice(self._loop.time)
+
+    def _start_override_observer(self):
+        pass
+
+    def _start_netlink_monitor(self):
+        pass
+
+    def _update_display(self, msg, strength=None):
+        self.messages.append(msg)
+
+    def _heartbeat(self):
+        self.heartbeats.append(self._loop.time())
+        super()._heartbeat()
+
+    def _create_portal_session(self, on_state_change=None):
+        return self.portal_session
+
+    async def _read_connectivity_snapshot_async(self):
+        if not self.connected:
+            return ConnectivitySnapshot(False)
+        return ConnectivitySnapshot(True, ip=IP, strength=70, ssid="HomeNetwork")
+
+
+@pytest.fixture
+def pin_factory():
+    previous = Device.pin_factory
+    Device.pin_factory = MockFactory()
+    yield Device.pin_factory
+    Device.pin_factory.reset()
+    Device.pin_factory = previous
+
+
+@pytest.fixture
+def make_manager(tmp_path, virtual_loop, pin_factory, monkeypatch):
+    async def run_async(cmd):
+        pass
+
+    monkeypatch.setattr(async_manager, "run_async", run_async)
+
+    def make_manager(*args):
+        options = get_arg_parser().parse_args(['--engine', WiFiSetupManager.ENGINE_ASYNCIO,
+                                               '--nm_backend', WiFiSetupManager.NM_BACKEND_NMCLI,
+                                               '--mailbox_dir', str(tmp_path / 'messages'),
+                                               '--display_socket', '',
+                                               '--framebuffer', '',
+                                               '--scan_interval', '0',
+                                               '--diagnostics_dir', str(tmp_path),
+                                               '--screen_off_seconds', str(SCREEN_OFF_SECONDS),
+                                               '--override_debounce', str(DEBOUNCE_SECONDS)] + list(args))
+        manager = FakeAsyncManager(UIO(), options)
+        manager._override_file = OverrideFile(str(tmp_path / 'oled_override.txt'))
+        manager._reconnect_ladder = RecordingLadder(virtual_loop.time)
+        return manager
+
+    return make_manager
+
+
+def run(loop, manager, scenario):
+    """@brief Run the manager on the virtual clock loop until the scenario completes, then stop it."""
+    async def main():
+        task = asyncio.ensure_future(manager._run())
+        while not manager.heartbeats:
+            await asyncio.sleep(0)
+        try:
+            await scenario()
+        finally:
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    loop.run_until_complete(main())
+
+
+def press(manager):
+    # gpiozero calls when_pressed from the thread that changes the pin.
+    manager._btn.pin.drive_low()
+    manager._btn.pin.drive_high()
+
+
+def test_screen_off_timer(virtual_loop, make_manager):
+    manager = make_manager()
+
+    async def scenario():
+        start = virtual_loop.time()
+        await asyncio.sleep(SCREEN_OFF_SECONDS / 2)
+        # A button press restarts the screen off timer.
+        press(manager)
+        await asyncio.sleep(0)
+        pressed = virtual_loop.time()
+        await asyncio.sleep(SCREEN_OFF_SECONDS - 1)
+        assert manager._screen_on and manager._device.events == []
+        await asyncio.sleep(2)
+        assert not manager._screen_on
+        assert manager._device.events == [('hide', pytest.approx(pressed + SCREEN_OFF_SECONDS, abs=0.01))]
+        assert pressed > start
+        press(manager)
+        await asyncio.sleep(0)
+        assert manager._screen_on
+        assert manager._device.events[-1][0] == 'show'
+
+    run(virtual_loop, manager, scenario)
+
+
+def test_button_press_resets_heartbeat(virtual_loop, make_manager):
+    manager = make_manager()
+
+    async def scenario():
+        start = manager.heartbeats[0]
+        # The heartbeat backs off to the base interval while the connectivity is unchanged.
+        await asyncio.sleep(40)
+        assert [t - start for t in manager.heartbeats] == pytest.approx([0, 2, 6, 14, 24, 34], abs=0.01)
+        press(manager)
+        await asyncio.sleep(0)
+        pressed = virtual_loop.time()
+        await asyncio.sleep(9)
+        # The next heartbeat is the minimum interval after the press, not at the base interval.
+        assert [t - pressed for t in manager.heartbeats[6:]] == pytest.approx([2, 4, 8], abs=0.01)
+        assert manager._heartbeat_policy.get_stats()['resets'] == {RESET_BUTTON: 1}
+
+    run(virtual_loop, manager, scenario)
+
+
+def test_override_debounce(virtual_loop, make_manager, tmp_path):
+    manager = make_manager()
+    msg = "Backup\nrunning"
+
+    async def scenario():
+        # The checks are made between the first and second heartbeats, which redraw the display.
+        await asyncio.sleep(1)
+        with open(tmp_path / 'oled_override.txt', 'w') as fd:
+            fd.write(msg)
+        # An older modification time so that the file is not re-read as racily modified.
+        os.utime(tmp_path / 'oled_override.txt', ns=(10 ** 18, 10 ** 18))
+        # The burst of events from a single write.
+        for _ in range(5):
+            manager.handle_interrupt_trigger()
+        await asyncio.sleep(DEBOUNCE_SECONDS / 2)
+        assert msg not in manager.messages
+        await asyncio.sleep(0.3)
+        assert manager._override_debouncer.get_stats() == {'triggers': 5, 'calls': 1}
+        assert manager.messages.count(msg) == 1
+        assert manager._override_file.get_stats()['reads'] == 1
+        # An event that does not change the file does not redraw the display.
+        os.utime(tmp_path / 'oled_override.txt', ns=(0, 0))
+        manager.handle_interrupt_trigger()
+        await asyncio.sleep(0.1)
+        assert manager._override_debouncer.get_stats() == {'triggers': 6, 'calls': 2}
+        assert manager._override_redraws_skipped == 1
+        assert manager.messages.count(msg) == 1
+        assert len(manager.heartbeats) == 1
+
+    run(virtual_loop, manager, scenario)
+
+
+def test_led_state(virtual_loop, make_manager):
+    manager = make_manager('--led_pin', str(LED_PIN))
+    manager.portal_session = FakePortalSession(60, PORTAL_SUCCEEDED)
+
+    async def scenario():
+        pin = manager._led._led.pin
+        await asyncio.sleep(0.1)
+        assert manager._led._state == LED_CONNECTED and pin.state
+        # NetworkManager reports the connectivity has been lost.
+        manager.connected = False
+        manager._on_connectivity_change()
+        await asyncio.sleep(0.1)
+        assert manager._led._state == LED_DISCONNECTED and not pin.state
+        manager._start_wifi_portal()
+        await asyncio.sleep(1)
+        assert manager._led._state == LED_CONFIGURING
+        # The portal connects to the network.
+        manager.connected = True
+        await asyncio.sleep(60)
+        assert manager._led._state == LED_CONNECTED and pin.state
+        # No display is used in LED mode.
+        assert manager._device is None
+
+    run(virtual_loop, manager, scenario)
+    assert not manager._led._led.pin.state
+
+
+def test_stop_cancels_portal(virtual_loop, make_manager):
+    manager = make_manager()
+    manager.portal_session = FakePortalSession(3600, PORTAL_SUCCEEDED)
+    tasks = []
+
+    async def scenario():
+        manager._start_wifi_portal()
+        await asyncio.sleep(10)
+        tasks.append(manager._portal_task)
+        assert not tasks[0].done()
+
+    run(virtual_loop, manager, scenario)
+    virtual_loop.run_until_complete(asyncio.sleep(0))
+    assert tasks[0].cancelled()
+    assert manager.portal_session.cancelled
+    # A cancelled portal does not start a reconnect.
+    assert manager._reconnect_ladder.get_stats()['runs'] == 0
+
+
+def test_stop_completes_reconnect_step(virtual_loop, make_manager):
+    manager = make_manager()
+    manager.portal_session = FakePortalSession(1, PORTAL_FAILED)
+    tasks = []
+
+    async def scenario():
+        manager.connected = False
+        manager._start_wifi_portal()
+        # Stop while the reconnect step is pausing between networking off and on.
+        while manager._reconnect_ladder.cmds != [['networking', 'off']]:
+            await asyncio.sleep(CMD_SECONDS)
+        tasks.append(manager._reconnect_task)
+
+    run(virtual_loop, manager, scenario)
+    # The reconnect task is not cancelled, the step completes so networking is not left off.
+    assert tasks[0].done() and not tasks[0].cancelled()
+    assert manager._reconnect_ladder.cmds == [['networking', 'off'], ['networking', 'on']]
+    assert manager._reconnect_ladder.get_stats()['cancelled'] == 1
+    assert manager._reconnect_task is None
+
+
+def test_portal_waits_for_scan(virtual_loop, make_manager):
+    manager = make_manager()
+    manager._ssid_scanner = SlowScanner(manager._wake_ssid_scanner, virtual_loop.time)
+    manager.connected = False
+    manager.portal_session = FakePortalSession(60, PORTAL_SUCCEEDED)
+
+    async def scenario():
+        # The first heartbeat finds the device offline, which starts a scan.
+        await asyncio.sleep(1)
+        assert not manager._ssid_scanner.wait_idle(0)
+        manager._start_wifi_portal()
+        await asyncio.sleep(SCAN_SECONDS)
+        # wifi-connect is started once the scan has completed and the fresh result is not scanned again.
+        assert manager._ssid_scanner.completed == [pytest.approx(manager.portal_session.started, abs=0.01)]
+        assert manager._ssid_scanner.get_stats()['scans'] == 1
+
+    run(virtual_loop, manager, scenario)
@@ -0,0 +1,263 @@
+import asyncio
+import threading
+
+from time import sleep
+
+import pytest
+
+from rpi_wifi_setup.connectivity import ConnectivitySnapshot, ConnectivityCache, AsyncConnectivityCache
+
+READ_SECONDS = 1.5
+
+
+class Reader(object):
+    """@brief A connectivity read that takes READ_SECONDS on the event loop clock."""
+
+    def __init__(self):
+        self.reads = 0
+
+    async def __call__(self):
+        self.reads += 1
+        await asyncio.sleep(READ_SECONDS)
+        return ConnectivitySnapshot(True, ip=f"192.168.1.{self.reads}", strength=70)
+
+
+def make_cache(loop, ttl=2.0):
+    reader = Reader()
+    return reader, AsyncConnectivityCache(reader, ttl=ttl, clock=loop.time)
+
+
+def test_async_ttl(virtual_loop):
+    reader, cache = make_cache(virtual_loop)
+
+    async def run():
+        first = await cache.get()
+        assert virtual_loop.time() == READ_SECONDS
+        await asyncio.sleep(1.9)
+        assert await cache.get() is first
+        await asyncio.sleep(0.1)
+        second = await cache.get()
+        assert second.ip == "192.168.1.2"
+        cache.invalidate()
+        await cache.get()
+
+    virtual_loop.run_until_complete(run())
+    assert reader.reads == 3
+    assert cache.get_stats() == {'hits': 1, 'misses': 3, 'shared': 0}
+
+
+def test_async_set_resets_ttl(virtual_loop):
+    reader, cache = make_cache(virtual_loop)
+
+    async def run():
+        snapshot = ConnectivitySnapshot(False)
+        cache.set(snapshot)
+        await asyncio.sleep(1.0)
+        assert await cache.get() is snapshot
+        await asyncio.sleep(1.0)
+        assert (await cache.get()).connected
+
+    virtual_loop.run_until_complete(run())
+    assert reader.reads == 1
+
+
+def test_async_single_flight(virtual_loop):
+    reader, cache = make_cache(virtual_loop)
+
+    async def run():
+        return await asyncio.gather(*(cache.get() for _ in range(5)))
+
+    snapshots = virtual_loop.run_until_complete(run())
+    assert reader.reads == 1
+    assert all(snapshot is snapshots[0] for snapshot in snapshots)
+    assert cache.get_stats() == {'hits': 0, 'misses': 1, 'shared': 4}
+    assert virtual_loop.time() == READ_SECONDS
+
+
+def test_async_cancelled_caller_does_not_cancel_refresh(virtual_loop):
+    reader, cache = make_cache(virtual_loop)
+
+    async def run():
+        first = asyncio.ensure_future(cache.get())
+        second = asyncio.ensure_future(cache.get())
+        await asyncio.sleep(0.5)
+        first.cancel()
+        snapshot = await second
+        assert first.cancelled()
+        return snapshot
+
+    assert virtual_loop.run_until_complete(run()).connected
+    assert reader.reads == 1
+
+
+def test_async_close_cancels_refresh(virtual_loop):
+    reader, cache = make_cache(virtual_loop)
+
+    async def run():
+        waiters = [asyncio.ensure_future(cache.get()) for _ in range(2)]
+        await asyncio.sleep(0.5)
+        cache.close()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        assert all(isinstance(result, asyncio.CancelledError) for result in results)
+        assert cache.peek() is None
+        # The next caller starts a new refresh.
+        assert (await cache.get()).connected
+
+    virtual_loop.run_until_complete(run())
+    assert reader.reads == 2
+    # No refresh task is left pending.
+    assert not [task for task in asyncio.all_tasks(virtual_loop) if not task.done()]
+
+
+def test_async_close_when_idle(virtual_loop):
+    reader, cache = make_cache(virtual_loop)
+    cache.close()
+    assert virtual_loop.run_until_complete(cache.get()).connected
+
+
+def test_async_read_error_is_shared(virtual_loop):
+    async def fail():
+        await asyncio.sleep(1.0)
+        raise OSError("nmcli failed")
+
+    cache = AsyncConnectivityCache(fail, clock=virtual_loop.time)
+
+    async def run():
+        return await asyncio.gather(cache.get(), cache.get(), return_exceptions=True)
+
+    results = virtual_loop.run_until_complete(run())
+    assert all(isinstance(result, OSError) for result in results)
+    assert cache.peek() is None
+
+
+def test_threaded_ttl(clock):
+    reads = []
+
+    def read():
+        reads.append(clock.now)
+        return ConnectivitySnapshot(True)
+
+    cache = ConnectivityCache(read, ttl=2.0, clock=clock)
+    first = cache.get()
+    clock.now = 1.9
+    assert cache.get() is first
+    clock.now = 2.0
+    assert cache.get() is not first
+    assert reads == [0.0, 2.0]
+
+
+def test_async_invalidate_during_refresh(virtual_loop):
+    reader, cache = make_cache(virtual_loop)
+
+    async def run():
+        waiter = asyncio.ensure_future(cache.get())
+        await asyncio.sleep(0.5)
+        cache.invalidate()
+        return await waiter
+
+    # The first read started before the invalidate so it is read again.
+    assert virtual_loop.run_until_complete(run()).ip == "192.168.1.2"
+    assert reader.reads == 2
+
+
+def test_async_set_during_refresh(virtual_loop):
+    reader, cache = make_cache(virtual_loop)
+    snapshot = ConnectivitySnapshot(False)
+
+    async def run():
+        waiters = [asyncio.ensure_future(cache.get()) for _ in range(2)]
+        await asyncio.sleep(0.5)
+        cache.set(snapshot)
+        return await asyncio.gather(*waiters)
+
+    assert virtual_loop.run_until_complete(run()) == [snapshot, snapshot]
+    assert cache.peek() is snapshot
+    assert reader.reads == 1
+
+
+class BlockingReader(object):
+    """@brief A connectivity read that blocks until released by the test."""
+
+    def __init__(self):
+        self.reads = 0
+        self.started = threading.Semaphore(0)
+        self._release = threading.Semaphore(0)
+
+    def __call__(self):
+        self.reads += 1
+        self.started.release()
+        self._release.acquire()
+        return ConnectivitySnapshot(True, ip=f"192.168.1.{self.reads}")
+
+    def release(self):
+        self._release.release()
+
+
+class Callers(object):
+    """@brief Calls ConnectivityCache.get() on several threads."""
+
+    def __init__(self, cache, count):
+        self.results = [None] * count
+        self._threads = [threading.Thread(target=self._get, args=(cache, index)) for index in range(count)]
+        for thread in self._threads:
+            thread.start()
+        # Allow the callers to block on the refresh.
+        sleep(0.1)
+
+    def _get(self, cache, index):
+        self.results[index] = cache.get()
+
+    def join(self):
+        for thread in self._threads:
+            thread.join(5)
+            assert not thread.is_alive()
+        return self.results
+
+
+@pytest.fixture
+def blocking_cache(clock):
+    reader = BlockingReader()
+    return reader, ConnectivityCache(reader, ttl=2.0, clock=clock)
+
+
+def test_threaded_single_flight(blocking_cache):
+    reader, cache = blocking_cache
+    callers = Callers(cache, 5)
+    assert reader.started.acquire(timeout=5)
+    reader.release()
+    results = callers.join()
+    assert reader.reads == 1
+    assert all(result is results[0] for result in results)
+    assert cache.get_stats() == {'hits': 0, 'misses': 1, 'shared': 4}
+
+
+def test_threaded_invalidate_during_refresh(blocking_cache):
+    reader, cache = blocking_cache
+    callers = Callers(cache, 3)
+    assert reader.started.acquire(timeout=5)
+    cache.invalidate()
+    reader.release()
+    # The first read started before the invalidate so it is read again.
+    assert reader.started.acquire(timeout=5)
+    reader.release()
+    results = callers.join()
+    assert reader.reads == 2
+    assert [result.ip for result in results] == ["192.168.1.2"] * 3
+
+
+def test_threaded_set_during_refresh(blocking_cache):
+    reader, cache = blocking_cache
+    callers = Callers(cache, 3)
+    assert reader.started.acquire(timeout=5)
+    snapshot = ConnectivitySnapshot(False)
+    cache.set(snapshot)
+    reader.release()
+    assert callers.join() == [snapshot] * 3
+    # The older refresh result does not replace the snapshot that was set.
+    assert cache.peek() is snapshot
+    assert reader.reads == 1
+
+
+@pytest.mark.parametrize("connected", [True, False])
+def test_snapshot_equality_ignores_timestamp(connected):
+    assert ConnectivitySnapshot(connected, timestamp=1) == ConnectivitySnapshot(connected, timestamp=2)
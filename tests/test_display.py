@@ -0,0 +1,164 @@
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+ImageDraw = pytest.importorskip("PIL.ImageDraw")
+pytest.importorskip("luma.oled")
+
+from luma.core.device import dummy  # noqa: E402
+from luma.oled.device import ssd1306  # noqa: E402
+
+from rpi_wifi_setup.display import DiffingDisplay, pack_pages, unpack_pages, COLUMNADDR, PAGEADDR, ADDRESS_CMD_BYTES  # noqa: E402
+
+WIDTH = 128
+HEIGHT = 64
+PAGES = HEIGHT // 8
+
+
+class RecordingSerial(object):
+    """@brief A luma serial interface that records the commands and data sent to the display."""
+
+    def __init__(self):
+        self.sent = []
+
+    def command(self, *cmd):
+        self.sent.append(('command', cmd))
+
+    def data(self, data):
+        self.sent.append(('data', bytes(data)))
+
+    def cleanup(self):
+        pass
+
+    def get_windows(self):
+        """@return A list of (command, data) tuples, one per address window sent."""
+        return [(self.sent[index][1], self.sent[index + 1][1]) for index in range(0, len(self.sent), 2)]
+
+
+@pytest.fixture
+def serial():
+    return RecordingSerial()
+
+
+@pytest.fixture
+def display(serial):
+    device = ssd1306(serial_interface=serial, width=WIDTH, height=HEIGHT)
+    # Ignore the commands sent by the luma device to initialise and clear the display.
+    serial.sent.clear()
+    return DiffingDisplay(device)
+
+
+def new_image(size=(WIDTH, HEIGHT)):
+    return Image.new('1', size)
+
+
+def window(first_col, last_col, first_page, last_page):
+    return (COLUMNADDR, first_col, last_col, PAGEADDR, first_page, last_page)
+
+
+def test_pack_pages():
+    image = new_image()
+    ImageDraw.Draw(image).point([(0, 0), (1, 7), (2, 8), (WIDTH - 1, HEIGHT - 1)], fill=1)
+    pages = pack_pages(image, PAGES)
+    assert len(pages) == PAGES
+    # Bit 0 of each byte is the top row of the page.
+    assert pages[0][:3] == bytes([0x01, 0x80, 0x00])
+    assert pages[1][:3] == bytes([0x00, 0x00, 0x01])
+    assert pages[PAGES - 1][WIDTH - 1] == 0x80
+    assert unpack_pages(b''.join(pages), WIDTH, HEIGHT).tobytes() == image.tobytes()
+
+
+def test_first_frame_sent_in_full(display, serial):
+    image = new_image()
+    ImageDraw.Draw(image).rectangle((0, 0, 7, 7), fill=1)
+    assert display.display(image) == ADDRESS_CMD_BYTES + WIDTH * PAGES
+    assert serial.get_windows() == [(window(0, WIDTH - 1, 0, PAGES - 1), b''.join(pack_pages(image, PAGES)))]
+
+
+def test_unchanged_frame(display, serial):
+    display.display(new_image())
+    serial.sent.clear()
+    assert display.display(new_image()) == 0
+    assert serial.sent == []
+    assert display.get_stats() == {'frames': 2, 'frames_skipped': 1, 'bytes_sent': ADDRESS_CMD_BYTES + WIDTH * PAGES}
+
+
+def test_one_glyph_change(display, serial):
+    display.display(new_image())
+    serial.sent.clear()
+    # A 6x8 glyph in the third page.
+    image = new_image()
+    ImageDraw.Draw(image).rectangle((10, 16, 15, 23), fill=1)
+    assert display.display(image) == ADDRESS_CMD_BYTES + 6
+    assert serial.get_windows() == [(window(10, 15, 2, 2), b'\xff' * 6)]
+
+
+def test_glyph_across_pages(display, serial):
+    display.display(new_image())
+    serial.sent.clear()
+    # A glyph that starts half way down the third page is sent as one window in each page.
+    image = new_image()
+    ImageDraw.Draw(image).rectangle((10, 20, 15, 27), fill=1)
+    assert display.display(image) == 2 * (ADDRESS_CMD_BYTES + 6)
+    assert serial.get_windows() == [(window(10, 15, 2, 2), b'\xf0' * 6),
+                                    (window(10, 15, 3, 3), b'\x0f' * 6)]
+
+
+def test_changed_columns_only(display, serial):
+    image = new_image()
+    ImageDraw.Draw(image).rectangle((10, 0, 20, 7), fill=1)
+    display.display(image)
+    serial.sent.clear()
+    # Only the columns between the first and last that changed are sent.
+    ImageDraw.Draw(image).point([(12, 0), (18, 0)], fill=0)
+    assert display.display(image) == ADDRESS_CMD_BYTES + 7
+    assert serial.get_windows() == [(window(12, 18, 0, 0), bytes([0xfe, 0xff, 0xff, 0xff, 0xff, 0xff, 0xfe]))]
+
+
+def test_full_change(display, serial):
+    display.display(new_image())
+    serial.sent.clear()
+    image = new_image()
+    ImageDraw.Draw(image).rectangle((0, 0, WIDTH - 1, HEIGHT - 1), fill=1)
+    # Every page has changed so each is sent as a window of the whole width.
+    assert display.display(image) == PAGES * (ADDRESS_CMD_BYTES + WIDTH)
+    assert serial.get_windows() == [(window(0, WIDTH - 1, page, page), b'\xff' * WIDTH) for page in range(PAGES)]
+
+
+def test_invalidate(display, serial):
+    display.display(new_image())
+    display.invalidate()
+    serial.sent.clear()
+    assert display.display(new_image()) == ADDRESS_CMD_BYTES + WIDTH * PAGES
+    assert serial.get_windows() == [(window(0, WIDTH - 1, 0, PAGES - 1), bytes(WIDTH * PAGES))]
+
+
+def test_column_offset(serial):
+    # The 64 pixel wide display RAM starts at column 32.
+    display = DiffingDisplay(ssd1306(serial_interface=serial, width=64, height=48))
+    display.display(new_image((64, 48)))
+    serial.sent.clear()
+    image = new_image((64, 48))
+    ImageDraw.Draw(image).rectangle((0, 0, 1, 7), fill=1)
+    display.display(image)
+    assert serial.get_windows() == [(window(32, 33, 0, 0), b'\xff' * 2)]
+
+
+def test_display_buffer(display, serial):
+    buffer = bytearray(WIDTH * PAGES)
+    buffer[0] = 0xff
+    assert display.display_buffer(buffer) == ADDRESS_CMD_BYTES + len(buffer)
+    assert serial.get_windows() == [(window(0, WIDTH - 1, 0, PAGES - 1), bytes(buffer))]
+    serial.sent.clear()
+    # The display RAM no longer holds the last image so the next image is sent in full.
+    assert display.display(new_image()) == ADDRESS_CMD_BYTES + WIDTH * PAGES
+
+
+def test_other_devices():
+    device = dummy(width=WIDTH, height=HEIGHT, mode='1')
+    display = DiffingDisplay(device)
+    image = new_image()
+    ImageDraw.Draw(image).rectangle((10, 16, 15, 23), fill=1)
+    # Devices that are not in the SSD1306 family are sent the whole image when it changes.
+    assert display.display(image) == WIDTH * PAGES
+    assert display.display(image) == 0
+    assert device.image.tobytes() == image.tobytes()
@@ -0,0 +1,130 @@
+import os
+
+import pytest
+
+from rpi_wifi_setup.display_socket import DisplaySocketServer, encode_display_message, parse_display_message
+from rpi_wifi_setup.display_client import DisplayClient
+
+
+class Timers(object):
+    """@brief A schedule function that keeps the timers so the test can fire them."""
+
+    def __init__(self):
+        self.pending = []
+
+    def __call__(self, delay, function):
+        timer = Timer(delay, function)
+        self.pending.append(timer)
+        return timer
+
+    def fire(self):
+        timers, self.pending = self.pending, []
+        for timer in timers:
+            if not timer.cancelled:
+                timer.function()
+
+
+class Timer(object):
+
+    def __init__(self, delay, function):
+        self.delay = delay
+        self.function = function
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+@pytest.fixture
+def server(tmp_path, clock):
+    changes = []
+    timers = Timers()
+    server = DisplaySocketServer(str(tmp_path / "display.sock"), on_change=lambda: changes.append(server.get_message()),
+                                 rate=10, burst=1, schedule=timers, clock=clock)
+    server.open()
+    server.changes = changes
+    server.timers = timers
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def client(server):
+    with DisplayClient(server.get_path()) as client:
+        yield client
+
+
+@pytest.mark.parametrize("text, signal, expected", [
+    ("CPU: 55C\nLoad: 0.4", None, ("CPU: 55C\nLoad: 0.4", None)),
+    ("{not json", None, ("{not json", None)),
+    ('{"text": "x"}', 80, ('{"text": "x"}', 80)),
+    (None, None, None),
+])
+def test_encode_round_trip(text, signal, expected):
+    assert parse_display_message(encode_display_message(text, signal=signal)) == expected
+
+
+@pytest.mark.parametrize("data, expected", [
+    (b"Plain text\n", ("Plain text", None)),
+    (b'{"lines": ["Rx", "Tx"], "signal": 130}', ("Rx\nTx", 100)),
+    (b'{"text": "  "}', None),
+    (b"", None),
+])
+def test_parse(data, expected):
+    assert parse_display_message(data) == expected
+
+
+def test_parse_invalid():
+    with pytest.raises(ValueError):
+        parse_display_message(b"{not json")
+
+
+def test_burst_displays_latest(server, client):
+    for index in range(5):
+        client.show(f"Message {index}")
+    assert server.handle_events()
+    # The latest message is displayed although only the first was within the rate limit.
+    assert server.changes == [("Message 4", None)]
+    assert server.get_stats()['rate_limited'] == 4 and server.get_stats()['accepted'] == 5
+
+
+def test_message_over_rate_limit_displayed_later(server, client, clock):
+    client.show("First")
+    assert server.handle_events()
+    client.show("Second")
+    assert not server.handle_events()
+    assert server.changes == [("First", None)]
+    # The message is kept and displayed when the rate limit next allows.
+    assert server.get_message() == ("Second", None)
+    assert [timer.delay for timer in server.timers.pending] == [pytest.approx(0.1)]
+    clock.now = 0.1
+    server.timers.fire()
+    assert server.changes == [("First", None), ("Second", None)]
+    assert not server.timers.pending
+
+
+def test_remove_not_rate_limited(server, client, clock):
+    client.show("First")
+    client.clear()
+    # The message was received and removed in the same call so the display does not change.
+    assert not server.handle_events()
+    assert server.get_message() is None and server.changes == []
+    clock.now = 1.0
+    client.show("Second")
+    assert server.handle_events()
+    # The rate limit is used up but the message is removed at once.
+    client.clear()
+    assert server.handle_events()
+    assert server.changes == [("Second", None), None]
+
+
+def test_close_cancels_timer(server, client):
+    client.show("First")
+    client.show("Second")
+    server.handle_events()
+    client.show("Third")
+    server.handle_events()
+    timers = list(server.timers.pending)
+    server.close()
+    assert timers and all(timer.cancelled for timer in timers)
+    assert not os.path.exists(server.get_path())
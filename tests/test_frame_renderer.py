@@ -0,0 +1,95 @@
+import os
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+ImageDraw = pytest.importorskip("PIL.ImageDraw")
+ImageFont = pytest.importorskip("PIL.ImageFont")
+
+from rpi_wifi_setup.frame_renderer import FrameRenderer, BitmapCache, TEXT_POS, WIFI_ICON_POS  # noqa: E402
+
+FONT_FILE = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+SIZE = (128, 64)
+SCREENS = [("OFFLINE\nHold button to\nsetup WiFi", None),
+           ("ONLINE\n192.168.1.50\nSignal: 0%", 0),
+           ("ONLINE\n192.168.1.50\nSignal: 26%", 26),
+           ("ONLINE\n192.168.1.50\nSignal: 51%", 51),
+           ("ONLINE\n192.168.1.50\nSignal: 100%", 100),
+           ("Line 1\n\nLine 3", None),
+           ("", None)]
+
+
+@pytest.fixture
+def font():
+    if os.path.isfile(FONT_FILE):
+        return ImageFont.truetype(FONT_FILE, 14)
+    return ImageFont.load_default(14)
+
+
+def render_canvas(msg, strength, font):
+    """@brief Render a frame by drawing on an ImageDraw canvas as the display did before frames were cached."""
+    image = Image.new('1', SIZE)
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, SIZE[0] - 1, SIZE[1] - 1), outline="white", fill="black")
+    draw.text(TEXT_POS, msg, fill="white", font=font)
+    if strength is not None:
+        x, y = WIFI_ICON_POS
+        for i in range(4):
+            height = (i + 1) * 3
+            fill = "white" if strength > (i * 25) else "black"
+            draw.rectangle([x + (i * 4), y - height, x + (i * 4) + 2, y], outline="white", fill=fill)
+    return image
+
+
+@pytest.mark.parametrize("cache_size", [BitmapCache.DEFAULT_SIZE, 0])
+def test_matches_canvas(font, cache_size):
+    renderer = FrameRenderer(SIZE, font, cache_size=cache_size)
+    # Render each screen twice so that cached frames and bitmaps are also compared.
+    for msg, strength in SCREENS * 2:
+        image = renderer.render(msg, strength=strength)
+        assert image.mode == '1' and image.size == SIZE
+        assert image.tobytes() == render_canvas(msg, strength, font).tobytes(), (msg, strength)
+
+
+def test_cached_frame(font):
+    renderer = FrameRenderer(SIZE, font)
+    image = renderer.render("ONLINE", strength=60)
+    assert renderer.render("ONLINE", strength=60) is image
+    # The same number of bars is the same frame.
+    assert renderer.render("ONLINE", strength=70) is image
+    assert renderer.render("ONLINE", strength=80) is not image
+
+
+def test_no_cache(font):
+    renderer = FrameRenderer(SIZE, font, cache_size=0)
+    image = renderer.render("ONLINE", strength=60)
+    assert renderer.render("ONLINE", strength=60) is not image
+    stats = renderer.get_stats()
+    assert stats['hits'] == 0
+    assert stats['size'] == 0
+
+
+def test_bitmap_cache_lru():
+    cache = BitmapCache(2)
+    created = []
+
+    def create(key):
+        created.append(key)
+        return key.upper()
+
+    for key in ("a", "b", "a", "c", "a", "b"):
+        assert cache.get(key, lambda: create(key)) == key.upper()
+    # b was the least recently used when c was added and c when b was added again.
+    assert created == ["a", "b", "c", "b"]
+    assert cache.get_stats() == {'hits': 2, 'misses': 4, 'size': 2}
+    assert cache.get("a", lambda: create("a")) == "A"
+    assert cache.get("c", lambda: create("c")) == "C"
+    assert created == ["a", "b", "c", "b", "c"]
+
+
+def test_renderer_eviction(font):
+    renderer = FrameRenderer(SIZE, font, cache_size=4)
+    for index in range(20):
+        msg = f"Count\n{index}"
+        assert renderer.render(msg).tobytes() == render_canvas(msg, None, font).tobytes()
+    assert renderer.get_stats()['size'] == 4
@@ -0,0 +1,89 @@
+import pytest
+
+from rpi_wifi_setup.framebuffer import FramebufferReader, FramebufferWriter, get_frame_size
+
+WIDTH = 128
+HEIGHT = 64
+
+
+class BufferDisplay(object):
+    """@brief Records the frames sent with DiffingDisplay.display_buffer()."""
+
+    def __init__(self):
+        self.frames = []
+
+    def display_buffer(self, data):
+        self.frames.append(bytes(data))
+
+
+@pytest.fixture
+def framebuffer(tmp_path):
+    changes = []
+    reader = FramebufferReader(str(tmp_path / "fb"), WIDTH, HEIGHT, on_change=lambda: changes.append(reader.is_active()))
+    reader.open()
+    writer = FramebufferWriter(str(tmp_path / "fb"))
+    reader.changes = changes
+    yield reader, writer
+    writer.close()
+    reader.close()
+
+
+def frame(value):
+    return bytes([value]) * get_frame_size(WIDTH, HEIGHT)
+
+
+def test_write_and_clear(framebuffer):
+    reader, writer = framebuffer
+    assert (writer.width, writer.height) == (WIDTH, HEIGHT)
+    assert not reader.is_active() and not reader.handle_events()
+
+    display = BufferDisplay()
+    writer.write(frame(0x55))
+    assert reader.handle_events()
+    assert reader.blit(display)
+    assert display.frames == [frame(0x55)]
+    # Only one change is reported per frame.
+    assert not reader.handle_events()
+
+    writer.clear()
+    assert reader.handle_events()
+    assert reader.changes == [True, False]
+    assert reader.get_stats() == {'frames': 1, 'torn': 0}
+
+
+def test_frame_being_written(framebuffer):
+    reader, writer = framebuffer
+    writer.write(frame(1))
+    reader.handle_events()
+    # The sequence number is odd while the writer updates the frame.
+    sequence = writer._begin_update()
+    assert not reader.handle_events()
+    assert not reader.blit(BufferDisplay())
+    writer._end_update(sequence)
+    assert reader.handle_events()
+    assert reader.get_stats()['torn'] == 1
+
+
+def test_wrong_frame_size(framebuffer):
+    _reader, writer = framebuffer
+    with pytest.raises(Exception):
+        writer.write(b'\0' * 10)
+
+
+def test_dummy_device_matches_images(framebuffer):
+    Image = pytest.importorskip("PIL.Image")
+    ImageDraw = pytest.importorskip("PIL.ImageDraw")
+    pytest.importorskip("luma.core")
+    from luma.core.device import dummy
+    from rpi_wifi_setup.display import DiffingDisplay
+
+    reader, writer = framebuffer
+    device = dummy(width=WIDTH, height=HEIGHT, mode='1')
+    display = DiffingDisplay(device)
+    for index in range(8):
+        image = Image.new('1', (WIDTH, HEIGHT))
+        ImageDraw.Draw(image).rectangle((index * 8, index * 4, index * 8 + 20, HEIGHT - 1), fill=1)
+        writer.write_image(image)
+        assert reader.handle_events()
+        assert reader.blit(display)
+        assert device.image.tobytes() == image.tobytes(), index
@@ -0,0 +1,91 @@
+import pytest
+
+from rpi_wifi_setup.connectivity import ConnectivitySnapshot
+from rpi_wifi_setup.heartbeat import HeartbeatPolicy, RESET_BUTTON, RESET_PORTAL, RESET_DISCONNECT, RESET_CHANGE
+
+BASE_INTERVAL = 10.0
+MIN_INTERVAL = 2.0
+MAX_INTERVAL = 120.0
+IP = "192.168.1.50"
+
+
+@pytest.fixture
+def policy(clock):
+    return HeartbeatPolicy(BASE_INTERVAL, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, backoff=2.0, clock=clock)
+
+
+def snapshot(connected, clock, ip=IP):
+    return ConnectivitySnapshot(connected, ip=ip if connected else None, timestamp=clock.now)
+
+
+def intervals(policy, shown, count):
+    return [policy.next_interval(shown) for _ in range(count)]
+
+
+def test_backoff_shown(policy):
+    # The interval doubles up to the base interval while the screen is on.
+    assert intervals(policy, True, 5) == [2.0, 4.0, 8.0, 10.0, 10.0]
+    assert policy.get_interval(True) == BASE_INTERVAL
+
+
+def test_backoff_not_shown(policy):
+    # The interval doubles up to the maximum interval while the screen is off.
+    assert intervals(policy, False, 8) == [2.0, 4.0, 8.0, 16.0, 32.0, 64.0, 120.0, 120.0]
+    # Turning the screen on caps the interval at once.
+    assert policy.get_interval(True) == BASE_INTERVAL
+    assert policy.next_interval(True) == BASE_INTERVAL
+    # The backed off interval was capped at the base interval by the heartbeat.
+    assert policy.get_interval(False) == BASE_INTERVAL
+
+
+def test_reset_reasons(policy, clock):
+    for reason in (RESET_BUTTON, RESET_PORTAL, RESET_BUTTON):
+        intervals(policy, False, 4)
+        policy.reset(reason)
+        assert policy.get_interval(False) == MIN_INTERVAL
+    assert not policy.record(snapshot(True, clock))
+    intervals(policy, False, 4)
+    # A different address resets the interval.
+    assert policy.record(snapshot(True, clock, ip="192.168.1.51"))
+    assert policy.get_interval(False) == MIN_INTERVAL
+    intervals(policy, False, 4)
+    assert policy.record(snapshot(False, clock))
+    assert policy.get_interval(False) == MIN_INTERVAL
+    assert policy.get_stats()['resets'] == {RESET_BUTTON: 2, RESET_PORTAL: 1, RESET_CHANGE: 1, RESET_DISCONNECT: 1}
+
+
+def test_unchanged_state_backs_off(policy, clock):
+    assert not policy.record(None)
+    assert not policy.record(snapshot(True, clock))
+    intervals(policy, True, 3)
+    # Only the connectivity and address are compared, not the signal strength.
+    assert not policy.record(ConnectivitySnapshot(True, ip=IP, strength=20, timestamp=clock.now))
+    assert policy.get_interval(True) == BASE_INTERVAL
+    assert policy.get_stats()['resets'] == {}
+
+
+def test_detect_time(policy, clock):
+    stats = policy.get_stats()
+    assert stats['detect_disconnect_last'] is None and stats['detect_disconnect_max'] is None
+    clock.now = 100.0
+    policy.record(snapshot(True, clock))
+    clock.now = 108.0
+    policy.record(snapshot(True, clock))
+    # The link was last seen connected 6 seconds before the disconnect was seen.
+    clock.now = 114.0
+    assert policy.record(snapshot(False, clock))
+    clock.now = 200.0
+    policy.record(snapshot(True, clock))
+    clock.now = 202.0
+    assert policy.record(snapshot(False, clock))
+    stats = policy.get_stats()
+    assert stats['detect_disconnect_last'] == 2.0
+    assert stats['detect_disconnect_max'] == 6.0
+
+
+def test_polls_per_hour(policy, clock):
+    intervals(policy, True, 10)
+    clock.now = 1800.0
+    stats = policy.get_stats()
+    assert stats['polls'] == 10
+    assert stats['polls_per_hour'] == 20.0
@@ -0,0 +1,106 @@
+import os
+
+import pytest
+
+from rpi_wifi_setup.inotify import InotifyWatcher, InotifyDirectoryWatcher, parse_inotify_events, INOTIFY_EVENT, \
+    IN_CLOSE_WRITE
+
+pytestmark = pytest.mark.skipif(not InotifyWatcher.is_available(), reason="inotify is not available")
+
+NAME = "oled_override.txt"
+
+
+class Changes(object):
+    """@brief Records the on_change calls."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, *args):
+        self.calls.append(args)
+
+
+def write(path, text):
+    with open(path, 'w') as fd:
+        fd.write(text)
+
+
+@pytest.fixture
+def watcher(tmp_path):
+    changes = Changes()
+    watcher = InotifyWatcher(str(tmp_path / NAME), on_change=changes)
+    watcher.open()
+    watcher.changes = changes
+    yield watcher
+    watcher.close()
+
+
+def test_parse_inotify_events():
+    name = NAME.encode() + b'\0' * 3
+    data = INOTIFY_EVENT.pack(1, IN_CLOSE_WRITE, 0, len(name)) + name + INOTIFY_EVENT.pack(1, IN_CLOSE_WRITE, 0, 0)
+    assert parse_inotify_events(data) == [(1, IN_CLOSE_WRITE, 0, NAME), (1, IN_CLOSE_WRITE, 0, "")]
+
+
+def test_other_files_ignored(watcher, tmp_path):
+    # Other files in the directory wake the owner but do not call on_change.
+    write(tmp_path / "other.txt", "other")
+    assert not watcher.handle_events()
+    assert watcher.changes.calls == []
+    assert watcher.get_stats() == {'wakeups': 1, 'events': 1, 'matched': 0}
+    write(tmp_path / NAME, "Hello")
+    assert watcher.handle_events()
+    assert watcher.changes.calls == [()]
+    assert watcher.get_stats() == {'wakeups': 2, 'events': 2, 'matched': 1}
+
+
+def test_partial_write_not_reported(watcher, tmp_path):
+    with open(tmp_path / NAME, 'w') as fd:
+        fd.write("Hel")
+        fd.flush()
+        # Opens and writes are not watched, only the close after the write.
+        assert not watcher.handle_events()
+        assert watcher.get_stats()['events'] == 0
+        fd.write("lo")
+    assert watcher.handle_events()
+    assert len(watcher.changes.calls) == 1
+
+
+def test_rename_over(watcher, tmp_path):
+    # An editor (or an atomic update) writes a temporary file and renames it over the file.
+    write(tmp_path / NAME, "Hello")
+    watcher.handle_events()
+    temp = tmp_path / f".{NAME}.swp"
+    write(temp, "Goodbye")
+    os.rename(temp, tmp_path / NAME)
+    # The close of the temporary file, its rename from and the rename to are read together.
+    assert watcher.handle_events()
+    assert len(watcher.changes.calls) == 2
+    assert watcher.get_stats()['events'] == 4
+
+
+def test_delete(watcher, tmp_path):
+    write(tmp_path / NAME, "Hello")
+    watcher.handle_events()
+    os.remove(tmp_path / NAME)
+    assert watcher.handle_events()
+    assert len(watcher.changes.calls) == 2
+
+
+def test_no_events(watcher):
+    assert not watcher.handle_events()
+    assert watcher.get_stats() == {'wakeups': 1, 'events': 0, 'matched': 0}
+
+
+def test_directory_watcher(tmp_path):
+    changes = Changes()
+    watcher = InotifyDirectoryWatcher(str(tmp_path), on_change=changes)
+    watcher.open()
+    try:
+        assert not watcher.handle_events()
+        write(tmp_path / "a", "A")
+        write(tmp_path / ".b", "B")
+        os.rename(tmp_path / ".b", tmp_path / "b")
+        assert watcher.handle_events()
+        assert changes.calls == [({"a", ".b", "b"},)]
+    finally:
+        watcher.close()
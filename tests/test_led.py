@@ -0,0 +1,75 @@
+from time import sleep
+
+import pytest
+
+from gpiozero import Device, LED
+from gpiozero.pins.mock import MockFactory
+
+from rpi_wifi_setup.led import PatternLED, LED_CONNECTED, LED_DISCONNECTED, LED_CONFIGURING, LED_NO_INTERNET
+from rpi_wifi_setup.rpi_wifi_setup import WifiLEDCtrl
+
+PIN = 5
+# The flash patterns used by the tests, short so that the pin changes within the test.
+BLINK_PATTERNS = {LED_CONFIGURING: (0.01, 0.01), LED_NO_INTERNET: (0.01, 0.03)}
+
+
+@pytest.fixture
+def pin_factory():
+    previous = Device.pin_factory
+    Device.pin_factory = MockFactory()
+    yield Device.pin_factory
+    Device.pin_factory.reset()
+    Device.pin_factory = previous
+
+
+@pytest.fixture
+def led(pin_factory):
+    led = LED(PIN)
+    yield led
+    led.close()
+
+
+def count_changes(pin, seconds):
+    pin.clear_states()
+    sleep(seconds)
+    # The first entry is the state when cleared.
+    return len(pin.states) - 1
+
+
+@pytest.mark.parametrize("state, value", [(LED_CONNECTED, True), (LED_DISCONNECTED, False)])
+def test_steady_state_written_once(led, state, value):
+    output = PatternLED(led, blink_patterns=BLINK_PATTERNS)
+    output.show(LED_CONFIGURING)
+    output.show(state)
+    assert count_changes(led.pin, 0.1) == 0
+    assert led.pin.state == value
+    output.show(state)
+    assert output.get_stats() == {'writes': 2}
+
+
+def test_flashing_state(led):
+    output = PatternLED(led, blink_patterns=BLINK_PATTERNS)
+    output.show(LED_CONFIGURING)
+    assert count_changes(led.pin, 0.2) >= 4
+    output.off()
+    assert count_changes(led.pin, 0.1) == 0
+    assert not led.pin.state
+
+
+def test_led_thread(pin_factory):
+    led_ctrl = WifiLEDCtrl(PIN)
+    led_ctrl.start()
+    try:
+        for state, value in ((WifiLEDCtrl.CONNECTED, True), (WifiLEDCtrl.DISCONNECTED, False)):
+            led_ctrl.set_state(state)
+            # Allow the state to be applied before counting.
+            sleep(0.05)
+            wakeups = led_ctrl.get_stats()['wakeups']
+            assert count_changes(led_ctrl.led.pin, 0.2) == 0
+            assert led_ctrl.led.pin.state == value
+            # The thread only wakes when the state changes.
+            assert led_ctrl.get_stats()['wakeups'] == wakeups
+    finally:
+        led_ctrl.stop()
+    assert not led_ctrl.is_alive()
+    led_ctrl.led.close()
@@ -0,0 +1,101 @@
+import os
+
+from time import time
+
+import pytest
+
+from rpi_wifi_setup.mailbox import Mailbox, parse_message
+
+
+@pytest.fixture
+def mailbox(tmp_path, clock):
+    clock.now = time()
+    return Mailbox(str(tmp_path), clock=clock)
+
+
+def write(mailbox, name, text, mtime_ns=None):
+    path = os.path.join(mailbox.get_folder(), name)
+    with open(path, 'w') as fd:
+        fd.write(text)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_parse_message():
+    assert parse_message("#priority=2\n#ttl=10\nHello\n", 100.0) == (2, 110.0, "Hello")
+    assert parse_message("#expires=50\nHello", 0) == (0, 50.0, "Hello")
+    # Unknown headers are displayed.
+    assert parse_message("#colour=red\nHello", 0) == (0, None, "#colour=red\nHello")
+
+
+def test_priority_and_rotation(mailbox):
+    write(mailbox, "a", "#priority=1\nA")
+    write(mailbox, "b", "#priority=1\nB")
+    write(mailbox, "c", "C")
+    assert mailbox.scan()
+    shown = set()
+    for _ in range(2):
+        shown.add(mailbox.get_message())
+        mailbox.rotate()
+    assert shown == {"A", "B"}
+    os.remove(os.path.join(mailbox.get_folder(), "a"))
+    os.remove(os.path.join(mailbox.get_folder(), "b"))
+    assert mailbox.update({"a", "b"})
+    assert mailbox.get_message() == "C"
+
+
+def test_expiry(mailbox, clock):
+    assert mailbox.get_next_expiry() is None
+    expires = clock.now + 10
+    write(mailbox, "a", f"#expires={expires}\nA")
+    write(mailbox, "b", f"#expires={expires + 5}\nB")
+    write(mailbox, "c", "C")
+    mailbox.scan()
+    assert mailbox.get_next_expiry() == expires
+    clock.now = expires - 1
+    assert not mailbox.expire()
+    clock.now = expires
+    assert mailbox.expire()
+    assert mailbox.get_next_expiry() == expires + 5
+    clock.now = expires + 5
+    assert mailbox.expire()
+    assert mailbox.get_next_expiry() is None
+    assert mailbox.get_message() == "C"
+
+
+def test_timestamp_change_keeps_expiry_entry(mailbox, clock):
+    text = f"#expires={clock.now + 10}\nA"
+    write(mailbox, "a", text, mtime_ns=1_000_000_000)
+    mailbox.scan()
+    for second in range(2, 10):
+        # The same message rewritten, only the modification time changes.
+        write(mailbox, "a", text, mtime_ns=second * 1_000_000_000)
+        assert not mailbox.update({"a"})
+    assert len(mailbox._expiry_heap) == 1
+    assert mailbox.get_stats() == {'messages': 1, 'reads': 9}
+
+
+def test_changed_expiry(mailbox, clock):
+    write(mailbox, "a", f"#expires={clock.now + 10}\nA")
+    mailbox.scan()
+    write(mailbox, "a", f"#expires={clock.now + 20}\nA")
+    assert mailbox.update({"a"})
+    # The stale entry of the earlier expiry is dropped.
+    assert mailbox.get_next_expiry() == clock.now + 20
+    clock.now += 10
+    assert not mailbox.expire()
+    assert mailbox.get_message() == "A"
+
+
+def test_expiry_heap_bounded(mailbox, clock):
+    for index in range(100):
+        write(mailbox, "a", f"#expires={clock.now + 10 + index}\nA")
+        mailbox.update({"a"})
+    assert len(mailbox._expiry_heap) <= 3
+    assert mailbox.get_next_expiry() == clock.now + 109
+
+
+def test_hidden_files_ignored(mailbox):
+    write(mailbox, ".a", "A")
+    assert not mailbox.scan()
+    assert mailbox.get_message() is None
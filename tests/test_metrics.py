@@ -0,0 +1,127 @@
+import os
+import urllib.request
+import urllib.error
+
+from timeit import timeit
+
+import pytest
+
+from rpi_wifi_setup.metrics import MetricsRegistry, TextfileExporter, MetricsHTTPServer, Histogram, \
+    METRIC_COMMAND, METRIC_RENDER, METRIC_DISPLAY_TRANSFER, METRIC_BUTTON_TO_DISPLAY, METRIC_PORTAL, \
+    METRIC_TIME_TO_CONNECTIVITY, METRIC_PREFIX
+from rpi_wifi_setup.heartbeat import HeartbeatPolicy
+
+# The observations on a heartbeat with the nmcli backend that redraws the display after a button press.
+HEARTBEAT_TIMERS = ((METRIC_COMMAND, {'command': "check_internet"}),
+                    (METRIC_COMMAND, {'command': "wifi_ip"}),
+                    (METRIC_COMMAND, {'command': "wifi_strength"}),
+                    (METRIC_RENDER, {}),
+                    (METRIC_DISPLAY_TRANSFER, {}))
+HEARTBEAT_OBSERVATIONS = ((METRIC_BUTTON_TO_DISPLAY, {}),
+                          (METRIC_TIME_TO_CONNECTIVITY, {}))
+
+
+def parse(text):
+    """@return A dict of sample name and labels: value."""
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith('#'):
+            assert line.startswith(f"# HELP {METRIC_PREFIX}") or line.startswith(f"# TYPE {METRIC_PREFIX}"), line
+            continue
+        name, value = line.rsplit(' ', 1)
+        samples[name] = float(value)
+    return samples
+
+
+def test_histograms():
+    registry = MetricsRegistry()
+    for value in (0.0005, 0.003, 0.003, 0.2, 100.0):
+        registry.observe(METRIC_RENDER, value)
+    registry.observe(METRIC_COMMAND, 0.02, command="check_internet")
+    registry.observe(METRIC_PORTAL, 95.0, state="succeeded")
+    samples = parse(registry.render())
+    render = METRIC_PREFIX + METRIC_RENDER
+    assert samples[f'{render}_bucket{{le="0.001"}}'] == 1
+    assert samples[f'{render}_bucket{{le="0.005"}}'] == 3
+    assert samples[f'{render}_bucket{{le="30.0"}}'] == 4
+    assert samples[f'{render}_bucket{{le="+Inf"}}'] == 5 == samples[f'{render}_count']
+    assert samples[f'{render}_sum'] == pytest.approx(100.2065)
+    command = METRIC_PREFIX + METRIC_COMMAND
+    assert samples[f'{command}_bucket{{command="check_internet",le="0.025"}}'] == 1
+    assert samples[f'{command}_count{{command="check_internet"}}'] == 1
+    portal = METRIC_PREFIX + METRIC_PORTAL
+    assert samples[f'{portal}_bucket{{state="succeeded",le="60.0"}}'] == 0
+    assert samples[f'{portal}_bucket{{state="succeeded",le="120.0"}}'] == 1
+
+
+def test_histogram_size_fixed():
+    # The memory used does not grow with the number of observations.
+    histogram = Histogram()
+    buckets = len(histogram.get_cumulative_counts())
+    for index in range(100000):
+        histogram.observe(index / 1000)
+    assert len(histogram.get_cumulative_counts()) == buckets
+    assert histogram.get_count() == 100000
+
+
+def test_textfile(tmp_path, clock):
+    registry = MetricsRegistry()
+    filename = str(tmp_path / 'rpi_wifi_setup.prom')
+    exporter = TextfileExporter(registry, filename, min_interval=15, clock=clock)
+    assert exporter.write()
+    registry.observe(METRIC_RENDER, 0.002)
+    # Not written before min_interval.
+    assert not exporter.write()
+    clock.now = 15
+    assert exporter.write()
+    # Not written without a change.
+    assert not exporter.write()
+    registry.observe(METRIC_RENDER, 0.002)
+    assert exporter.write(force=True)
+    with open(filename) as fd:
+        assert fd.read() == registry.render()
+    # The temporary file is renamed into place.
+    assert os.listdir(tmp_path) == ['rpi_wifi_setup.prom']
+
+
+def test_http():
+    registry = MetricsRegistry()
+    registry.observe(METRIC_RENDER, 0.002)
+    server = MetricsHTTPServer(registry, 0)
+    server.start()
+    try:
+        url = f"http://127.0.0.1:{server.get_port()}"
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            assert response.read().decode() == registry.render()
+        with pytest.raises(urllib.error.HTTPError) as ex:
+            urllib.request.urlopen(f"{url}/other")
+        assert ex.value.code == 404
+    finally:
+        server.stop()
+
+
+def test_overhead(tmp_path):
+    # The timers recorded on each heartbeat plus the textfile write (amortised over the
+    # heartbeats between writes) must cost less than 1% of the shortest heartbeat interval.
+    registry = MetricsRegistry()
+    iterations = 2000
+    writes = 50
+
+    def timers():
+        for name, labels in HEARTBEAT_TIMERS:
+            with registry.time(name, **labels):
+                pass
+        for name, labels in HEARTBEAT_OBSERVATIONS:
+            registry.observe(name, 0.1, **labels)
+
+    timer_cost = timeit(timers, number=iterations) / iterations
+    exporter = TextfileExporter(registry, str(tmp_path / 'overhead.prom'), min_interval=0)
+
+    def write():
+        registry.observe(METRIC_RENDER, 0.001)
+        exporter.write()
+
+    write_cost = timeit(write, number=writes) / writes
+    heartbeat_interval = HeartbeatPolicy.DEFAULT_MIN_SECONDS
+    writes_per_heartbeat = min(1.0, heartbeat_interval / TextfileExporter.DEFAULT_MIN_INTERVAL_SECONDS)
+    assert timer_cost + write_cost * writes_per_heartbeat < heartbeat_interval * 0.01
@@ -0,0 +1,108 @@
+import os
+import errno
+
+import pytest
+
+from rpi_wifi_setup.netlink import RtnetlinkMonitor, parse_netlink_messages, RTM_NEWADDR, RTM_DELADDR, RTM_NEWLINK, \
+    RTM_GETADDR, NLMSGHDR
+
+# Read from a NETLINK_ROUTE socket while 10.99.0.1/24 was added to ifb0 (ifindex 2), the link
+# was set up, the address was deleted and the link was set down, and an RTM_GETADDR dump.
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+IFACE = "ifb0"
+IFINDEX = 2
+ADDRESS = "10.99.0.1"
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), 'rb') as fd:
+        return fd.read()
+
+
+def event_fields(event):
+    return (event.msg_type, event.ifindex, event.ifname, event.address, event.link_up)
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("rtm_newaddr_ifb0.bin", (RTM_NEWADDR, IFINDEX, IFACE, ADDRESS, None)),
+    ("rtm_deladdr_ifb0.bin", (RTM_DELADDR, IFINDEX, IFACE, ADDRESS, None)),
+    ("rtm_newlink_ifb0_up.bin", (RTM_NEWLINK, IFINDEX, IFACE, None, True)),
+    ("rtm_newlink_ifb0_down.bin", (RTM_NEWLINK, IFINDEX, IFACE, None, False)),
+])
+def test_parse_notification(name, expected):
+    events = parse_netlink_messages(read_fixture(name))
+    assert [event_fields(event) for event in events] == [expected]
+
+
+def test_parse_dump():
+    # Several address messages in one read, followed by NLMSG_DONE.
+    events = parse_netlink_messages(read_fixture("rtm_getaddr_dump.bin"))
+    assert [(event.ifname, event.address) for event in events] == [("lo", "127.0.0.1"), ("eth0", "192.0.2.2")]
+
+
+def test_parse_truncated():
+    data = read_fixture("rtm_getaddr_dump.bin")
+    assert [event.ifname for event in parse_netlink_messages(data[:-40])] == ["lo"]
+    assert parse_netlink_messages(data[:10]) == []
+
+
+def test_monitor_apply():
+    monitor = RtnetlinkMonitor(IFACE)
+
+    def apply(*names):
+        return monitor.apply([event for name in names for event in parse_netlink_messages(read_fixture(name))])
+
+    assert apply("rtm_newaddr_ifb0.bin")
+    assert monitor.get_ip() == ADDRESS
+    assert apply("rtm_newlink_ifb0_up.bin") and monitor.is_link_up()
+    # The addresses of other interfaces are ignored.
+    assert not apply("rtm_getaddr_dump.bin", "rtm_newaddr_ifb0.bin")
+    assert apply("rtm_deladdr_ifb0.bin")
+    assert monitor.get_ip() is None
+    assert apply("rtm_newlink_ifb0_down.bin") and monitor.is_link_up() is False
+
+
+class FakeSocket(object):
+    """@brief Returns the queued reads (bytes or an exception) and records the requests sent."""
+
+    def __init__(self, reads):
+        self.reads = list(reads)
+        self.sent = []
+
+    def recv(self, size):
+        if not self.reads:
+            raise BlockingIOError()
+        read = self.reads.pop(0)
+        if isinstance(read, Exception):
+            raise read
+        return read
+
+    def send(self, data):
+        self.sent.append(data)
+        # The kernel queues the dump reply when the request is sent.
+        self.reads.append(read_fixture("rtm_newaddr_ifb0.bin"))
+
+
+def test_overrun_reads_state_again():
+    calls = []
+    monitor = RtnetlinkMonitor(IFACE, on_change=lambda: calls.append("change"), on_overrun=lambda: calls.append("overrun"))
+    monitor._ifindex = IFINDEX
+    # A notification that was read before the overrun is discarded.
+    monitor._sock = FakeSocket([read_fixture("rtm_deladdr_ifb0.bin"), OSError(errno.ENOBUFS, "No buffer space available")])
+    monitor.apply(parse_netlink_messages(read_fixture("rtm_newaddr_ifb0.bin")))
+
+    assert monitor.handle_events()
+    assert calls == ["overrun"]
+    assert monitor.get_overruns() == 1
+    assert len(monitor._sock.sent) == 1
+    _length, msg_type, _flags, _seq, _pid = NLMSGHDR.unpack_from(monitor._sock.sent[0])
+    assert msg_type == RTM_GETADDR
+    # The address is read again from the dump reply.
+    assert monitor.get_ip() == ADDRESS
+
+
+def test_other_socket_errors_raised():
+    monitor = RtnetlinkMonitor(IFACE)
+    monitor._sock = FakeSocket([OSError(errno.EBADF, "Bad file descriptor")])
+    with pytest.raises(OSError):
+        monitor.handle_events()
@@ -0,0 +1,192 @@
+import queue
+import shutil
+import threading
+import subprocess
+
+import pytest
+
+pytest.importorskip("jeepney")
+
+from jeepney import DBusAddress, HeaderFields, MessageType, new_error, new_method_return, new_signal, message_bus  # noqa: E402
+from jeepney.io.blocking import open_dbus_connection, Proxy  # noqa: E402
+
+from rpi_wifi_setup.nm_dbus import NMDBusMonitor  # noqa: E402
+
+DEVICE_PATH = "/org/freedesktop/NetworkManager/Devices/3"
+IP4_CONFIG_PATH = "/org/freedesktop/NetworkManager/IP4Config/5"
+AP_PATH = "/org/freedesktop/NetworkManager/AccessPoint/7"
+CHANGE_TIMEOUT_SECONDS = 5
+
+BUS_CONFIG = """<!DOCTYPE busconfig PUBLIC "-//freedesktop//DTD D-Bus Bus Configuration 1.0//EN"
+ "http://www.freedesktop.org/standards/dbus/1.0/busconfig.dtd">
+<busconfig>
+  <type>session</type>
+  <listen>unix:path={path}</listen>
+  <auth>EXTERNAL</auth>
+  <policy context="default">
+    <allow send_destination="*"/>
+    <allow receive_sender="*"/>
+    <allow own="*"/>
+  </policy>
+</busconfig>
+"""
+
+
+class NullUIO(object):
+
+    def debug(self, msg):
+        pass
+
+    def info(self, msg):
+        pass
+
+    def warn(self, msg):
+        pass
+
+    def error(self, msg):
+        pass
+
+
+class FakeNetworkManager(threading.Thread):
+    """@brief Owns the NetworkManager bus name on a private bus and answers the property reads
+              and GetDeviceByIpIface calls that NMDBusMonitor makes. Signals are queued by the
+              test and sent from this thread."""
+
+    def __init__(self, address):
+        super().__init__(daemon=True)
+        self._conn = open_dbus_connection(bus=address)
+        Proxy(message_bus, self._conn).RequestName(NMDBusMonitor.NM_BUS_NAME)
+        self._signals = queue.Queue()
+        self._running = True
+        self.properties = {
+            (NMDBusMonitor.NM_PATH, NMDBusMonitor.NM_INTERFACE): {'Connectivity': ('u', NMDBusMonitor.CONNECTIVITY_FULL)},
+            (DEVICE_PATH, NMDBusMonitor.DEVICE_INTERFACE): {'Ip4Config': ('o', IP4_CONFIG_PATH)},
+            (DEVICE_PATH, NMDBusMonitor.WIRELESS_INTERFACE): {'ActiveAccessPoint': ('o', AP_PATH)},
+            (IP4_CONFIG_PATH, NMDBusMonitor.IP4_CONFIG_INTERFACE): {'AddressData': ('aa{sv}', [{'address': ('s', '192.168.1.50'),
+                                                                                                 'prefix': ('u', 24)}])},
+            (AP_PATH, NMDBusMonitor.AP_INTERFACE): {'Strength': ('y', 74), 'Ssid': ('ay', b'HomeNetwork')},
+        }
+
+    def run(self):
+        while self._running:
+            try:
+                while True:
+                    self._conn.send(self._signals.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                msg = self._conn.receive(timeout=0.05)
+            except TimeoutError:
+                continue
+            if msg.header.message_type == MessageType.method_call:
+                self._conn.send(self._reply(msg))
+
+    def _reply(self, msg):
+        member = msg.header.fields.get(HeaderFields.member)
+        path = msg.header.fields.get(HeaderFields.path)
+        if member == 'GetDeviceByIpIface' and msg.body == ('wlan0',):
+            return new_method_return(msg, 'o', (DEVICE_PATH,))
+        if member == 'Get':
+            interface, name = msg.body
+            value = self.properties.get((path, interface), {}).get(name)
+            if value is not None:
+                return new_method_return(msg, 'v', (value,))
+        return new_error(msg, 'org.freedesktop.DBus.Error.UnknownMethod')
+
+    def properties_changed(self, path, interface, changed):
+        self.properties[(path, interface)].update(changed)
+        self._signals.put(new_signal(DBusAddress(path, interface=NMDBusMonitor.PROPERTIES_INTERFACE),
+                                     'PropertiesChanged', 'sa{sv}as', (interface, changed, [])))
+
+    def state_changed(self, connectivity):
+        self.properties[(NMDBusMonitor.NM_PATH, NMDBusMonitor.NM_INTERFACE)]['Connectivity'] = ('u', connectivity)
+        self._signals.put(new_signal(DBusAddress(NMDBusMonitor.NM_PATH, interface=NMDBusMonitor.NM_INTERFACE),
+                                     'StateChanged', 'u', (70,)))
+
+    def stop(self):
+        self._running = False
+        self.join()
+        self._conn.close()
+
+
+@pytest.fixture
+def bus_address(tmp_path):
+    dbus_daemon = shutil.which("dbus-daemon")
+    if dbus_daemon is None:
+        pytest.skip("dbus-daemon is not installed")
+    config_file = tmp_path / "bus.conf"
+    config_file.write_text(BUS_CONFIG.format(path=tmp_path / "bus"))
+    daemon = subprocess.Popen([dbus_daemon, f"--config-file={config_file}", "--nofork", "--print-address"],
+                              stdout=subprocess.PIPE, encoding="utf-8")
+    try:
+        yield daemon.stdout.readline().strip()
+    finally:
+        daemon.terminate()
+        daemon.wait()
+
+
+@pytest.fixture
+def fake_nm(bus_address):
+    fake_nm = FakeNetworkManager(bus_address)
+    fake_nm.start()
+    yield fake_nm
+    fake_nm.stop()
+
+
+class Changes(object):
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def __call__(self):
+        self._event.set()
+
+    def wait(self):
+        assert self._event.wait(CHANGE_TIMEOUT_SECONDS), "no change reported"
+        self._event.clear()
+
+
+@pytest.fixture
+def monitor(bus_address, fake_nm):
+    changes = Changes()
+    monitor = NMDBusMonitor(NullUIO(), iface="wlan0", on_change=changes, bus=bus_address)
+    monitor.changes = changes
+    monitor.connect()
+    yield monitor
+    monitor.stop()
+
+
+def test_initial_state(monitor):
+    assert monitor.is_connected()
+    assert monitor.is_internet_connected()
+    assert monitor.get_ip() == "192.168.1.50"
+    assert monitor.get_strength() == 74
+    assert monitor.get_ssid() == "HomeNetwork"
+
+
+def test_signals(monitor, fake_nm):
+    monitor.start()
+    fake_nm.properties_changed(AP_PATH, NMDBusMonitor.AP_INTERFACE, {'Strength': ('y', 40)})
+    monitor.changes.wait()
+    assert monitor.get_strength() == 40
+
+    fake_nm.properties_changed(IP4_CONFIG_PATH, NMDBusMonitor.IP4_CONFIG_INTERFACE,
+                               {'AddressData': ('aa{sv}', [{'address': ('s', '192.168.1.51')}])})
+    monitor.changes.wait()
+    assert monitor.get_ip() == "192.168.1.51"
+
+    fake_nm.properties_changed(DEVICE_PATH, NMDBusMonitor.WIRELESS_INTERFACE, {'ActiveAccessPoint': ('o', NMDBusMonitor.NO_OBJECT_PATH)})
+    monitor.changes.wait()
+    assert monitor.get_strength() == 0 and monitor.get_ssid() is None
+
+    # StateChanged carries no connectivity so the monitor reads the property.
+    fake_nm.state_changed(1)
+    monitor.changes.wait()
+    assert not monitor.is_internet_connected()
+
+
+def test_no_network_manager(bus_address):
+    monitor = NMDBusMonitor(NullUIO(), bus=bus_address)
+    with pytest.raises(Exception):
+        monitor.connect()
+    assert not monitor.is_connected()
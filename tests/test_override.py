@@ -0,0 +1,166 @@
+import os
+
+import pytest
+
+from rpi_wifi_setup.override import OverrideFile, Debouncer
+
+WINDOW = 0.02
+# An mtime long enough ago that the file is not re-read because of the timestamp granularity.
+OLD_MTIME_NS = 1_000_000_000
+
+
+class Scheduled(object):
+    """@brief A scheduled call returned by FakeSchedule."""
+
+    def __init__(self, delay, function):
+        self.delay = delay
+        self.function = function
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeSchedule(object):
+    """@brief Records the calls that a Debouncer schedules."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, delay, function):
+        self.calls.append(Scheduled(delay, function))
+        return self.calls[-1]
+
+
+class Callback(object):
+    """@brief Counts the calls."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'oled_override.txt')
+
+
+def write(path, text, mtime_ns=OLD_MTIME_NS):
+    with open(path, 'w') as fd:
+        fd.write(text)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_no_file(path):
+    override_file = OverrideFile(path)
+    assert not override_file.update()
+    assert override_file.get_message() is None
+    assert override_file.get_stats() == {'reads': 0, 'changes': 0}
+
+
+def test_unchanged_file_not_read(path):
+    override_file = OverrideFile(path)
+    write(path, "Hello\n")
+    assert override_file.update()
+    assert override_file.get_message() == "Hello"
+    for _ in range(3):
+        assert not override_file.update()
+    assert override_file.get_stats() == {'reads': 1, 'changes': 1}
+
+
+def test_rewrite_same_text(path):
+    override_file = OverrideFile(path)
+    write(path, "Hello")
+    override_file.update()
+    # The modification time changed so the file is read but the message has not changed.
+    write(path, "Hello", mtime_ns=OLD_MTIME_NS * 2)
+    assert not override_file.update()
+    assert override_file.get_stats() == {'reads': 2, 'changes': 1}
+    write(path, "World", mtime_ns=OLD_MTIME_NS * 3)
+    assert override_file.update()
+    assert override_file.get_message() == "World"
+
+
+def test_racy_mtime_reread(path):
+    override_file = OverrideFile(path)
+    # The file was modified too recently to trust its modification time.
+    write(path, "Hello", mtime_ns=None)
+    assert override_file.update()
+    assert not override_file.update()
+    assert override_file.get_stats()['reads'] == 2
+
+
+def test_delete_and_empty(path):
+    override_file = OverrideFile(path)
+    write(path, "Hello")
+    override_file.update()
+    os.remove(path)
+    assert override_file.update()
+    assert override_file.get_message() is None
+    write(path, "  \n")
+    assert not override_file.update()
+    assert override_file.get_message() is None
+
+
+def test_debouncer_poll(clock):
+    callback = Callback()
+    debouncer = Debouncer(WINDOW, callback, clock=clock)
+    assert debouncer.get_delay() is None
+    assert not debouncer.poll()
+    debouncer.trigger()
+    clock.now += WINDOW / 2
+    # Triggers within the window do not move its end.
+    debouncer.trigger()
+    assert debouncer.get_delay() == pytest.approx(WINDOW / 2)
+    assert not debouncer.poll()
+    clock.now += WINDOW / 2
+    assert debouncer.get_delay() == 0.0
+    assert debouncer.poll()
+    assert not debouncer.poll()
+    assert debouncer.get_delay() is None
+    assert callback.calls == 1
+    # The next trigger starts a new window.
+    debouncer.trigger()
+    assert debouncer.get_delay() == pytest.approx(WINDOW)
+    assert debouncer.get_stats() == {'triggers': 3, 'calls': 1}
+
+
+def test_debouncer_cancel(clock):
+    callback = Callback()
+    debouncer = Debouncer(WINDOW, callback, clock=clock)
+    debouncer.trigger()
+    debouncer.cancel()
+    clock.now += WINDOW
+    assert debouncer.get_delay() is None
+    assert not debouncer.poll()
+    assert callback.calls == 0
+
+
+def test_debouncer_no_window(clock):
+    callback = Callback()
+    debouncer = Debouncer(0, callback, clock=clock)
+    for _ in range(3):
+        debouncer.trigger()
+    assert debouncer.get_delay() is None
+    assert callback.calls == 3
+
+
+def test_debouncer_schedule():
+    callback = Callback()
+    schedule = FakeSchedule()
+    debouncer = Debouncer(WINDOW, callback, schedule=schedule)
+    debouncer.trigger()
+    debouncer.trigger()
+    assert len(schedule.calls) == 1
+    assert schedule.calls[0].delay == WINDOW
+    # The owner's loop is not used when a schedule function is given.
+    assert debouncer.get_delay() is None
+    schedule.calls[0].function()
+    assert callback.calls == 1
+    debouncer.trigger()
+    debouncer.cancel()
+    assert schedule.calls[1].cancelled
+    assert debouncer.get_stats() == {'triggers': 3, 'calls': 1}
@@ -0,0 +1,121 @@
+import os
+import sys
+import asyncio
+import threading
+
+from time import sleep
+
+import pytest
+
+from rpi_wifi_setup.portal import PortalSession, PORTAL_STARTING, PORTAL_RUNNING, PORTAL_STOPPING, \
+    PORTAL_SUCCEEDED, PORTAL_FAILED, PORTAL_TIMED_OUT, PORTAL_CANCELLED
+
+FAKE_WIFI_CONNECT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'fake_wifi_connect.py')
+KILL_TIMEOUT = 0.3
+DONE_TIMEOUT_SECONDS = 10
+
+
+class Case(object):
+
+    def __init__(self, name, args, expected_states, returncode, timeout=0, cancel_after=None, cancel_in_prepare=False):
+        self.name = name
+        self.args = args
+        self.expected_states = expected_states
+        self.returncode = returncode
+        self.timeout = timeout
+        self.cancel_after = cancel_after
+        self.cancel_in_prepare = cancel_in_prepare
+
+    def __repr__(self):
+        return self.name
+
+
+CASES = (
+    Case("connect", ['connect', '0.2'],
+         [PORTAL_STARTING, PORTAL_RUNNING, PORTAL_SUCCEEDED], 0),
+    Case("fail", ['fail', '0.1'],
+         [PORTAL_STARTING, PORTAL_RUNNING, PORTAL_FAILED], 1),
+    Case("timeout", ['connect', '30'],
+         [PORTAL_STARTING, PORTAL_RUNNING, PORTAL_STOPPING, PORTAL_TIMED_OUT], -15, timeout=0.3),
+    Case("cancel", ['connect', '30'],
+         [PORTAL_STARTING, PORTAL_RUNNING, PORTAL_STOPPING, PORTAL_CANCELLED], -15, cancel_after=0.3),
+    # Ignores SIGTERM.
+    Case("cancel stubborn", ['stubborn', '30'],
+         [PORTAL_STARTING, PORTAL_RUNNING, PORTAL_STOPPING, PORTAL_CANCELLED], -9, cancel_after=0.3),
+    # Starts a grandchild that ignores SIGTERM.
+    Case("cancel child", ['child', '30'],
+         [PORTAL_STARTING, PORTAL_RUNNING, PORTAL_STOPPING, PORTAL_CANCELLED], None, cancel_after=0.5),
+    Case("cancel in prepare", ['connect', '30'],
+         [PORTAL_STARTING, PORTAL_CANCELLED], None, cancel_in_prepare=True),
+)
+
+
+class Recorder(object):
+    """@brief Records the session states."""
+
+    def __init__(self):
+        self.states = []
+        self.done = threading.Event()
+
+    def __call__(self, session, state):
+        self.states.append(state)
+        if not session.is_active():
+            self.done.set()
+
+
+def make_session(case, pid_file, recorder):
+    return PortalSession([sys.executable, FAKE_WIFI_CONNECT] + case.args + [pid_file],
+                         timeout=case.timeout,
+                         kill_timeout=KILL_TIMEOUT,
+                         on_state_change=recorder)
+
+
+def check(case, session, recorder, pid_file):
+    assert recorder.states == case.expected_states, session.get_error()
+    if case.returncode is not None:
+        assert session.get_returncode() == case.returncode
+    if os.path.isfile(pid_file):
+        # The grandchild ignores SIGTERM, it must have been killed with the process group.
+        with open(pid_file) as fd:
+            pid = int(fd.read())
+        sleep(0.1)
+        if os.path.exists(f"/proc/{pid}"):
+            with open(f"/proc/{pid}/stat") as fd:
+                assert fd.read().split()[2] == 'Z'
+
+
+@pytest.mark.parametrize("case", CASES, ids=repr)
+def test_session_thread(case, tmp_path):
+    pid_file = str(tmp_path / 'child.pid')
+    recorder = Recorder()
+    session = make_session(case, pid_file, recorder)
+    session.start(prepare=session.cancel if case.cancel_in_prepare else None)
+    if case.cancel_after:
+        sleep(case.cancel_after)
+        assert session.cancel()
+    assert recorder.done.wait(DONE_TIMEOUT_SECONDS), recorder.states
+    session.join()
+    # The session has finished so there is nothing to cancel.
+    assert not session.cancel()
+    check(case, session, recorder, pid_file)
+
+
+@pytest.mark.parametrize("case", CASES, ids=repr)
+def test_session_async(case, tmp_path):
+    pid_file = str(tmp_path / 'child.pid')
+    recorder = Recorder()
+    session = make_session(case, pid_file, recorder)
+
+    async def prepare():
+        session.cancel()
+
+    async def run():
+        task = asyncio.get_running_loop().create_task(session.run_async(prepare=prepare if case.cancel_in_prepare else None))
+        if case.cancel_after:
+            await asyncio.sleep(case.cancel_after)
+            # Cancel from another thread as the gpiozero button does.
+            threading.Thread(target=session.cancel).start()
+        await asyncio.wait_for(task, DONE_TIMEOUT_SECONDS)
+
+    asyncio.run(run())
+    check(case, session, recorder, pid_file)
@@ -0,0 +1,97 @@
+import os
+import sys
+import asyncio
+import threading
+
+import pytest
+
+from rpi_wifi_setup.portal import PortalSession, LineSplitter, MAX_LINE_BYTES, PORTAL_SUCCEEDED, PORTAL_FAILED, \
+    PORTAL_EVENT_STARTED, PORTAL_EVENT_CLIENT_CONNECTED, PORTAL_EVENT_CREDENTIALS, PORTAL_EVENT_CONNECTING, \
+    PORTAL_EVENT_CONNECTED, PORTAL_EVENT_CONNECT_FAILED
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+FAKE_WIFI_CONNECT = os.path.join(FIXTURES, 'fake_wifi_connect.py')
+# The time between transcript lines.
+LINE_SECONDS = 0.01
+DONE_TIMEOUT_SECONDS = 30
+
+ATTEMPT = [PORTAL_EVENT_STARTED, PORTAL_EVENT_CLIENT_CONNECTED, PORTAL_EVENT_CREDENTIALS, PORTAL_EVENT_CONNECTING]
+# transcript, exit code, expected final state, expected events
+CASES = (
+    ('wifi_connect_success.txt', 0, PORTAL_SUCCEEDED, ATTEMPT + [PORTAL_EVENT_CONNECTED]),
+    ('wifi_connect_failed.txt', 0, PORTAL_SUCCEEDED, ATTEMPT + [PORTAL_EVENT_CONNECT_FAILED] + ATTEMPT + [PORTAL_EVENT_CONNECTED]),
+    ('wifi_connect_failed.txt', 1, PORTAL_FAILED, ATTEMPT + [PORTAL_EVENT_CONNECT_FAILED] + ATTEMPT + [PORTAL_EVENT_CONNECTED]),
+)
+
+
+class Recorder(object):
+    """@brief Records the wifi-connect output lines and events."""
+
+    def __init__(self):
+        self.lines = []
+        self.events = []
+        self.done = threading.Event()
+
+    def on_output(self, session, line, event):
+        self.lines.append(line)
+        if event:
+            self.events.append(event)
+
+    def on_state_change(self, session, state):
+        if not session.is_active():
+            self.done.set()
+
+
+def make_session(transcript, returncode, recorder):
+    # The fake wifi-connect writes each transcript line in two parts, alternately to stdout and stderr.
+    cmd = [sys.executable, FAKE_WIFI_CONNECT, 'replay', str(LINE_SECONDS), os.path.join(FIXTURES, transcript), str(returncode)]
+    return PortalSession(cmd,
+                         timeout=0,
+                         on_state_change=recorder.on_state_change,
+                         on_output=recorder.on_output)
+
+
+def check(case, session, recorder):
+    transcript, _returncode, state, events = case
+    with open(os.path.join(FIXTURES, transcript)) as fd:
+        lines = fd.read().splitlines()
+    assert recorder.lines == lines
+    assert recorder.events == events
+    assert [event for event, t in session.get_events()] == events
+    assert session.get_state() == state
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_progress_thread(case):
+    recorder = Recorder()
+    session = make_session(case[0], case[1], recorder)
+    session.start()
+    assert recorder.done.wait(DONE_TIMEOUT_SECONDS)
+    session.join()
+    check(case, session, recorder)
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_progress_async(case):
+    recorder = Recorder()
+    session = make_session(case[0], case[1], recorder)
+    asyncio.run(asyncio.wait_for(session.run_async(), DONE_TIMEOUT_SECONDS))
+    check(case, session, recorder)
+
+
+def test_line_splitter():
+    splitter = LineSplitter()
+    assert splitter.feed(b"Connecting to acc") == []
+    assert splitter.feed(b"ess point 'x'...\r\nUser connected") == ["Connecting to access point 'x'..."]
+    # Long lines are truncated.
+    assert splitter.feed(b"A" * (MAX_LINE_BYTES * 4)) == []
+    lines = splitter.feed(b"\n")
+    assert len(lines) == 1 and len(lines[0]) == MAX_LINE_BYTES
+    assert splitter.flush() == []
+
+
+def test_line_splitter_flush():
+    # The last line has no newline.
+    splitter = LineSplitter()
+    assert splitter.feed(b"Connection failed") == []
+    assert splitter.flush() == ["Connection failed"]
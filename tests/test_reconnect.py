@@ -0,0 +1,204 @@
+import os
+import sys
+import json
+import asyncio
+import threading
+
+from time import time
+
+import pytest
+
+from rpi_wifi_setup.reconnect import ReconnectLadder, parse_last_wifi_profile, STEPS, STEP_CONNECTION_UP, \
+    STEP_DEVICE_REAPPLY, STEP_RADIO_TOGGLE, STEP_NETWORKING_CYCLE
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+FAKE_NMCLI = [sys.executable, os.path.join(FIXTURES, 'fake_nmcli.py')]
+# The time connectivity takes to return after the step that restores it.
+CONNECT_DELAY_SECONDS = 0.05
+# The time between the off and on commands when cancelling part way through a step.
+PAUSE_SECONDS = 0.6
+
+
+class Case(object):
+
+    def __init__(self, name, fix, hang=None, fail=()):
+        self.name = name
+        self.fix = fix
+        self.hang = hang
+        self.fail = list(fail)
+
+    def __repr__(self):
+        return self.name
+
+
+CASES = (
+    Case("connection up", STEP_CONNECTION_UP),
+    Case("device reapply", STEP_DEVICE_REAPPLY),
+    Case("radio toggle", STEP_RADIO_TOGGLE),
+    Case("networking cycle", STEP_NETWORKING_CYCLE),
+    Case("no connectivity", None),
+    Case("reapply hangs", STEP_RADIO_TOGGLE, hang=STEP_DEVICE_REAPPLY),
+    Case("up/reapply fail", STEP_RADIO_TOGGLE, fail=(STEP_CONNECTION_UP, STEP_DEVICE_REAPPLY)),
+)
+
+
+def make_ladder():
+    # nmcli is replaced by true so there is no last used profile and the ladder starts at device reapply.
+    return ReconnectLadder('wlan0', nmcli=["true"], settle=0.2, poll_interval=0.01, pause=0.0)
+
+
+def no_step_attempted(ladder):
+    return all(stats['attempts'] == 0 for stats in ladder.get_stats()['steps'].values())
+
+
+def test_cancel_before_run_starts():
+    ladder = make_ladder()
+    steps = []
+    generation = ladder.begin()
+    ladder.cancel()
+    assert ladder.run(lambda: True, on_step=steps.append, generation=generation) is None
+    assert ladder.get_stats()['cancelled'] == 1
+    assert no_step_attempted(ladder)
+
+    # A run scheduled after the cancel is not stopped by it.
+    assert ladder.run(lambda: True, on_step=steps.append) == STEP_DEVICE_REAPPLY
+    assert steps == [STEP_DEVICE_REAPPLY]
+
+
+def test_cancel_before_async_run_starts():
+    ladder = make_ladder()
+
+    async def is_connected():
+        return True
+
+    async def run():
+        generation = ladder.begin()
+        task = asyncio.ensure_future(ladder.run_async(is_connected, generation=generation))
+        # The cancel lands after the run was scheduled but before it starts.
+        ladder.cancel()
+        return await task
+
+    assert asyncio.run(run()) is None
+    assert ladder.get_stats()['cancelled'] == 1
+    assert no_step_attempted(ladder)
+
+
+def test_cancel_while_running():
+    ladder = make_ladder()
+    timer = threading.Timer(0.05, ladder.cancel)
+    timer.start()
+    assert ladder.run(lambda: False) is None
+    timer.join()
+    stats = ladder.get_stats()
+    assert stats['cancelled'] == 1 and stats['failures'] == 0
+
+
+def test_parse_last_wifi_profile():
+    with open(os.path.join(FIXTURES, 'nmcli_connection_show.txt')) as fd:
+        assert parse_last_wifi_profile(fd.read()) == "Home:Network"
+    assert parse_last_wifi_profile("Wired connection 1:802-3-ethernet:1\n") is None
+
+
+class FakeNmcli(object):
+    """@brief The state file of the fake nmcli command."""
+
+    def __init__(self, state_file, case):
+        self._state_file = state_file
+        with open(state_file, 'w') as fd:
+            json.dump({'fix': case.fix, 'delay': CONNECT_DELAY_SECONDS, 'hang': case.hang, 'fail': case.fail,
+                       'connected_at': None, 'calls': []}, fd)
+
+    def _read(self):
+        with open(self._state_file) as fd:
+            return json.load(fd)
+
+    def is_connected(self):
+        connected_at = self._read()['connected_at']
+        return connected_at is not None and time() >= connected_at
+
+    def get_step_calls(self):
+        """@return The nmcli commands run by the steps, not the connectivity checks."""
+        return [call for call in self._read()['calls'] if '--fields' not in call and '-f' not in call]
+
+
+@pytest.fixture(params=CASES, ids=repr)
+def fake_nmcli(request, tmp_path, monkeypatch):
+    state_file = str(tmp_path / 'state.json')
+    monkeypatch.setenv('FAKE_NMCLI_STATE', state_file)
+    fake_nmcli = FakeNmcli(state_file, request.param)
+    fake_nmcli.case = request.param
+    return fake_nmcli
+
+
+def make_fake_nmcli_ladder():
+    return ReconnectLadder('wlan0', nmcli=FAKE_NMCLI, timeout=1.0, settle=0.3, poll_interval=0.02, pause=0.0)
+
+
+def check_ladder(fake_nmcli, ladder, step):
+    case = fake_nmcli.case
+    assert step == case.fix
+    called = fake_nmcli.get_step_calls()
+    if case.fix:
+        # The steps after the one that restored connectivity must not run.
+        for later in STEPS[STEPS.index(case.fix) + 1:]:
+            assert ladder.get_stats()['steps'][later]['attempts'] == 0, later
+        if case.fix != STEP_NETWORKING_CYCLE:
+            assert not any('networking' in call for call in called)
+    if case.fix == STEP_CONNECTION_UP:
+        assert called[0][-2:] == ['id', 'Home:Network']
+
+
+def test_ladder(fake_nmcli):
+    ladder = make_fake_nmcli_ladder()
+    step = ladder.run(fake_nmcli.is_connected)
+    check_ladder(fake_nmcli, ladder, step)
+
+
+def test_ladder_async(fake_nmcli):
+    ladder = make_fake_nmcli_ladder()
+
+    async def is_connected():
+        return fake_nmcli.is_connected()
+
+    step = asyncio.run(ladder.run_async(is_connected))
+    check_ladder(fake_nmcli, ladder, step)
+
+
+@pytest.fixture
+def networking_cycle(tmp_path, monkeypatch):
+    """@brief A fake nmcli that never restores connectivity and a ladder that only cycles networking."""
+    state_file = str(tmp_path / 'state.json')
+    monkeypatch.setenv('FAKE_NMCLI_STATE', state_file)
+    fake_nmcli = FakeNmcli(state_file, Case("networking cycle", None))
+    ladder = ReconnectLadder('wlan0', nmcli=FAKE_NMCLI, steps=(STEP_NETWORKING_CYCLE,), timeout=1.0,
+                             settle=0.3, poll_interval=0.02, pause=PAUSE_SECONDS)
+    return fake_nmcli, ladder
+
+
+def networking_calls(fake_nmcli):
+    return [call[-1] for call in fake_nmcli.get_step_calls() if 'networking' in call]
+
+
+def test_cancel_during_pause(networking_cycle):
+    fake_nmcli, ladder = networking_cycle
+    # Cancel between networking off and on.
+    timer = threading.Timer(PAUSE_SECONDS / 2, ladder.cancel)
+    timer.start()
+    assert ladder.run(fake_nmcli.is_connected) is None
+    timer.join()
+    assert networking_calls(fake_nmcli) == ['off', 'on']
+    assert ladder.get_stats()['cancelled'] == 1
+
+
+def test_task_cancelled_during_pause(networking_cycle):
+    fake_nmcli, ladder = networking_cycle
+
+    async def run():
+        task = asyncio.ensure_future(ladder.run_async(lambda: asyncio.sleep(0, False)))
+        await asyncio.sleep(PAUSE_SECONDS / 2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert networking_calls(fake_nmcli) == ['off', 'on']
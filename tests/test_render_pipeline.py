@@ -0,0 +1,194 @@
+import threading
+
+from time import sleep
+
+import pytest
+
+from p3lib.uio import UIO
+
+from rpi_wifi_setup.render_pipeline import DisplayState, DisplayScheduler, DisplayConsumer, FrameGovernor, \
+    PRIORITY_STATUS, PRIORITY_OVERRIDE, PRIORITY_PORTAL
+
+# The time the fake display takes to send the first frame, the second takes twice as long.
+SEND_SECONDS = 0.01
+LOCK_WAIT_SECONDS = 0.5
+TIMEOUT_SECONDS = 5
+MAX_FPS = 10
+
+
+class RecordingLock(object):
+    """@brief A display lock that signals when a thread starts waiting for it."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waiting = threading.Event()
+
+    def __enter__(self):
+        self.waiting.set()
+        self.lock.acquire()
+
+    def __exit__(self, *args):
+        self.lock.release()
+
+
+@pytest.fixture
+def scheduler(clock):
+    return DisplayScheduler(clock=clock)
+
+
+def drain(scheduler):
+    """@return The messages of the waiting frames in the order they are sent."""
+    msgs = []
+    while scheduler.depth():
+        msgs.append(scheduler.get().msg)
+    return msgs
+
+
+def get_in_thread(scheduler, **kwargs):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(scheduler.get(**kwargs)))
+    thread.start()
+    return thread, results
+
+
+def test_one_slot_per_priority(scheduler):
+    for msg in ("A", "B", "C"):
+        scheduler.put(DisplayState(msg))
+    assert scheduler.depth() == 1
+    # Only the newest frame is sent.
+    assert drain(scheduler) == ["C"]
+    assert scheduler.get_stats() == {'depth': 0, 'puts': 3, 'frames_dropped': 2}
+
+
+def test_put_drops_lower_priorities(scheduler):
+    scheduler.put(DisplayState("status"), PRIORITY_STATUS)
+    scheduler.put(DisplayState("override"), PRIORITY_OVERRIDE)
+    assert scheduler.depth() == 1
+    # A lower priority frame waits behind a higher priority frame.
+    scheduler.put(DisplayState("status 2"), PRIORITY_STATUS)
+    assert scheduler.depth() == 2
+    assert drain(scheduler) == ["override", "status 2"]
+    scheduler.put(DisplayState("status 3"), PRIORITY_STATUS)
+    scheduler.put(DisplayState("override 2"), PRIORITY_OVERRIDE)
+    scheduler.put(DisplayState("portal"), PRIORITY_PORTAL)
+    assert drain(scheduler) == ["portal"]
+    assert scheduler.get_stats()['frames_dropped'] == 3
+
+
+def test_floor(scheduler):
+    scheduler.put(DisplayState("status"), PRIORITY_STATUS)
+    scheduler.put(DisplayState("portal"), PRIORITY_PORTAL)
+    # The portal owns the display, the waiting status frame is dropped.
+    scheduler.set_floor(PRIORITY_PORTAL)
+    assert scheduler.depth() == 1
+    scheduler.put(DisplayState("status 2"), PRIORITY_STATUS)
+    scheduler.put(DisplayState("override"), PRIORITY_OVERRIDE)
+    assert drain(scheduler) == ["portal"]
+    assert scheduler.get_stats() == {'depth': 0, 'puts': 4, 'frames_dropped': 3}
+    # Status frames are shown again once the portal has completed.
+    scheduler.set_floor(PRIORITY_STATUS)
+    scheduler.put(DisplayState("status 3"), PRIORITY_STATUS)
+    assert drain(scheduler) == ["status 3"]
+
+
+def test_close_wakes_get(scheduler, clock):
+    thread, results = get_in_thread(scheduler)
+    sleep(0.05)
+    assert thread.is_alive()
+    scheduler.close()
+    thread.join(TIMEOUT_SECONDS)
+    assert results == [None]
+
+
+def test_close_wakes_get_waiting_for_governor(scheduler, clock):
+    scheduler.put(DisplayState("A"))
+    # The frame may not be sent for a long time.
+    thread, results = get_in_thread(scheduler, not_before=lambda: clock.now + 3600)
+    sleep(0.05)
+    assert thread.is_alive()
+    scheduler.close()
+    thread.join(TIMEOUT_SECONDS)
+    assert results == [None]
+
+
+def test_consumer_lock_accounting(scheduler, clock):
+    lock = RecordingLock()
+    shown = []
+    sent = (threading.Event(), threading.Event())
+
+    def show(state):
+        # The fake clock advances while the frame is sent.
+        shown.append(state.msg)
+        clock.now += SEND_SECONDS * len(shown)
+        sent[len(shown) - 1].set()
+
+    consumer = DisplayConsumer(UIO(), scheduler, lock, show, clock=clock)
+    consumer.start()
+    try:
+        scheduler.put(DisplayState("A"))
+        assert sent[0].wait(TIMEOUT_SECONDS)
+        # The display lock is held by another thread when the second frame is put.
+        with lock.lock:
+            lock.waiting.clear()
+            scheduler.put(DisplayState("B"))
+            assert lock.waiting.wait(TIMEOUT_SECONDS)
+            clock.now += LOCK_WAIT_SECONDS
+        assert sent[1].wait(TIMEOUT_SECONDS)
+    finally:
+        consumer.stop()
+    assert not consumer.is_alive()
+    assert shown == ["A", "B"]
+    assert consumer.get_busy_seconds() == 0.0
+    stats = consumer.get_stats()
+    assert stats['frames_sent'] == 2
+    assert stats['lock_hold_last_ms'] == pytest.approx(SEND_SECONDS * 2000)
+    assert stats['lock_hold_max_ms'] == pytest.approx(SEND_SECONDS * 2000)
+    assert stats['lock_hold_avg_ms'] == pytest.approx(SEND_SECONDS * 1500)
+    assert stats['lock_wait_max_ms'] == pytest.approx(LOCK_WAIT_SECONDS * 1000)
+
+
+@pytest.mark.parametrize("max_fps", [MAX_FPS, 0])
+def test_governor_interval(clock, max_fps):
+    governor = FrameGovernor(max_fps, clock=clock)
+    min_interval = 1.0 / max_fps if max_fps else 0.0
+    # The first frame is not delayed.
+    assert governor.get_delay() == 0.0
+    assert governor.get_interval() == min_interval
+    # The send time rises until the bus limit is above the frame rate limit.
+    average = 0.0
+    for send_time in (0.001, 0.01, 0.1, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2):
+        clock.now += 1.0
+        governor.record(clock.now, send_time)
+        average += (send_time - average) * FrameGovernor.SEND_TIME_WEIGHT
+        assert governor.get_interval() == pytest.approx(max(min_interval, average / FrameGovernor.MAX_BUS_DUTY))
+    assert governor.get_interval() > 1.0 / MAX_FPS
+    assert governor.get_next_frame_time() == pytest.approx(clock.now + governor.get_interval())
+    clock.now += 0.1
+    assert governor.get_delay() == pytest.approx(governor.get_interval() - 0.1)
+
+
+def test_governor_no_fps_limit(clock):
+    governor = FrameGovernor(0, clock=clock)
+    assert governor.get_interval() == 0.0
+    governor.record(clock.now, 0.01)
+    # Only the bus limit applies, the moving average send time is 2 ms.
+    assert governor.get_interval() == pytest.approx(0.002 / FrameGovernor.MAX_BUS_DUTY)
+    assert governor.get_stats() == {'interval_ms': 4.0, 'send_time_ms': 2.0}
+
+
+def test_get_merges_frames_while_waiting(scheduler, clock):
+    governor = FrameGovernor(MAX_FPS, clock=clock)
+    governor.record(clock.now, 0.001)
+    scheduler.put(DisplayState("A"))
+    thread, results = get_in_thread(scheduler, not_before=governor.get_next_frame_time)
+    sleep(0.05)
+    # The frame is held back until the next frame time.
+    assert thread.is_alive()
+    scheduler.put(DisplayState("B"))
+    scheduler.put(DisplayState("C"))
+    assert thread.is_alive()
+    clock.now = governor.get_next_frame_time()
+    thread.join(TIMEOUT_SECONDS)
+    # Only the newest of the frames put during the wait is sent.
+    assert [state.msg for state in results] == ["C"]
+    assert scheduler.get_stats() == {'depth': 0, 'puts': 3, 'frames_dropped': 2}
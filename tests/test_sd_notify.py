@@ -0,0 +1,124 @@
+import os
+import socket
+
+from time import sleep, monotonic
+
+import pytest
+
+from rpi_wifi_setup.sd_notify import SystemdNotifier, write_service_dropin, remove_service_dropin
+
+WATCHDOG_SECONDS = 0.2
+
+
+class FakeSystemd(object):
+    """@brief Receives the notify messages as systemd does."""
+
+    def __init__(self, address):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(address)
+        self._sock.settimeout(0)
+        self.messages = []
+
+    def receive(self):
+        """@brief Read the messages received as (time, {field: value}) tuples."""
+        while True:
+            try:
+                data = self._sock.recv(4096)
+            except BlockingIOError:
+                break
+            fields = dict(line.split('=', 1) for line in data.decode('utf-8').splitlines())
+            self.messages.append((monotonic(), fields))
+
+    def close(self):
+        self._sock.close()
+
+
+@pytest.fixture(params=["path", "abstract"])
+def notify_socket(request, tmp_path):
+    """@return The address bound by the fake systemd and the NOTIFY_SOCKET value."""
+    if request.param == "path":
+        address = str(tmp_path / "notify")
+        return address, address
+    name = f"rpi_wifi_setup_test_{os.getpid()}"
+    return '\0' + name, '@' + name
+
+
+def test_watchdog(notify_socket):
+    address, environ_address = notify_socket
+    fake_systemd = FakeSystemd(address)
+    notifier = SystemdNotifier(environ={'NOTIFY_SOCKET': environ_address,
+                                        'WATCHDOG_USEC': str(int(WATCHDOG_SECONDS * 1_000_000)),
+                                        'WATCHDOG_PID': str(os.getpid())})
+    assert notifier.is_enabled()
+    assert notifier.get_watchdog_interval() == WATCHDOG_SECONDS / 2
+
+    notifier.ready("Checking connectivity")
+    # A main loop that pings the watchdog and then stalls.
+    start = monotonic()
+    iteration = 0
+    while monotonic() - start < WATCHDOG_SECONDS * 2:
+        notifier.status(f"ONLINE 192.168.1.50 Signal: {50 + iteration // 4 % 3}%")
+        notifier.watchdog()
+        iteration += 1
+        sleep(WATCHDOG_SECONDS / 20)
+        fake_systemd.receive()
+    sleep(WATCHDOG_SECONDS * 1.5)
+    notifier.stopping()
+    fake_systemd.receive()
+    fake_systemd.close()
+    notifier.close()
+
+    messages = fake_systemd.messages
+    assert messages[0][1] == {'READY': '1', 'STATUS': 'Checking connectivity'}
+    assert messages[-1][1] == {'STOPPING': '1'}
+    pings = [t for t, fields in messages if 'WATCHDOG' in fields]
+    statuses = [fields['STATUS'] for _, fields in messages[1:] if 'STATUS' in fields]
+    # Unchanged status lines are not sent.
+    assert statuses and all(a != b for a, b in zip(statuses, statuses[1:]))
+    assert len(pings) >= 3
+    gaps = [b - a for a, b in zip([messages[0][0]] + pings, pings)]
+    # systemd restarts the service when no ping is received for WatchdogSec.
+    assert max(gaps) < WATCHDOG_SECONDS
+    assert messages[-1][0] - pings[-1] > WATCHDOG_SECONDS
+
+
+def test_every_status_change_sent(tmp_path):
+    address = str(tmp_path / "notify")
+    fake_systemd = FakeSystemd(address)
+    notifier = SystemdNotifier(environ={'NOTIFY_SOCKET': address})
+    notifier.ready()
+    for index in range(20):
+        notifier.status(f"Signal: {index}%")
+        # The socket queue holds a few messages, systemd reads them as they arrive.
+        fake_systemd.receive()
+    notifier.status("Signal: 19%")
+    fake_systemd.receive()
+    fake_systemd.close()
+    notifier.close()
+    assert len(fake_systemd.messages) == 21
+
+
+def test_no_notify_socket():
+    notifier = SystemdNotifier(environ={})
+    notifier.ready("x")
+    notifier.watchdog()
+    assert not notifier.is_enabled()
+    assert notifier.get_watchdog_delay() is None
+
+
+def test_watchdog_of_another_process():
+    # E.G a child of the service.
+    notifier = SystemdNotifier(environ={'NOTIFY_SOCKET': '/run/systemd/notify',
+                                        'WATCHDOG_USEC': '1000000',
+                                        'WATCHDOG_PID': str(os.getpid() + 1)})
+    assert notifier.get_watchdog_interval() is None
+
+
+def test_dropin(tmp_path):
+    folder = str(tmp_path)
+    dropin_file = write_service_dropin("rpi_wifi_setup", 30, folder=folder)
+    with open(dropin_file) as fd:
+        assert fd.read().splitlines() == ["[Service]", "Type=notify", "NotifyAccess=main", "WatchdogSec=30"]
+    assert remove_service_dropin("rpi_wifi_setup", folder=folder) == dropin_file
+    assert not os.listdir(folder)
+    assert remove_service_dropin("rpi_wifi_setup", folder=folder) is None
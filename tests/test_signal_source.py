@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from rpi_wifi_setup.signal_source import SignalSource, ProcNetWirelessSource, NmcliSignalSource, dbm_to_percent
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+PROC_NET_WIRELESS_FIXTURE = os.path.join(FIXTURES, 'proc_net_wireless.txt')
+NMCLI_FIXTURE = os.path.join(FIXTURES, 'nmcli_device_wifi.txt')
+
+
+def test_proc_and_nmcli_sources_agree():
+    # Both fixtures were recorded on the same connection.
+    proc_strength = ProcNetWirelessSource('wlan0', path=PROC_NET_WIRELESS_FIXTURE).read()
+    nmcli_strength = NmcliSignalSource('wlan0', cmd=['cat', NMCLI_FIXTURE]).read()
+    assert proc_strength == nmcli_strength == 74
+
+
+@pytest.mark.parametrize("dbm, percent", [(-30, 100), (-40, 100), (-56, 74), (-70, 50), (-99, 2), (-100, 0), (-110, 0)])
+def test_dbm_to_percent_matches_network_manager(dbm, percent):
+    assert dbm_to_percent(dbm) == percent
+
+
+@pytest.mark.parametrize("line, strength", [
+    ("wlan0: 0000   54.  -56.  -256", 74),
+    # Some drivers report the level as an unsigned 8 bit value.
+    ("wlan0: 0000   54.  200.  -256", 74),
+    # Not associated.
+    ("wlan0: 0000    0.    0.  -256", 0),
+])
+def test_proc_parse(line, strength):
+    assert ProcNetWirelessSource('wlan0').parse(f"header\nheader\n {line}\n") == strength
+
+
+def test_proc_parse_other_interface():
+    assert ProcNetWirelessSource('wlan1').parse(" wlan0: 0000   54.  -56.  -256\n") is None
+
+
+def test_nmcli_parse_not_connected():
+    assert NmcliSignalSource('wlan0').parse("IN-USE  SIGNAL\n        82\n") == 0
+
+
+def test_read_is_abstract():
+    with pytest.raises(TypeError):
+        SignalSource('wlan0')
@@ -0,0 +1,151 @@
+import os
+import asyncio
+import threading
+
+from time import sleep, monotonic
+
+import pytest
+
+from rpi_wifi_setup.ssid_scan import SsidScanner, parse_wifi_list, split_terse_fields
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+NMCLI_FIXTURE = os.path.join(FIXTURES, 'nmcli_device_wifi_list.txt')
+EXPECTED_SSIDS = ["HomeNetwork", "BT-7XK2PQ", "Cafe:Guest", "NETGEAR42-5G", "DIRECT-3F-HP Printer",
+                  "Back\\Slash", "SKY8F2C1", "Neighbour WiFi", "EE-Hub-X9K2"]
+SCAN_CMD = ["cat", NMCLI_FIXTURE]
+SLOW_SCAN_SECONDS = 0.3
+SLOW_SCAN_CMD = ["sh", "-c", f'sleep {SLOW_SCAN_SECONDS}; cat "{NMCLI_FIXTURE}"']
+HUNG_SCAN_CMD = ["sleep", "30"]
+TIMEOUT = 0.2
+INTERVAL = 30
+IDLE_INTERVAL = 300
+
+
+def ssids(result):
+    return [network.ssid for network in result.networks]
+
+
+def test_split_terse_fields():
+    assert split_terse_fields("a\\:b:1:WPA\\\\2") == ["a:b", "1", "WPA\\2"]
+
+
+def test_parse_wifi_list():
+    with open(NMCLI_FIXTURE) as fd:
+        networks = parse_wifi_list(fd.read())
+    assert [network.ssid for network in networks] == EXPECTED_SSIDS
+    assert networks[0].signal == 82 and networks[0].security == "WPA2"
+    assert networks[2].security == ""
+
+
+@pytest.fixture
+def scanner(clock):
+    changes = []
+    scanner = SsidScanner(interval=INTERVAL, idle_interval=IDLE_INTERVAL, cmd=SCAN_CMD,
+                          on_change=lambda: changes.append(scanner.get_delay()), clock=clock)
+    scanner.changes = changes
+    return scanner
+
+
+def test_duty_cycle(scanner, clock):
+    # No scans while online.
+    assert scanner.get_delay() is None
+    scanner.set_offline(True)
+    assert scanner.changes == [0.0]
+    assert ssids(scanner.scan()) == EXPECTED_SSIDS
+    assert scanner.get_delay() == INTERVAL
+    clock.now = 10
+    assert scanner.get_delay() == INTERVAL - 10
+    scanner.set_screen_on(False)
+    assert scanner.get_delay() == IDLE_INTERVAL - 10
+    # No scans while the portal is running.
+    scanner.set_paused(True)
+    assert scanner.get_delay() is None
+    scanner.set_paused(False)
+    scanner.set_screen_on(True)
+    clock.now = 40
+    assert scanner.get_delay() == 0
+    # Unchanged states are not reported.
+    scanner.set_offline(True)
+    assert len(scanner.changes) == 5
+
+
+def test_disabled(clock):
+    scanner = SsidScanner(interval=0, cmd=SCAN_CMD, clock=clock)
+    scanner.set_offline(True)
+    assert not scanner.is_enabled()
+    assert scanner.get_delay() is None
+
+
+def test_result_max_age(scanner, clock):
+    assert scanner.get_result() is None
+    result = scanner.scan()
+    clock.now = INTERVAL
+    assert scanner.get_result(max_age=INTERVAL) is result
+    clock.now = INTERVAL + 1
+    assert scanner.get_result(max_age=INTERVAL) is None
+    assert scanner.get_result() is result
+    assert scanner.get_stats()['networks'] == len(EXPECTED_SSIDS)
+
+
+def test_failed_scan(clock):
+    scanner = SsidScanner(cmd=["false"], clock=clock)
+    scanner.set_offline(True)
+    assert scanner.scan() is None
+    assert scanner.get_stats()['errors'] == 1
+    # A failed scan is not retried until the next interval.
+    assert scanner.get_delay() == SsidScanner.DEFAULT_INTERVAL_SECONDS
+
+
+def test_scan_timeout(clock):
+    scanner = SsidScanner(cmd=HUNG_SCAN_CMD, timeout=TIMEOUT, clock=clock)
+    start = monotonic()
+    assert scanner.scan() is None
+    assert asyncio.run(scanner.scan_async()) is None
+    # The hung scan is killed and counted as an error.
+    assert monotonic() - start < TIMEOUT * 2 + 5
+    assert scanner.get_stats()['errors'] == 2
+    assert scanner.wait_idle(0)
+
+
+def test_wait_idle():
+    scanner = SsidScanner(cmd=SLOW_SCAN_CMD)
+    thread = threading.Thread(target=scanner.scan)
+    thread.start()
+    try:
+        while scanner.wait_idle(0):
+            sleep(0.01)
+        # Pausing does not stop the scan, the portal waits for it.
+        scanner.set_paused(True)
+        assert not scanner.wait_idle(0)
+        assert scanner.wait_idle(SLOW_SCAN_SECONDS * 10)
+        assert scanner.get_stats()['scans'] == 1
+    finally:
+        thread.join()
+
+
+def test_background_thread():
+    interval = 0.05
+    scanner = SsidScanner(interval=interval, cmd=SCAN_CMD)
+    scanner.start()
+    try:
+        sleep(interval * 4)
+        assert scanner.get_stats()['scans'] == 0
+        scanner.set_offline(True)
+        sleep(interval * 4)
+        scans = scanner.get_stats()['scans']
+        assert 2 <= scans <= 6
+        scanner.set_paused(True)
+        # A scan in progress when paused may complete.
+        sleep(interval)
+        scans = scanner.get_stats()['scans']
+        sleep(interval * 4)
+        assert scanner.get_stats()['scans'] == scans
+    finally:
+        scanner.stop()
+
+
+def test_scan_async():
+    scanner = SsidScanner(cmd=SCAN_CMD)
+    result = asyncio.run(scanner.scan_async())
+    assert ssids(result) == EXPECTED_SSIDS
+    assert scanner.get_stats()['scans'] == 1